@@ -589,3 +589,170 @@ REST_FRAMEWORK = {
         'rest_framework.parsers.MultiPartParser',
     ],
 }
+
+# Extracted text storage
+# Text larger than this many bytes is moved out of the Document row into a
+# compressed side table. Uses zstd when the zstandard package is installed.
+EXTRACTED_TEXT_COMPRESSION_THRESHOLD = 64 * 1024
+EXTRACTED_TEXT_COMPRESSION_CODEC = 'zstd'
+
+# Document chunking
+# Passages written after extraction for retrieval and analysis. Token counts
+# use CHUNK_TOKENIZER (a Hugging Face tokenizer name) when set, and a
+# word/punctuation approximation otherwise.
+CHUNK_MAX_TOKENS = 256
+CHUNK_OVERLAP_TOKENS = 32
+CHUNK_TOKENIZER = None
+
+# Semantic retrieval
+# Passage embeddings live in a memory-mapped IVF index on disk; run
+# `manage.py build_vector_index` to (re)build it from all chunks.
+EMBEDDING_MODEL = 'sentence-transformers/all-MiniLM-L6-v2'
+VECTOR_INDEX_DIR = os.path.join(BASE_DIR, 'vector_index')
+VECTOR_INDEX_NPROBE = 16
+VECTOR_INDEX_DELTA_LIMIT = 100000
+RETRIEVAL_TOP_K = 5
+RETRIEVAL_MIN_SCORE = 0.0
+# Document selections are scored exactly in parallel shards of
+# RETRIEVAL_SHARD_SIZE documents (RETRIEVAL_MAX_WORKERS threads, default
+# min(8, cores)); selections over RETRIEVAL_EXACT_ROWS passages use one
+# IVF pass instead
+RETRIEVAL_SHARD_SIZE = 16
+RETRIEVAL_MAX_WORKERS = None
+RETRIEVAL_EXACT_ROWS = 8000
+
+# Hybrid retrieval
+# RETRIEVAL_MODE is 'hybrid' (BM25 and vector results fused by reciprocal
+# rank), 'dense' or 'bm25'. The BM25 index is built with
+# `manage.py build_bm25_index`, and rebuilt in a background thread once more
+# than BM25_DELTA_LIMIT documents were processed or deleted since the last
+# build.
+RETRIEVAL_MODE = 'hybrid'
+RETRIEVAL_RRF_K = 60
+RETRIEVAL_CANDIDATES = 4
+BM25_INDEX_DIR = os.path.join(VECTOR_INDEX_DIR, 'bm25')
+BM25_K1 = 1.2
+BM25_B = 0.75
+BM25_DELTA_LIMIT = 200
+
+# Embedding service
+# Passages from concurrently finishing documents are encoded together in
+# length-bucketed batches. EMBEDDING_TORCH_THREADS defaults to all cores.
+EMBEDDING_MAX_BATCH_SIZE = 64
+EMBEDDING_MAX_WAIT_MS = 20
+EMBEDDING_TORCH_THREADS = None
+
+# Embedding cache
+# Passage embeddings are cached as float16 keyed by (model id, normalized
+# text hash). Bump EMBEDDING_MODEL_REVISION when the model weights change so
+# only that model's entries stop matching.
+EMBEDDING_MODEL_REVISION = None
+EMBEDDING_CACHE_MAX_ENTRIES = 1000000
+
+# Model registry
+# One loaded copy per process for each model. 'preload' models are loaded by
+# the gunicorn master before forking (see gunicorn.conf.py) and shared
+# copy-on-write by the workers; 'lazy' models load on first use.
+# Transformer models can run on ONNX Runtime instead of PyTorch with
+# 'backend': 'onnx' (and 'quantize': True for int8 weights) once exported
+# with `manage.py export_onnx_models`.
+MODEL_REGISTRY = {
+    'embedding': {'policy': 'preload', 'backend': 'pytorch'},
+    'ner': {'policy': 'lazy', 'backend': 'pytorch', 'model': 'dslim/bert-base-NER'},
+    'sentiment': {'policy': 'lazy', 'backend': 'pytorch', 'model': 'distilbert-base-uncased-finetuned-sst-2-english'},
+    'llm': {'policy': 'lazy', 'model': 'orca-mini-3b-gguf2-q4_0.gguf'},
+}
+MODEL_WARMUP = True
+
+# ONNX Runtime
+ONNX_MODEL_DIR = os.path.join(BASE_DIR, 'onnx_models')
+ONNX_INTRA_OP_THREADS = None
+
+# Entity and sentiment analysis
+# Run over document chunks after extraction (NLP_ANALYZE_ON_PROCESS) and on
+# demand via /api/nlp/analysis/; results are cached per passage text hash.
+NLP_ANALYSIS_BATCH_SIZE = 16
+NLP_ANALYZE_ON_PROCESS = True
+
+# Answer generation
+# analyze_query answers with the local LLM ('llm' in MODEL_REGISTRY) when
+# gpt4all is installed, otherwise with the retrieved passages. Clients can
+# stream the answer as server-sent events.
+LLM_ENABLED = True
+LLM_MAX_TOKENS = 512
+LLM_DOCUMENT_MAX_TOKENS = 1024
+LLM_CONTEXT_CHARS = 6000
+# Document generation drafts from the reference passages most relevant to
+# its title and prompt, shared fairly between the references, within this
+# budget (estimated at 4 characters per token)
+GENERATION_CONTEXT_TOKENS = 1500
+
+# Document rendering
+# Generated documents are rendered to their output format (DOCX, PDF, HTML,
+# Markdown or text) by at most GENERATION_RENDER_WORKERS threads per
+# process, into a temporary file that spills to disk past
+# GENERATION_SPOOL_MAX_BYTES before it is copied to storage.
+GENERATION_RENDER_WORKERS = 2
+GENERATION_SPOOL_MAX_BYTES = 1024 * 1024
+
+# Document templates
+# Template files (DOCX, HTML, Markdown, text) are compiled once into a render
+# plan and kept in a per-process LRU cache of TEMPLATE_CACHE_SIZE plans,
+# keyed by template id and updated_at.
+TEMPLATE_CACHE_SIZE = 32
+
+# Mail merge batches
+# A batch renders its template against every data row when it is
+# downloaded, across BATCH_WORKERS processes (default: one per core) in
+# chunks of BATCH_CHUNK_SIZE rows, streaming the ZIP as documents finish.
+# The worker pool is shared by all downloads of a server process, and at
+# most BATCH_MAX_CONCURRENT batches render at once; a batch can only be
+# downloaded once at a time, unless its progress is older than
+# BATCH_STALE_SECONDS.
+BATCH_WORKERS = None
+BATCH_CHUNK_SIZE = 16
+BATCH_PROGRESS_EVERY = 100
+BATCH_MAX_ROWS = 100000
+BATCH_MAX_CONCURRENT = 2
+BATCH_STALE_SECONDS = 900
+
+# LLM scheduler
+# Every generation in a process goes through LLM_MAX_CONCURRENT slots, each
+# holding its own model instance; queries are served before document
+# generation. Each job runs in a fresh chat session, so nothing of one
+# request stays in the model's context for the next; evaluated prompt
+# prefixes are not cached.
+LLM_MAX_CONCURRENT = 1
+
+# Answer cache
+# analyze_query answers are reused for the same document selection when the
+# normalized query matches exactly or its embedding is at least
+# ANSWER_CACHE_SIMILARITY cosine-similar to a cached query. Reprocessing or
+# deleting a document drops the answers that depend on it.
+ANSWER_CACHE_ENABLED = True
+ANSWER_CACHE_SIMILARITY = 0.95
+ANSWER_CACHE_MAX_ENTRIES = 10000
+
+# Conversations
+# analyze_query stores each query and answer in a conversation. The LLM
+# sees the last CONVERSATION_CONTEXT_TURNS messages within
+# CONVERSATION_CONTEXT_TOKENS (estimated) plus a rolling summary of older
+# turns, refreshed in the background every CONVERSATION_SUMMARY_BATCH
+# messages and capped at CONVERSATION_SUMMARY_TOKENS.
+CONVERSATION_PAGE_SIZE = 50
+CONVERSATION_CONTEXT_TURNS = 6
+CONVERSATION_CONTEXT_TOKENS = 400
+CONVERSATION_SUMMARY_TOKENS = 150
+CONVERSATION_SUMMARY_BATCH = 4
+
+# Sectioned generation
+# Documents created with `sections` headings (or a number of sections, which
+# the LLM outlines first) are generated section by section, each from the
+# reference passages most relevant to its heading
+# (GENERATION_SECTION_CONTEXT_TOKENS) with at most LLM_SECTION_MAX_TOKENS.
+# Sections are written concurrently, one per LLM_MAX_CONCURRENT slot.
+# Sections are stored with a hash of their inputs, and regeneration only
+# rewrites the sections whose inputs changed.
+GENERATION_SECTION_CONTEXT_TOKENS = 600
+GENERATION_MAX_SECTIONS = 60
+LLM_SECTION_MAX_TOKENS = 384
@@ -0,0 +1,355 @@
+import csv
+import io
+import json
+import logging
+import os
+import re
+import threading
+import time
+import zipfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+
+from .renderers import EXTENSIONS, render_to_file
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHUNK_SIZE = 16
+DEFAULT_PROGRESS_EVERY = 100
+DEFAULT_MAX_ROWS = 100000
+DEFAULT_MAX_CONCURRENT = 2
+# A rendering batch whose progress was not saved for this long is assumed
+# to belong to a download that died, and may be downloaded again
+DEFAULT_STALE_SECONDS = 900
+MAX_STORED_ERRORS = 100
+# Already compressed formats are stored in the ZIP as they are
+STORED_FORMATS = ('docx', 'pdf')
+
+_UNSAFE_NAME_RE = re.compile(r'[^\w. -]+')
+
+
+class BatchDataError(Exception):
+    """Raised when mail merge data cannot be parsed"""
+
+
+class BatchInProgress(Exception):
+    """Raised when a batch is already being downloaded"""
+
+
+class RenderersBusy(Exception):
+    """Raised when BATCH_MAX_CONCURRENT batches are already rendering"""
+
+
+def iter_rows(file, data_format):
+    """
+    Read mail merge rows from a binary file, one at a time for CSV and JSON Lines
+
+    Yields:
+        dict: One row of placeholder values
+
+    Raises:
+        BatchDataError: If the data is malformed
+    """
+    text = io.TextIOWrapper(file, encoding='utf-8-sig', newline='')
+    try:
+        if data_format == 'csv':
+            for row in csv.DictReader(text):
+                yield row
+        elif data_format == 'jsonl':
+            for number, line in enumerate(text, 1):
+                if not line.strip():
+                    continue
+                row = json.loads(line)
+                if not isinstance(row, dict):
+                    raise BatchDataError(f"Line {number} is not a JSON object")
+                yield row
+        else:
+            rows = json.load(text)
+            if not isinstance(rows, list) or not all(isinstance(row, dict) for row in rows):
+                raise BatchDataError("JSON data must be a list of objects")
+            yield from rows
+    except (csv.Error, UnicodeDecodeError, ValueError) as e:
+        raise BatchDataError(f"Cannot parse {data_format} data: {str(e)}")
+    finally:
+        # Leave the file open for the caller, unless it already closed it
+        if not text.closed:
+            text.detach()
+
+
+def inspect_rows(file, data_format, max_rows=None):
+    """
+    Count the rows of a data file and return the fields of its first row
+
+    Raises:
+        BatchDataError: If the data is malformed or has too many rows
+    """
+    max_rows = max_rows or getattr(settings, 'BATCH_MAX_ROWS', DEFAULT_MAX_ROWS)
+    count = 0
+    fields = []
+    for row in iter_rows(file, data_format):
+        if count == 0:
+            fields = list(row)
+        count += 1
+        if count > max_rows:
+            raise BatchDataError(f"Batches are limited to {max_rows} rows")
+    return count, fields
+
+
+def safe_filename(value, max_length=100):
+    """A filesystem-safe form of a name, possibly empty"""
+    return _UNSAFE_NAME_RE.sub('_', str(value or '')).strip(' .')[:max_length]
+
+
+def entry_name(row, index, filename_field, output_format, seen):
+    """Unique, filesystem-safe ZIP entry name for a row"""
+    base = safe_filename(row.get(filename_field)) if filename_field else ''
+    base = base or f"{index + 1:05d}"
+    name = f"{base}.{EXTENSIONS[output_format]}"
+    suffix = 1
+    while name in seen:
+        suffix += 1
+        name = f"{base}_{suffix}.{EXTENSIONS[output_format]}"
+    seen.add(name)
+    return name
+
+
+# Worker processes shared by all batches of this process, and the slots
+# limiting how many batches use them at once
+_pool = None
+_pool_lock = threading.Lock()
+_render_slots = None
+
+
+def get_render_pool():
+    """The shared pool of BATCH_WORKERS render processes, started on first use"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            workers = getattr(settings, 'BATCH_WORKERS', None) or os.cpu_count() or 1
+            _pool = ProcessPoolExecutor(max_workers=workers)
+        return _pool
+
+
+def _discard_render_pool(pool):
+    """Drop a broken pool, so the next batch starts a new one"""
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _get_render_slots():
+    global _render_slots
+    with _pool_lock:
+        if _render_slots is None:
+            _render_slots = threading.BoundedSemaphore(
+                getattr(settings, 'BATCH_MAX_CONCURRENT', DEFAULT_MAX_CONCURRENT)
+            )
+        return _render_slots
+
+
+def _claim_batch(batch):
+    """
+    Mark a batch as rendering, unless another download is rendering it
+
+    Returns:
+        bool: True if this download may render the batch
+    """
+    from .models import BatchGeneration
+
+    now = timezone.now()
+    stale = now - timedelta(seconds=getattr(settings, 'BATCH_STALE_SECONDS', DEFAULT_STALE_SECONDS))
+    return bool(
+        BatchGeneration.objects.filter(id=batch.id)
+        .filter(~Q(status='rendering') | Q(updated_at__lt=stale))
+        .update(
+            status='rendering', completed_rows=0, failed_rows=0, errors=[],
+            started_at=now, finished_at=None, updated_at=now,
+        )
+    )
+
+
+def _render_chunk(plan, output_format, rows):
+    """Render (index, row) pairs in a worker; returns (index, data, error) tuples"""
+    results = []
+    for index, row in rows:
+        try:
+            out = io.BytesIO()
+            values = {name: '' if value is None else value for name, value in row.items()}
+            render_to_file(
+                str(values.get('content', '')), output_format, out,
+                title=str(values.get('title', '')), plan=plan, values=values,
+            )
+            results.append((index, out.getvalue(), None))
+        except Exception as e:
+            results.append((index, None, str(e)))
+    return results
+
+
+class ZipStream(io.RawIOBase):
+    """
+    Write-only sink for zipfile that hands written bytes back to a generator
+
+    It cannot seek, so zipfile writes each entry's sizes in a data
+    descriptor after its data, and nothing has to be rewritten later.
+    """
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def pop(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def _chunked(rows, size):
+    chunk = []
+    for item in rows:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _rendered_chunks(executor, plan, output_format, rows, chunk_size, window):
+    """
+    Render chunks in order, keeping at most `window` chunks in flight
+
+    The compiled template is sent with every chunk, since the pool is
+    shared by batches of different templates. Chunks still queued when the
+    generator is closed are cancelled.
+    """
+    pending = deque()
+    try:
+        for chunk in _chunked(rows, chunk_size):
+            pending.append((chunk, executor.submit(_render_chunk, plan, output_format, chunk)))
+            if len(pending) >= window:
+                yield pending.popleft()
+        while pending:
+            yield pending.popleft()
+    finally:
+        for _, future in pending:
+            future.cancel()
+
+
+def stream_batch_zip(batch, plan):
+    """
+    Render a mail merge batch and yield it as a ZIP archive, piece by piece
+
+    Rows are read from the data file as they are needed and rendered by the
+    pool of BATCH_WORKERS processes shared by all downloads, of which at
+    most BATCH_MAX_CONCURRENT render at once. Only a bounded window of
+    rendered documents is held at a time: each is written to the archive
+    and sent as soon as it is ready, so neither the archive nor the
+    documents are ever stored. Progress is saved on the batch every
+    BATCH_PROGRESS_EVERY rows; rows that fail are listed in errors.txt at
+    the end of the archive.
+
+    The batch is claimed and a render slot taken when the generator is
+    first advanced, which yields an empty piece: callers should advance it
+    once before starting a response, to report the errors below.
+
+    Args:
+        batch (BatchGeneration): The batch to render
+        plan (RenderPlan): The batch template, compiled
+
+    Yields:
+        bytes: Consecutive pieces of the ZIP file
+
+    Raises:
+        RenderersBusy: If BATCH_MAX_CONCURRENT batches are rendering
+        BatchInProgress: If another download is rendering this batch
+    """
+    from .models import BatchGeneration
+
+    slots = _get_render_slots()
+    if not slots.acquire(blocking=False):
+        raise RenderersBusy("Too many batches are rendering, try again later")
+    if not _claim_batch(batch):
+        slots.release()
+        raise BatchInProgress(f"Batch {batch.id} is already being downloaded")
+
+    workers = getattr(settings, 'BATCH_WORKERS', None) or os.cpu_count() or 1
+    chunk_size = getattr(settings, 'BATCH_CHUNK_SIZE', DEFAULT_CHUNK_SIZE)
+    progress_every = getattr(settings, 'BATCH_PROGRESS_EVERY', DEFAULT_PROGRESS_EVERY)
+    compression = zipfile.ZIP_STORED if batch.output_format in STORED_FORMATS else zipfile.ZIP_DEFLATED
+
+    completed = failed = 0
+    errors = []
+    names = set()
+    started = time.monotonic()
+    stream = ZipStream()
+    archive = zipfile.ZipFile(stream, 'w')
+    executor = get_render_pool()
+    finished = False
+    try:
+        yield b''
+        with batch.data_file.open('rb') as file:
+            rows = enumerate(iter_rows(file, batch.data_format))
+            chunks = _rendered_chunks(executor, plan, batch.output_format, rows, chunk_size, window=2 * workers)
+            for chunk, future in chunks:
+                rows_by_index = dict(chunk)
+                for index, data, error in future.result():
+                    if error is None:
+                        name = entry_name(rows_by_index[index], index, batch.filename_field, batch.output_format, names)
+                        info = zipfile.ZipInfo(name, date_time=time.localtime()[:6])
+                        info.compress_type = compression
+                        archive.writestr(info, data)
+                        completed += 1
+                    else:
+                        failed += 1
+                        errors.append({'row': index + 1, 'error': error})
+                    if (completed + failed) % progress_every == 0:
+                        BatchGeneration.objects.filter(id=batch.id).update(
+                            completed_rows=completed, failed_rows=failed, updated_at=timezone.now()
+                        )
+                yield stream.pop()
+        if errors:
+            archive.writestr('errors.txt', ''.join(f"Row {e['row']}: {e['error']}\n" for e in errors))
+        archive.close()
+        yield stream.pop()
+        finished = True
+    except Exception as e:
+        logger.error(f"Batch {batch.id} failed: {str(e)}")
+        errors.append({'row': None, 'error': str(e)})
+        if isinstance(e, BrokenProcessPool):
+            _discard_render_pool(executor)
+        raise
+    finally:
+        # Also reached when the client disconnects and the generator is closed
+        slots.release()
+        if not finished and not any(error['row'] is None for error in errors):
+            errors.append({'row': None, 'error': f"Download stopped after {completed + failed} rows"})
+        BatchGeneration.objects.filter(id=batch.id).update(
+            status='completed' if finished else 'failed',
+            completed_rows=completed, failed_rows=failed, errors=errors[:MAX_STORED_ERRORS],
+            finished_at=timezone.now(), updated_at=timezone.now(),
+        )
+        elapsed = time.monotonic() - started
+        logger.info(
+            f"Batch {batch.id}: {completed} rendered, {failed} failed in {elapsed:.1f}s "
+            f"({(completed + failed) / elapsed if elapsed else 0:.1f} rows/s, {workers} workers)"
+        )
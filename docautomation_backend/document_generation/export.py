@@ -0,0 +1,235 @@
+import json
+import logging
+import os
+import time
+import zipfile
+
+from django.db.models import Q
+from django.utils.dateparse import parse_date, parse_datetime
+
+from .batch import ZipStream, safe_filename
+from .renderers import EXTENSIONS
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+INCLUDE_CHOICES = ('originals', 'text', 'generated')
+COPY_CHUNK_SIZE = 64 * 1024
+# Rows fetched per query while iterating over the selection
+ITERATOR_CHUNK_SIZE = 100
+# Already compressed files are stored in the ZIP as they are
+STORED_EXTENSIONS = ('.pdf', '.docx', '.doc', '.xlsx', '.pptx', '.png', '.jpg', '.jpeg', '.gif', '.zip', '.gz')
+
+
+class ExportError(Exception):
+    """Raised when an export request is invalid"""
+
+
+def _id_list(value, name):
+    """Ids from a JSON list or a comma-separated string"""
+    if value in (None, ''):
+        return []
+    if isinstance(value, str):
+        value = value.split(',')
+    if not isinstance(value, list):
+        raise ExportError(f"{name} must be a list of ids")
+    try:
+        return [int(item) for item in value if str(item).strip()]
+    except (TypeError, ValueError):
+        raise ExportError(f"{name} must be a list of ids")
+
+
+def _parse_time(value, name):
+    parsed = parse_datetime(value) or parse_date(value)
+    if parsed is None:
+        raise ExportError(f"{name} must be a date or datetime")
+    return parsed
+
+
+def select_export(params):
+    """
+    Documents and generated documents selected by an export request
+
+    Args:
+        params (dict): `document_ids` and `generated_ids` (lists or
+            comma-separated), the filters `document_type`,
+            `processing_status`, `created_after`, `created_before` and `q`
+            (title contains), and `include`: any of originals, text and
+            generated (all by default). Generated documents are those listed
+            plus those drawn from the selected documents.
+
+    Returns:
+        tuple: (documents queryset or None, generated documents queryset,
+        include list)
+
+    Raises:
+        ExportError: If the request selects nothing or is malformed
+    """
+    from document_processing.models import Document
+    from .models import GeneratedDocument
+
+    document_ids = _id_list(params.get('document_ids'), 'document_ids')
+    generated_ids = _id_list(params.get('generated_ids'), 'generated_ids')
+    include = params.get('include') or list(INCLUDE_CHOICES)
+    if isinstance(include, str):
+        include = [item.strip() for item in include.split(',') if item.strip()]
+    unknown = [item for item in include if item not in INCLUDE_CHOICES]
+    if unknown:
+        raise ExportError(f"Unknown include values: {', '.join(map(str, unknown))}")
+
+    filters = {}
+    for field in ('document_type', 'processing_status'):
+        if params.get(field):
+            filters[field] = params[field]
+    if params.get('created_after'):
+        filters['created_at__gte'] = _parse_time(params['created_after'], 'created_after')
+    if params.get('created_before'):
+        filters['created_at__lt'] = _parse_time(params['created_before'], 'created_before')
+    if params.get('q'):
+        filters['title__icontains'] = params['q']
+    if not (document_ids or generated_ids or filters):
+        raise ExportError("Select documents with document_ids, generated_ids or a filter")
+
+    documents = None
+    if document_ids or filters:
+        documents = Document.objects.filter(**filters)
+        if document_ids:
+            documents = documents.filter(id__in=document_ids)
+        documents = documents.order_by('id')
+
+    generated = GeneratedDocument.objects.none()
+    if 'generated' in include:
+        selected = Q(id__in=generated_ids)
+        if documents is not None:
+            selected |= Q(reference_documents__in=documents.values('id'))
+        generated = (
+            GeneratedDocument.objects.filter(selected, status='completed').exclude(file='')
+            .distinct().order_by('id')
+        )
+    return documents, generated, include
+
+
+def _compression(name):
+    return zipfile.ZIP_STORED if os.path.splitext(name)[1].lower() in STORED_EXTENSIONS else zipfile.ZIP_DEFLATED
+
+
+def _write_entry(archive, stream, name, pieces, size_hint=0):
+    """Write one archive entry from an iterable of bytes, yielding the archive as it grows"""
+    info = zipfile.ZipInfo(name, date_time=time.localtime()[:6])
+    info.compress_type = _compression(name)
+    # Only used to decide whether the entry needs ZIP64 sizes
+    info.file_size = size_hint
+    with archive.open(info, 'w') as entry:
+        for piece in pieces:
+            entry.write(piece)
+            data = stream.pop()
+            if data:
+                yield data
+    yield stream.pop()
+
+
+def _iter_file(file):
+    """Read an open storage file in COPY_CHUNK_SIZE pieces, closing it at the end"""
+    try:
+        while True:
+            piece = file.read(COPY_CHUNK_SIZE)
+            if not piece:
+                break
+            yield piece
+    finally:
+        file.close()
+
+
+def _open_stored(field):
+    """An open storage file, or None if it is missing"""
+    try:
+        return field.open('rb')
+    except (OSError, ValueError):
+        return None
+
+
+def stream_export_zip(documents, generated, include):
+    """
+    Yield a ZIP archive of documents and generated documents, piece by piece
+
+    Files are copied from storage to the archive in COPY_CHUNK_SIZE pieces
+    and each piece of the archive is yielded as soon as it is written, so
+    nothing is buffered beyond one piece and no temporary file is used.
+    Extracted text is decompressed incrementally. Rows are read from the
+    database ITERATOR_CHUNK_SIZE at a time. The archive ends with
+    manifest.json, which lists every entry and the files that were missing.
+
+    Layout:
+        documents/<id>-<title>/original.<ext>
+        documents/<id>-<title>/extracted_text.txt
+        generated/<id>-<title>.<ext>
+        manifest.json
+
+    Args:
+        documents (QuerySet): Documents to export, or None
+        generated (QuerySet): Generated documents to export
+        include (list): Any of originals, text and generated
+
+    Yields:
+        bytes: Consecutive pieces of the ZIP file
+    """
+    from document_processing.text_storage import iter_extracted_text
+
+    started = time.monotonic()
+    stream = ZipStream()
+    archive = zipfile.ZipFile(stream, 'w')
+    manifest = {'documents': [], 'generated_documents': [], 'missing': []}
+
+    if documents is not None and ('originals' in include or 'text' in include):
+        for document in documents.defer('extracted_text').iterator(chunk_size=ITERATOR_CHUNK_SIZE):
+            folder = f"documents/{document.id}-{safe_filename(document.title) or 'document'}"
+            entries = []
+            if 'originals' in include and document.file:
+                file = _open_stored(document.file)
+                if file is None:
+                    manifest['missing'].append(document.file.name)
+                else:
+                    name = f"{folder}/original{os.path.splitext(document.file.name)[1].lower()}"
+                    yield from _write_entry(archive, stream, name, _iter_file(file), size_hint=document.file.size)
+                    entries.append(name)
+            if 'text' in include and document.text_length:
+                name = f"{folder}/extracted_text.txt"
+                pieces = (piece.encode('utf-8') for piece in iter_extracted_text(document))
+                # Up to 4 bytes per character in UTF-8
+                yield from _write_entry(archive, stream, name, pieces, size_hint=4 * document.text_length)
+                entries.append(name)
+            manifest['documents'].append({
+                'id': document.id,
+                'title': document.title,
+                'document_type': document.document_type,
+                'processing_status': document.processing_status,
+                'created_at': document.created_at.isoformat(),
+                'entries': entries,
+            })
+
+    fields = ('id', 'title', 'prompt', 'output_format', 'file', 'created_at')
+    for generated_doc in generated.only(*fields).iterator(chunk_size=ITERATOR_CHUNK_SIZE):
+        file = _open_stored(generated_doc.file)
+        if file is None:
+            manifest['missing'].append(generated_doc.file.name)
+            continue
+        extension = EXTENSIONS.get(generated_doc.output_format, generated_doc.output_format)
+        name = f"generated/{generated_doc.id}-{safe_filename(generated_doc.title) or 'document'}.{extension}"
+        yield from _write_entry(archive, stream, name, _iter_file(file), size_hint=generated_doc.file.size)
+        manifest['generated_documents'].append({
+            'id': generated_doc.id,
+            'title': generated_doc.title,
+            'prompt': generated_doc.prompt,
+            'output_format': generated_doc.output_format,
+            'created_at': generated_doc.created_at.isoformat(),
+            'entry': name,
+        })
+
+    archive.writestr('manifest.json', json.dumps(manifest, indent=2))
+    archive.close()
+    yield stream.pop()
+    logger.info(
+        f"Exported {len(manifest['documents'])} documents and {len(manifest['generated_documents'])} "
+        f"generated documents ({stream.tell()} bytes, {len(manifest['missing'])} files missing) "
+        f"in {time.monotonic() - started:.1f}s"
+    )
@@ -0,0 +1,135 @@
+import hashlib
+import json
+import logging
+from datetime import datetime
+
+from django.core.files.storage import default_storage
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Bump when the generation pipeline changes in a way that changes its output
+FINGERPRINT_VERSION = 1
+# Completed documents checked for a file that still exists
+MAX_CANDIDATES = 5
+
+
+def reference_hashes(document_ids):
+    """
+    Content hash of each reference document, from its chunk hashes
+
+    Documents that have not been chunked yet fall back to their update time
+    and text length.
+
+    Returns:
+        dict: Document id to hex digest
+    """
+    from document_processing.models import Document, DocumentChunk
+
+    digests = {}
+    chunks = (
+        DocumentChunk.objects.filter(document_id__in=document_ids)
+        .order_by('document_id', 'index')
+        .values_list('document_id', 'content_hash')
+        .iterator(chunk_size=2000)
+    )
+    for document_id, chunk_hash in chunks:
+        digests.setdefault(document_id, hashlib.sha256()).update(chunk_hash.encode('ascii'))
+    hashes = {document_id: digest.hexdigest() for document_id, digest in digests.items()}
+
+    missing = [document_id for document_id in document_ids if document_id not in hashes]
+    if missing:
+        for document_id, updated_at, text_length in Document.objects.filter(id__in=missing).values_list(
+            'id', 'updated_at', 'text_length'
+        ):
+            hashes[document_id] = f"{updated_at.isoformat()}:{text_length}"
+    return hashes
+
+
+def get_generation_model_id():
+    """Models generated content depends on: the embedding model and the LLM (or the placeholder)"""
+    from nlp import embeddings
+    from nlp.llm import get_llm_model_id
+
+    generation_model = get_llm_model_id() or 'placeholder'
+    return f"{embeddings.get_model_id()}|{generation_model}"
+
+
+def compute_fingerprint(generated_doc, document_ids=None):
+    """
+    Fingerprint of everything a generated document is made from
+
+    Covers title, prompt, outline, template version (id and updated_at),
+    the content of the reference documents, output format and models. An
+    outline planned by the LLM from a section count is not part of it: it
+    follows from the other inputs, and is only stored after the
+    fingerprint was first computed.
+    Templates using a `{{ date }}` placeholder also depend on the current
+    date.
+
+    Args:
+        generated_doc (GeneratedDocument): A saved document
+        document_ids (list): Its reference document ids, read from the
+            database if not given
+
+    Returns:
+        str: Hex SHA-256 digest
+    """
+    if document_ids is None:
+        document_ids = list(generated_doc.reference_documents.values_list('id', flat=True))
+    hashes = reference_hashes(document_ids)
+
+    template = generated_doc.template
+    template_key = None
+    if template is not None:
+        template_key = [template.id, template.updated_at.isoformat()]
+        from .templating import TemplateError, get_template_cache
+        try:
+            if 'date' in get_template_cache().get(template).placeholders:
+                template_key.append(datetime.now().strftime('%Y-%m-%d'))
+        except TemplateError:
+            pass
+
+    key = {
+        'version': FINGERPRINT_VERSION,
+        'title': generated_doc.title,
+        'prompt': generated_doc.prompt,
+        'template': template_key,
+        'outline': [] if generated_doc.section_count else generated_doc.outline,
+        'section_count': generated_doc.section_count,
+        'references': [hashes.get(document_id, '') for document_id in sorted(document_ids)],
+        'output_format': generated_doc.output_format,
+        'model': get_generation_model_id(),
+    }
+    return hashlib.sha256(json.dumps(key, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def find_cached(fingerprint):
+    """
+    Latest completed document with this fingerprint whose file still exists
+
+    Returns:
+        GeneratedDocument: Or None
+    """
+    from .models import GeneratedDocument
+
+    candidates = (
+        GeneratedDocument.objects.filter(fingerprint=fingerprint, status='completed')
+        .exclude(file='')
+        .order_by('-updated_at')
+        .only('id', 'content', 'file')[:MAX_CANDIDATES]
+    )
+    for candidate in candidates:
+        if default_storage.exists(candidate.file.name):
+            return candidate
+    return None
+
+
+def link_cached(generated_doc, cached):
+    """Complete a document with the content and file of an identical earlier generation"""
+    generated_doc.content = cached.content
+    generated_doc.file.name = cached.file.name
+    generated_doc.status = 'completed'
+    generated_doc.error_message = ''
+    generated_doc.save()
+    logger.info(f"Generated document {generated_doc.id} reuses the output of {cached.id}")
@@ -0,0 +1,35 @@
+# Generated by Django 4.2.30 on 2026-10-19 09:15
+
+from django.db import migrations, models
+import django.db.models.deletion
+import document_generation.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('document_generation', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BatchGeneration',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('output_format', models.CharField(choices=[('docx', 'DOCX'), ('pdf', 'PDF'), ('txt', 'Text'), ('markdown', 'Markdown'), ('html', 'HTML')], default='docx', max_length=20)),
+                ('data_file', models.FileField(upload_to=document_generation.models.batch_data_path)),
+                ('data_format', models.CharField(choices=[('csv', 'CSV'), ('json', 'JSON'), ('jsonl', 'JSON Lines')], default='csv', max_length=10)),
+                ('filename_field', models.CharField(blank=True, max_length=255)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('rendering', 'Rendering'), ('completed', 'Completed'), ('failed', 'Failed')], default='pending', max_length=20)),
+                ('total_rows', models.PositiveIntegerField(default=0)),
+                ('completed_rows', models.PositiveIntegerField(default=0)),
+                ('failed_rows', models.PositiveIntegerField(default=0)),
+                ('errors', models.JSONField(blank=True, default=list)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('template', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='batches', to='document_generation.documenttemplate')),
+            ],
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 4.2.30 on 2026-10-19 09:19
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('document_generation', '0003_generated_document_fingerprint'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='generateddocument',
+            name='outline',
+            field=models.JSONField(blank=True, default=list),
+        ),
+        migrations.CreateModel(
+            name='GeneratedSection',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('index', models.PositiveIntegerField()),
+                ('heading', models.CharField(max_length=255)),
+                ('content', models.TextField(blank=True)),
+                ('input_hash', models.CharField(db_index=True, max_length=64)),
+                ('dependencies', models.JSONField(blank=True, default=list)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('generating', 'Generating'), ('completed', 'Completed'), ('failed', 'Failed')], default='pending', max_length=20)),
+                ('error_message', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('generated_document', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='sections', to='document_generation.generateddocument')),
+            ],
+            options={
+                'ordering': ['generated_document', 'index'],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='generatedsection',
+            constraint=models.UniqueConstraint(fields=('generated_document', 'index'), name='unique_generated_section_index'),
+        ),
+    ]
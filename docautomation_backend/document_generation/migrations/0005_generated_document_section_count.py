@@ -0,0 +1,23 @@
+# Generated by Django 4.2.30 on 2026-10-19 09:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('document_generation', '0004_generated_sections'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='generateddocument',
+            name='section_count',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AlterField(
+            model_name='generateddocument',
+            name='status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('outlining', 'Outlining'), ('generating', 'Generating'), ('completed', 'Completed'), ('failed', 'Failed')], default='pending', max_length=20),
+        ),
+    ]
@@ -14,6 +14,12 @@ def template_file_path(instance, filename):
     filename = f"{uuid.uuid4()}.{ext}"
     return os.path.join('templates/', filename)
 
+def batch_data_path(instance, filename):
+    """Generate file path for mail merge data files"""
+    ext = filename.split('.')[-1]
+    filename = f"{uuid.uuid4()}.{ext}"
+    return os.path.join('batch_data/', filename)
+
 class DocumentTemplate(models.Model):
     """Document template model for storing template files"""
     TEMPLATE_TYPES = (
@@ -38,6 +44,7 @@ class GeneratedDocument(models.Model):
     """Generated document model for storing AI-generated documents"""
     GENERATION_STATUS = (
         ('pending', 'Pending'),
+        ('outlining', 'Outlining'),
         ('generating', 'Generating'),
         ('completed', 'Completed'),
         ('failed', 'Failed'),
@@ -60,8 +67,80 @@ class GeneratedDocument(models.Model):
     error_message = models.TextField(blank=True)
     template = models.ForeignKey(DocumentTemplate, on_delete=models.SET_NULL, blank=True, null=True)
     reference_documents = models.ManyToManyField('document_processing.Document', blank=True)
+    # Hash of the generation inputs; documents sharing it share their output
+    fingerprint = models.CharField(max_length=64, blank=True, db_index=True)
+    # Section headings; documents with an outline are generated section by section
+    outline = models.JSONField(default=list, blank=True)
+    # Sections to plan with the LLM when no outline is given
+    section_count = models.PositiveSmallIntegerField(default=0)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
     def __str__(self):
         return self.title
+
+class GeneratedSection(models.Model):
+    """One section of a generated document, reusable while its inputs are unchanged"""
+    SECTION_STATUS = (
+        ('pending', 'Pending'),
+        ('generating', 'Generating'),
+        ('completed', 'Completed'),
+        ('failed', 'Failed'),
+    )
+    
+    generated_document = models.ForeignKey(GeneratedDocument, on_delete=models.CASCADE, related_name='sections')
+    index = models.PositiveIntegerField()
+    heading = models.CharField(max_length=255)
+    content = models.TextField(blank=True)
+    # Hash of everything the content was written from: document title and
+    # prompt, heading, reference passages and models
+    input_hash = models.CharField(max_length=64, db_index=True)
+    # Content hashes of the reference passages the section was written from
+    dependencies = models.JSONField(default=list, blank=True)
+    status = models.CharField(max_length=20, choices=SECTION_STATUS, default='pending')
+    error_message = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        ordering = ['generated_document', 'index']
+        constraints = [
+            models.UniqueConstraint(fields=['generated_document', 'index'], name='unique_generated_section_index'),
+        ]
+    
+    def __str__(self):
+        return f"{self.generated_document_id}:{self.index} {self.heading}"
+
+class BatchGeneration(models.Model):
+    """Mail merge of one template against many data rows, downloaded as a ZIP"""
+    BATCH_STATUS = (
+        ('pending', 'Pending'),
+        ('rendering', 'Rendering'),
+        ('completed', 'Completed'),
+        ('failed', 'Failed'),
+    )
+    
+    DATA_FORMATS = (
+        ('csv', 'CSV'),
+        ('json', 'JSON'),
+        ('jsonl', 'JSON Lines'),
+    )
+    
+    template = models.ForeignKey(DocumentTemplate, on_delete=models.CASCADE, related_name='batches')
+    output_format = models.CharField(max_length=20, choices=GeneratedDocument.FORMAT_TYPES, default='docx')
+    data_file = models.FileField(upload_to=batch_data_path)
+    data_format = models.CharField(max_length=10, choices=DATA_FORMATS, default='csv')
+    # Column naming each output file; rows are numbered when empty
+    filename_field = models.CharField(max_length=255, blank=True)
+    status = models.CharField(max_length=20, choices=BATCH_STATUS, default='pending')
+    total_rows = models.PositiveIntegerField(default=0)
+    completed_rows = models.PositiveIntegerField(default=0)
+    failed_rows = models.PositiveIntegerField(default=0)
+    errors = models.JSONField(default=list, blank=True)
+    started_at = models.DateTimeField(blank=True, null=True)
+    finished_at = models.DateTimeField(blank=True, null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    def __str__(self):
+        return f"Batch {self.id}: {self.template} x {self.total_rows}"
@@ -0,0 +1,693 @@
+import io
+import logging
+import os
+import re
+import tempfile
+import threading
+import zipfile
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from html import escape as html_escape
+from xml.sax.saxutils import escape as xml_escape
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import default_storage
+
+from .templating import CONTENT
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+DEFAULT_RENDER_WORKERS = 2
+DEFAULT_SPOOL_MAX_BYTES = 1024 * 1024
+
+CONTENT_TYPES = {
+    'docx': 'application/vnd.openxmlformats-officedocument.wordprocessingml.document',
+    'pdf': 'application/pdf',
+    'txt': 'text/plain; charset=utf-8',
+    'markdown': 'text/markdown; charset=utf-8',
+    'html': 'text/html; charset=utf-8',
+}
+EXTENSIONS = {
+    'docx': 'docx',
+    'pdf': 'pdf',
+    'txt': 'txt',
+    'markdown': 'md',
+    'html': 'html',
+}
+
+_HEADING_RE = re.compile(r'^(#{1,6})\s+(.*?)\s*#*\s*$')
+_BULLET_RE = re.compile(r'^\s*[-*+]\s+(.*)$')
+_NUMBERED_RE = re.compile(r'^\s*(\d+)[.)]\s+(.*)$')
+_FENCE_RE = re.compile(r'^\s*(```+|~~~+)\s*([\w+#.-]*)')
+_TABLE_ROW_RE = re.compile(r'^\s*\|')
+_TABLE_SEPARATOR_RE = re.compile(r'^[\s|:-]+$')
+_INLINE_RE = re.compile(r'(\*\*.+?\*\*|__.+?__|\*[^*\s][^*]*?\*|`[^`]+`)')
+# Characters XML 1.0 does not allow, even escaped
+_XML_INVALID_RE = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f]')
+_DOCX_MONOSPACE = '<w:rFonts w:ascii="Consolas" w:hAnsi="Consolas"/>'
+_DOCX_PSTYLE_RE = re.compile(r'<w:pStyle [^>]*/>')
+_DOCX_SECTPR_RE = re.compile(r'<w:sectPr[ >].*?</w:sectPr>|<w:sectPr/>', re.S)
+
+
+def _iter_lines(content):
+    # str.splitlines() and StringIO would both hold a second copy of the content
+    start = 0
+    while start < len(content):
+        end = content.find('\n', start)
+        if end == -1:
+            end = len(content)
+        yield content[start:end].rstrip('\r')
+        start = end + 1
+
+
+def iter_blocks(content):
+    """
+    Split Markdown into blocks without copying it into a list of lines
+
+    Fenced code blocks and pipe tables are preformatted: their lines are
+    kept verbatim, including indentation and inline markers.
+
+    Yields:
+        tuple: (kind, marker, text) where kind is 'heading' (marker is the
+        level), 'bullet', 'numbered' (marker is the number), 'code' (marker
+        is the fence's language, text the lines joined with newlines),
+        'table' (text the rows, one per line) or 'paragraph'
+    """
+    paragraph = []
+    table = []
+    fence = None
+    code = []
+    for line in _iter_lines(content):
+        if fence is not None:
+            if line.strip().startswith(fence[0]):
+                yield 'code', fence[1] or None, '\n'.join(code)
+                fence, code = None, []
+            else:
+                code.append(line)
+            continue
+        if table and not _TABLE_ROW_RE.match(line):
+            yield 'table', None, '\n'.join(table)
+            table = []
+        opening = _FENCE_RE.match(line)
+        if opening or _TABLE_ROW_RE.match(line):
+            if paragraph:
+                yield 'paragraph', None, ' '.join(paragraph)
+                paragraph = []
+            if opening:
+                fence = (opening.group(1), opening.group(2))
+            else:
+                table.append(line.strip())
+            continue
+        heading = _HEADING_RE.match(line)
+        bullet = _BULLET_RE.match(line)
+        numbered = _NUMBERED_RE.match(line)
+        if heading or bullet or numbered or not line.strip():
+            if paragraph:
+                yield 'paragraph', None, ' '.join(paragraph)
+                paragraph = []
+            if heading:
+                yield 'heading', len(heading.group(1)), heading.group(2)
+            elif bullet:
+                yield 'bullet', None, bullet.group(1).strip()
+            elif numbered:
+                yield 'numbered', numbered.group(1), numbered.group(2).strip()
+        else:
+            paragraph.append(line.strip())
+    if paragraph:
+        yield 'paragraph', None, ' '.join(paragraph)
+    if table:
+        yield 'table', None, '\n'.join(table)
+    if fence is not None:
+        # Unclosed fence: the rest of the content is code
+        yield 'code', fence[1] or None, '\n'.join(code)
+
+
+def table_rows(text):
+    """
+    Cells of a pipe table block, without its header separator row
+
+    Returns:
+        list: One list of cell strings per row
+    """
+    rows = []
+    for line in text.split('\n'):
+        if _TABLE_SEPARATOR_RE.match(line):
+            continue
+        line = line.strip()
+        if line.startswith('|'):
+            line = line[1:]
+        if line.endswith('|') and not line.endswith('\\|'):
+            line = line[:-1]
+        rows.append([cell.strip().replace('\\|', '|') for cell in re.split(r'(?<!\\)\|', line)])
+    return rows
+
+
+def iter_runs(text):
+    """
+    Split inline Markdown into runs
+
+    Yields:
+        tuple: (text, bold, italic, code)
+    """
+    for part in _INLINE_RE.split(text):
+        if not part:
+            continue
+        if part[:2] in ('**', '__') and part[-2:] == part[:2] and len(part) > 4:
+            yield part[2:-2], True, False, False
+        elif part[0] == '*' and part[-1] == '*' and len(part) > 2:
+            yield part[1:-1], False, True, False
+        elif part[0] == '`' and part[-1] == '`' and len(part) > 2:
+            yield part[1:-1], False, False, True
+        else:
+            yield part, False, False, False
+
+
+def plain_text(text):
+    """Inline Markdown with the markup removed"""
+    return ''.join(run[0] for run in iter_runs(text))
+
+
+def render_markdown(content, out, title=''):
+    """Write the content unchanged, in pieces"""
+    writer = io.TextIOWrapper(out, encoding='utf-8', newline='')
+    for start in range(0, len(content), 64 * 1024):
+        writer.write(content[start:start + 64 * 1024])
+    writer.flush()
+    writer.detach()
+
+
+def render_text(content, out, title=''):
+    """Plain text: Markdown markers dropped, headings underlined"""
+    writer = io.TextIOWrapper(out, encoding='utf-8', newline='')
+    previous = None
+    for kind, marker, text in iter_blocks(content):
+        if previous in ('bullet', 'numbered') and kind != previous:
+            writer.write("\n")
+        previous = kind
+        if kind in ('code', 'table'):
+            writer.write(f"{text}\n\n")
+            continue
+        text = plain_text(text)
+        if kind == 'heading':
+            writer.write(f"{text}\n{('=' if marker == 1 else '-') * len(text)}\n\n")
+        elif kind == 'bullet':
+            writer.write(f"  - {text}\n")
+        elif kind == 'numbered':
+            writer.write(f"  {marker}. {text}\n")
+        else:
+            writer.write(f"{text}\n\n")
+    writer.flush()
+    writer.detach()
+
+
+def _html_runs(text):
+    parts = []
+    for run, bold, italic, code in iter_runs(text):
+        run = html_escape(run)
+        if bold:
+            run = f"<strong>{run}</strong>"
+        elif italic:
+            run = f"<em>{run}</em>"
+        elif code:
+            run = f"<code>{run}</code>"
+        parts.append(run)
+    return ''.join(parts)
+
+
+def _write_html_table(writer, text):
+    rows = table_rows(text)
+    writer.write("<table>\n")
+    for i, row in enumerate(rows):
+        tag = 'th' if i == 0 and len(rows) > 1 else 'td'
+        writer.write("<tr>" + ''.join(f"<{tag}>{_html_runs(cell)}</{tag}>" for cell in row) + "</tr>\n")
+    writer.write("</table>\n")
+
+
+def _write_html_blocks(writer, content):
+    open_list = None
+    for kind, marker, text in iter_blocks(content):
+        list_tag = {'bullet': 'ul', 'numbered': 'ol'}.get(kind)
+        if open_list and open_list != list_tag:
+            writer.write(f"</{open_list}>\n")
+            open_list = None
+        if list_tag and not open_list:
+            writer.write(f"<{list_tag}>\n")
+            open_list = list_tag
+        if kind == 'heading':
+            writer.write(f"<h{marker}>{_html_runs(text)}</h{marker}>\n")
+        elif kind == 'code':
+            language = f' class="language-{html_escape(marker)}"' if marker else ''
+            writer.write(f"<pre><code{language}>{html_escape(text)}</code></pre>\n")
+        elif kind == 'table':
+            _write_html_table(writer, text)
+        elif list_tag:
+            writer.write(f"<li>{_html_runs(text)}</li>\n")
+        else:
+            writer.write(f"<p>{_html_runs(text)}</p>\n")
+    if open_list:
+        writer.write(f"</{open_list}>\n")
+
+
+def render_html(content, out, title=''):
+    """Standalone HTML page"""
+    writer = io.TextIOWrapper(out, encoding='utf-8', newline='')
+    writer.write(
+        '<!DOCTYPE html>\n<html>\n<head>\n<meta charset="utf-8">\n'
+        f'<title>{html_escape(title)}</title>\n'
+        '<style>body{font-family:sans-serif;max-width:50em;margin:2em auto;line-height:1.5}</style>\n'
+        '</head>\n<body>\n'
+    )
+    _write_html_blocks(writer, content)
+    writer.write('</body>\n</html>\n')
+    writer.flush()
+    writer.detach()
+
+
+def render_html_template(plan, content, values, out):
+    """Fill an HTML template; `{{ content }}` becomes the rendered body"""
+    writer = io.TextIOWrapper(out, encoding='utf-8', newline='')
+    for literal, name in plan.segments:
+        writer.write(literal)
+        if name == CONTENT:
+            _write_html_blocks(writer, content)
+        elif name:
+            writer.write(html_escape(str(values.get(name, ''))))
+    writer.flush()
+    writer.detach()
+
+
+_DOCX_CONTENT_TYPES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="xml" ContentType="application/xml"/>'
+    '<Override PartName="/word/document.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml"/>'
+    '<Override PartName="/word/styles.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.styles+xml"/>'
+    '</Types>'
+)
+_DOCX_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+    'Target="word/document.xml"/>'
+    '</Relationships>'
+)
+_DOCX_DOCUMENT_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/styles" Target="styles.xml"/>'
+    '</Relationships>'
+)
+_W_NS = 'xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main"'
+
+
+def _docx_heading_style(level):
+    size = {1: 32, 2: 28, 3: 24}.get(level, 22)
+    return (
+        f'<w:style w:type="paragraph" w:styleId="Heading{level}">'
+        f'<w:name w:val="heading {level}"/><w:basedOn w:val="Normal"/><w:next w:val="Normal"/>'
+        f'<w:pPr><w:keepNext/><w:spacing w:before="240" w:after="120"/><w:outlineLvl w:val="{level - 1}"/></w:pPr>'
+        f'<w:rPr><w:b/><w:sz w:val="{size}"/></w:rPr></w:style>'
+    )
+
+
+_DOCX_STYLES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    f'<w:styles {_W_NS}>'
+    '<w:docDefaults><w:rPrDefault><w:rPr>'
+    '<w:rFonts w:ascii="Calibri" w:hAnsi="Calibri" w:cs="Calibri"/><w:sz w:val="22"/>'
+    '</w:rPr></w:rPrDefault>'
+    '<w:pPrDefault><w:pPr><w:spacing w:after="160" w:line="264" w:lineRule="auto"/></w:pPr></w:pPrDefault>'
+    '</w:docDefaults>'
+    '<w:style w:type="paragraph" w:default="1" w:styleId="Normal"><w:name w:val="Normal"/></w:style>'
+    + ''.join(_docx_heading_style(level) for level in range(1, 7)) +
+    '<w:style w:type="paragraph" w:styleId="ListParagraph"><w:name w:val="List Paragraph"/>'
+    '<w:basedOn w:val="Normal"/><w:pPr><w:spacing w:after="60"/>'
+    '<w:ind w:left="720" w:hanging="360"/></w:pPr></w:style>'
+    '</w:styles>'
+)
+
+
+def _docx_text(text):
+    return xml_escape(_XML_INVALID_RE.sub('', text))
+
+
+def _docx_properties(style, properties):
+    """
+    Paragraph properties for a block, based on those of a template paragraph
+
+    The block's own style (a heading or list item) replaces the template
+    paragraph's style; its other properties are kept.
+    """
+    if properties in ('', '<w:pPr/>'):
+        return f'<w:pPr><w:pStyle w:val="{style}"/></w:pPr>' if style else ''
+    if not style:
+        return properties
+    if _DOCX_PSTYLE_RE.search(properties):
+        return _DOCX_PSTYLE_RE.sub(f'<w:pStyle w:val="{style}"/>', properties, count=1)
+    # pStyle must be the first child of pPr
+    return properties.replace('<w:pPr>', f'<w:pPr><w:pStyle w:val="{style}"/>', 1)
+
+
+def _docx_paragraph(kind, marker, text, properties=''):
+    style = {'heading': f'Heading{marker}', 'bullet': 'ListParagraph', 'numbered': 'ListParagraph'}.get(kind)
+    parts = ['<w:p>', _docx_properties(style, properties)]
+    if kind in ('code', 'table'):
+        # Preformatted: one monospace run, with a line break per line
+        lines = '<w:br/>'.join(
+            f'<w:t xml:space="preserve">{_docx_text(line)}</w:t>' for line in text.split('\n')
+        )
+        parts.append(f'<w:r><w:rPr>{_DOCX_MONOSPACE}<w:sz w:val="18"/></w:rPr>{lines}</w:r></w:p>')
+        return ''.join(parts)
+    if kind == 'bullet':
+        parts.append('<w:r><w:t xml:space="preserve">•\t</w:t></w:r>')
+    elif kind == 'numbered':
+        parts.append(f'<w:r><w:t xml:space="preserve">{marker}.\t</w:t></w:r>')
+    for run, bold, italic, code in iter_runs(text):
+        properties = ''.join((
+            '<w:b/>' if bold else '',
+            '<w:i/>' if italic else '',
+            _DOCX_MONOSPACE if code else '',
+        ))
+        if properties:
+            properties = f'<w:rPr>{properties}</w:rPr>'
+        parts.append(f'<w:r>{properties}<w:t xml:space="preserve">{_docx_text(run)}</w:t></w:r>')
+    parts.append('</w:p>')
+    return ''.join(parts)
+
+
+def render_docx(content, out, title=''):
+    """
+    WordprocessingML package, with word/document.xml written paragraph by paragraph
+
+    Headings map to the built-in Heading styles, so Word's navigation pane
+    and table of contents pick them up.
+    """
+    with zipfile.ZipFile(out, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr('[Content_Types].xml', _DOCX_CONTENT_TYPES)
+        archive.writestr('_rels/.rels', _DOCX_RELS)
+        archive.writestr('word/_rels/document.xml.rels', _DOCX_DOCUMENT_RELS)
+        archive.writestr('word/styles.xml', _DOCX_STYLES)
+        with archive.open('word/document.xml', 'w') as part:
+            part.write(
+                f'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n<w:document {_W_NS}><w:body>'.encode('utf-8')
+            )
+            for block in iter_blocks(content):
+                part.write(_docx_paragraph(*block).encode('utf-8'))
+            part.write(
+                '<w:sectPr><w:pgSz w:w="12240" w:h="15840"/>'
+                '<w:pgMar w:top="1440" w:right="1440" w:bottom="1440" w:left="1440" '
+                'w:header="720" w:footer="720" w:gutter="0"/></w:sectPr>'
+                '</w:body></w:document>'.encode('utf-8')
+            )
+
+
+def render_docx_template(plan, content, values, out):
+    """
+    Fill a DOCX template, keeping its styles, headers, footers and media
+
+    A placeholder alone in its paragraph is replaced by paragraphs
+    (`{{ content }}` by the rendered body) that keep the placeholder
+    paragraph's properties, so a `{{ title }}` in a Heading 1 paragraph
+    stays a heading; one within text by plain text.
+    """
+    with zipfile.ZipFile(out, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        for name, data in plan.parts.items():
+            archive.writestr(name, data)
+        with archive.open('word/document.xml', 'w') as part:
+            for literal, name, properties in plan.segments:
+                part.write(literal.encode('utf-8'))
+                if name is None:
+                    continue
+                if properties is not None:
+                    value = content if name == CONTENT else str(values.get(name, ''))
+                    _write_docx_blocks(part, iter_blocks(value), properties)
+                else:
+                    part.write(_docx_text(str(values.get(name, ''))).encode('utf-8'))
+
+
+def _write_docx_blocks(part, blocks, properties):
+    """
+    Write blocks as paragraphs in place of a template paragraph
+
+    A section break in the template paragraph's properties ends the section
+    after it, so only the last paragraph keeps it. A value without blocks
+    still writes the (empty) paragraph: table cells and other containers
+    must hold at least one.
+    """
+    inner = _DOCX_SECTPR_RE.sub('', properties)
+    previous = None
+    for block in blocks:
+        if previous is not None:
+            part.write(_docx_paragraph(*previous, properties=inner).encode('utf-8'))
+        previous = block
+    if previous is None:
+        part.write(f'<w:p>{properties}</w:p>'.encode('utf-8'))
+    else:
+        part.write(_docx_paragraph(*previous, properties=properties).encode('utf-8'))
+
+
+class _PDFWriter:
+    """
+    Minimal PDF writer that emits each page as soon as it is full
+
+    Text is set in the standard Courier fonts, whose fixed advance (0.6 em)
+    makes line wrapping exact without font metrics. Only the page object
+    numbers and byte offsets are kept until the end.
+
+    The standard fonts only cover Windows-1252 (WinAnsiEncoding): other
+    characters, such as CJK text or most symbols, are printed as '?'. They
+    are counted in `replaced` and logged when the document is closed.
+    """
+    PAGE_WIDTH = 612
+    PAGE_HEIGHT = 792
+    MARGIN = 72
+    CATALOG, PAGES, FONT, BOLD_FONT = 1, 2, 3, 4
+
+    def __init__(self, out, title=''):
+        self.out = out
+        self.start = out.tell()
+        self.offsets = {}
+        self.page_ids = []
+        self.next_id = 5
+        self.lines = []
+        self.y = self.PAGE_HEIGHT - self.MARGIN
+        self.replaced = 0
+        self._write(b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n')
+        self._object(self.CATALOG, b'<< /Type /Catalog /Pages 2 0 R >>')
+        self._object(self.FONT, b'<< /Type /Font /Subtype /Type1 /BaseFont /Courier /Encoding /WinAnsiEncoding >>')
+        self._object(
+            self.BOLD_FONT, b'<< /Type /Font /Subtype /Type1 /BaseFont /Courier-Bold /Encoding /WinAnsiEncoding >>'
+        )
+        self.info_id = self._new_id()
+        self._object(self.info_id, b'<< /Title ' + self._string(title) + b' /Producer (DocAutomation) >>')
+
+    def _write(self, data):
+        self.out.write(data)
+
+    def _new_id(self):
+        self.next_id += 1
+        return self.next_id - 1
+
+    def _object(self, object_id, body):
+        self.offsets[object_id] = self.out.tell() - self.start
+        self._write(f'{object_id} 0 obj\n'.encode('ascii') + body + b'\nendobj\n')
+
+    def _string(self, text):
+        try:
+            data = text.encode('cp1252')
+        except UnicodeEncodeError:
+            data = text.encode('cp1252', errors='replace')
+            self.replaced += sum(1 for char in text if char != '?' and char.encode('cp1252', 'replace') == b'?')
+        data = data.replace(b'\\', b'\\\\').replace(b'(', b'\\(').replace(b')', b'\\)')
+        return b'(' + data + b')'
+
+    def add_line(self, text, size=10, bold=False, space_before=0):
+        leading = size * 1.25
+        if self.y - space_before - leading < self.MARGIN:
+            self.flush_page()
+        elif self.lines:
+            self.y -= space_before
+        self.y -= leading
+        font = b'/F2' if bold else b'/F1'
+        self.lines.append(
+            b'BT ' + font + f' {size} Tf {self.MARGIN} {self.y:.1f} Td '.encode('ascii') + self._string(text) + b' Tj ET'
+        )
+
+    def add_block(self, text, size=10, bold=False, indent='', space_before=6):
+        """Wrap a block of text to the page width and add its lines"""
+        width = int((self.PAGE_WIDTH - 2 * self.MARGIN) / (size * 0.6))
+        # Greedy wrap; with a fixed-width font, characters are all it takes
+        lines = []
+        line, length = [], len(indent)
+        for word in text.split():
+            while len(word) > width - len(indent):
+                # Hard-break words longer than a line
+                if line:
+                    lines.append(line)
+                    line, length = [], len(indent)
+                lines.append([word[:width - len(indent)]])
+                word = word[width - len(indent):]
+            if line and length + 1 + len(word) > width:
+                lines.append(line)
+                line, length = [], len(indent)
+            length += len(word) + (1 if line else 0)
+            line.append(word)
+        if line or not lines:
+            lines.append(line)
+        continuation = ' ' * len(indent)
+        for i, words in enumerate(lines):
+            self.add_line((indent if i == 0 else continuation) + ' '.join(words), size, bold,
+                          space_before if i == 0 else 0)
+
+    def add_preformatted(self, text, size=9, space_before=6):
+        """Add lines as they are, hard-wrapped at the page width"""
+        width = int((self.PAGE_WIDTH - 2 * self.MARGIN) / (size * 0.6))
+        for i, line in enumerate(text.split('\n')):
+            line = line.expandtabs(4)
+            pieces = [line[start:start + width] for start in range(0, len(line), width)] or ['']
+            for j, piece in enumerate(pieces):
+                self.add_line(piece, size, space_before=space_before if i == 0 and j == 0 else 0)
+
+    def flush_page(self):
+        if not self.lines:
+            return
+        stream = zlib.compress(b'\n'.join(self.lines))
+        content_id = self._new_id()
+        self._object(
+            content_id,
+            f'<< /Length {len(stream)} /Filter /FlateDecode >>\nstream\n'.encode('ascii') + stream + b'\nendstream'
+        )
+        page_id = self._new_id()
+        self._object(page_id, (
+            f'<< /Type /Page /Parent {self.PAGES} 0 R /MediaBox [0 0 {self.PAGE_WIDTH} {self.PAGE_HEIGHT}] '
+            f'/Resources << /Font << /F1 {self.FONT} 0 R /F2 {self.BOLD_FONT} 0 R >> >> '
+            f'/Contents {content_id} 0 R >>'
+        ).encode('ascii'))
+        self.page_ids.append(page_id)
+        self.lines = []
+        self.y = self.PAGE_HEIGHT - self.MARGIN
+
+    def close(self):
+        self.flush_page()
+        if not self.page_ids:
+            # A PDF needs at least one page
+            self.add_line('')
+            self.flush_page()
+        kids = ' '.join(f'{page_id} 0 R' for page_id in self.page_ids)
+        self._object(self.PAGES, f'<< /Type /Pages /Kids [{kids}] /Count {len(self.page_ids)} >>'.encode('ascii'))
+        xref_offset = self.out.tell() - self.start
+        size = self.next_id
+        entries = [b'0000000000 65535 f \n']
+        for object_id in range(1, size):
+            entries.append(f'{self.offsets[object_id]:010d} 00000 n \n'.encode('ascii'))
+        self._write(f'xref\n0 {size}\n'.encode('ascii') + b''.join(entries))
+        self._write(
+            f'trailer\n<< /Size {size} /Root {self.CATALOG} 0 R /Info {self.info_id} 0 R >>\n'
+            f'startxref\n{xref_offset}\n%%EOF\n'.encode('ascii')
+        )
+        if self.replaced:
+            logger.warning(f"PDF output: {self.replaced} characters outside Windows-1252 were replaced with '?'")
+
+
+def render_pdf(content, out, title=''):
+    """Paginated PDF with headings in bold; pages are written as they fill"""
+    writer = _PDFWriter(out, title)
+    for kind, marker, text in iter_blocks(content):
+        if kind in ('code', 'table'):
+            writer.add_preformatted(text, size=9)
+            continue
+        text = plain_text(text)
+        if kind == 'heading':
+            writer.add_block(text, size={1: 16, 2: 13}.get(marker, 11), bold=True, space_before=12)
+        elif kind == 'bullet':
+            writer.add_block(text, indent='  - ', space_before=2)
+        elif kind == 'numbered':
+            writer.add_block(text, indent=f'  {marker}. ', space_before=2)
+        else:
+            writer.add_block(text)
+    writer.close()
+
+
+RENDERERS = {
+    'docx': render_docx,
+    'pdf': render_pdf,
+    'txt': render_text,
+    'markdown': render_markdown,
+    'html': render_html,
+}
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_render_executor():
+    """Pool that bounds how many documents are rendered at once"""
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                workers = getattr(settings, 'GENERATION_RENDER_WORKERS', DEFAULT_RENDER_WORKERS)
+                _executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='render')
+    return _executor
+
+
+def render_to_file(content, output_format, out, title='', plan=None, values=None):
+    """
+    Render Markdown content into a binary file object in the given format
+
+    Args:
+        plan (RenderPlan): Compiled template to fill, if any. DOCX and HTML
+            templates are filled natively for their own format; otherwise
+            the template is filled as Markdown and rendered like content.
+        values (dict): Placeholder values; `content` is always the content
+
+    Raises:
+        ValueError: If the format is not one of GeneratedDocument.FORMAT_TYPES
+    """
+    renderer = RENDERERS.get(output_format)
+    if renderer is None:
+        raise ValueError(f"Unsupported output format: {output_format}")
+    if plan is not None:
+        values = values or {}
+        if plan.template_type == output_format == 'docx':
+            return render_docx_template(plan, content, values, out)
+        if plan.template_type == output_format == 'html':
+            return render_html_template(plan, content, values, out)
+        content = plan.fill_text(dict(values, **{CONTENT: content}))
+    renderer(content, out, title)
+
+
+def save_rendered(content, output_format, name, title='', plan=None, values=None):
+    """
+    Render into a spooled temporary file, then copy it to default_storage
+
+    Output stays in memory up to GENERATION_SPOOL_MAX_BYTES and goes to
+    disk beyond that, so large reports do not grow the worker's memory.
+
+    Args:
+        name (str): Storage path without extension
+        plan (RenderPlan), values (dict): Template to fill, as in render_to_file()
+
+    Returns:
+        str: The path the file was saved under
+    """
+    max_size = getattr(settings, 'GENERATION_SPOOL_MAX_BYTES', DEFAULT_SPOOL_MAX_BYTES)
+    with tempfile.SpooledTemporaryFile(max_size=max_size) as spool:
+        render_to_file(content, output_format, spool, title, plan, values)
+        size = spool.tell()
+        spool.seek(0)
+        path = default_storage.save(f"{name}.{EXTENSIONS[output_format]}", File(spool, name=os.path.basename(name)))
+    logger.info(f"Rendered {output_format} ({size} bytes) to {path}")
+    return path
+
+
+def render_document(content, output_format, name, title='', plan=None, values=None):
+    """Render and save a document on the bounded render pool, waiting for the result"""
+    return get_render_executor().submit(save_rendered, content, output_format, name, title, plan, values).result()
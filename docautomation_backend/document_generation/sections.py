@@ -0,0 +1,274 @@
+import hashlib
+import json
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import connection
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+DEFAULT_SECTION_CONTEXT_TOKENS = 600
+DEFAULT_MAX_SECTIONS = 60
+EXCERPT_CHARS = 200
+
+
+class SectionError(Exception):
+    """Raised when sections of a generated document could not be written"""
+
+
+def parse_sections(value):
+    """
+    The `sections` of a generation request
+
+    Either the section headings (a list, or a string with one heading per
+    line) or the number of sections to outline with the LLM.
+
+    Returns:
+        tuple: (outline, section_count), one of them empty
+    """
+    max_sections = getattr(settings, 'GENERATION_MAX_SECTIONS', DEFAULT_MAX_SECTIONS)
+    if isinstance(value, bool):
+        return [], 0
+    if isinstance(value, int) or (isinstance(value, str) and value.strip().isdigit()):
+        return [], min(int(value), max_sections)
+    return normalize_outline(value), 0
+
+
+def normalize_outline(value):
+    """
+    Section headings from a list, or a string with one heading per line
+
+    Returns:
+        list: Non-empty headings, at most GENERATION_MAX_SECTIONS
+    """
+    if isinstance(value, str):
+        value = value.splitlines()
+    if not isinstance(value, list):
+        return []
+    max_sections = getattr(settings, 'GENERATION_MAX_SECTIONS', DEFAULT_MAX_SECTIONS)
+    headings = [' '.join(str(heading).split()).lstrip('#').strip()[:255] for heading in value]
+    return [heading for heading in headings if heading][:max_sections]
+
+
+def outline_document(generated_doc, document_ids):
+    """
+    First stage of a long generation: plan section_count section headings
+
+    The outline is stored on the document, so later regenerations keep it.
+    Without an LLM the sections are numbered.
+    """
+    from nlp.llm import generate_outline
+    from nlp.retrieval import assemble_context
+
+    count = generated_doc.section_count
+    passages = assemble_context(f"{generated_doc.title}\n{generated_doc.prompt}", document_ids)
+    headings = generate_outline(
+        generated_doc.title, generated_doc.prompt, [passage['text'] for passage in passages], count
+    )
+    outline = normalize_outline(headings or [])[:count]
+    if not outline:
+        outline = [f"Section {i}" for i in range(1, count + 1)]
+    generated_doc.outline = outline
+    generated_doc.save(update_fields=['outline', 'updated_at'])
+    logger.info(f"Outlined generated document {generated_doc.id} in {len(outline)} sections")
+    return outline
+
+
+def section_input_hash(generated_doc, heading, dependencies, model_id):
+    """
+    Hash of everything a section's content is written from
+
+    The rest of the outline is only context for the LLM: adding, removing
+    or moving other sections does not make a section stale.
+    """
+    key = {
+        'title': generated_doc.title,
+        'prompt': generated_doc.prompt,
+        'heading': heading,
+        'dependencies': dependencies,
+        'model': model_id,
+    }
+    return hashlib.sha256(json.dumps(key, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def plan_sections(generated_doc, document_ids):
+    """
+    Select each section's reference passages and hash its inputs
+
+    Each section draws on the passages most relevant to its heading, within
+    GENERATION_SECTION_CONTEXT_TOKENS. A section depends on those passages
+    only, so an edit elsewhere in the references leaves it unchanged.
+
+    Returns:
+        list: Dicts with index, heading, passages, dependencies and input_hash
+    """
+    from document_processing.chunking import content_hash
+    from nlp.retrieval import assemble_context
+    from .generation_cache import get_generation_model_id
+
+    model_id = get_generation_model_id()
+    budget = getattr(settings, 'GENERATION_SECTION_CONTEXT_TOKENS', DEFAULT_SECTION_CONTEXT_TOKENS)
+    plans = []
+    for index, heading in enumerate(generated_doc.outline):
+        passages = assemble_context(
+            f"{generated_doc.title}\n{generated_doc.prompt}\n{heading}", document_ids, token_budget=budget
+        )
+        dependencies = [content_hash(passage['text']) for passage in passages]
+        plans.append({
+            'index': index,
+            'heading': heading,
+            'passages': passages,
+            'dependencies': dependencies,
+            'input_hash': section_input_hash(generated_doc, heading, dependencies, model_id),
+        })
+    return plans
+
+
+def placeholder_section(heading, passages):
+    """Section body used when no local LLM is available"""
+    if not passages:
+        return f"No reference passages were found for \"{heading}\"."
+    return (
+        f"This section would be written from {len(passages)} reference passages.\n\n"
+        f"Excerpt: {passages[0]['text'][:EXCERPT_CHARS]}..."
+    )
+
+
+def write_section(generated_doc, plan):
+    """The body of one section, from the local LLM or a placeholder"""
+    from nlp.llm import generate_section_text
+
+    body = generate_section_text(
+        generated_doc.title, generated_doc.prompt, plan['heading'], generated_doc.outline,
+        [passage['text'] for passage in plan['passages']],
+    )
+    return body.strip() if body else placeholder_section(plan['heading'], plan['passages'])
+
+
+def assemble_sections(title, sections):
+    """Markdown document made of the sections, in order"""
+    parts = [f"# {title}\n"]
+    for section in sections:
+        parts.append(f"## {section.heading}\n\n{section.content.strip()}\n")
+    return "\n".join(parts)
+
+
+def sync_sections(generated_doc, plans, reuse=True):
+    """
+    Match the stored sections to the plans
+
+    Sections whose input hash is unchanged keep their content, and changed
+    ones take the content of any completed section with the same inputs,
+    of this document or another. The others are left pending.
+
+    Returns:
+        tuple: (sections in order, the pending ones, number reused)
+    """
+    from .models import GeneratedSection
+
+    hashes = [plan['input_hash'] for plan in plans]
+    memo = {}
+    if reuse:
+        memo = dict(
+            GeneratedSection.objects.filter(input_hash__in=hashes, status='completed')
+            .values_list('input_hash', 'content')
+        )
+    existing = {section.index: section for section in generated_doc.sections.all()}
+    generated_doc.sections.filter(index__gte=len(plans)).delete()
+
+    sections = []
+    pending = []
+    reused = 0
+    for plan in plans:
+        section = existing.get(plan['index']) or GeneratedSection(
+            generated_document=generated_doc, index=plan['index']
+        )
+        unchanged = (
+            reuse and section.pk is not None and section.status == 'completed'
+            and section.input_hash == plan['input_hash']
+        )
+        if not unchanged:
+            section.heading = plan['heading']
+            section.input_hash = plan['input_hash']
+            section.dependencies = plan['dependencies']
+            section.error_message = ''
+            if plan['input_hash'] in memo:
+                section.content = memo[plan['input_hash']]
+                section.status = 'completed'
+            else:
+                section.content = ''
+                section.status = 'pending'
+                pending.append((section, plan))
+            section.save()
+        if section.status == 'completed':
+            reused += 1
+        sections.append(section)
+    return sections, pending, reused
+
+
+def generate_section(generated_doc, section, plan):
+    """Write one pending section and store it; failures are recorded on the section"""
+    from .models import GeneratedSection
+
+    try:
+        GeneratedSection.objects.filter(id=section.id).update(status='generating')
+        try:
+            section.content = write_section(generated_doc, plan)
+            section.status = 'completed'
+        except Exception as e:
+            logger.error(f"Section {section.index} of generated document {generated_doc.id} failed: {str(e)}")
+            section.status = 'failed'
+            section.error_message = str(e)
+        section.save(update_fields=['content', 'status', 'error_message', 'updated_at'])
+        return section
+    finally:
+        # Runs in a pool thread, which would otherwise keep its connection open
+        connection.close()
+
+
+def generate_sections(generated_doc, document_ids, reuse=True):
+    """
+    Generate a document with an outline section by section
+
+    Only sections whose inputs changed since they were written are
+    generated; the others are reused, so regenerating after a small edit to
+    one reference only rewrites the sections drawing on the edited
+    passages. Sections are independent of each other and are written
+    concurrently, one per LLM scheduler slot (LLM_MAX_CONCURRENT), then
+    assembled in outline order.
+
+    Args:
+        generated_doc (GeneratedDocument): A document with an outline
+        document_ids (list): Its reference document ids
+        reuse (bool): False regenerates every section
+
+    Returns:
+        str: The assembled Markdown content
+
+    Raises:
+        SectionError: If any section failed; the others are kept for the
+            next attempt
+    """
+    started = time.monotonic()
+    plans = plan_sections(generated_doc, document_ids)
+    sections, pending, reused = sync_sections(generated_doc, plans, reuse=reuse)
+    if pending:
+        from nlp.scheduler import get_llm_scheduler
+        workers = min(len(pending), get_llm_scheduler().max_concurrent)
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='generate-section') as pool:
+            list(pool.map(lambda item: generate_section(generated_doc, *item), pending))
+
+    failed = [section for section in sections if section.status == 'failed']
+    logger.info(
+        f"Generated document {generated_doc.id}: {len(pending) - len(failed)} sections written, "
+        f"{reused} reused, {len(failed)} failed in {time.monotonic() - started:.1f}s"
+    )
+    if failed:
+        raise SectionError(
+            f"{len(failed)} of {len(sections)} sections failed: "
+            + "; ".join(f"{section.heading}: {section.error_message}" for section in failed[:3])
+        )
+    return assemble_sections(generated_doc.title, sections)
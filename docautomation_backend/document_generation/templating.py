@@ -0,0 +1,297 @@
+import html
+import logging
+import re
+import threading
+import zipfile
+from collections import OrderedDict
+
+from django.conf import settings
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_SIZE = 32
+CONTENT = 'content'
+
+PLACEHOLDER_RE = re.compile(r'\{\{\s*([A-Za-z_][\w.-]*)\s*\}\}')
+_DOCX_PARAGRAPH_RE = re.compile(r'<w:p[ >].*?</w:p>', re.S)
+_DOCX_TEXT_RE = re.compile(r'<w:t(?: [^>]*)?>(.*?)</w:t>', re.S)
+_DOCX_PPR_RE = re.compile(r'<w:pPr>.*?</w:pPr>|<w:pPr/>', re.S)
+_DOCX_RPR_RE = re.compile(r'<w:rPr>.*?</w:rPr>', re.S)
+_DOCX_STYLE_RE = re.compile(r'<w:pStyle w:val="([^"]+)"')
+_DOCX_STYLE_ID_RE = re.compile(r'w:styleId="([^"]+)"')
+_DOCX_SEGMENT_RE = re.compile(r'\x00(\d+)\x00|' + PLACEHOLDER_RE.pattern)
+_HTML_HEADING_RE = re.compile(r'<h([1-6])[^>]*>(.*?)</h\1>', re.S | re.I)
+_HTML_STYLE_RE = re.compile(r'<style[^>]*>.*?</style>|<link[^>]*rel="?stylesheet"?[^>]*>', re.S | re.I)
+_HTML_BLOCK_END_RE = re.compile(r'</(p|div|li|tr|h[1-6])>|<br\s*/?>', re.I)
+_TAG_RE = re.compile(r'<[^>]+>')
+
+
+class TemplateError(Exception):
+    """Raised when a template file cannot be compiled"""
+
+
+def _segments(text):
+    """Split template text into (literal, placeholder name) pairs; the last name is None"""
+    segments = []
+    position = 0
+    for match in PLACEHOLDER_RE.finditer(text):
+        segments.append((text[position:match.start()], match.group(1)))
+        position = match.end()
+    segments.append((text[position:], None))
+    return segments
+
+
+class RenderPlan:
+    """
+    A template compiled for rendering
+
+    Attributes:
+        template_type (str): The template's format
+        segments (list): (literal, placeholder) pairs of the native
+            template: Markdown/text, the HTML page, or the DOCX
+            word/document.xml. A None placeholder ends the list. DOCX
+            segments are (literal, placeholder, properties) triples:
+            properties is the paragraph properties (`<w:pPr>`) of a
+            placeholder that fills a paragraph on its own, which is replaced
+            by whole paragraphs inheriting them, and None for a placeholder
+            within text.
+        text_segments (list): The same template as Markdown, used to render
+            it into other output formats
+        placeholders (list): Placeholder names in order of first use
+        sections (list): Heading titles of the template
+        styles (list): Paragraph style ids (DOCX) or stylesheets (HTML)
+        parts (dict): The other parts of a DOCX package, by name
+    """
+
+    def __init__(self, template_type, segments, text_segments, sections=None, styles=None, parts=None):
+        self.template_type = template_type
+        self.segments = segments
+        self.text_segments = text_segments
+        self.sections = sections or []
+        self.styles = styles or []
+        self.parts = parts or {}
+        self.placeholders = list(dict.fromkeys(name for _, name in text_segments if name))
+
+    def fill_text(self, values):
+        """The template as Markdown with placeholders replaced; unknown ones are left empty"""
+        return ''.join(
+            literal + (str(values.get(name, '')) if name else '') for literal, name in self.text_segments
+        )
+
+    def describe(self):
+        return {
+            'template_type': self.template_type,
+            'placeholders': self.placeholders,
+            'sections': self.sections,
+            'styles': self.styles,
+        }
+
+
+def _compile_text(text, template_type):
+    if CONTENT not in PLACEHOLDER_RE.findall(text):
+        text = text.rstrip('\n') + f"\n\n{{{{ {CONTENT} }}}}\n"
+    sections = [line.lstrip('#').strip() for line in text.splitlines() if re.match(r'#{1,6}\s', line)]
+    segments = _segments(text)
+    return RenderPlan(template_type, segments, segments, sections=sections)
+
+
+def _html_to_markdown(text):
+    """Rough Markdown form of an HTML template, for rendering it to other formats"""
+    text = _HTML_STYLE_RE.sub('', text)
+    text = re.sub(r'<head[^>]*>.*?</head>', '', text, flags=re.S | re.I)
+    text = _HTML_HEADING_RE.sub(lambda m: f"\n\n{'#' * int(m.group(1))} {_TAG_RE.sub('', m.group(2)).strip()}\n\n", text)
+    text = re.sub(r'<li[^>]*>', '\n- ', text, flags=re.I)
+    text = _HTML_BLOCK_END_RE.sub('\n\n', text)
+    text = html.unescape(_TAG_RE.sub('', text))
+    return re.sub(r'\n{3,}', '\n\n', text).strip() + '\n'
+
+
+def _compile_html(text):
+    if CONTENT not in PLACEHOLDER_RE.findall(text):
+        marker = f"{{{{ {CONTENT} }}}}\n"
+        end = text.lower().rfind('</body>')
+        text = text[:end] + marker + text[end:] if end != -1 else text + marker
+    sections = [_TAG_RE.sub('', title).strip() for _, title in _HTML_HEADING_RE.findall(text)]
+    styles = _HTML_STYLE_RE.findall(text)
+    return RenderPlan('html', _segments(text), _segments(_html_to_markdown(text)), sections=sections, styles=styles)
+
+
+def _docx_segments(document, blocks):
+    """
+    Split DOCX XML into (literal, placeholder, properties) triples
+
+    Block placeholders have been replaced by their index in `blocks`, a list
+    of (name, properties) pairs, between NUL characters; NUL cannot occur in
+    XML, so the markers never clash with the document's own text.
+    """
+    segments = []
+    position = 0
+    for match in _DOCX_SEGMENT_RE.finditer(document):
+        if match.group(1) is not None:
+            name, properties = blocks[int(match.group(1))]
+        else:
+            name, properties = match.group(2), None
+        segments.append((document[position:match.start()], name, properties))
+        position = match.end()
+    segments.append((document[position:], None, None))
+    return segments
+
+
+def _docx_paragraph_text(paragraph):
+    return html.unescape(''.join(_DOCX_TEXT_RE.findall(paragraph)))
+
+
+def _compile_docx(file):
+    try:
+        with zipfile.ZipFile(file) as package:
+            parts = {name: package.read(name) for name in package.namelist()}
+    except zipfile.BadZipFile as e:
+        raise TemplateError(f"Not a DOCX file: {str(e)}")
+    if 'word/document.xml' not in parts:
+        raise TemplateError("DOCX template has no word/document.xml")
+    document = parts.pop('word/document.xml').decode('utf-8')
+
+    blocks = []
+    markdown = []
+    sections = []
+
+    def normalize(match):
+        paragraph = match.group(0)
+        text = _docx_paragraph_text(paragraph)
+        style = _DOCX_STYLE_RE.search(paragraph)
+        level = re.match(r'Heading(\d)', style.group(1)) if style else None
+        if text.strip():
+            markdown.append(f"{'#' * int(level.group(1))} {text}" if level else text)
+            if level:
+                sections.append(text)
+        if '{{' not in text:
+            return paragraph
+        whole = PLACEHOLDER_RE.fullmatch(text.strip())
+        if whole:
+            # A paragraph holding only a placeholder is replaced wholesale,
+            # so it can expand to several paragraphs styled like it. The same
+            # name may still appear within text elsewhere, so each occurrence
+            # gets its own marker.
+            properties = _DOCX_PPR_RE.search(paragraph)
+            blocks.append((whole.group(1), properties.group(0) if properties else ''))
+            return f"\x00{len(blocks) - 1}\x00"
+        if PLACEHOLDER_RE.search(paragraph):
+            return paragraph
+        # Word splits text into runs at edits and spell-check boundaries, so
+        # a placeholder may span several runs: merge the paragraph into one
+        # run with the first run's formatting
+        properties = _DOCX_PPR_RE.search(paragraph)
+        run_properties = _DOCX_RPR_RE.search(paragraph.split('</w:pPr>')[-1])
+        return (
+            f"<w:p>{properties.group(0) if properties else ''}"
+            f"<w:r>{run_properties.group(0) if run_properties else ''}"
+            f"<w:t xml:space=\"preserve\">{html.escape(text, quote=False)}</w:t></w:r></w:p>"
+        )
+
+    document = _DOCX_PARAGRAPH_RE.sub(normalize, document)
+    text = "\n\n".join(markdown) + "\n"
+    if CONTENT not in PLACEHOLDER_RE.findall(document) and CONTENT not in (name for name, _ in blocks):
+        # Generated content goes after the template's own paragraphs
+        blocks.append((CONTENT, ''))
+        end = document.rfind('<w:sectPr')
+        if end == -1:
+            end = document.rfind('</w:body>')
+        document = document[:end] + f"\x00{len(blocks) - 1}\x00" + document[end:]
+        text += f"\n{{{{ {CONTENT} }}}}\n"
+
+    styles = []
+    if 'word/styles.xml' in parts:
+        styles = list(dict.fromkeys(_DOCX_STYLE_ID_RE.findall(parts['word/styles.xml'].decode('utf-8'))))
+    return RenderPlan(
+        'docx', _docx_segments(document, blocks), _segments(text), sections=sections, styles=styles, parts=parts,
+    )
+
+
+def compile_template(template):
+    """
+    Parse a DocumentTemplate's file into a RenderPlan
+
+    Placeholders are written `{{ name }}`. `{{ content }}` receives the
+    generated body; templates without it get the body at the end.
+
+    Raises:
+        TemplateError: If the file is missing or its format is not supported
+    """
+    if not template.file:
+        raise TemplateError(f"Template {template.id} has no file")
+    if template.template_type == 'pdf':
+        raise TemplateError("PDF templates cannot be filled in; upload the DOCX or HTML source instead")
+    try:
+        with template.file.open('rb') as file:
+            if template.template_type == 'docx':
+                return _compile_docx(file)
+            text = file.read().decode('utf-8', errors='replace')
+    except (OSError, ValueError) as e:
+        raise TemplateError(f"Cannot read template {template.id}: {str(e)}")
+    if template.template_type == 'html':
+        return _compile_html(text)
+    return _compile_text(text, template.template_type)
+
+
+class TemplateCache:
+    """
+    Process-wide LRU cache of compiled templates
+
+    Keyed by (template id, updated_at), so editing or re-uploading a
+    template makes the next lookup compile it again, and the stale plan is
+    dropped.
+    """
+
+    def __init__(self, max_size=None):
+        self.max_size = max_size or getattr(settings, 'TEMPLATE_CACHE_SIZE', DEFAULT_CACHE_SIZE)
+        self._plans = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+
+    def get(self, template):
+        """
+        The RenderPlan of a DocumentTemplate, compiling it on first use
+
+        Raises:
+            TemplateError: If the template cannot be compiled
+        """
+        key = (template.id, template.updated_at)
+        with self._lock:
+            plan = self._plans.get(key)
+            if plan is not None:
+                self._plans.move_to_end(key)
+                self.stats['hits'] += 1
+                return plan
+            self.stats['misses'] += 1
+
+        # Compile outside the lock; two threads may compile the same
+        # template once, which is harmless
+        plan = compile_template(template)
+        with self._lock:
+            for stale in [cached for cached in self._plans if cached[0] == template.id and cached != key]:
+                del self._plans[stale]
+            self._plans[key] = plan
+            while len(self._plans) > self.max_size:
+                self._plans.popitem(last=False)
+                self.stats['evictions'] += 1
+        logger.info(f"Compiled template {template.id}: {len(plan.placeholders)} placeholders")
+        return plan
+
+    def clear(self):
+        with self._lock:
+            self._plans.clear()
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_template_cache():
+    """Return the process-wide template cache"""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = TemplateCache()
+    return _cache
@@ -1,3 +1,656 @@
-from django.test import TestCase
+import io
+import json
+import re
+import shutil
+import tempfile
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+from xml.etree import ElementTree
 
-# Create your tests here.
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase, TransactionTestCase, override_settings
+
+from document_processing.chunking import chunk_document
+from document_processing.models import Document
+from document_processing.text_storage import store_extracted_text
+
+from .batch import stream_batch_zip
+from .generation_cache import compute_fingerprint, find_cached
+from .models import BatchGeneration, DocumentTemplate, GeneratedDocument
+from .renderers import iter_blocks, render_docx, render_html, render_pdf, render_text, render_to_file, table_rows
+from .sections import SectionError, generate_sections, outline_document, parse_sections
+from .templating import TemplateCache, TemplateError, compile_template, get_template_cache
+
+W = '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}'
+W_NS = 'xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main"'
+
+CONTENT = """# Quarterly report
+
+Revenue grew by **12%** over the *previous* quarter.
+
+- First point
+- Second point
+
+1. Step one
+2. Step two
+
+```python
+def total(rows):
+    return sum(rows)
+```
+
+| Region | Revenue |
+| --- | --- |
+| North \\| East | 10 |
+| South | 20 |
+"""
+
+
+def docx_paragraphs(data):
+    """Parse word/document.xml of a DOCX package into (style, text) pairs"""
+    with zipfile.ZipFile(io.BytesIO(data)) as package:
+        for name in package.namelist():
+            if name.endswith('.xml') or name.endswith('.rels'):
+                # Every part must be well-formed
+                ElementTree.fromstring(package.read(name))
+        root = ElementTree.fromstring(package.read('word/document.xml'))
+    body = root.find(f'{W}body')
+    paragraphs = []
+    for paragraph in body.iter(f'{W}p'):
+        style = paragraph.find(f'{W}pPr/{W}pStyle')
+        text = ''.join(node.text or '' for node in paragraph.iter(f'{W}t'))
+        paragraphs.append((style.get(f'{W}val') if style is not None else None, text))
+    return body, paragraphs
+
+
+def pdf_objects(data):
+    """Check a PDF's cross-reference table against its objects; return the object count"""
+    startxref = int(re.search(rb'startxref\n(\d+)\n%%EOF\n$', data).group(1))
+    assert data[startxref:startxref + 5] == b'xref\n', "startxref does not point at the xref table"
+    header = re.match(rb'xref\n0 (\d+)\n', data[startxref:])
+    size = int(header.group(1))
+    entries = data[startxref + header.end():].split(b'\n')[:size]
+    for object_id, entry in enumerate(entries[1:], 1):
+        offset = int(entry[:10])
+        expected = f'{object_id} 0 obj\n'.encode('ascii')
+        assert data[offset:offset + len(expected)] == expected, f"object {object_id} is not at {offset}"
+    return size
+
+
+class MarkdownBlockTests(TestCase):
+    def test_blocks(self):
+        kinds = [(kind, marker) for kind, marker, _ in iter_blocks(CONTENT)]
+
+        self.assertEqual(kinds, [
+            ('heading', 1), ('paragraph', None), ('bullet', None), ('bullet', None),
+            ('numbered', '1'), ('numbered', '2'), ('code', 'python'), ('table', None),
+        ])
+        code = [text for kind, _, text in iter_blocks(CONTENT) if kind == 'code'][0]
+        self.assertEqual(code, "def total(rows):\n    return sum(rows)")
+
+    def test_table_rows_skip_separator_and_unescape_pipes(self):
+        table = [text for kind, _, text in iter_blocks(CONTENT) if kind == 'table'][0]
+
+        self.assertEqual(table_rows(table), [['Region', 'Revenue'], ['North | East', '10'], ['South', '20']])
+
+    def test_unclosed_fence_runs_to_the_end(self):
+        self.assertEqual(list(iter_blocks("Intro\n```\ncode *kept*")), [
+            ('paragraph', None, 'Intro'), ('code', None, 'code *kept*'),
+        ])
+
+
+class RendererTests(TestCase):
+    def render(self, renderer, content=CONTENT, title='Report'):
+        out = io.BytesIO()
+        renderer(content, out, title)
+        return out.getvalue()
+
+    def test_docx_is_well_formed_and_styled(self):
+        body, paragraphs = docx_paragraphs(self.render(render_docx))
+
+        self.assertEqual(paragraphs[0], ('Heading1', 'Quarterly report'))
+        self.assertEqual(paragraphs[1], (None, 'Revenue grew by 12% over the previous quarter.'))
+        self.assertEqual(paragraphs[2], ('ListParagraph', '•\tFirst point'))
+        self.assertEqual(paragraphs[5], ('ListParagraph', '2.\tStep two'))
+        self.assertEqual(paragraphs[6][1], "def total(rows):    return sum(rows)")
+        self.assertEqual(body[-1].tag, f'{W}sectPr')
+        bold = [run for run in body.iter(f'{W}r') if run.find(f'{W}rPr/{W}b') is not None]
+        self.assertEqual([run.find(f'{W}t').text for run in bold], ['12%'])
+
+    def test_docx_drops_invalid_xml_characters(self):
+        _, paragraphs = docx_paragraphs(self.render(render_docx, "Bell\x07 & <tag>"))
+
+        self.assertEqual(paragraphs, [(None, 'Bell & <tag>')])
+
+    def test_pdf_xref_offsets(self):
+        data = self.render(render_pdf)
+
+        self.assertTrue(data.startswith(b'%PDF-1.4\n'))
+        self.assertGreater(pdf_objects(data), 5)
+
+    def test_pdf_pages_and_offsets_after_a_prefix(self):
+        content = "\n\n".join(f"Paragraph {i} " + "word " * 60 for i in range(80))
+        out = io.BytesIO(b'prefix')
+        out.seek(0, io.SEEK_END)
+        render_pdf(content, out, 'Long')
+        data = out.getvalue()[len(b'prefix'):]
+
+        pdf_objects(data)
+        pages = int(re.search(rb'/Type /Pages /Kids \[[^\]]*\] /Count (\d+)', data).group(1))
+        self.assertGreater(pages, 1)
+
+    def test_pdf_counts_characters_it_cannot_encode(self):
+        with self.assertLogs('document_generation.renderers', level='WARNING') as logs:
+            data = self.render(render_pdf, "Prices in € and 円 (yen) and 漢字")
+        pdf_objects(data)
+        self.assertIn("3 characters outside Windows-1252", logs.output[0])
+
+    def test_html_escapes_and_renders_code_and_tables(self):
+        html = self.render(render_html, CONTENT + "\nA <script> tag", title='<Report>').decode('utf-8')
+
+        self.assertIn('<title>&lt;Report&gt;</title>', html)
+        self.assertIn('<h1>Quarterly report</h1>', html)
+        self.assertIn('<strong>12%</strong>', html)
+        self.assertIn('<ol>\n<li>Step one</li>', html)
+        self.assertIn('<pre><code class="language-python">def total(rows):\n    return sum(rows)</code></pre>', html)
+        self.assertIn('<tr><th>Region</th><th>Revenue</th></tr>', html)
+        self.assertIn('<tr><td>North | East</td><td>10</td></tr>', html)
+        self.assertIn('A &lt;script&gt; tag', html)
+
+    def test_text_underlines_headings(self):
+        text = self.render(render_text).decode('utf-8')
+
+        self.assertTrue(text.startswith("Quarterly report\n================\n\n"))
+        self.assertIn("  - First point\n", text)
+        self.assertIn("| North \\| East | 10 |", text)
+
+    def test_unknown_format(self):
+        with self.assertRaises(ValueError):
+            render_to_file("text", 'odt', io.BytesIO())
+
+
+def docx_template(last='{{ content }}'):
+    """A DOCX template with a heading, a placeholder split across runs, a table cell and a section break"""
+    document = (
+        f'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n<w:document {W_NS}><w:body>'
+        '<w:p><w:pPr><w:pStyle w:val="Heading1"/><w:jc w:val="center"/></w:pPr>'
+        '<w:r><w:t>{{ title }}</w:t></w:r></w:p>'
+        '<w:p><w:r><w:rPr><w:b/></w:rPr><w:t>Dear {{ na</w:t></w:r><w:r><w:t>me }},</w:t></w:r></w:p>'
+        '<w:tbl><w:tr><w:tc><w:p><w:r><w:t>{{ notes }}</w:t></w:r></w:p></w:tc></w:tr></w:tbl>'
+        '<w:p><w:pPr><w:sectPr><w:pgSz w:w="12240" w:h="15840"/></w:sectPr></w:pPr>'
+        f'<w:r><w:t>{last}</w:t></w:r></w:p>'
+        '<w:sectPr><w:pgSz w:w="12240" w:h="15840"/></w:sectPr>'
+        '</w:body></w:document>'
+    )
+    out = io.BytesIO()
+    with zipfile.ZipFile(out, 'w') as package:
+        package.writestr('word/document.xml', document)
+        package.writestr('word/styles.xml', f'<w:styles {W_NS}><w:style w:styleId="Heading1"/></w:styles>')
+    return out.getvalue()
+
+
+class TemplateTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.media_root = tempfile.mkdtemp()
+        cls.media_settings = override_settings(MEDIA_ROOT=cls.media_root)
+        cls.media_settings.enable()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.media_settings.disable()
+        shutil.rmtree(cls.media_root, ignore_errors=True)
+        super().tearDownClass()
+
+    def create_template(self, template_type, data, name='template'):
+        template = DocumentTemplate(title=name, template_type=template_type)
+        template.file.save(f'{name}.{template_type}', ContentFile(data), save=True)
+        return template
+
+    def test_markdown_template(self):
+        plan = compile_template(self.create_template('markdown', b'# Invoice for {{ name }}\n\nTotal: {{ total }}\n'))
+
+        self.assertEqual(plan.placeholders, ['name', 'total', 'content'])
+        self.assertEqual(plan.sections, ['Invoice for {{ name }}'])
+        self.assertEqual(
+            plan.fill_text({'name': 'ACME', 'content': 'Body'}),
+            "# Invoice for ACME\n\nTotal: \n\nBody\n",
+        )
+
+    def test_html_template_is_filled_natively(self):
+        plan = compile_template(self.create_template(
+            'html', b'<html><head><style>h1{color:red}</style></head><body><h1>{{ name }}</h1></body></html>'
+        ))
+        out = io.BytesIO()
+        render_to_file("Some **text**", 'html', out, plan=plan, values={'name': '<ACME>'})
+        html = out.getvalue().decode('utf-8')
+
+        self.assertEqual(plan.styles, ['<style>h1{color:red}</style>'])
+        self.assertIn('<h1>&lt;ACME&gt;</h1>', html)
+        self.assertIn('<h1>&lt;ACME&gt;</h1><p>Some <strong>text</strong></p>\n', html)
+
+        # Other formats are rendered from the template's Markdown form
+        out = io.BytesIO()
+        render_to_file("Body", 'txt', out, plan=plan, values={'name': 'ACME'})
+        self.assertEqual(out.getvalue().decode('utf-8'), "ACME\n====\n\nBody\n\n")
+
+    def test_docx_template(self):
+        plan = compile_template(self.create_template('docx', docx_template()))
+
+        self.assertEqual(plan.placeholders, ['title', 'name', 'notes', 'content'])
+        self.assertEqual([name for _, name, properties in plan.segments if properties is not None],
+                         ['title', 'notes', 'content'])
+        self.assertEqual(plan.styles, ['Heading1'])
+
+        out = io.BytesIO()
+        render_to_file(
+            "## Findings\n\nAll **good**.", 'docx', out, plan=plan,
+            values={'title': 'Audit & review', 'name': 'Ms <Smith>', 'notes': ''},
+        )
+        body, paragraphs = docx_paragraphs(out.getvalue())
+
+        self.assertEqual(paragraphs[0], ('Heading1', 'Audit & review'))
+        heading = body.find(f'{W}p')
+        self.assertIsNotNone(heading.find(f'{W}pPr/{W}jc'))
+        self.assertEqual(paragraphs[1], (None, 'Dear Ms <Smith>,'))
+        # The merged run keeps the first run's formatting
+        self.assertIsNotNone(body.findall(f'{W}p')[1].find(f'{W}r/{W}rPr/{W}b'))
+        # An empty value still leaves the table cell its paragraph
+        cell = body.find(f'{W}tbl/{W}tr/{W}tc')
+        self.assertEqual(len(cell.findall(f'{W}p')), 1)
+        self.assertEqual(paragraphs[-2:], [('Heading2', 'Findings'), (None, 'All good.')])
+        # Only the last paragraph of the content keeps the section break
+        content = body.findall(f'{W}p')[-2:]
+        self.assertIsNone(content[0].find(f'{W}pPr/{W}sectPr'))
+        self.assertIsNotNone(content[1].find(f'{W}pPr/{W}sectPr'))
+
+    def test_docx_template_without_content_placeholder(self):
+        plan = compile_template(self.create_template('docx', docx_template(last='Signed')))
+
+        out = io.BytesIO()
+        render_to_file("Appended body", 'docx', out, plan=plan, values={})
+        body, paragraphs = docx_paragraphs(out.getvalue())
+        self.assertEqual(paragraphs[-1], (None, 'Appended body'))
+        self.assertEqual(body[-1].tag, f'{W}sectPr')
+
+    def test_docx_placeholder_both_alone_and_within_text(self):
+        plan = compile_template(self.create_template('docx', docx_template(last='Report: {{ title }}')))
+
+        out = io.BytesIO()
+        render_to_file("Body", 'docx', out, plan=plan, values={'title': 'Audit'})
+        _, paragraphs = docx_paragraphs(out.getvalue())
+        self.assertEqual(paragraphs[0], ('Heading1', 'Audit'))
+        self.assertEqual(paragraphs[-2:], [(None, 'Report: Audit'), (None, 'Body')])
+
+    def test_unsupported_templates(self):
+        with self.assertRaises(TemplateError):
+            compile_template(self.create_template('pdf', b'%PDF-1.4'))
+        with self.assertRaises(TemplateError):
+            compile_template(self.create_template('docx', b'not a zip'))
+
+    def test_cache_recompiles_edited_templates(self):
+        template = self.create_template('markdown', b'Hello {{ name }}')
+        cache = TemplateCache(max_size=2)
+
+        self.assertIs(cache.get(template), cache.get(template))
+        template.file.save('edited.markdown', ContentFile(b'Bye {{ other }}'), save=True)
+        self.assertEqual(cache.get(template).placeholders, ['other', 'content'])
+        self.assertEqual(cache.stats, {'hits': 1, 'misses': 2, 'evictions': 0})
+
+
+class BatchTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.media_root = tempfile.mkdtemp()
+        cls.media_settings = override_settings(MEDIA_ROOT=cls.media_root)
+        cls.media_settings.enable()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.media_settings.disable()
+        shutil.rmtree(cls.media_root, ignore_errors=True)
+        super().tearDownClass()
+
+    def setUp(self):
+        # Render in threads, so patched renderers apply, with fresh render slots
+        executor = ThreadPoolExecutor(max_workers=2)
+        self.addCleanup(executor.shutdown)
+        for patcher in (
+            mock.patch('document_generation.batch.get_render_pool', return_value=executor),
+            mock.patch('document_generation.batch._render_slots', None),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.template = DocumentTemplate(title='Letter', template_type='markdown')
+        self.template.file.save('letter.markdown', ContentFile(b'# Letter to {{ name }}\n\n{{ content }}\n'), save=True)
+
+    def create_batch(self, rows, **data):
+        response = self.client.post('/api/generate/batches/', dict({
+            'template_id': self.template.id, 'output_format': 'markdown', 'rows': rows, 'filename_field': 'name',
+        }, **data), content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        return BatchGeneration.objects.get(id=response.data['id'])
+
+    def download(self, batch):
+        response = self.client.get(f'/api/generate/batches/{batch.id}/download/')
+        self.assertEqual(response.status_code, 200)
+        return zipfile.ZipFile(io.BytesIO(b''.join(response.streaming_content)))
+
+    def test_rows_are_rendered_into_a_zip(self):
+        batch = self.create_batch([{'name': 'Ann', 'content': 'Hello'}, {'name': 'Bob/..'}, {'name': 'Ann'}])
+        self.assertEqual(batch.total_rows, 3)
+
+        archive = self.download(batch)
+        self.assertEqual(archive.namelist(), ['Ann.md', 'Bob_.md', 'Ann_2.md'])
+        self.assertIn("Letter to Ann", archive.read('Ann.md').decode('utf-8'))
+        self.assertIn("Hello", archive.read('Ann.md').decode('utf-8'))
+        batch.refresh_from_db()
+        self.assertEqual((batch.status, batch.completed_rows, batch.failed_rows), ('completed', 3, 0))
+
+    def test_failed_rows_are_listed_in_errors_txt(self):
+        batch = self.create_batch([{'name': 'Ann'}, {'name': 'Bob'}, {'name': 'Cid'}])
+
+        def render(content, output_format, out, values=None, **options):
+            if values['name'] == 'Bob':
+                raise ValueError("bad row")
+            return render_to_file(content, output_format, out, values=values, **options)
+
+        with mock.patch('document_generation.batch.render_to_file', render):
+            archive = self.download(batch)
+
+        self.assertEqual(archive.namelist(), ['Ann.md', 'Cid.md', 'errors.txt'])
+        self.assertEqual(archive.read('errors.txt').decode('utf-8'), "Row 2: bad row\n")
+        batch.refresh_from_db()
+        self.assertEqual((batch.status, batch.completed_rows, batch.failed_rows), ('completed', 2, 1))
+        self.assertEqual(batch.errors, [{'row': 2, 'error': "bad row"}])
+
+    def test_batch_being_downloaded_is_refused(self):
+        batch = self.create_batch([{'name': 'Ann'}])
+        pieces = stream_batch_zip(batch, get_template_cache().get(self.template))
+        next(pieces)
+
+        response = self.client.get(f'/api/generate/batches/{batch.id}/download/')
+        self.assertEqual(response.status_code, 409)
+
+        # A closed download releases the batch
+        pieces.close()
+        batch.refresh_from_db()
+        self.assertEqual(batch.status, 'failed')
+        self.assertEqual(batch.errors, [{'row': None, 'error': "Download stopped after 0 rows"}])
+        self.assertEqual(self.download(batch).namelist(), ['Ann.md'])
+
+    @override_settings(BATCH_MAX_CONCURRENT=1)
+    def test_busy_renderers_ask_to_retry(self):
+        first = self.create_batch([{'name': 'Ann'}])
+        second = self.create_batch([{'name': 'Bob'}])
+        pieces = stream_batch_zip(first, get_template_cache().get(self.template))
+        next(pieces)
+
+        response = self.client.get(f'/api/generate/batches/{second.id}/download/')
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '30')
+
+        pieces.close()
+        self.assertEqual(self.download(second).namelist(), ['Bob.md'])
+
+    def test_data_files_and_missing_fields(self):
+        data = SimpleUploadedFile('people.csv', b'name,city\nAnn,Paris\nBob,Rome\n')
+        response = self.client.post('/api/generate/batches/', {
+            'template_id': self.template.id, 'output_format': 'txt', 'data': data,
+        })
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual((response.data['data_format'], response.data['total_rows']), ('csv', 2))
+        self.assertEqual(response.data['missing_fields'], [])
+
+        response = self.client.post('/api/generate/batches/', {
+            'template_id': self.template.id, 'data': SimpleUploadedFile('people.json', b'{"name": "Ann"}'),
+        })
+        self.assertEqual(response.status_code, 400)
+
+
+class GenerationCacheTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.media_root = tempfile.mkdtemp()
+        cls.media_settings = override_settings(MEDIA_ROOT=cls.media_root)
+        cls.media_settings.enable()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.media_settings.disable()
+        shutil.rmtree(cls.media_root, ignore_errors=True)
+        super().tearDownClass()
+
+    def setUp(self):
+        self.reference = Document.objects.create(title='terms.txt', document_type='txt')
+        chunk_document(self.reference, "Payment is due within thirty days. " * 20, max_tokens=50, overlap=0)
+
+    def create_generated(self, **fields):
+        fields = dict({'title': 'Memo', 'prompt': 'Summarize the terms', 'output_format': 'markdown'}, **fields)
+        generated = GeneratedDocument.objects.create(**fields)
+        generated.reference_documents.set([self.reference])
+        return generated
+
+    def test_fingerprint_covers_inputs(self):
+        first = compute_fingerprint(self.create_generated())
+
+        self.assertEqual(compute_fingerprint(self.create_generated()), first)
+        self.assertNotEqual(compute_fingerprint(self.create_generated(prompt='Other')), first)
+        self.assertNotEqual(compute_fingerprint(self.create_generated(output_format='pdf')), first)
+        self.assertNotEqual(compute_fingerprint(self.create_generated(outline=['Intro'])), first)
+
+        chunk_document(self.reference, "Payment is due within sixty days. " * 20, max_tokens=50, overlap=0)
+        self.assertNotEqual(compute_fingerprint(self.create_generated()), first)
+
+    def test_find_cached_needs_an_existing_file(self):
+        fingerprint = compute_fingerprint(self.create_generated())
+        self.assertIsNone(find_cached(fingerprint))
+
+        done = self.create_generated(status='completed', fingerprint=fingerprint, content='Body')
+        done.file.save('memo.md', ContentFile(b'Body'), save=True)
+        self.assertEqual(find_cached(fingerprint), done)
+
+        done.file.storage.delete(done.file.name)
+        self.assertIsNone(find_cached(fingerprint))
+
+
+class SectionTests(TransactionTestCase):
+    # Sections are written by pool threads, on their own connections
+
+    def setUp(self):
+        self.passages = {}
+        self.written = []
+        self.failing = set()
+        for target, replacement in (
+            ('nlp.retrieval.assemble_context', self.assemble_context),
+            ('nlp.llm.generate_section_text', self.generate_section_text),
+        ):
+            patcher = mock.patch(target, replacement)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.generated = self.create_generated(['Background', 'Terms', 'Risks'])
+
+    def create_generated(self, outline):
+        return GeneratedDocument.objects.create(
+            title='Memo', prompt='Summarize the terms', output_format='markdown', outline=outline
+        )
+
+    def assemble_context(self, query_text, document_ids, token_budget=None):
+        heading = query_text.rsplit('\n', 1)[-1]
+        return [{'document_id': 1, 'index': 0, 'text': self.passages.get(heading, f"About {heading.lower()}.")}]
+
+    def generate_section_text(self, title, prompt, heading, outline, reference_texts, **options):
+        if heading in self.failing:
+            raise RuntimeError("model crashed")
+        self.written.append(heading)
+        return f"{heading} from {reference_texts[0]}"
+
+    def test_only_changed_sections_are_rewritten(self):
+        content = generate_sections(self.generated, [1])
+        self.assertEqual(sorted(self.written), ['Background', 'Risks', 'Terms'])
+        self.assertTrue(content.startswith("# Memo\n"))
+        self.assertLess(content.index("## Background"), content.index("## Terms"))
+        self.assertLess(content.index("## Terms"), content.index("## Risks"))
+
+        self.written.clear()
+        self.passages['Terms'] = "Payment within sixty days."
+        content = generate_sections(self.generated, [1])
+        self.assertEqual(self.written, ['Terms'])
+        self.assertIn("Terms from Payment within sixty days.", content)
+        self.assertIn("Risks from About risks.", content)
+
+        self.written.clear()
+        generate_sections(self.generated, [1], reuse=False)
+        self.assertEqual(sorted(self.written), ['Background', 'Risks', 'Terms'])
+
+    def test_sections_are_shared_between_documents(self):
+        generate_sections(self.generated, [1])
+        self.written.clear()
+
+        content = generate_sections(self.create_generated(['Terms', 'Appendix']), [1])
+        self.assertEqual(self.written, ['Appendix'])
+        self.assertIn("Terms from About terms.", content)
+
+    def test_failed_sections_are_retried_alone(self):
+        self.failing.add('Risks')
+        with self.assertRaisesMessage(SectionError, "1 of 3 sections failed: Risks: model crashed"):
+            generate_sections(self.generated, [1])
+        self.assertEqual(
+            dict(self.generated.sections.values_list('heading', 'status')),
+            {'Background': 'completed', 'Terms': 'completed', 'Risks': 'failed'},
+        )
+
+        self.failing.clear()
+        self.written.clear()
+        generate_sections(self.generated, [1])
+        self.assertEqual(self.written, ['Risks'])
+
+    def test_shorter_outline_drops_trailing_sections(self):
+        generate_sections(self.generated, [1])
+        self.generated.outline = ['Background']
+        self.generated.save()
+
+        self.assertEqual(generate_sections(self.generated, [1]), "# Memo\n\n## Background\n\nBackground from About background.\n")
+        self.assertEqual(self.generated.sections.count(), 1)
+
+    @override_settings(GENERATION_MAX_SECTIONS=3)
+    def test_parse_sections(self):
+        self.assertEqual(parse_sections(2), ([], 2))
+        self.assertEqual(parse_sections('10'), ([], 3))
+        self.assertEqual(parse_sections(True), ([], 0))
+        self.assertEqual(parse_sections(["## Intro", " ", "Terms  and   conditions"]), (['Intro', 'Terms and conditions'], 0))
+        self.assertEqual(parse_sections("A\nB\nC\nD"), (['A', 'B', 'C'], 0))
+
+
+class OutlineTests(TestCase):
+    def setUp(self):
+        self.generated = GeneratedDocument.objects.create(
+            title='Memo', prompt='Summarize the terms', output_format='markdown', section_count=3
+        )
+        passages = [{'document_id': 1, 'index': 0, 'text': "Payment is due within thirty days."}]
+        patcher = mock.patch('nlp.retrieval.assemble_context', return_value=passages)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_outline_is_planned_from_the_references(self):
+        headings = ["## Background", "", "Payment   terms", "Risks", "Appendix"]
+        with mock.patch('nlp.llm.generate_outline', return_value=headings) as generate_outline:
+            outline = outline_document(self.generated, [1])
+
+        self.assertEqual(outline, ['Background', 'Payment terms', 'Risks'])
+        self.assertEqual(generate_outline.call_args.args[2:], (["Payment is due within thirty days."], 3))
+        self.generated.refresh_from_db()
+        self.assertEqual(self.generated.outline, outline)
+
+    def test_sections_are_numbered_without_an_llm(self):
+        with mock.patch('nlp.llm.generate_outline', return_value=None):
+            self.assertEqual(outline_document(self.generated, [1]), ['Section 1', 'Section 2', 'Section 3'])
+
+    def test_planned_outline_does_not_change_fingerprint(self):
+        before = compute_fingerprint(self.generated)
+        self.generated.outline = ['Background', 'Terms', 'Risks']
+        self.generated.save()
+
+        self.assertEqual(compute_fingerprint(self.generated), before)
+
+
+class ExportTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.media_root = tempfile.mkdtemp()
+        cls.media_settings = override_settings(MEDIA_ROOT=cls.media_root)
+        cls.media_settings.enable()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.media_settings.disable()
+        shutil.rmtree(cls.media_root, ignore_errors=True)
+        super().tearDownClass()
+
+    def setUp(self):
+        self.document = Document.objects.create(title='Supply contract', document_type='txt', processing_status='completed')
+        self.document.file.save('contract.txt', ContentFile(b'Original bytes'), save=False)
+        store_extracted_text(self.document, "Extracted text é")
+        self.document.save()
+
+        self.lost = Document.objects.create(title='Lost scan', document_type='pdf', processing_status='completed')
+        self.lost.file.save('lost.pdf', ContentFile(b'%PDF-1.4'), save=True)
+        self.lost.file.storage.delete(self.lost.file.name)
+
+        self.generated = GeneratedDocument.objects.create(
+            title='Memo: terms', prompt='Summarize', output_format='markdown', status='completed'
+        )
+        self.generated.file.save('memo.md', ContentFile(b'# Memo'), save=True)
+        self.generated.reference_documents.set([self.document])
+        failed = GeneratedDocument.objects.create(title='Draft', prompt='Summarize', status='failed')
+        failed.reference_documents.set([self.document])
+
+    def export(self, method='get', **params):
+        if method == 'post':
+            response = self.client.post('/api/generate/export/', params, content_type='application/json')
+        else:
+            response = self.client.get('/api/generate/export/', params)
+        self.assertEqual(response.status_code, 200)
+        return zipfile.ZipFile(io.BytesIO(b''.join(response.streaming_content)))
+
+    def test_archive_layout_and_manifest(self):
+        archive = self.export(document_ids=f"{self.document.id},{self.lost.id}")
+
+        folder = f"documents/{self.document.id}-Supply contract"
+        memo = f"generated/{self.generated.id}-Memo_ terms.md"
+        self.assertEqual(
+            archive.namelist(),
+            [f"{folder}/original.txt", f"{folder}/extracted_text.txt", memo, 'manifest.json'],
+        )
+        self.assertEqual(archive.read(f"{folder}/original.txt"), b'Original bytes')
+        self.assertEqual(archive.read(f"{folder}/extracted_text.txt").decode('utf-8'), "Extracted text é")
+        self.assertEqual(archive.read(memo), b'# Memo')
+
+        manifest = json.loads(archive.read('manifest.json'))
+        self.assertEqual(manifest['missing'], [self.lost.file.name])
+        self.assertEqual([document['entries'] for document in manifest['documents']], [
+            [f"{folder}/original.txt", f"{folder}/extracted_text.txt"], [],
+        ])
+        self.assertEqual([generated['entry'] for generated in manifest['generated_documents']], [memo])
+
+    def test_filters_and_include(self):
+        archive = self.export(q='supply', include='text')
+        self.assertEqual(archive.namelist(), [
+            f"documents/{self.document.id}-Supply contract/extracted_text.txt", 'manifest.json',
+        ])
+
+        archive = self.export(method='post', generated_ids=[self.generated.id])
+        self.assertEqual(archive.namelist(), [f"generated/{self.generated.id}-Memo_ terms.md", 'manifest.json'])
+
+    def test_invalid_requests(self):
+        for params in ({}, {'document_ids': 'x'}, {'q': 'supply', 'include': 'everything'},
+                       {'created_after': 'soon'}):
+            response = self.client.get('/api/generate/export/', params)
+            self.assertEqual(response.status_code, 400, params)
@@ -1,14 +1,18 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 
-from .views import DocumentTemplateViewSet, GeneratedDocumentViewSet
+from .views import BatchGenerationViewSet, DocumentTemplateViewSet, GeneratedDocumentViewSet, export_archive
 
 # Create a router
 router = DefaultRouter()
 router.register('templates', DocumentTemplateViewSet, basename='documenttemplate')
+router.register('batches', BatchGenerationViewSet, basename='batchgeneration')
 router.register('', GeneratedDocumentViewSet, basename='generateddocument')
 
 urlpatterns = [
+    # Bulk ZIP export, ahead of the generated document detail routes
+    path('export/', export_archive, name='export-archive'),
+    
     # Include router URLs
     path('', include(router.urls)),
 ] 
\ No newline at end of file
@@ -1,19 +1,24 @@
 from django.shortcuts import render
 from rest_framework import viewsets, status
-from rest_framework.decorators import action, permission_classes
+from rest_framework.decorators import action, api_view, permission_classes
 from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.parsers import MultiPartParser, FormParser, JSONParser
-from django.http import FileResponse
+from django.http import FileResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404
 import os
 import threading
 import io
+import json
+import logging
 from datetime import datetime
 
-from .models import DocumentTemplate, GeneratedDocument
+from .models import BatchGeneration, DocumentTemplate, GeneratedDocument, GeneratedSection
 from document_processing.models import Document
 
+# Configure logging
+logger = logging.getLogger(__name__)
+
 # Serializers
 from rest_framework import serializers
 
@@ -27,7 +32,21 @@ class GeneratedDocumentSerializer(serializers.ModelSerializer):
     class Meta:
         model = GeneratedDocument
         fields = '__all__'
-        read_only_fields = ['id', 'created_at', 'updated_at']
+        read_only_fields = ['id', 'fingerprint', 'created_at', 'updated_at']
+
+class GeneratedSectionSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = GeneratedSection
+        exclude = ['dependencies']
+
+class BatchGenerationSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = BatchGeneration
+        fields = '__all__'
+        read_only_fields = [
+            'id', 'status', 'total_rows', 'completed_rows', 'failed_rows', 'errors',
+            'started_at', 'finished_at', 'created_at', 'updated_at',
+        ]
 
 # Document Template ViewSet
 class DocumentTemplateViewSet(viewsets.ModelViewSet):
@@ -39,6 +58,16 @@ class DocumentTemplateViewSet(viewsets.ModelViewSet):
     def get_permissions(self):
         """Return appropriate permissions"""
         return [AllowAny()]
+    
+    @action(detail=True, methods=['get'])
+    def plan(self, request, pk=None):
+        """Placeholders, sections and styles found in the template file"""
+        from .templating import TemplateError, get_template_cache
+        template = self.get_object()
+        try:
+            return Response(get_template_cache().get(template).describe())
+        except TemplateError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
 # Generated Document ViewSet
 class GeneratedDocumentViewSet(viewsets.ModelViewSet):
@@ -67,11 +96,17 @@ class GeneratedDocumentViewSet(viewsets.ModelViewSet):
                     status=status.HTTP_400_BAD_REQUEST
                 )
             
-            # Create the generated document
+            # Create the generated document; with `sections` headings, or a
+            # number of sections to outline first, it is generated section
+            # by section
+            from .sections import parse_sections
+            outline, section_count = parse_sections(request.data.get('sections'))
             generated_doc = GeneratedDocument(
                 title=title,
                 prompt=prompt,
                 output_format=output_format,
+                outline=outline,
+                section_count=section_count,
                 status='pending'
             )
             
@@ -85,23 +120,36 @@ class GeneratedDocumentViewSet(viewsets.ModelViewSet):
             
             generated_doc.save()
             
-            # Add reference documents if provided
+            # Add reference documents if provided, skipping unknown ids
+            documents = {}
             if document_ids and isinstance(document_ids, list):
-                for doc_id in document_ids:
-                    try:
-                        doc = Document.objects.get(id=doc_id)
-                        generated_doc.reference_documents.add(doc)
-                    except Document.DoesNotExist:
-                        pass
+                try:
+                    document_ids = [int(doc_id) for doc_id in document_ids]
+                except (TypeError, ValueError):
+                    document_ids = []
+                documents = Document.objects.only('id').in_bulk(document_ids)
+                generated_doc.reference_documents.add(*documents.values())
             
-            # Start generation in background thread
-            threading.Thread(target=self.generate_document, args=(generated_doc,)).start()
+            # Link the output of an identical earlier generation, unless the
+            # client asks for a fresh one with "cache": false
+            from .generation_cache import compute_fingerprint, find_cached, link_cached
+            use_cache = str(request.data.get('cache', True)).lower() not in ('0', 'false')
+            generated_doc.fingerprint = compute_fingerprint(generated_doc, list(documents))
+            cached = find_cached(generated_doc.fingerprint) if use_cache else None
+            if cached is not None:
+                link_cached(generated_doc, cached)
+            else:
+                generated_doc.save(update_fields=['fingerprint'])
+                # Start generation in background thread
+                threading.Thread(target=self.generate_document, args=(generated_doc, use_cache)).start()
             
             # Return the created document
             serializer = self.get_serializer(generated_doc)
             headers = self.get_success_headers(serializer.data)
+            response = serializer.data
+            response['cached'] = cached is not None
             return Response(
-                serializer.data, 
+                response, 
                 status=status.HTTP_201_CREATED, 
                 headers=headers
             )
@@ -115,55 +163,69 @@ class GeneratedDocumentViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
     
-    def generate_document(self, generated_doc):
+    def generate_document(self, generated_doc, use_cache=True):
         """Background task to generate document content"""
         try:
             # Update status
             generated_doc.status = 'generating'
             generated_doc.save()
             
-            # Get reference document texts if available
-            reference_texts = []
-            for doc in generated_doc.reference_documents.all():
-                if doc.extracted_text:
-                    reference_texts.append(doc.extracted_text)
-            
-            # Generate simple content (placeholder for actual AI generation)
-            content = f"""# {generated_doc.title}
-
-## Generated based on your prompt:
-"{generated_doc.prompt}"
-
-## This is a placeholder document
-This document was created as a demonstration of the document generation feature.
-In a production environment, this would be replaced with actual AI-generated content
-based on your prompt and reference documents.
-
-## Reference Documents Used:
-"""
-            
-            # Add information about reference documents
-            if reference_texts:
-                for i, doc in enumerate(generated_doc.reference_documents.all()):
-                    content += f"\n### Document {i+1}: {doc.title}\n"
-                    content += f"Excerpt: {doc.extracted_text[:200]}...\n"
+            references = list(generated_doc.reference_documents.order_by('id').only('id', 'title'))
+            if not generated_doc.outline and generated_doc.section_count:
+                # Long documents are planned first, then written section by section
+                from .sections import outline_document
+                generated_doc.status = 'outlining'
+                generated_doc.save(update_fields=['status', 'updated_at'])
+                outline_document(generated_doc, [doc.id for doc in references])
+                generated_doc.status = 'generating'
+                generated_doc.save(update_fields=['status', 'updated_at'])
+            if generated_doc.outline:
+                # Section by section, rewriting only the sections whose
+                # inputs changed since the last generation
+                from .sections import generate_sections
+                content = generate_sections(generated_doc, [doc.id for doc in references], reuse=use_cache)
             else:
-                content += "\nNo reference documents were provided."
+                # The reference passages most relevant to the request, within
+                # GENERATION_CONTEXT_TOKENS; full texts are never loaded
+                from nlp.retrieval import assemble_context
+                passages = assemble_context(
+                    f"{generated_doc.title}\n{generated_doc.prompt}", [doc.id for doc in references]
+                )
+                reference_texts = [passage['text'] for passage in passages]
+                
+                # Draft with the local LLM through the shared scheduler, which
+                # queues document generation behind interactive queries
+                from nlp.llm import generate_document_text
+                body = generate_document_text(generated_doc.title, generated_doc.prompt, reference_texts)
+                if body:
+                    content = f"# {generated_doc.title}\n\n{body.strip()}\n"
+                else:
+                    content = self.placeholder_content(generated_doc, references, passages)
             
             # Save the generated content
             generated_doc.content = content
             
-            # Generate an actual file based on the requested format
-            filename = f"{generated_doc.title.replace(' ', '_')}.{generated_doc.output_format}"
-            
-            # Simple file generation (placeholder)
-            from django.core.files.base import ContentFile
-            from django.core.files.storage import default_storage
+            # Fill the template, if any, compiled once per template version
+            plan = None
+            if generated_doc.template:
+                from .templating import TemplateError, get_template_cache
+                try:
+                    plan = get_template_cache().get(generated_doc.template)
+                except TemplateError as e:
+                    logger.warning(f"Ignoring template {generated_doc.template.id}: {str(e)}")
+            values = {
+                'title': generated_doc.title,
+                'prompt': generated_doc.prompt,
+                'date': datetime.now().strftime('%Y-%m-%d'),
+            }
             
-            # For simplicity, we're just creating a text file regardless of format
-            # In a real implementation, you would use libraries like python-docx, ReportLab, etc.
-            file_content = content.encode('utf-8')
-            file_path = default_storage.save(f"generated_documents/{filename}", ContentFile(file_content))
+            # Render the requested format on the bounded render pool
+            from .renderers import render_document
+            file_path = render_document(
+                content, generated_doc.output_format,
+                f"generated_documents/{generated_doc.title.replace(' ', '_')}",
+                title=generated_doc.title, plan=plan, values=values,
+            )
             
             # Update the document with the file and mark as completed
             generated_doc.file.name = file_path
@@ -180,19 +242,76 @@ based on your prompt and reference documents.
             generated_doc.error_message = str(e)
             generated_doc.save()
     
+    def placeholder_content(self, generated_doc, references, passages):
+        """Content used when no local LLM is available"""
+        content = f"""# {generated_doc.title}
+
+## Generated based on your prompt:
+"{generated_doc.prompt}"
+
+## This is a placeholder document
+This document was created as a demonstration of the document generation feature.
+In a production environment, this would be replaced with actual AI-generated content
+based on your prompt and reference documents.
+
+## Reference Documents Used:
+"""
+        
+        # Add information about reference documents, quoting the first
+        # passage selected from each
+        if references:
+            excerpts = {}
+            for passage in passages:
+                excerpts.setdefault(passage['document_id'], passage['text'])
+            for i, doc in enumerate(references):
+                content += f"\n### Document {i+1}: {doc.title}\n"
+                if doc.id in excerpts:
+                    content += f"Excerpt: {excerpts[doc.id][:200]}...\n"
+        else:
+            content += "\nNo reference documents were provided."
+        return content
+    
     @action(detail=True, methods=['post'])
     def regenerate(self, request, pk=None):
-        """Regenerate a document with the same parameters"""
+        """
+        Regenerate a document with the same parameters
+        
+        Nothing is regenerated when the inputs match a completed generation,
+        this one included, and documents with sections only rewrite the
+        sections whose inputs changed. Send "cache": false to regenerate
+        everything.
+        """
+        from .generation_cache import compute_fingerprint, find_cached, link_cached
         generated_doc = self.get_object()
+        use_cache = str(request.data.get('cache', True)).lower() not in ('0', 'false')
+        generated_doc.fingerprint = compute_fingerprint(generated_doc)
+        cached = find_cached(generated_doc.fingerprint) if use_cache else None
+        if cached is not None:
+            if cached.id == generated_doc.id:
+                generated_doc.save(update_fields=['fingerprint'])
+            else:
+                link_cached(generated_doc, cached)
+            return Response(
+                {'status': 'Document is up to date', 'cached': True},
+                status=status.HTTP_200_OK
+            )
+        generated_doc.save(update_fields=['fingerprint'])
         
         # Start regeneration in background thread
-        threading.Thread(target=self.generate_document, args=(generated_doc,)).start()
+        threading.Thread(target=self.generate_document, args=(generated_doc, use_cache)).start()
         
         return Response(
             {'status': 'Document regeneration started'},
             status=status.HTTP_202_ACCEPTED
         )
     
+    @action(detail=True, methods=['get'])
+    def sections(self, request, pk=None):
+        """Sections of a document generated from an outline, with their status"""
+        generated_doc = self.get_object()
+        serializer = GeneratedSectionSerializer(generated_doc.sections.all(), many=True)
+        return Response(serializer.data)
+    
     @action(detail=True, methods=['get'])
     def download(self, request, pk=None):
         """Download the generated document file"""
@@ -214,15 +333,8 @@ based on your prompt and reference documents.
                 )
             
             # Determine content type
-            content_type = 'application/octet-stream'  # Default
-            if generated_doc.output_format == 'pdf':
-                content_type = 'application/pdf'
-            elif generated_doc.output_format == 'docx':
-                content_type = 'application/vnd.openxmlformats-officedocument.wordprocessingml.document'
-            elif generated_doc.output_format == 'txt' or generated_doc.output_format == 'markdown':
-                content_type = 'text/plain'
-            elif generated_doc.output_format == 'html':
-                content_type = 'text/html'
+            from .renderers import CONTENT_TYPES, EXTENSIONS
+            content_type = CONTENT_TYPES.get(generated_doc.output_format, 'application/octet-stream')
             
             # Serve the file
             response = FileResponse(
@@ -231,7 +343,7 @@ based on your prompt and reference documents.
             )
             
             # Set filename
-            filename = f"{generated_doc.title}.{generated_doc.output_format}"
+            filename = f"{generated_doc.title}.{EXTENSIONS.get(generated_doc.output_format, generated_doc.output_format)}"
             response['Content-Disposition'] = f'attachment; filename="{filename}"'
             
             return response
@@ -244,3 +356,128 @@ based on your prompt and reference documents.
                 {'error': str(e)},
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
+
+# Batch Generation ViewSet
+class BatchGenerationViewSet(viewsets.ModelViewSet):
+    """Mail merge: one template rendered against every row of a CSV or JSON data set"""
+    queryset = BatchGeneration.objects.all().order_by('-created_at')
+    serializer_class = BatchGenerationSerializer
+    parser_classes = (MultiPartParser, FormParser, JSONParser)
+    http_method_names = ['get', 'post', 'delete', 'head', 'options']
+    
+    def get_permissions(self):
+        """Return appropriate permissions"""
+        return [AllowAny()]
+    
+    def create(self, request, *args, **kwargs):
+        """
+        Create a batch from a template and its data
+        
+        Send the data as a `data` file (CSV, JSON list or JSON Lines,
+        detected from the extension unless `data_format` is given) or as a
+        JSON `rows` list. Nothing is rendered until the batch is downloaded.
+        """
+        from django.core.files.base import ContentFile
+        from .batch import BatchDataError, inspect_rows
+        from .templating import TemplateError, get_template_cache
+        
+        output_format = request.data.get('output_format', 'docx')
+        if output_format not in dict(GeneratedDocument.FORMAT_TYPES):
+            return Response({'error': f"Unsupported output format: {output_format}"}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            template = DocumentTemplate.objects.get(id=request.data.get('template_id'))
+            plan = get_template_cache().get(template)
+        except (DocumentTemplate.DoesNotExist, ValueError, TypeError):
+            return Response({'error': 'Template not found'}, status=status.HTTP_404_NOT_FOUND)
+        except TemplateError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        
+        data_file = request.FILES.get('data')
+        rows = request.data.get('rows')
+        if data_file is not None:
+            extension = os.path.splitext(data_file.name)[1].lower().lstrip('.')
+            data_format = request.data.get('data_format') or ('jsonl' if extension in ('jsonl', 'ndjson') else extension)
+        elif isinstance(rows, list):
+            # Stored as JSON Lines so the rows can be read back one at a time
+            data_format = 'jsonl'
+            data_file = ContentFile(''.join(json.dumps(row) + '\n' for row in rows).encode('utf-8'), name='rows.jsonl')
+        else:
+            return Response({'error': 'Provide a data file or a rows list'}, status=status.HTTP_400_BAD_REQUEST)
+        if data_format not in dict(BatchGeneration.DATA_FORMATS):
+            return Response({'error': f"Unsupported data format: {data_format}"}, status=status.HTTP_400_BAD_REQUEST)
+        
+        try:
+            total_rows, fields = inspect_rows(data_file, data_format)
+        except BatchDataError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        if not total_rows:
+            return Response({'error': 'The data has no rows'}, status=status.HTTP_400_BAD_REQUEST)
+        data_file.seek(0)
+        
+        batch = BatchGeneration.objects.create(
+            template=template,
+            output_format=output_format,
+            data_file=data_file,
+            data_format=data_format,
+            filename_field=request.data.get('filename_field', ''),
+            total_rows=total_rows,
+        )
+        response = self.get_serializer(batch).data
+        # Placeholders the data does not provide are left empty
+        response['missing_fields'] = [name for name in plan.placeholders if name not in fields and name != 'content']
+        return Response(response, status=status.HTTP_201_CREATED)
+    
+    @action(detail=True, methods=['get'])
+    def download(self, request, pk=None):
+        """Render the batch and stream the documents as a ZIP archive"""
+        from .batch import BatchInProgress, RenderersBusy, stream_batch_zip
+        from .templating import TemplateError, get_template_cache
+        
+        batch = self.get_object()
+        try:
+            plan = get_template_cache().get(batch.template)
+        except TemplateError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        
+        # The first (empty) piece claims the batch and a render slot
+        pieces = stream_batch_zip(batch, plan)
+        try:
+            next(pieces)
+        except BatchInProgress as e:
+            return Response({'error': str(e)}, status=status.HTTP_409_CONFLICT)
+        except RenderersBusy as e:
+            response = Response({'error': str(e)}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+            response['Retry-After'] = '30'
+            return response
+        
+        response = StreamingHttpResponse(pieces, content_type='application/zip')
+        response['Content-Disposition'] = f'attachment; filename="batch_{batch.id}.zip"'
+        # Stop nginx from buffering the archive
+        response['X-Accel-Buffering'] = 'no'
+        return response
+
+# Bulk export
+@api_view(['GET', 'POST'])
+@permission_classes([AllowAny])
+def export_archive(request):
+    """
+    Stream a ZIP of original files, extracted text and generated documents
+    
+    Select documents with `document_ids` (a list, or comma-separated in the
+    query string), `generated_ids` and/or the filters `document_type`,
+    `processing_status`, `created_after`, `created_before` and `q`; limit
+    what is exported with `include` (originals, text, generated).
+    """
+    from .export import ExportError, select_export, stream_export_zip
+    
+    params = request.data if request.method == 'POST' else request.query_params
+    try:
+        documents, generated, include = select_export(params)
+    except ExportError as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    
+    response = StreamingHttpResponse(stream_export_zip(documents, generated, include), content_type='application/zip')
+    response['Content-Disposition'] = f'attachment; filename="export_{datetime.now().strftime("%Y%m%d_%H%M%S")}.zip"'
+    # Stop nginx from buffering the archive
+    response['X-Accel-Buffering'] = 'no'
+    return response
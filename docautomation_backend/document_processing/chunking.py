@@ -0,0 +1,238 @@
+import bisect
+import hashlib
+import logging
+import re
+from collections import namedtuple
+
+from django.conf import settings
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Try to import optional dependencies
+try:
+    from transformers import AutoTokenizer
+    HAVE_TRANSFORMERS = True
+except ImportError:
+    logger.warning("transformers not available. Chunk token counts will be approximated by words.")
+    HAVE_TRANSFORMERS = False
+
+DEFAULT_MAX_TOKENS = 256
+DEFAULT_OVERLAP_TOKENS = 32
+
+# Words and individual punctuation marks; close to sub-word tokenizer counts
+# for English prose without needing a model vocabulary
+_TOKEN_RE = re.compile(r'\w+|[^\w\s]', re.UNICODE)
+# Blocks of text separated by blank lines, used to feed model tokenizers piecewise
+_BLOCK_RE = re.compile(r'\S(?:.*?)(?=\n\s*\n|\Z)', re.DOTALL)
+# Page markers written by the OCR extractor, and form feeds written by Tika
+_PAGE_RE = re.compile(r'--- Page (\d+) ---|\f')
+_SENTENCE_END = {'.', '!', '?', ';'}
+
+Chunk = namedtuple('Chunk', ['index', 'start_char', 'end_char', 'text', 'token_count', 'page', 'content_hash'])
+
+_tokenizers = {}
+
+
+def get_chunking_options():
+    """Return (max_tokens, overlap_tokens) from settings"""
+    max_tokens = getattr(settings, 'CHUNK_MAX_TOKENS', DEFAULT_MAX_TOKENS)
+    overlap = getattr(settings, 'CHUNK_OVERLAP_TOKENS', DEFAULT_OVERLAP_TOKENS)
+    return max_tokens, overlap
+
+
+def _get_model_tokenizer():
+    """Load the tokenizer named by CHUNK_TOKENIZER, if configured and available"""
+    name = getattr(settings, 'CHUNK_TOKENIZER', None)
+    if not name or not HAVE_TRANSFORMERS:
+        return None
+    if name not in _tokenizers:
+        try:
+            _tokenizers[name] = AutoTokenizer.from_pretrained(name, use_fast=True)
+        except Exception as e:
+            logger.error(f"Error loading tokenizer {name}: {str(e)}")
+            _tokenizers[name] = None
+    return _tokenizers[name]
+
+
+def iter_token_spans(text):
+    """
+    Yield (start, end) character spans of tokens in text
+
+    Uses the CHUNK_TOKENIZER model tokenizer when one is configured, feeding
+    it one paragraph at a time, and a word/punctuation regex otherwise.
+    """
+    tokenizer = _get_model_tokenizer()
+    if tokenizer is None:
+        for match in _TOKEN_RE.finditer(text):
+            yield match.span()
+        return
+
+    for block in _BLOCK_RE.finditer(text):
+        base = block.start()
+        encoded = tokenizer(block.group(), add_special_tokens=False, return_offsets_mapping=True)
+        for start, end in encoded['offset_mapping']:
+            if end > start:
+                yield base + start, base + end
+
+
+def count_tokens(text):
+    """Count tokens the same way the chunker does"""
+    return sum(1 for _ in iter_token_spans(text))
+
+
+def content_hash(text):
+    """Stable hash of a chunk's text"""
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def _page_starts(text):
+    """Return (offsets, page_numbers) for each page marker in text"""
+    offsets = [0]
+    pages = [1]
+    for match in _PAGE_RE.finditer(text):
+        if match.group(1):
+            page = int(match.group(1))
+        else:
+            page = pages[-1] + 1
+        offsets.append(match.end())
+        pages.append(page)
+    return offsets, pages
+
+
+def iter_chunks(text, max_tokens=None, overlap=None):
+    """
+    Split text into overlapping, token-bounded chunks
+
+    Chunks end on a sentence boundary when one falls in the second half of
+    the token window. Only the tokens of the current window are held in
+    memory, so arbitrarily long texts are chunked in a single pass.
+
+    Args:
+        text (str): Text to split
+        max_tokens (int): Maximum tokens per chunk
+        overlap (int): Tokens shared between consecutive chunks
+
+    Yields:
+        Chunk: Chunks in document order
+    """
+    default_max, default_overlap = get_chunking_options()
+    max_tokens = max_tokens or default_max
+    overlap = default_overlap if overlap is None else overlap
+    if max_tokens < 1:
+        raise ValueError("max_tokens must be positive")
+    overlap = max(0, min(overlap, max_tokens // 2))
+
+    page_offsets, page_numbers = _page_starts(text)
+    spans = iter_token_spans(text)
+    window = []
+    index = 0
+    exhausted = False
+
+    while True:
+        while not exhausted and len(window) < max_tokens:
+            span = next(spans, None)
+            if span is None:
+                exhausted = True
+            else:
+                window.append(span)
+        if not window:
+            break
+
+        size = len(window)
+        if not exhausted:
+            for i in range(size - 1, size // 2 - 1, -1):
+                start, end = window[i]
+                if text[start:end] in _SENTENCE_END and (end == len(text) or text[end].isspace()):
+                    size = i + 1
+                    break
+
+        start_char = window[0][0]
+        end_char = window[size - 1][1]
+        chunk_text = text[start_char:end_char]
+        page = page_numbers[bisect.bisect_right(page_offsets, start_char) - 1]
+        yield Chunk(index, start_char, end_char, chunk_text, size, page, content_hash(chunk_text))
+        index += 1
+
+        if exhausted and size == len(window):
+            break
+        # Step forward, keeping `overlap` tokens but always making progress
+        window = window[max(size - overlap, 1):]
+
+
+def chunk_document(document, text=None, max_tokens=None, overlap=None, batch_size=500):
+    """
+    Persist DocumentChunk rows for a document, touching only what changed
+
+    Chunks whose index, offsets and content hash already match the stored
+    row are left alone; changed chunks are updated in place and surplus
+    rows from a previous, longer extraction are deleted.
+
+    Args:
+        document: Document model instance
+        text (str): Extracted text, read from the document if not given
+        max_tokens (int): Token budget per chunk, defaults to CHUNK_MAX_TOKENS
+        overlap (int): Overlap in tokens, defaults to CHUNK_OVERLAP_TOKENS
+        batch_size (int): Rows per bulk insert/update
+
+    Returns:
+        dict: Counts of created, updated, unchanged and deleted chunks
+    """
+    from django.db import transaction
+    from .models import DocumentChunk
+
+    if text is None:
+        text = document.get_extracted_text()
+
+    existing = {
+        row[0]: row for row in DocumentChunk.objects.filter(document=document).values_list(
+            'index', 'start_char', 'end_char', 'content_hash', 'id'
+        )
+    }
+    stats = {'created': 0, 'updated': 0, 'unchanged': 0, 'deleted': 0}
+    to_create = []
+    to_update = []
+    count = 0
+
+    def flush():
+        if to_create:
+            DocumentChunk.objects.bulk_create(to_create, batch_size=batch_size)
+            stats['created'] += len(to_create)
+            to_create.clear()
+        if to_update:
+            DocumentChunk.objects.bulk_update(
+                to_update,
+                ['text', 'start_char', 'end_char', 'page', 'token_count', 'content_hash'],
+                batch_size=batch_size,
+            )
+            stats['updated'] += len(to_update)
+            to_update.clear()
+
+    with transaction.atomic():
+        for chunk in iter_chunks(text or "", max_tokens, overlap):
+            count += 1
+            fields = {
+                'text': chunk.text,
+                'start_char': chunk.start_char,
+                'end_char': chunk.end_char,
+                'page': chunk.page,
+                'token_count': chunk.token_count,
+                'content_hash': chunk.content_hash,
+            }
+            current = existing.get(chunk.index)
+            if current is None:
+                to_create.append(DocumentChunk(document=document, index=chunk.index, **fields))
+            elif current[1:4] == (chunk.start_char, chunk.end_char, chunk.content_hash):
+                stats['unchanged'] += 1
+            else:
+                to_update.append(DocumentChunk(id=current[4], document=document, index=chunk.index, **fields))
+            if len(to_create) + len(to_update) >= batch_size:
+                flush()
+        flush()
+
+        stale = [row[4] for index, row in existing.items() if index >= count]
+        if stale:
+            stats['deleted'] = DocumentChunk.objects.filter(id__in=stale).delete()[0]
+
+    logger.info(f"Chunked document {document.id}: {stats}")
+    return stats
@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+
+from document_processing.models import Document
+from document_processing.text_storage import get_compression_threshold
+
+
+class Command(BaseCommand):
+    help = "Move large inline extracted text into compressed storage"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100,
+                            help="Number of documents to load per query")
+
+    def handle(self, *args, **options):
+        threshold = get_compression_threshold()
+        compacted = 0
+
+        # Only ids are loaded up front so that large texts are read one at a time
+        ids = Document.objects.filter(text_compressed=False).values_list('id', flat=True)
+        for doc_id in ids.iterator(chunk_size=options['batch_size']):
+            document = Document.objects.get(id=doc_id)
+            text = document.extracted_text
+            if len(text.encode('utf-8')) <= threshold:
+                if document.text_length != len(text):
+                    document.text_length = len(text)
+                    document.save(update_fields=['text_length'])
+                continue
+
+            document.set_extracted_text(text)
+            document.save(update_fields=['extracted_text', 'text_compressed', 'text_length'])
+            compacted += 1
+
+        self.stdout.write(self.style.SUCCESS(f"Compressed extracted text for {compacted} document(s)"))
@@ -0,0 +1,69 @@
+import base64
+import gzip
+import json
+
+from django.core.management.base import BaseCommand
+
+from document_processing.models import Document
+from document_processing.text_storage import get_extracted_text
+
+
+class Command(BaseCommand):
+    help = "Export documents and their extracted text as JSON Lines, gzipped if the path ends in .gz"
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="Output file, e.g. corpus.jsonl.gz")
+        parser.add_argument('document_ids', nargs='*', type=int,
+                            help="Documents to export (default: all)")
+        parser.add_argument('--status', default=None,
+                            help="Only export documents with this processing status")
+        parser.add_argument('--include-blobs', action='store_true',
+                            help="Also export the original files, base64-encoded")
+        parser.add_argument('--batch-size', type=int, default=200,
+                            help="Number of documents to load per query")
+
+    def handle(self, *args, **options):
+        queryset = Document.objects.select_related('compressed_text').order_by('id')
+        if options['document_ids']:
+            queryset = queryset.filter(id__in=options['document_ids'])
+        if options['status']:
+            queryset = queryset.filter(processing_status=options['status'])
+
+        opener = gzip.open if options['path'].endswith('.gz') else open
+        exported = missing_files = 0
+        # Rows are streamed from the database and written one at a time, so
+        # memory use does not grow with the size of the corpus
+        with opener(options['path'], 'wt', encoding='utf-8') as output:
+            for document in queryset.iterator(chunk_size=options['batch_size']):
+                row = {
+                    'id': document.id,
+                    'title': document.title,
+                    'document_type': document.document_type,
+                    'file_name': document.file.name,
+                    'metadata': document.metadata,
+                    'processing_status': document.processing_status,
+                    'error_message': document.error_message,
+                    'created_at': document.created_at.isoformat(),
+                    'updated_at': document.updated_at.isoformat(),
+                    'extracted_text': get_extracted_text(document),
+                }
+                if options['include_blobs']:
+                    row['file_data'] = self._read_file(document)
+                    if row['file_data'] is None:
+                        missing_files += 1
+                output.write(json.dumps(row, ensure_ascii=False) + '\n')
+                exported += 1
+
+        self.stdout.write(self.style.SUCCESS(f"Exported {exported} document(s) to {options['path']}"))
+        if missing_files:
+            self.stdout.write(self.style.WARNING(f"{missing_files} original file(s) were missing"))
+
+    def _read_file(self, document):
+        """The original file base64-encoded, or None if it is missing"""
+        if not document.file:
+            return None
+        try:
+            with document.file.open('rb') as file:
+                return base64.b64encode(file.read()).decode('ascii')
+        except (OSError, ValueError):
+            return None
@@ -0,0 +1,127 @@
+import base64
+import gzip
+import json
+import os
+from contextlib import contextmanager
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from document_processing.models import Document, DocumentText, document_file_path
+from document_processing.text_storage import prepare_extracted_text
+
+
+@contextmanager
+def exported_timestamps():
+    """
+    Stop Document's auto_now fields from stamping the current time, so
+    imported rows keep their exported times without a second update
+    """
+    fields = [Document._meta.get_field('created_at'), Document._meta.get_field('updated_at')]
+    flags = [(field.auto_now, field.auto_now_add) for field in fields]
+    for field in fields:
+        field.auto_now = field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field, (auto_now, auto_now_add) in zip(fields, flags):
+            field.auto_now, field.auto_now_add = auto_now, auto_now_add
+
+
+class Command(BaseCommand):
+    help = "Import documents from a JSON Lines export (see export_corpus), in batches"
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="File written by export_corpus, gzipped if it ends in .gz")
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help="Number of documents to insert per query")
+        parser.add_argument('--keep-ids', action='store_true',
+                            help="Keep the exported ids, skipping documents whose id already exists")
+
+    def handle(self, *args, **options):
+        if not os.path.exists(options['path']):
+            raise CommandError(f"{options['path']} does not exist")
+
+        opener = gzip.open if options['path'].endswith('.gz') else open
+        totals = {'imported': 0, 'skipped': 0}
+        batch = []
+        # Only one batch of rows is held at a time, so memory use does not
+        # grow with the size of the corpus
+        with opener(options['path'], 'rt', encoding='utf-8') as data:
+            for number, line in enumerate(data, 1):
+                if not line.strip():
+                    continue
+                try:
+                    batch.append(json.loads(line))
+                except ValueError as e:
+                    raise CommandError(f"Line {number} is not valid JSON: {str(e)}")
+                if len(batch) >= options['batch_size']:
+                    self._import_batch(batch, options['keep_ids'], totals)
+                    batch = []
+            if batch:
+                self._import_batch(batch, options['keep_ids'], totals)
+        if options['keep_ids'] and totals['imported']:
+            self._reset_sequences()
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {totals['imported']} document(s), skipped {totals['skipped']}"
+        ))
+        if totals['imported']:
+            self.stdout.write(
+                "Run rebuild_search_index, rechunk_documents, build_bm25_index and build_vector_index "
+                "to make the imported documents searchable"
+            )
+
+    def _import_batch(self, rows, keep_ids, totals):
+        if keep_ids:
+            existing = set(Document.objects.filter(id__in=[row['id'] for row in rows]).values_list('id', flat=True))
+            totals['skipped'] += sum(1 for row in rows if row['id'] in existing)
+            rows = [row for row in rows if row['id'] not in existing]
+
+        now = timezone.now()
+        documents = []
+        blobs = []
+        for row in rows:
+            document = Document(
+                title=row['title'][:255],
+                document_type=row.get('document_type') or 'other',
+                metadata=row.get('metadata') or {},
+                processing_status=row.get('processing_status') or 'completed',
+                error_message=row.get('error_message') or '',
+                created_at=parse_datetime(row.get('created_at') or '') or now,
+                updated_at=parse_datetime(row.get('updated_at') or '') or now,
+            )
+            if keep_ids:
+                document.id = row['id']
+            document.file.name = self._store_file(row)
+            blobs.append(prepare_extracted_text(document, row.get('extracted_text')))
+            documents.append(document)
+
+        with transaction.atomic(), exported_timestamps():
+            Document.objects.bulk_create(documents)
+            DocumentText.objects.bulk_create([
+                DocumentText(document=document, **blob) for document, blob in zip(documents, blobs) if blob
+            ])
+        totals['imported'] += len(documents)
+
+    def _reset_sequences(self):
+        """Move the id sequences past the imported ids, so new rows do not collide with them"""
+        statements = connection.ops.sequence_reset_sql(no_style(), [Document, DocumentText])
+        if statements:
+            with connection.cursor() as cursor:
+                for statement in statements:
+                    cursor.execute(statement)
+
+    def _store_file(self, row):
+        """Save an exported original file to storage; otherwise keep the exported file name"""
+        if not row.get('file_data'):
+            return row.get('file_name') or ''
+        filename = os.path.basename(row.get('file_name') or '') or f"{row['title']}.bin"
+        return default_storage.save(
+            document_file_path(None, filename), ContentFile(base64.b64decode(row['file_data']))
+        )
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from document_processing.models import Document
+from document_processing.search import index_document
+
+
+class Command(BaseCommand):
+    help = "Rebuild the full-text search index from extracted text"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100,
+                            help="Number of documents to load per query")
+
+    def handle(self, *args, **options):
+        indexed = 0
+        failed = 0
+
+        ids = Document.objects.filter(processing_status='completed').values_list('id', flat=True)
+        for doc_id in ids.iterator(chunk_size=options['batch_size']):
+            document = Document.objects.get(id=doc_id)
+            if index_document(document):
+                indexed += 1
+            else:
+                failed += 1
+
+        self.stdout.write(self.style.SUCCESS(f"Indexed {indexed} document(s), {failed} failed"))
@@ -0,0 +1,49 @@
+from django.core.management.base import BaseCommand
+
+from document_processing.chunking import chunk_document
+from document_processing.models import Document
+from document_processing.signals import document_processed
+
+
+class Command(BaseCommand):
+    help = "Re-run the chunking stage, rewriting only chunks that changed"
+
+    def add_arguments(self, parser):
+        parser.add_argument('document_ids', nargs='*', type=int,
+                            help="Documents to chunk (default: all completed documents)")
+        parser.add_argument('--max-tokens', type=int, default=None,
+                            help="Token budget per chunk (default: CHUNK_MAX_TOKENS)")
+        parser.add_argument('--overlap', type=int, default=None,
+                            help="Overlapping tokens between chunks (default: CHUNK_OVERLAP_TOKENS)")
+
+    def handle(self, *args, **options):
+        queryset = Document.objects.filter(processing_status='completed')
+        if options['document_ids']:
+            queryset = queryset.filter(id__in=options['document_ids'])
+
+        totals = {'created': 0, 'updated': 0, 'unchanged': 0, 'deleted': 0}
+        reindexed = 0
+        for doc_id in queryset.values_list('id', flat=True).iterator():
+            document = Document.objects.get(id=doc_id)
+            text = document.get_extracted_text()
+            stats = chunk_document(document, text, max_tokens=options['max_tokens'], overlap=options['overlap'])
+            for key, value in stats.items():
+                totals[key] += value
+
+            if stats['created'] or stats['updated'] or stats['deleted']:
+                # Embeddings, keyword index, analysis and cached answers follow the chunks
+                reindexed += 1
+                for receiver, result in document_processed.send_robust(
+                    sender=Document, document=document, text=text
+                ):
+                    if isinstance(result, Exception):
+                        self.stderr.write(
+                            f"Error in post-processing stage {receiver.__name__} "
+                            f"for document {document.id}: {str(result)}"
+                        )
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Chunks created: {totals['created']}, updated: {totals['updated']}, "
+            f"unchanged: {totals['unchanged']}, deleted: {totals['deleted']}; "
+            f"{reindexed} document(s) re-indexed"
+        ))
@@ -0,0 +1,45 @@
+# Generated by Django 4.2.30 on 2026-10-19 08:44
+
+from django.db import migrations, models
+import django.db.models.deletion
+from django.db.models.functions import Length
+
+
+def backfill_text_length(apps, schema_editor):
+    # Existing texts are stored inline, so their length is that of extracted_text
+    Document = apps.get_model('document_processing', 'Document')
+    Document.objects.exclude(extracted_text='').update(text_length=Length('extracted_text'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('document_processing', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='document',
+            name='text_compressed',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='document',
+            name='text_length',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.CreateModel(
+            name='DocumentText',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('codec', models.CharField(choices=[('zlib', 'zlib'), ('zstd', 'Zstandard')], default='zlib', max_length=10)),
+                ('data', models.BinaryField()),
+                ('original_size', models.PositiveBigIntegerField(default=0)),
+                ('compressed_size', models.PositiveBigIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('document', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='compressed_text', to='document_processing.document')),
+            ],
+        ),
+        migrations.RunPython(backfill_text_length, migrations.RunPython.noop),
+    ]
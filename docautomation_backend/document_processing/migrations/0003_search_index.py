@@ -0,0 +1,22 @@
+from django.db import migrations
+
+from document_processing.search import get_search_backend
+
+
+def create_search_index(apps, schema_editor):
+    get_search_backend(schema_editor.connection.vendor).create_index(schema_editor)
+
+
+def drop_search_index(apps, schema_editor):
+    get_search_backend(schema_editor.connection.vendor).drop_index(schema_editor)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('document_processing', '0002_document_text'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
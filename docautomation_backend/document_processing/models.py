@@ -29,6 +29,8 @@ class Document(models.Model):
     file = models.FileField(upload_to=document_file_path)
     document_type = models.CharField(max_length=10, choices=DOCUMENT_TYPES, default='other')
     extracted_text = models.TextField(blank=True)
+    text_compressed = models.BooleanField(default=False)
+    text_length = models.PositiveIntegerField(default=0)
     metadata = models.JSONField(default=dict, blank=True, null=True)
     processing_status = models.CharField(max_length=20, choices=PROCESSING_STATUS, default='pending')
     error_message = models.TextField(blank=True)
@@ -37,3 +39,53 @@ class Document(models.Model):
     
     def __str__(self):
         return self.title
+
+    def get_extracted_text(self):
+        """Return the extracted text, decompressing it if it is stored externally"""
+        from .text_storage import get_extracted_text
+        return get_extracted_text(self)
+
+    def set_extracted_text(self, text):
+        """Store extracted text inline or compressed depending on its size"""
+        from .text_storage import store_extracted_text
+        store_extracted_text(self, text)
+
+class DocumentText(models.Model):
+    """Compressed extracted text for large documents, kept out of the Document row"""
+    CODECS = (
+        ('zlib', 'zlib'),
+        ('zstd', 'Zstandard'),
+    )
+
+    document = models.OneToOneField(Document, on_delete=models.CASCADE, related_name='compressed_text')
+    codec = models.CharField(max_length=10, choices=CODECS, default='zlib')
+    data = models.BinaryField()
+    original_size = models.PositiveBigIntegerField(default=0)
+    compressed_size = models.PositiveBigIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.document_id} ({self.codec}, {self.compressed_size} bytes)"
+
+class DocumentChunk(models.Model):
+    """Token-bounded passage of a document's extracted text"""
+    document = models.ForeignKey(Document, on_delete=models.CASCADE, related_name='chunks')
+    index = models.PositiveIntegerField()
+    text = models.TextField()
+    start_char = models.PositiveIntegerField()
+    end_char = models.PositiveIntegerField()
+    page = models.PositiveIntegerField(blank=True, null=True)
+    token_count = models.PositiveIntegerField()
+    content_hash = models.CharField(max_length=64, db_index=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['document', 'index']
+        constraints = [
+            models.UniqueConstraint(fields=['document', 'index'], name='unique_document_chunk_index'),
+        ]
+
+    def __str__(self):
+        return f"{self.document_id}:{self.index}"
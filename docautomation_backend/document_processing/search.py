@@ -0,0 +1,271 @@
+import html
+import logging
+import re
+
+from django.db import connection
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+SEARCH_TABLE = 'document_processing_search'
+SEARCH_CONFIG = 'english'
+HIGHLIGHT_START = '<mark>'
+HIGHLIGHT_END = '</mark>'
+# Private-use characters the engines wrap matches in, so the rest of the
+# snippet can be HTML-escaped before they become HIGHLIGHT_START/END
+MATCH_START = '\ue000'
+MATCH_END = '\ue001'
+SNIPPET_CONTEXT = 80
+
+_TERM_RE = re.compile(r'\w+\*?', re.UNICODE)
+
+
+def highlight(snippet):
+    """HTML-escape a snippet and turn its match markers into highlight tags"""
+    return html.escape(snippet or '').replace(MATCH_START, HIGHLIGHT_START).replace(MATCH_END, HIGHLIGHT_END)
+
+
+def _find_in_pieces(pieces, query):
+    """
+    Find query, case-insensitively, in text read piece by piece
+
+    Returns:
+        str: Snippet with the first match between MATCH_START and
+        MATCH_END, or None if the text does not contain it
+    """
+    needle = query.lower()
+    window = ''
+    for piece in pieces:
+        window += piece
+        position = window.lower().find(needle)
+        if position != -1:
+            end = position + len(query)
+            if len(window) - end < SNIPPET_CONTEXT:
+                window += next(pieces, '')
+            return (
+                window[max(position - SNIPPET_CONTEXT, 0):position] + MATCH_START + window[position:end]
+                + MATCH_END + window[end:end + SNIPPET_CONTEXT]
+            )
+        # Keep enough of the end for a match across pieces and its context
+        window = window[-(len(query) + SNIPPET_CONTEXT):]
+    return None
+
+
+class SearchBackend:
+    """Base class for full-text search over document titles and extracted text"""
+
+    vendor = None
+
+    def create_index(self, schema_editor):
+        """Create the index structures; called from the search migration"""
+
+    def drop_index(self, schema_editor):
+        """Drop the index structures"""
+
+    def index_document(self, document, text):
+        """Insert or replace a document in the index"""
+
+    def remove_document(self, document_id):
+        """Remove a document from the index"""
+
+    def search(self, query, offset=0, limit=20):
+        """
+        Run a ranked search
+
+        Returns:
+            tuple: (total_count, [(document_id, rank, snippet), ...])
+        """
+        raise NotImplementedError
+
+
+class SQLiteSearchBackend(SearchBackend):
+    """FTS5 virtual table keyed by document id"""
+
+    vendor = 'sqlite'
+
+    def create_index(self, schema_editor):
+        schema_editor.execute(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE} "
+            f"USING fts5(title, body, tokenize='porter unicode61')"
+        )
+
+    def drop_index(self, schema_editor):
+        schema_editor.execute(f"DROP TABLE IF EXISTS {SEARCH_TABLE}")
+
+    def index_document(self, document, text):
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {SEARCH_TABLE} WHERE rowid = %s", [document.id])
+            cursor.execute(
+                f"INSERT INTO {SEARCH_TABLE} (rowid, title, body) VALUES (%s, %s, %s)",
+                [document.id, document.title, text],
+            )
+
+    def remove_document(self, document_id):
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {SEARCH_TABLE} WHERE rowid = %s", [document_id])
+
+    def search(self, query, offset=0, limit=20):
+        match = self.build_match(query)
+        if not match:
+            return 0, []
+        with connection.cursor() as cursor:
+            cursor.execute(f"SELECT count(*) FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH %s", [match])
+            total = cursor.fetchone()[0]
+            # bm25() is lower-is-better; title matches weigh more than body matches
+            cursor.execute(
+                f"SELECT rowid, -bm25({SEARCH_TABLE}, 10.0, 1.0) AS rank, "
+                f"snippet({SEARCH_TABLE}, 1, %s, %s, '…', 24) "
+                f"FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH %s "
+                f"ORDER BY rank DESC LIMIT %s OFFSET %s",
+                [MATCH_START, MATCH_END, match, limit, offset],
+            )
+            return total, [(rowid, rank, highlight(snippet)) for rowid, rank, snippet in cursor.fetchall()]
+
+    @staticmethod
+    def build_match(query):
+        """Quote each term so user input cannot break the FTS5 query syntax"""
+        terms = []
+        for term in _TERM_RE.findall(query):
+            if term.endswith('*'):
+                terms.append(f'"{term[:-1]}"*')
+            else:
+                terms.append(f'"{term}"')
+        return " ".join(terms)
+
+
+class PostgresSearchBackend(SearchBackend):
+    """Side table with a tsvector column and a GIN index"""
+
+    vendor = 'postgresql'
+
+    def create_index(self, schema_editor):
+        schema_editor.execute(
+            f"CREATE TABLE IF NOT EXISTS {SEARCH_TABLE} ("
+            f"document_id bigint PRIMARY KEY REFERENCES document_processing_document (id) "
+            f"ON DELETE CASCADE DEFERRABLE INITIALLY DEFERRED, "
+            f"title text NOT NULL, body text NOT NULL, search_vector tsvector NOT NULL)"
+        )
+        schema_editor.execute(
+            f"CREATE INDEX IF NOT EXISTS {SEARCH_TABLE}_vector_idx "
+            f"ON {SEARCH_TABLE} USING GIN (search_vector)"
+        )
+
+    def drop_index(self, schema_editor):
+        schema_editor.execute(f"DROP TABLE IF EXISTS {SEARCH_TABLE}")
+
+    def index_document(self, document, text):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"INSERT INTO {SEARCH_TABLE} (document_id, title, body, search_vector) "
+                f"VALUES (%s, %s, %s, setweight(to_tsvector(%s, %s), 'A') || setweight(to_tsvector(%s, %s), 'D')) "
+                f"ON CONFLICT (document_id) DO UPDATE SET title = EXCLUDED.title, "
+                f"body = EXCLUDED.body, search_vector = EXCLUDED.search_vector",
+                [document.id, document.title, text,
+                 SEARCH_CONFIG, document.title, SEARCH_CONFIG, text],
+            )
+
+    def remove_document(self, document_id):
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {SEARCH_TABLE} WHERE document_id = %s", [document_id])
+
+    def search(self, query, offset=0, limit=20):
+        if not query.strip():
+            return 0, []
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"SELECT count(*) FROM {SEARCH_TABLE} "
+                f"WHERE search_vector @@ websearch_to_tsquery(%s, %s)",
+                [SEARCH_CONFIG, query],
+            )
+            total = cursor.fetchone()[0]
+            # Headlines are only computed for the rows on the requested page
+            cursor.execute(
+                f"SELECT page.document_id, page.rank, ts_headline(%s, page.body, page.q, %s) FROM ("
+                f"SELECT document_id, body, q, ts_rank_cd(search_vector, q) AS rank "
+                f"FROM {SEARCH_TABLE}, websearch_to_tsquery(%s, %s) q "
+                f"WHERE search_vector @@ q ORDER BY rank DESC LIMIT %s OFFSET %s"
+                f") page ORDER BY page.rank DESC",
+                [SEARCH_CONFIG,
+                 f"StartSel={MATCH_START}, StopSel={MATCH_END}, MaxFragments=2, MaxWords=24, MinWords=8",
+                 SEARCH_CONFIG, query, limit, offset],
+            )
+            return total, [(document_id, rank, highlight(snippet)) for document_id, rank, snippet in cursor.fetchall()]
+
+
+class FallbackSearchBackend(SearchBackend):
+    """
+    Unindexed substring search for databases without a supported full-text engine
+
+    Inline texts are matched by the database. Compressed texts cannot be,
+    so each one is decompressed piece by piece and scanned; this backend is
+    only meant for small deployments.
+    """
+
+    def search(self, query, offset=0, limit=20):
+        from .models import Document
+        from .text_storage import iter_extracted_text
+
+        query = query.strip()
+        if not query:
+            return 0, []
+        matches = list(
+            Document.objects.filter(text_compressed=False, extracted_text__icontains=query)
+            .values_list('created_at', 'id')
+        )
+        snippets = {}
+        compressed = (
+            Document.objects.filter(text_compressed=True).select_related('compressed_text')
+            .only('id', 'created_at', 'text_compressed', 'compressed_text__codec', 'compressed_text__data')
+        )
+        for document in compressed.iterator(chunk_size=20):
+            snippet = _find_in_pieces(iter_extracted_text(document), query)
+            if snippet is not None:
+                matches.append((document.created_at, document.id))
+                snippets[document.id] = snippet
+
+        matches.sort(reverse=True)
+        page = [document_id for _, document_id in matches[offset:offset + limit]]
+        inline = [document_id for document_id in page if document_id not in snippets]
+        for document in Document.objects.filter(id__in=inline).only('id', 'extracted_text'):
+            snippets[document.id] = _find_in_pieces(iter([document.extracted_text]), query) or ''
+        return len(matches), [(document_id, 1.0, highlight(snippets[document_id])) for document_id in page]
+
+
+BACKENDS = {
+    'sqlite': SQLiteSearchBackend,
+    'postgresql': PostgresSearchBackend,
+}
+
+
+def get_search_backend(vendor=None):
+    """Return the search backend for the default database"""
+    return BACKENDS.get(vendor or connection.vendor, FallbackSearchBackend)()
+
+
+def index_document(document, text=None):
+    """
+    Update the search index for a single document
+
+    Args:
+        document: Document model instance
+        text (str): Extracted text, read from the document if not given
+
+    Returns:
+        bool: True if the index was updated, False otherwise
+    """
+    try:
+        if text is None:
+            text = document.get_extracted_text()
+        get_search_backend().index_document(document, text or "")
+        return True
+    except Exception as e:
+        logger.error(f"Error indexing document {document.id}: {str(e)}")
+        return False
+
+
+def remove_document(document_id):
+    """Remove a document from the search index"""
+    try:
+        get_search_backend().remove_document(document_id)
+    except Exception as e:
+        logger.error(f"Error removing document {document_id} from search index: {str(e)}")
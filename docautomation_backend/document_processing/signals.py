@@ -0,0 +1,16 @@
+from django.db.models.signals import post_delete
+from django.dispatch import Signal, receiver
+
+from .models import Document
+from .search import remove_document
+
+# Sent by process_document once extraction, indexing and chunking are done.
+# Receivers get `document` and the extracted `text`; other apps hook their
+# post-extraction stages (embeddings, analysis) onto it.
+document_processed = Signal()
+
+
+@receiver(post_delete, sender=Document)
+def remove_deleted_document_from_index(sender, instance, **kwargs):
+    """Keep the search index in sync when documents are deleted"""
+    remove_document(instance.id)
@@ -1,3 +1,267 @@
-from django.test import TestCase
+import gzip
+import io
+import json
+import os
+import shutil
+import tempfile
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from rest_framework.test import APIClient
+
+from .chunking import chunk_document, content_hash, iter_chunks
+from .models import Document, DocumentChunk, DocumentText
+from .search import get_search_backend, index_document
+from .text_storage import (
+    compress_text, decompress_text, get_extracted_text, iter_decompressed,
+    iter_extracted_text, read_extracted_text, store_extracted_text,
+)
+
+SENTENCE = "The supplier shall deliver the goods within thirty days. "
+
+
+def create_document(text='', title='contract.txt'):
+    """A processed document with the given extracted text"""
+    document = Document.objects.create(title=title, document_type='txt', processing_status='completed')
+    store_extracted_text(document, text)
+    document.save()
+    return document
+
+
+class ChunkingTests(TestCase):
+    def test_chunks_are_bounded_and_overlap(self):
+        text = " ".join(f"word{i}" for i in range(100))
+        chunks = list(iter_chunks(text, max_tokens=20, overlap=5))
+
+        self.assertTrue(all(chunk.token_count <= 20 for chunk in chunks))
+        self.assertEqual([chunk.index for chunk in chunks], list(range(len(chunks))))
+        self.assertEqual(chunks[0].start_char, 0)
+        self.assertEqual(chunks[-1].end_char, len(text))
+        for previous, chunk in zip(chunks, chunks[1:]):
+            self.assertEqual(previous.text.split()[-5:], chunk.text.split()[:5])
+        for chunk in chunks:
+            self.assertEqual(text[chunk.start_char:chunk.end_char], chunk.text)
+            self.assertEqual(chunk.content_hash, content_hash(chunk.text))
+
+    def test_chunks_end_on_sentence_boundary(self):
+        chunks = list(iter_chunks(SENTENCE * 10, max_tokens=15, overlap=0))
+
+        for chunk in chunks[:-1]:
+            self.assertTrue(chunk.text.endswith('.'), chunk.text)
+
+    def test_page_numbers_follow_markers(self):
+        feeds = list(iter_chunks("first page text\fsecond page text\fthird page text", max_tokens=3, overlap=0))
+        self.assertEqual([(chunk.text, chunk.page) for chunk in feeds], [
+            ("first page text", 1), ("second page text", 2), ("third page text", 3),
+        ])
+
+        # The OCR marker is 8 tokens long
+        marked = list(iter_chunks("--- Page 4 ---\nalpha beta gamma", max_tokens=8, overlap=0))
+        self.assertEqual((marked[-1].text, marked[-1].page), ("alpha beta gamma", 4))
+
+    def test_rejects_empty_window(self):
+        with self.assertRaises(ValueError):
+            list(iter_chunks("text", max_tokens=-1))
+
+    def test_chunk_document_only_touches_changes(self):
+        document = create_document()
+        text = SENTENCE * 20
+
+        first = chunk_document(document, text, max_tokens=20, overlap=0)
+        self.assertEqual(first['created'], DocumentChunk.objects.filter(document=document).count())
+
+        again = chunk_document(document, text, max_tokens=20, overlap=0)
+        self.assertEqual(again, {'created': 0, 'updated': 0, 'unchanged': first['created'], 'deleted': 0})
+
+        edited = "An amended opening sentence. " + SENTENCE * 9
+        shorter = chunk_document(document, edited, max_tokens=20, overlap=0)
+        self.assertGreater(shorter['updated'], 0)
+        self.assertGreater(shorter['deleted'], 0)
+        stored = DocumentChunk.objects.filter(document=document).order_by('index')
+        self.assertEqual([chunk.text for chunk in stored], [chunk.text for chunk in iter_chunks(edited, 20, 0)])
+
+
+@override_settings(EXTRACTED_TEXT_COMPRESSION_THRESHOLD=1000, EXTRACTED_TEXT_COMPRESSION_CODEC='zlib')
+class TextStorageTests(TestCase):
+    def test_small_text_is_stored_inline(self):
+        document = create_document("Short text")
+
+        self.assertFalse(document.text_compressed)
+        self.assertEqual(document.extracted_text, "Short text")
+        self.assertEqual(document.text_length, 10)
+        self.assertFalse(DocumentText.objects.filter(document=document).exists())
+
+    def test_large_text_is_compressed(self):
+        text = "Clause é€ 42. " * 200
+        document = create_document(text)
+        document = Document.objects.get(id=document.id)
+
+        self.assertTrue(document.text_compressed)
+        self.assertEqual(document.extracted_text, "")
+        self.assertEqual(document.text_length, len(text))
+        self.assertLess(document.compressed_text.compressed_size, document.compressed_text.original_size)
+        self.assertEqual(get_extracted_text(document), text)
+
+    def test_shrinking_text_drops_compressed_copy(self):
+        document = create_document("x" * 2000)
+        store_extracted_text(document, "now short")
+        document.save()
+
+        self.assertFalse(DocumentText.objects.filter(document=document).exists())
+        self.assertEqual(get_extracted_text(document), "now short")
+
+    def test_codec_round_trip(self):
+        text = "Paragraph ü\n" * 500
+        codec, data = compress_text(text, 'zlib')
+
+        self.assertEqual(decompress_text(codec, data), text)
+        # Tiny pieces split multi-byte characters across reads
+        self.assertEqual("".join(iter_decompressed(codec, data, chunk_size=7)), text)
+
+    def test_ranges_of_compressed_and_inline_text(self):
+        long_text = "".join(f"{i:04d}é " for i in range(500))
+        for text in (long_text, long_text[:300]):
+            document = Document.objects.defer('extracted_text').get(id=create_document(text).id)
+            for offset, limit in ((0, None), (0, 10), (123, 50), (len(text) - 5, 100), (len(text) + 5, 10)):
+                expected = text[offset:] if limit is None else text[offset:offset + limit]
+                self.assertEqual(read_extracted_text(document, offset, limit), expected)
+            pieces = list(iter_extracted_text(document, 10, 200, chunk_size=16))
+            self.assertEqual("".join(pieces), text[10:210])
+
+
+@override_settings(EXTRACTED_TEXT_COMPRESSION_THRESHOLD=1000, EXTRACTED_TEXT_COMPRESSION_CODEC='zlib')
+class DocumentApiTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+
+    def test_extracted_text_pages(self):
+        text = "".join(f"line {i}\n" for i in range(400))
+        document = create_document(text)
+
+        pages = []
+        offset = 0
+        while offset is not None:
+            response = self.client.get(
+                f'/api/documents/{document.id}/extracted_text/', {'offset': offset, 'limit': 1000}
+            )
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.data['total_length'], len(text))
+            pages.append(response.data['extracted_text'])
+            offset = response.data['next_offset']
+
+        self.assertEqual(len(pages), -(-len(text) // 1000))
+        self.assertEqual("".join(pages), text)
+
+    def test_extracted_text_rejects_bad_range(self):
+        document = create_document("text")
+
+        for params in ({'offset': 'x'}, {'offset': -1}, {'limit': -5}):
+            response = self.client.get(f'/api/documents/{document.id}/extracted_text/', params)
+            self.assertEqual(response.status_code, 400)
+
+    def test_list_leaves_out_text(self):
+        create_document("x" * 5000)
+        create_document("inline text", title='short.txt')
+
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/documents/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data), 2)
+        self.assertTrue(all('extracted_text' not in item for item in response.data))
+
+    def test_search_pages_and_escapes_snippets(self):
+        for i in range(5):
+            document = create_document(f"Invoice {i}: <script>alert(1)</script> penalty clause applies.")
+            index_document(document)
+
+        response = self.client.get('/api/documents/search/', {'q': 'penalty', 'page': 2, 'page_size': 2})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['count'], 5)
+        self.assertEqual(len(response.data['results']), 2)
+        self.assertTrue(response.data['has_more'])
+        for result in response.data['results']:
+            self.assertNotIn('<script>', result['snippet'])
+
+        _, hits = get_search_backend().search('penalty', offset=4, limit=2)
+        self.assertEqual(len(hits), 1)
+
+    def test_renaming_updates_search_index(self):
+        document = create_document("Quarterly maintenance schedule.", title='draft.txt')
+        index_document(document)
+        self.client.force_authenticate(User.objects.create_user('editor'))
+
+        response = self.client.patch(f'/api/documents/{document.id}/', {'title': 'Boiler servicing'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(get_search_backend().search('boiler')[0], 1)
+        self.assertEqual(get_search_backend().search('draft')[0], 0)
+
+
+@override_settings(EXTRACTED_TEXT_COMPRESSION_THRESHOLD=1000, EXTRACTED_TEXT_COMPRESSION_CODEC='zlib')
+class CorpusTransferTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.media_root = tempfile.mkdtemp()
+        cls.media_settings = override_settings(MEDIA_ROOT=cls.media_root)
+        cls.media_settings.enable()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.media_settings.disable()
+        shutil.rmtree(cls.media_root, ignore_errors=True)
+        super().tearDownClass()
+
+    def setUp(self):
+        self.long_text = "Clause é 42. " * 200
+        self.terms = create_document(self.long_text, title='terms.txt')
+        self.terms.file.save('terms.txt', ContentFile(b'original bytes'), save=True)
+        self.note = create_document("Short note", title='note.txt')
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, True)
+
+    def export(self, *args):
+        path = os.path.join(self.directory, 'corpus.jsonl.gz')
+        call_command('export_corpus', path, *args, stdout=io.StringIO())
+        return path
+
+    def load(self, *args):
+        out = io.StringIO()
+        call_command('import_corpus', *args, stdout=out)
+        return out.getvalue()
+
+    def test_round_trip_keeps_text_files_and_timestamps(self):
+        path = self.export('--include-blobs')
+
+        self.assertIn("Imported 2 document(s), skipped 0", self.load(path, '--batch-size', '1'))
+        copies = Document.objects.exclude(id__in=[self.terms.id, self.note.id]).order_by('id')
+        self.assertEqual([copy.title for copy in copies], ['terms.txt', 'note.txt'])
+        self.assertTrue(copies[0].text_compressed)
+        self.assertEqual(get_extracted_text(copies[0]), self.long_text)
+        self.assertEqual(get_extracted_text(copies[1]), "Short note")
+        original = Document.objects.get(id=self.terms.id)
+        self.assertEqual((copies[0].created_at, copies[0].updated_at), (original.created_at, original.updated_at))
+        with copies[0].file.open('rb') as file:
+            self.assertEqual(file.read(), b'original bytes')
+
+    def test_export_selects_documents(self):
+        path = self.export(str(self.note.id), '--status', 'completed')
+
+        with gzip.open(path, 'rt', encoding='utf-8') as data:
+            rows = [json.loads(line) for line in data]
+        self.assertEqual([(row['id'], row['extracted_text']) for row in rows], [(self.note.id, "Short note")])
+        self.assertNotIn('file_data', rows[0])
+
+    def test_keep_ids_skips_existing_documents(self):
+        with gzip.open(self.export(str(self.note.id)), 'rt', encoding='utf-8') as data:
+            row = json.loads(data.readline())
+        path = os.path.join(self.directory, 'moved.jsonl')
+        with open(path, 'w', encoding='utf-8') as output:
+            output.write(json.dumps(dict(row, id=500)) + '\n')
+            output.write(json.dumps(row) + '\n')
+
+        self.assertIn("Imported 1 document(s), skipped 1", self.load(path, '--keep-ids'))
+        self.assertEqual(get_extracted_text(Document.objects.get(id=500)), "Short note")
+        # New documents are numbered after the imported ids
+        self.assertGreater(create_document("new").id, 500)
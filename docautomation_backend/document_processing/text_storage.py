@@ -0,0 +1,320 @@
+import codecs
+import logging
+import zlib
+
+from django.conf import settings
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Try to import optional dependencies
+try:
+    import zstandard
+    HAVE_ZSTD = True
+except ImportError:
+    logger.warning("zstandard not available. Extracted text will be compressed with zlib.")
+    HAVE_ZSTD = False
+
+try:
+    import brotli
+    HAVE_BROTLI = True
+except ImportError:
+    logger.warning("brotli not available. Streamed text will only be gzip-encoded.")
+    HAVE_BROTLI = False
+
+# HTTP Content-Encoding tokens for each storage codec. zlib streams are what
+# HTTP calls "deflate", so stored blobs can be sent to clients as-is.
+CONTENT_ENCODINGS = {
+    'zlib': 'deflate',
+    'zstd': 'zstd',
+}
+
+DEFAULT_THRESHOLD = 64 * 1024
+DEFAULT_CHUNK_SIZE = 64 * 1024
+
+
+def get_compression_threshold():
+    """Size in bytes above which extracted text is stored compressed"""
+    return getattr(settings, 'EXTRACTED_TEXT_COMPRESSION_THRESHOLD', DEFAULT_THRESHOLD)
+
+
+def get_compression_codec():
+    """Return the configured codec, falling back to zlib if zstandard is missing"""
+    codec = getattr(settings, 'EXTRACTED_TEXT_COMPRESSION_CODEC', 'zstd')
+    if codec == 'zstd' and not HAVE_ZSTD:
+        return 'zlib'
+    return codec
+
+
+def compress_text(text, codec=None):
+    """
+    Compress text with the given codec
+
+    Args:
+        text (str): Text to compress
+        codec (str): 'zstd' or 'zlib', defaults to the configured codec
+
+    Returns:
+        tuple: (codec, compressed_bytes)
+    """
+    codec = codec or get_compression_codec()
+    raw = text.encode('utf-8')
+    if codec == 'zstd':
+        return codec, zstandard.ZstdCompressor(level=10).compress(raw)
+    return 'zlib', zlib.compress(raw, 6)
+
+
+def decompress_text(codec, data):
+    """
+    Decompress a blob produced by compress_text
+
+    Args:
+        codec (str): Codec the blob was written with
+        data (bytes): Compressed bytes
+
+    Returns:
+        str: The original text
+    """
+    data = bytes(data)
+    if codec == 'zstd':
+        if not HAVE_ZSTD:
+            raise RuntimeError("zstandard is required to read this document's text")
+        return zstandard.ZstdDecompressor().decompress(data).decode('utf-8')
+    return zlib.decompress(data).decode('utf-8')
+
+
+def store_extracted_text(document, text):
+    """
+    Store a document's extracted text inline or in the compressed side table
+
+    Text larger than EXTRACTED_TEXT_COMPRESSION_THRESHOLD bytes is compressed
+    into a DocumentText row and the inline column is left empty. The caller is
+    responsible for saving the document itself.
+
+    Args:
+        document: Saved Document model instance
+        text (str): Extracted text
+    """
+    from .models import DocumentText
+
+    was_compressed = document.text_compressed
+    blob = prepare_extracted_text(document, text)
+    if blob is None:
+        if was_compressed:
+            DocumentText.objects.filter(document=document).delete()
+        return
+
+    DocumentText.objects.update_or_create(document=document, defaults=blob)
+    logger.info(
+        f"Stored text for document {document.id} compressed with {blob['codec']}: "
+        f"{blob['original_size']} -> {blob['compressed_size']} bytes"
+    )
+
+
+def prepare_extracted_text(document, text):
+    """
+    Set a document's inline text, length and compression flag, compressing
+    text over the threshold
+
+    Nothing is written to the database, so documents can be prepared in
+    bulk (see the import_corpus command).
+
+    Returns:
+        dict: DocumentText field values if the text is to be stored
+        compressed, None if it was stored inline
+    """
+    text = text or ""
+    size = len(text.encode('utf-8'))
+    document.text_length = len(text)
+    if size <= get_compression_threshold():
+        document.extracted_text = text
+        document.text_compressed = False
+        return None
+
+    codec, data = compress_text(text)
+    document.extracted_text = ""
+    document.text_compressed = True
+    return {'codec': codec, 'data': data, 'original_size': size, 'compressed_size': len(data)}
+
+
+def get_extracted_text(document):
+    """
+    Return a document's extracted text, decompressing it if needed
+
+    Args:
+        document: Document model instance
+
+    Returns:
+        str: The extracted text
+    """
+    if not document.text_compressed:
+        return document.extracted_text
+    from .models import DocumentText
+    try:
+        blob = document.compressed_text
+    except DocumentText.DoesNotExist:
+        logger.error(f"Document {document.id} is marked compressed but has no stored text")
+        return ""
+    return decompress_text(blob.codec, blob.data)
+
+
+def accepted_encodings(request):
+    """Return the set of content codings listed in the request's Accept-Encoding header"""
+    header = request.META.get('HTTP_ACCEPT_ENCODING', '')
+    encodings = set()
+    for part in header.split(','):
+        token, _, params = part.strip().partition(';')
+        if not token:
+            continue
+        if params.replace(' ', '') in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000'):
+            continue
+        encodings.add(token.strip().lower())
+    return encodings
+
+
+def iter_blob(data, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Yield a stored blob in fixed-size pieces"""
+    view = memoryview(data)
+    for start in range(0, len(view), chunk_size):
+        yield bytes(view[start:start + chunk_size])
+
+
+def iter_decompressed(codec, data, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Decompress a blob incrementally, yielding text pieces
+
+    Only one chunk of decompressed output is held at a time, so callers that
+    stop early never inflate the rest of the blob.
+    """
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    if codec == 'zstd':
+        if not HAVE_ZSTD:
+            raise RuntimeError("zstandard is required to read this document's text")
+        decompressor = zstandard.ZstdDecompressor().decompressobj()
+        for piece in iter_blob(data, chunk_size):
+            text = decoder.decode(decompressor.decompress(piece))
+            if text:
+                yield text
+    else:
+        decompressor = zlib.decompressobj()
+        for piece in iter_blob(data, chunk_size):
+            text = decoder.decode(decompressor.decompress(piece, chunk_size))
+            if text:
+                yield text
+            # Drain output held back by the max_length limit above
+            while decompressor.unconsumed_tail:
+                text = decoder.decode(decompressor.decompress(decompressor.unconsumed_tail, chunk_size))
+                if text:
+                    yield text
+        text = decoder.decode(decompressor.flush())
+        if text:
+            yield text
+    tail = decoder.decode(b'', final=True)
+    if tail:
+        yield tail
+
+
+def iter_extracted_text(document, offset=0, limit=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Yield a character range of a document's extracted text in pieces
+
+    Args:
+        document: Document model instance
+        offset (int): Index of the first character to return
+        limit (int): Maximum number of characters, or None for the rest
+        chunk_size (int): Approximate size of each yielded piece
+
+    Yields:
+        str: Consecutive pieces of the requested range
+    """
+    end = None if limit is None else offset + limit
+
+    if document.text_compressed:
+        from .models import DocumentText
+        try:
+            blob = document.compressed_text
+        except DocumentText.DoesNotExist:
+            logger.error(f"Document {document.id} is marked compressed but has no stored text")
+            return
+        pieces = iter_decompressed(blob.codec, blob.data, chunk_size)
+    else:
+        text = read_inline_range(document, offset, limit)
+        pieces = (text[i:i + chunk_size] for i in range(0, len(text), chunk_size))
+        offset, end = 0, None
+
+    position = 0
+    for piece in pieces:
+        piece_end = position + len(piece)
+        if piece_end > offset:
+            start = max(offset - position, 0)
+            stop = len(piece) if end is None else min(end - position, len(piece))
+            if stop > start:
+                yield piece[start:stop]
+        position = piece_end
+        if end is not None and position >= end:
+            break
+
+
+def read_inline_range(document, offset=0, limit=None):
+    """
+    Read a character range of inline extracted text
+
+    When the text column was deferred, only the requested substring is
+    fetched from the database.
+    """
+    if 'extracted_text' in document.get_deferred_fields():
+        from django.db.models.functions import Length, Substr
+        from .models import Document
+        length = limit if limit is not None else Length('extracted_text')
+        return Document.objects.filter(pk=document.pk).annotate(
+            text_range=Substr('extracted_text', offset + 1, length)
+        ).values_list('text_range', flat=True).first() or ""
+    text = document.extracted_text
+    return text[offset:] if limit is None else text[offset:offset + limit]
+
+
+def read_extracted_text(document, offset=0, limit=None):
+    """Return a character range of a document's extracted text as one string"""
+    return "".join(iter_extracted_text(document, offset, limit))
+
+
+def negotiate_stream_encoding(request):
+    """Pick the content coding to apply to streamed text, or None for identity"""
+    encodings = accepted_encodings(request)
+    if HAVE_BROTLI and 'br' in encodings:
+        return 'br'
+    if 'gzip' in encodings:
+        return 'gzip'
+    return None
+
+
+def iter_encoded(pieces, encoding):
+    """
+    Encode text pieces as UTF-8 and compress them on the fly
+
+    Args:
+        pieces: Iterable of str
+        encoding (str): 'br', 'gzip' or None
+
+    Yields:
+        bytes: Encoded output, flushed once per input piece
+    """
+    if encoding == 'br':
+        compressor = brotli.Compressor()
+        for piece in pieces:
+            compressor.process(piece.encode('utf-8'))
+            out = compressor.flush()
+            if out:
+                yield out
+        yield compressor.finish()
+    elif encoding == 'gzip':
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+        for piece in pieces:
+            out = compressor.compress(piece.encode('utf-8'))
+            out += compressor.flush(zlib.Z_SYNC_FLUSH)
+            if out:
+                yield out
+        yield compressor.flush()
+    else:
+        for piece in pieces:
+            yield piece.encode('utf-8')
@@ -232,10 +232,27 @@ def process_document(document):
                     text, metadata = extract_text_from_image(file_path)
         
         # Update document with extracted text and metadata
-        document.extracted_text = text
+        document.set_extracted_text(text)
         document.metadata = metadata
         document.processing_status = 'completed'
         document.save()
+
+        # Keep the full-text search index up to date
+        from .search import index_document
+        index_document(document, text)
+
+        # Split the text into passages for retrieval and analysis
+        from .chunking import chunk_document
+        try:
+            chunk_document(document, text)
+        except Exception as e:
+            logger.error(f"Error chunking document {document.id}: {str(e)}")
+
+        # Run post-extraction stages registered by other apps
+        from .signals import document_processed
+        for receiver, result in document_processed.send_robust(sender=document.__class__, document=document, text=text):
+            if isinstance(result, Exception):
+                logger.error(f"Error in post-processing stage {receiver.__name__} for document {document.id}: {str(result)}")
         
         logger.info(f"Document {document.id} processed successfully")
         return True
@@ -11,10 +11,21 @@ import threading
 from rest_framework import serializers
 
 class DocumentSerializer(serializers.ModelSerializer):
+    extracted_text = serializers.CharField(source='get_extracted_text', read_only=True)
+
     class Meta:
         model = Document
         fields = '__all__'
-        read_only_fields = ['id', 'created_at', 'updated_at']
+        read_only_fields = ['id', 'created_at', 'updated_at', 'text_compressed', 'text_length']
+
+
+class DocumentListSerializer(serializers.ModelSerializer):
+    """Documents in list responses, without their text; read it with the extracted_text action"""
+
+    class Meta:
+        model = Document
+        exclude = ['extracted_text']
+        read_only_fields = ['id', 'created_at', 'updated_at', 'text_compressed', 'text_length']
 
 # Document ViewSet
 class DocumentViewSet(viewsets.ModelViewSet):
@@ -25,7 +36,7 @@ class DocumentViewSet(viewsets.ModelViewSet):
     
     def get_permissions(self):
         """Return appropriate permissions based on action"""
-        if self.action in ['upload', 'create', 'list', 'retrieve', 'test_upload', 'preview', 'download', 'extracted_text']:
+        if self.action in ['upload', 'create', 'list', 'retrieve', 'test_upload', 'preview', 'download', 'extracted_text', 'text', 'search']:
             return [AllowAny()]
         return [IsAuthenticated()]
     
@@ -60,6 +71,14 @@ class DocumentViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
     
+    def perform_update(self, serializer):
+        """Save the document, re-indexing it for search when its title changes"""
+        previous_title = serializer.instance.title
+        document = serializer.save()
+        if document.title != previous_title and document.processing_status == 'completed':
+            from .search import index_document
+            index_document(document)
+
     @action(detail=False, methods=['post'])
     def upload(self, request):
         """Alternative endpoint for document upload"""
@@ -109,11 +128,13 @@ class DocumentViewSet(viewsets.ModelViewSet):
         document = self.get_object()
         
         # Return a basic preview with document details and first part of extracted text
+        from .text_storage import read_extracted_text
         preview_text = ""
-        if document.extracted_text:
+        extracted_text = read_extracted_text(document, 0, 501)
+        if extracted_text:
             # Get the first 500 characters of text as preview
-            preview_text = document.extracted_text[:500]
-            if len(document.extracted_text) > 500:
+            preview_text = extracted_text[:500]
+            if len(extracted_text) > 500:
                 preview_text += "..."
                 
         preview_data = {
@@ -183,16 +204,162 @@ class DocumentViewSet(viewsets.ModelViewSet):
     def extracted_text(self, request, pk=None):
         """
         Get the extracted text from a document
+
+        Accepts optional `offset` and `limit` query parameters (in characters)
+        so viewers can load large documents page by page. With `stream=true`
+        the text is streamed as text/plain instead of a JSON body.
         """
+        if request.query_params.get('stream') in ('1', 'true', 'yes'):
+            return self.text(request, pk=pk)
+
+        try:
+            offset, limit = self._get_text_range(request)
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        from .text_storage import read_extracted_text
+
         document = self.get_object()
-        
+        text = read_extracted_text(document, offset, limit)
+        end = offset + len(text)
+        has_more = end < document.text_length
+
         return Response({
             'id': document.id,
             'title': document.title,
-            'extracted_text': document.extracted_text,
-            'processing_status': document.processing_status
+            'extracted_text': text,
+            'processing_status': document.processing_status,
+            'offset': offset,
+            'limit': limit,
+            'total_length': document.text_length,
+            'has_more': has_more,
+            'next_offset': end if has_more else None,
+        })
+
+    @action(detail=True, methods=['get'])
+    def text(self, request, pk=None):
+        """
+        Stream the extracted text as text/plain
+
+        Supports the same `offset` and `limit` parameters as extracted_text.
+        The whole compressed text is sent as stored, without decompressing it
+        on the server, when the client accepts the codec it was written with.
+        Otherwise the text is streamed with gzip or brotli if accepted.
+        """
+        from django.http import StreamingHttpResponse
+        from .text_storage import (
+            CONTENT_ENCODINGS, accepted_encodings, iter_blob,
+            iter_encoded, iter_extracted_text, negotiate_stream_encoding,
+        )
+
+        try:
+            offset, limit = self._get_text_range(request)
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        document = self.get_object()
+
+        if document.text_compressed and offset == 0 and limit is None:
+            blob = getattr(document, 'compressed_text', None)
+            encoding = CONTENT_ENCODINGS.get(blob.codec) if blob else None
+            if encoding and encoding in accepted_encodings(request):
+                response = StreamingHttpResponse(
+                    iter_blob(blob.data),
+                    content_type='text/plain; charset=utf-8'
+                )
+                response['Content-Encoding'] = encoding
+                response['Content-Length'] = str(blob.compressed_size)
+                response['Vary'] = 'Accept-Encoding'
+                return response
+
+        encoding = negotiate_stream_encoding(request)
+        response = StreamingHttpResponse(
+            iter_encoded(iter_extracted_text(document, offset, limit), encoding),
+            content_type='text/plain; charset=utf-8'
+        )
+        if encoding:
+            response['Content-Encoding'] = encoding
+        response['Vary'] = 'Accept-Encoding'
+        response['X-Total-Length'] = str(document.text_length)
+        return response
+
+    @action(detail=False, methods=['get'])
+    def search(self, request):
+        """
+        Full-text search over document titles and extracted text
+
+        Query parameters: `q` (required), `page` and `page_size`. Results are
+        ranked by relevance and include a highlighted snippet.
+        """
+        from .search import get_search_backend
+
+        query = request.query_params.get('q', '').strip()
+        if not query:
+            return Response({'error': 'No search query provided'}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            page = int(request.query_params.get('page', 1))
+            page_size = min(int(request.query_params.get('page_size', 20)), 100)
+        except ValueError:
+            return Response({'error': 'page and page_size must be integers'}, status=status.HTTP_400_BAD_REQUEST)
+        if page < 1 or page_size < 1:
+            return Response({'error': 'page and page_size must be positive'}, status=status.HTTP_400_BAD_REQUEST)
+
+        total, hits = get_search_backend().search(query, offset=(page - 1) * page_size, limit=page_size)
+
+        documents = Document.objects.only(
+            'id', 'title', 'document_type', 'processing_status', 'created_at'
+        ).in_bulk([doc_id for doc_id, _, _ in hits])
+
+        results = []
+        for doc_id, rank, snippet in hits:
+            document = documents.get(doc_id)
+            if document is None:
+                continue
+            results.append({
+                'id': document.id,
+                'title': document.title,
+                'document_type': document.document_type,
+                'processing_status': document.processing_status,
+                'created_at': document.created_at,
+                'rank': rank,
+                'snippet': snippet,
+            })
+
+        return Response({
+            'query': query,
+            'count': total,
+            'page': page,
+            'page_size': page_size,
+            'has_more': page * page_size < total,
+            'results': results,
         })
 
+    def get_queryset(self):
+        """Defer the inline text column for actions that read it in ranges or not at all"""
+        queryset = super().get_queryset()
+        if self.action in ['list', 'extracted_text', 'text', 'preview']:
+            queryset = queryset.defer('extracted_text')
+        return queryset
+
+    def get_serializer_class(self):
+        """Lists leave out the text, which would be read (and decompressed) for every document"""
+        if self.action == 'list':
+            return DocumentListSerializer
+        return super().get_serializer_class()
+
+    def _get_text_range(self, request):
+        """Parse the offset/limit query parameters"""
+        try:
+            offset = int(request.query_params.get('offset', 0))
+            limit = request.query_params.get('limit')
+            limit = int(limit) if limit not in (None, '') else None
+        except ValueError:
+            raise ValueError('offset and limit must be integers')
+        if offset < 0 or (limit is not None and limit < 0):
+            raise ValueError('offset and limit must not be negative')
+        return offset, limit
+
 # This function is a placeholder to avoid circular imports
 def public_upload_document(request):
     pass
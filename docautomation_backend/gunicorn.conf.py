@@ -0,0 +1,32 @@
+"""
+Gunicorn configuration for production
+
+Models with the 'preload' policy in MODEL_REGISTRY are loaded once in the
+master process and inherited copy-on-write by every worker. Each worker then
+runs its own warmup inference, so no inference thread pools exist at fork
+time. Set PRELOAD_MODELS=false to load models inside each worker instead.
+"""
+import os
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:8000')
+workers = int(os.environ.get('GUNICORN_WORKERS', 4))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 120))
+
+preload_app = os.environ.get('PRELOAD_MODELS', 'true').lower() in ('1', 'true', 'yes')
+
+
+def when_ready(server):
+    """Runs in the master after the application is imported, before workers fork"""
+    if not preload_app:
+        return
+    from nlp.model_registry import registry
+    loaded = registry.preload(warmup=False)
+    registry.prepare_for_fork()
+    server.log.info(f"Preloaded models before fork: {', '.join(loaded) or 'none'}")
+
+
+def post_worker_init(worker):
+    """Runs in each worker once it has started"""
+    from django.conf import settings
+    from nlp.model_registry import registry
+    registry.preload(warmup=getattr(settings, 'MODEL_WARMUP', True))
@@ -0,0 +1,216 @@
+import logging
+
+from django.conf import settings
+from django.db import transaction
+
+from document_processing.chunking import content_hash
+from document_processing.models import DocumentChunk
+
+from .model_registry import ModelUnavailable, registry
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+TASKS = ('ner', 'sentiment')
+DEFAULT_BATCH_SIZE = 16
+LOOKUP_BATCH_SIZE = 500
+
+
+def get_model_id(task):
+    """Identifier of the model serving a task, stored with its cached results"""
+    config = registry.get_config(task)
+    model_id = config['model']
+    if config.get('backend') == 'onnx':
+        model_id += f"#onnx{'-int8' if config.get('quantize') else ''}"
+    return model_id
+
+
+def _clean_result(task, text, output):
+    """JSON-serializable copy of one pipeline output"""
+    if task == 'sentiment':
+        return {'label': output['label'], 'score': round(float(output['score']), 4)}
+    return [
+        {
+            'label': entity['entity_group'],
+            'text': text[int(entity['start']):int(entity['end'])],
+            'start': int(entity['start']),
+            'end': int(entity['end']),
+            'score': round(float(entity['score']), 4),
+        }
+        for entity in output
+    ]
+
+
+def analyze_texts(task, texts, batch_size=None):
+    """
+    Run NER or sentiment over passages, serving repeated passages from the cache
+
+    Results are cached in the Analysis table under (task, model id, SHA-256
+    of the exact text), the same hash DocumentChunk stores, so re-analyzing
+    an unchanged document never runs the model again.
+
+    Args:
+        texts (list): Passages to analyze
+        batch_size (int): Passages per model call, defaults to NLP_ANALYSIS_BATCH_SIZE
+
+    Returns:
+        list: One result per text. Sentiment results are {'label', 'score'};
+        NER results are lists of {'label', 'text', 'start', 'end', 'score'}.
+
+    Raises:
+        ModelUnavailable: If the task's model cannot be loaded
+    """
+    from .models import Analysis
+
+    if task not in TASKS:
+        raise ValueError(f"Unknown analysis task: {task}")
+    if not texts:
+        return []
+
+    model_id = get_model_id(task)
+    hashes = [content_hash(text) for text in texts]
+    unique_hashes = list(dict.fromkeys(hashes))
+
+    found = {}
+    for start in range(0, len(unique_hashes), LOOKUP_BATCH_SIZE):
+        rows = Analysis.objects.filter(
+            task=task, model_id=model_id, text_hash__in=unique_hashes[start:start + LOOKUP_BATCH_SIZE]
+        ).values_list('text_hash', 'result')
+        found.update(rows)
+
+    missing = [key for key in unique_hashes if key not in found]
+    if missing:
+        model = registry.get(task)
+        batch_size = batch_size or getattr(settings, 'NLP_ANALYSIS_BATCH_SIZE', DEFAULT_BATCH_SIZE)
+        # Only the text-classification pipeline accepts tokenizer arguments
+        options = {'truncation': True} if task == 'sentiment' else {}
+        first_text = {}
+        for key, text in zip(hashes, texts):
+            first_text.setdefault(key, text)
+
+        entries = []
+        for start in range(0, len(missing), batch_size):
+            keys = missing[start:start + batch_size]
+            batch = [first_text[key] for key in keys]
+            outputs = model(batch, batch_size=batch_size, **options)
+            for key, text, output in zip(keys, batch, outputs):
+                found[key] = _clean_result(task, text, output)
+                entries.append(Analysis(task=task, model_id=model_id, text_hash=key, result=found[key]))
+        Analysis.objects.bulk_create(entries, batch_size=LOOKUP_BATCH_SIZE, ignore_conflicts=True)
+        logger.info(f"Ran {task} on {len(missing)} passages ({len(unique_hashes) - len(missing)} cached)")
+
+    return [found[key] for key in hashes]
+
+
+def summarize_sentiment(texts, results):
+    """
+    Combine passage sentiment into a document-level result, weighted by passage length
+
+    Returns:
+        dict: label, score, per-label distribution and passage count, or
+        None when there are no passages
+    """
+    weights = {}
+    scores = {}
+    for text, result in zip(texts, results):
+        weight = max(len(text), 1)
+        weights[result['label']] = weights.get(result['label'], 0) + weight
+        scores[result['label']] = scores.get(result['label'], 0.0) + weight * result['score']
+    if not weights:
+        return None
+    total = sum(weights.values())
+    label = max(weights, key=weights.get)
+    return {
+        'label': label,
+        'score': round(scores[label] / weights[label], 4),
+        'distribution': {name: round(weight / total, 4) for name, weight in weights.items()},
+        'passages': len(results),
+    }
+
+
+def _document_chunks(document):
+    return list(
+        DocumentChunk.objects.filter(document=document).order_by('index').values_list('id', 'start_char', 'text')
+    )
+
+
+def store_entities(document):
+    """
+    Extract a document's entities from its chunks and replace its Entity rows
+
+    Entities found twice in the overlap between neighbouring chunks are
+    stored once, with offsets into the document's extracted text.
+
+    Returns:
+        int: Number of entities stored
+    """
+    from .models import Entity
+
+    chunks = _document_chunks(document)
+    results = analyze_texts('ner', [text for _, _, text in chunks])
+    model_id = get_model_id('ner')
+
+    entities = {}
+    for (chunk_id, chunk_start, _), found in zip(chunks, results):
+        for entity in found:
+            key = (chunk_start + entity['start'], chunk_start + entity['end'], entity['label'])
+            if key in entities and entities[key].score >= entity['score']:
+                continue
+            entities[key] = Entity(
+                document=document,
+                chunk_id=chunk_id,
+                model_id=model_id,
+                label=entity['label'],
+                text=entity['text'][:255],
+                start_char=key[0],
+                end_char=key[1],
+                score=entity['score'],
+            )
+
+    with transaction.atomic():
+        Entity.objects.filter(document=document).delete()
+        Entity.objects.bulk_create(
+            [entities[key] for key in sorted(entities)], batch_size=LOOKUP_BATCH_SIZE
+        )
+    return len(entities)
+
+
+def document_entities(document, refresh=False):
+    """Stored entities of a document, extracting them first if there are none for the current model"""
+    from .models import Entity
+
+    entities = Entity.objects.filter(document=document, model_id=get_model_id('ner'))
+    if refresh or not entities.exists():
+        store_entities(document)
+    return list(entities.values('label', 'text', 'start_char', 'end_char', 'score'))
+
+
+def document_sentiment(document):
+    """Length-weighted sentiment of a document's chunks"""
+    chunks = _document_chunks(document)
+    texts = [text for _, _, text in chunks]
+    return summarize_sentiment(texts, analyze_texts('sentiment', texts))
+
+
+def analyze_processed_document(document):
+    """
+    Post-extraction stage: extract entities and cache passage sentiment
+
+    Runs after chunking, so stale entities of a reprocessed document are
+    always dropped, even when the models are unavailable or the stage is
+    turned off with NLP_ANALYZE_ON_PROCESS.
+    """
+    from .models import Entity
+
+    Entity.objects.filter(document=document).delete()
+    if not getattr(settings, 'NLP_ANALYZE_ON_PROCESS', True):
+        return
+    for task in TASKS:
+        try:
+            if task == 'ner':
+                count = store_entities(document)
+                logger.info(f"Stored {count} entities for document {document.id}")
+            else:
+                document_sentiment(document)
+        except ModelUnavailable as e:
+            logger.info(f"Skipping {task} for document {document.id}: {str(e)}")
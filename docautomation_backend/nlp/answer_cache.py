@@ -0,0 +1,184 @@
+import hashlib
+import logging
+import threading
+
+import numpy as np
+from django.conf import settings
+from django.db.models import F, Q
+from django.utils import timezone
+
+from . import embeddings
+from .embedding_cache import normalize_text
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+ALL_DOCUMENTS = 'all'
+DEFAULT_SIMILARITY = 0.95
+DEFAULT_MAX_ENTRIES = 10000
+# Most recently used entries of a scope compared for a semantic match
+SCAN_LIMIT = 1000
+EVICTION_TARGET = 0.9
+
+
+def normalize_query(query_text):
+    """Case-, whitespace- and trailing-punctuation-insensitive form of a query"""
+    return normalize_text(query_text).casefold().rstrip(' ?!.')
+
+
+def get_scope(document_ids):
+    """Cache scope of a document selection; an empty selection means every document"""
+    if not document_ids:
+        return ALL_DOCUMENTS
+    key = ','.join(str(doc_id) for doc_id in sorted(set(document_ids)))
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+
+def get_answer_model_id():
+    """Models an answer depends on: the embedding model and the LLM (or the extractive fallback)"""
+    from .llm import get_llm_model_id
+
+    answer_model = get_llm_model_id() or 'extractive'
+    return f"{embeddings.get_model_id()}|{answer_model}"
+
+
+class AnswerCache:
+    """
+    Database-backed cache of analyze_query answers
+
+    Answers are stored per document selection. A query first matches
+    exactly on its normalized text, then on the cosine similarity of its
+    embedding to earlier queries of the same selection (at least
+    ANSWER_CACHE_SIMILARITY). Entries are removed when one of their
+    documents is reprocessed or deleted; entries over all documents are
+    removed whenever any document is.
+    """
+
+    def __init__(self, similarity=None, max_entries=None):
+        self.similarity = similarity or getattr(settings, 'ANSWER_CACHE_SIMILARITY', DEFAULT_SIMILARITY)
+        self.max_entries = max_entries or getattr(settings, 'ANSWER_CACHE_MAX_ENTRIES', DEFAULT_MAX_ENTRIES)
+        self._lock = threading.Lock()
+        self._stored_since_check = 0
+        self.stats = {'exact_hits': 0, 'semantic_hits': 0, 'misses': 0}
+
+    def lookup(self, query_text, document_ids):
+        """
+        Find a cached answer
+
+        Returns:
+            tuple: (answer, query_vector). answer is a dict with content,
+            sources, match ('exact' or 'semantic') and similarity, or None.
+            query_vector is the query embedding if it had to be computed,
+            so the caller can reuse it for retrieval.
+        """
+        from .models import AnswerCacheEntry
+
+        scope = get_scope(document_ids)
+        model_id = get_answer_model_id()
+        query_hash = hashlib.sha256(normalize_query(query_text).encode('utf-8')).hexdigest()
+        entries = AnswerCacheEntry.objects.filter(scope=scope, model_id=model_id)
+
+        entry = entries.filter(query_hash=query_hash).only('id', 'content', 'sources').first()
+        if entry is not None:
+            return self._hit(entry, 'exact', 1.0), None
+
+        query_vector = embeddings.encode([query_text])[0]
+        candidates = list(
+            entries.order_by('-last_used_at').values_list('id', 'query_vector')[:SCAN_LIMIT]
+        )
+        if candidates:
+            vectors = np.stack([
+                np.frombuffer(bytes(vector), dtype=np.float16) for _, vector in candidates
+            ]).astype(np.float32)
+            scores = vectors @ query_vector
+            best = int(np.argmax(scores))
+            if scores[best] >= self.similarity:
+                entry = AnswerCacheEntry.objects.only('id', 'content', 'sources').get(id=candidates[best][0])
+                return self._hit(entry, 'semantic', round(min(float(scores[best]), 1.0), 4)), query_vector
+
+        with self._lock:
+            self.stats['misses'] += 1
+        return None, query_vector
+
+    def _hit(self, entry, match, similarity):
+        from .models import AnswerCacheEntry
+
+        AnswerCacheEntry.objects.filter(id=entry.id).update(last_used_at=timezone.now(), hits=F('hits') + 1)
+        with self._lock:
+            self.stats[f'{match}_hits'] += 1
+        return {
+            'content': entry.content,
+            'sources': entry.sources,
+            'match': match,
+            'similarity': similarity,
+        }
+
+    def store(self, query_text, document_ids, content, sources, query_vector=None):
+        """Cache the answer to a query"""
+        from .models import AnswerCacheEntry
+
+        if query_vector is None:
+            query_vector = embeddings.encode([query_text])[0]
+        entry = AnswerCacheEntry.objects.create(
+            scope=get_scope(document_ids),
+            model_id=get_answer_model_id(),
+            query_text=query_text,
+            query_hash=hashlib.sha256(normalize_query(query_text).encode('utf-8')).hexdigest(),
+            query_vector=np.asarray(query_vector, dtype=np.float16).tobytes(),
+            content=content,
+            sources=sources,
+            last_used_at=timezone.now(),
+        )
+        if document_ids:
+            entry.documents.set(set(document_ids))
+
+        with self._lock:
+            self._stored_since_check += 1
+            check_size = self._stored_since_check >= max(1, self.max_entries // 100)
+            if check_size:
+                self._stored_since_check = 0
+        if check_size:
+            self.evict()
+        return entry
+
+    def evict(self):
+        """Remove least recently used entries once the cache exceeds its cap"""
+        from .models import AnswerCacheEntry
+
+        count = AnswerCacheEntry.objects.count()
+        if count <= self.max_entries:
+            return 0
+        excess = count - int(self.max_entries * EVICTION_TARGET)
+        stale_ids = list(
+            AnswerCacheEntry.objects.order_by('last_used_at', 'id').values_list('id', flat=True)[:excess]
+        )
+        deleted = AnswerCacheEntry.objects.filter(id__in=stale_ids).delete()[1].get(AnswerCacheEntry._meta.label, 0)
+        logger.info(f"Evicted {deleted} cached answers")
+        return deleted
+
+    def invalidate_document(self, document_id):
+        """Drop answers that may depend on a document"""
+        from .models import AnswerCacheEntry
+
+        stale_ids = list(
+            AnswerCacheEntry.objects.filter(
+                Q(documents__id=document_id) | Q(scope=ALL_DOCUMENTS)
+            ).values_list('id', flat=True).distinct()
+        )
+        if not stale_ids:
+            return 0
+        return AnswerCacheEntry.objects.filter(id__in=stale_ids).delete()[1].get(AnswerCacheEntry._meta.label, 0)
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_answer_cache():
+    """Return the process-wide answer cache"""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = AnswerCache()
+    return _cache
@@ -0,0 +1,523 @@
+import json
+import logging
+import math
+import os
+import re
+import shutil
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+import numpy as np
+from django.conf import settings
+from django.utils import timezone
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+try:
+    import fcntl
+    HAVE_FCNTL = True
+except ImportError:
+    HAVE_FCNTL = False
+
+DEFAULT_K1 = 1.2
+DEFAULT_B = 0.75
+DEFAULT_DELTA_LIMIT = 200
+BUILD_BATCH_SIZE = 10000
+
+CURRENT_FILE = 'CURRENT'
+META_FILE = 'meta.json'
+VOCABULARY_FILE = 'vocabulary.json'
+# Documents processed or deleted since the last build, with their log sequence numbers
+CHANGES_FILE = 'changes.json'
+CHANGES_LOCK_FILE = '.changes.lock'
+BUILD_LOCK_FILE = '.build.lock'
+ARRAYS = ('indptr', 'postings_rows', 'postings_tf', 'chunk_ids', 'document_ids', 'lengths')
+
+# Words, plus dotted/dashed identifiers such as clause numbers ("4.2", "12-b")
+_TOKEN_RE = re.compile(r'\w+(?:[.\-/]\w+)*', re.UNICODE)
+
+
+def tokenize(text):
+    return _TOKEN_RE.findall(text.lower())
+
+
+def _top_k(scores, k):
+    """Indices of the k largest scores, best first"""
+    if len(scores) <= k:
+        return np.argsort(-scores, kind='stable')
+    top = np.argpartition(-scores, k - 1)[:k]
+    return top[np.argsort(-scores[top], kind='stable')]
+
+
+class BM25Segment:
+    """
+    Immutable BM25 postings over a set of passages
+
+    Postings are stored CSR-style: the rows and term frequencies of term t
+    are postings_rows/postings_tf[indptr[t]:indptr[t + 1]], so a query is a
+    few array slices and one vectorized scoring pass per term.
+    """
+
+    def __init__(self, vocabulary, indptr, postings_rows, postings_tf, chunk_ids, document_ids, lengths):
+        self.vocabulary = vocabulary
+        self.indptr = indptr
+        self.postings_rows = postings_rows
+        self.postings_tf = postings_tf
+        self.chunk_ids = chunk_ids
+        self.document_ids = document_ids
+        self.lengths = lengths
+        self.avgdl = float(lengths.mean()) if len(lengths) else 0.0
+
+    def __len__(self):
+        return len(self.chunk_ids)
+
+    @classmethod
+    def build(cls, passages):
+        """
+        Index passages
+
+        Args:
+            passages: Iterable of (chunk_id, document_id, text)
+        """
+        vocabulary = {}
+        chunk_ids, document_ids, lengths = [], [], []
+        term_blocks, row_blocks, tf_blocks = [], [], []
+        terms, rows, tfs = [], [], []
+
+        def flush():
+            if terms:
+                term_blocks.append(np.asarray(terms, dtype=np.int32))
+                row_blocks.append(np.asarray(rows, dtype=np.int32))
+                tf_blocks.append(np.minimum(np.asarray(tfs, dtype=np.int32), 65535).astype(np.uint16))
+                terms.clear()
+                rows.clear()
+                tfs.clear()
+
+        for row, (chunk_id, document_id, text) in enumerate(passages):
+            counts = Counter(tokenize(text))
+            chunk_ids.append(chunk_id)
+            document_ids.append(document_id)
+            lengths.append(sum(counts.values()))
+            for term, tf in counts.items():
+                terms.append(vocabulary.setdefault(term, len(vocabulary)))
+                rows.append(row)
+                tfs.append(tf)
+            if len(terms) >= BUILD_BATCH_SIZE * 100:
+                flush()
+        flush()
+
+        if term_blocks:
+            all_terms = np.concatenate(term_blocks)
+            order = np.argsort(all_terms, kind='stable')
+            postings_rows = np.concatenate(row_blocks)[order]
+            postings_tf = np.concatenate(tf_blocks)[order]
+            counts = np.bincount(all_terms, minlength=len(vocabulary))
+        else:
+            postings_rows = np.zeros(0, dtype=np.int32)
+            postings_tf = np.zeros(0, dtype=np.uint16)
+            counts = np.zeros(len(vocabulary), dtype=np.int64)
+        indptr = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+
+        return cls(
+            vocabulary, indptr, postings_rows, postings_tf,
+            np.asarray(chunk_ids, dtype=np.int64),
+            np.asarray(document_ids, dtype=np.int64),
+            np.asarray(lengths, dtype=np.int32),
+        )
+
+    def document_frequency(self, term):
+        term_id = self.vocabulary.get(term)
+        return 0 if term_id is None else int(self.indptr[term_id + 1] - self.indptr[term_id])
+
+    def score(self, terms, idf, avgdl, k1, b):
+        """
+        BM25 scores of every passage for the query terms
+
+        Args:
+            terms (list): Distinct query terms
+            idf (dict): Inverse document frequency per term, from corpus-wide statistics
+            avgdl (float): Corpus-wide average passage length
+
+        Returns:
+            numpy.ndarray: (len(self),) float32 scores, 0 for non-matching passages
+        """
+        scores = np.zeros(len(self), dtype=np.float32)
+        if not len(self):
+            return scores
+        norms = k1 * (1 - b + b * self.lengths / max(avgdl, 1e-9))
+        for term in terms:
+            term_id = self.vocabulary.get(term)
+            if term_id is None:
+                continue
+            start, end = self.indptr[term_id], self.indptr[term_id + 1]
+            rows = self.postings_rows[start:end]
+            tf = self.postings_tf[start:end].astype(np.float32)
+            # Rows are unique within a term's postings, so fancy-index add is safe
+            scores[rows] += idf[term] * tf * (k1 + 1) / (tf + norms[rows])
+        return scores
+
+    def save(self, path):
+        os.makedirs(path, exist_ok=True)
+        for name in ARRAYS:
+            np.save(os.path.join(path, f'{name}.npy'), getattr(self, name))
+        with open(os.path.join(path, VOCABULARY_FILE), 'w') as f:
+            json.dump(sorted(self.vocabulary, key=self.vocabulary.get), f)
+
+    @classmethod
+    def load(cls, path):
+        arrays = {name: np.load(os.path.join(path, f'{name}.npy'), mmap_mode='r') for name in ARRAYS}
+        with open(os.path.join(path, VOCABULARY_FILE)) as f:
+            vocabulary = {term: i for i, term in enumerate(json.load(f))}
+        return cls(vocabulary, **arrays)
+
+
+def _empty_changes():
+    return {'seq': 0, 'changed': {}, 'deleted': {}}
+
+
+def _passages(document_ids=None):
+    from document_processing.models import DocumentChunk
+
+    chunks = DocumentChunk.objects.order_by('id')
+    if document_ids is not None:
+        chunks = chunks.filter(document_id__in=document_ids)
+    return chunks.values_list('id', 'document_id', 'text').iterator(chunk_size=2000)
+
+
+class BM25Index:
+    """
+    In-process BM25 keyword index over document passages
+
+    The main segment is built from all chunks by `build()` and saved to
+    BM25_INDEX_DIR, where every worker memory-maps it. Processed and deleted
+    documents are recorded in a change log next to it; processed documents
+    are left out of the main segment and served from a small per-process
+    delta segment built from their current chunks, and deleted ones are
+    masked out, so results stay fresh without a rebuild per upload. Once
+    more than BM25_DELTA_LIMIT documents are logged, a rebuild runs in a
+    background thread.
+
+    Until the first build there is no main segment: searches only cover
+    the logged documents and the index reports itself as not built.
+    """
+
+    def __init__(self, path, k1=None, b=None):
+        self.path = path
+        self.k1 = k1 or getattr(settings, 'BM25_K1', DEFAULT_K1)
+        self.b = b if b is not None else getattr(settings, 'BM25_B', DEFAULT_B)
+        self._lock = threading.Lock()
+        self._main = None
+        self._meta = {}
+        self._loaded_segment = None
+        self._changes = _empty_changes()
+        self._changes_signature = None
+        self._delta = None
+        self._delta_key = None
+        self._building = threading.Event()
+        self._warned_not_built = False
+
+    # Loading
+
+    def _current_segment(self):
+        try:
+            with open(os.path.join(self.path, CURRENT_FILE)) as f:
+                return f.read().strip() or None
+        except FileNotFoundError:
+            return None
+
+    def _ensure_loaded(self):
+        segment = self._current_segment()
+        if segment == self._loaded_segment:
+            return
+        with self._lock:
+            if segment == self._loaded_segment:
+                return
+            segment_path = os.path.join(self.path, segment)
+            self._main = BM25Segment.load(segment_path)
+            with open(os.path.join(segment_path, META_FILE)) as f:
+                self._meta = json.load(f)
+            self._loaded_segment = segment
+
+    @property
+    def built(self):
+        """Whether a main segment has been built"""
+        return self._current_segment() is not None
+
+    # Change log
+
+    @contextmanager
+    def _file_lock(self, name, blocking=True):
+        """
+        Hold an exclusive lock shared by every worker process
+
+        Yields:
+            bool: False if blocking is False and the lock is already held
+        """
+        os.makedirs(self.path, exist_ok=True)
+        with open(os.path.join(self.path, name), 'a') as lock_file:
+            if HAVE_FCNTL:
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+                except BlockingIOError:
+                    yield False
+                    return
+            try:
+                yield True
+            finally:
+                if HAVE_FCNTL:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _read_changes(self):
+        """The change log, re-read only when another process replaced it"""
+        changes_path = os.path.join(self.path, CHANGES_FILE)
+        try:
+            stat = os.stat(changes_path)
+        except FileNotFoundError:
+            self._changes, self._changes_signature = _empty_changes(), None
+            return self._changes
+        signature = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        if signature != self._changes_signature:
+            with open(changes_path) as f:
+                data = json.load(f)
+            changes = {
+                'seq': data['seq'],
+                'changed': {int(document_id): seq for document_id, seq in data['changed'].items()},
+                'deleted': {int(document_id): seq for document_id, seq in data['deleted'].items()},
+            }
+            self._changes, self._changes_signature = changes, signature
+        return self._changes
+
+    def _update_changes(self, update):
+        """Apply update(changes) to the change log under the log lock"""
+        with self._file_lock(CHANGES_LOCK_FILE):
+            changes = self._read_changes()
+            changes = {
+                'seq': changes['seq'],
+                'changed': dict(changes['changed']),
+                'deleted': dict(changes['deleted']),
+            }
+            update(changes)
+            tmp_path = os.path.join(self.path, f'{CHANGES_FILE}.tmp')
+            with open(tmp_path, 'w') as f:
+                json.dump(changes, f)
+            os.replace(tmp_path, os.path.join(self.path, CHANGES_FILE))
+            self._changes_signature = None
+            return changes
+
+    def mark_changed(self, document_id):
+        """Log a processed document, so its current chunks replace those in the main segment"""
+        def update(changes):
+            changes['seq'] += 1
+            changes['deleted'].pop(document_id, None)
+            changes['changed'][document_id] = changes['seq']
+        return self._update_changes(update)
+
+    def mark_deleted(self, document_id):
+        """Log a deleted document, so its passages are masked from the main segment"""
+        def update(changes):
+            changes['seq'] += 1
+            changes['changed'].pop(document_id, None)
+            changes['deleted'][document_id] = changes['seq']
+        return self._update_changes(update)
+
+    def pending_documents(self):
+        """Ids of the documents processed since the main segment was built"""
+        return sorted(self._read_changes()['changed'])
+
+    def deleted_documents(self):
+        """Ids of the documents deleted since the main segment was built"""
+        return sorted(self._read_changes()['deleted'])
+
+    def _get_delta(self, changed):
+        key = tuple(sorted(changed.items()))
+        if key != self._delta_key:
+            delta = BM25Segment.build(_passages(sorted(changed)))
+            with self._lock:
+                self._delta, self._delta_key = delta, key
+        return self._delta
+
+    # Building
+
+    def build(self, blocking=True):
+        """
+        Rebuild the main segment from every chunk and publish it to all workers
+
+        Builds are serialized across processes by a file lock. The new
+        segment is written to its own directory and published by atomically
+        replacing the CURRENT file; the previous segment is kept for workers
+        that are still loading it and older ones are removed. Documents
+        logged while the build ran stay in the change log.
+
+        Args:
+            blocking (bool): Wait for a running build instead of returning None
+
+        Returns:
+            dict: The new segment's metadata, or None if another build was
+            running and blocking is False
+        """
+        with self._file_lock(BUILD_LOCK_FILE, blocking=blocking) as acquired:
+            if not acquired:
+                return None
+            started = time.time()
+            # Everything logged up to here is covered by the chunks read below
+            watermark = self._read_changes()['seq']
+            segment = BM25Segment.build(_passages())
+            name = f'segment-{int(started * 1000)}'
+            segment.save(os.path.join(self.path, name))
+            meta = {
+                'built_at': timezone.now().isoformat(),
+                'passages': len(segment),
+                'terms': len(segment.vocabulary),
+                'postings': int(len(segment.postings_rows)),
+                'build_seconds': round(time.time() - started, 2),
+            }
+            with open(os.path.join(self.path, name, META_FILE), 'w') as f:
+                json.dump(meta, f)
+
+            def publish(changes):
+                previous = self._current_segment()
+                tmp_path = os.path.join(self.path, f'{CURRENT_FILE}.tmp')
+                with open(tmp_path, 'w') as f:
+                    f.write(name)
+                os.replace(tmp_path, os.path.join(self.path, CURRENT_FILE))
+                for log in ('changed', 'deleted'):
+                    changes[log] = {
+                        document_id: seq for document_id, seq in changes[log].items() if seq > watermark
+                    }
+                return previous
+
+            # Under the log lock, so no search sees the new segment with the old log
+            previous = []
+            self._update_changes(lambda changes: previous.append(publish(changes)))
+            self._remove_old_segments(keep=(name, previous[0]))
+
+            logger.info(
+                f"Built BM25 index: {meta['passages']} passages, {meta['terms']} terms "
+                f"in {meta['build_seconds']}s"
+            )
+            return meta
+
+    def _remove_old_segments(self, keep):
+        """Remove segments older than the previous one, and those of interrupted builds"""
+        for entry in os.listdir(self.path):
+            if entry.startswith('segment-') and entry not in keep:
+                shutil.rmtree(os.path.join(self.path, entry), ignore_errors=True)
+
+    def _build_in_background(self):
+        from django.db import connection
+
+        try:
+            self.build(blocking=False)
+        except Exception as e:
+            logger.error(f"Error rebuilding BM25 index: {str(e)}")
+        finally:
+            self._building.clear()
+            # Runs in its own thread, which would otherwise keep its connection open
+            connection.close()
+
+    def refresh(self):
+        """
+        Rebuild in a background thread if there is no main segment yet or
+        too many documents are logged as changed
+
+        Returns:
+            bool: Whether a build was started
+        """
+        changes = self._read_changes()
+        limit = getattr(settings, 'BM25_DELTA_LIMIT', DEFAULT_DELTA_LIMIT)
+        if self.built and len(changes['changed']) + len(changes['deleted']) <= limit:
+            return False
+        if self._building.is_set():
+            return False
+        self._building.set()
+        threading.Thread(target=self._build_in_background, name='bm25-build', daemon=True).start()
+        return True
+
+    # Searching
+
+    def search(self, query_text, k=10, document_ids=None):
+        """
+        Rank passages by BM25
+
+        Args:
+            query_text (str): Keyword query
+            k (int): Number of results
+            document_ids (list): Restrict results to these documents
+
+        Returns:
+            list: (score, chunk_id, document_id) tuples, best first; only
+            passages containing at least one query term
+        """
+        terms = list(dict.fromkeys(tokenize(query_text)))
+        if not terms:
+            return []
+        self._ensure_loaded()
+        if self._main is None and not self._warned_not_built:
+            logger.warning("BM25 index has not been built; run `manage.py build_bm25_index`")
+            self._warned_not_built = True
+
+        changes = self._read_changes()
+        # Passages of the main segment superseded by the delta, or deleted
+        masked_ids = np.asarray(list(changes['changed']) + list(changes['deleted']), dtype=np.int64)
+        delta = self._get_delta(changes['changed'])
+        segments = [delta] if self._main is None else [self._main, delta]
+
+        # Corpus-wide statistics, so main and delta scores are comparable
+        main_passages = len(self._main) if self._main is not None else 0
+        total = main_passages + len(delta)
+        if total == 0:
+            return []
+        avgdl = sum(segment.avgdl * len(segment) for segment in segments) / total
+        idf = {}
+        for term in terms:
+            df = sum(segment.document_frequency(term) for segment in segments)
+            idf[term] = math.log(1 + (total - df + 0.5) / (df + 0.5))
+
+        if document_ids is not None:
+            document_ids = np.unique(np.asarray(list(document_ids), dtype=np.int64))
+
+        results = []
+        for segment in segments:
+            scores = segment.score(terms, idf, avgdl, self.k1, self.b)
+            mask = scores > 0
+            if segment is self._main and len(masked_ids):
+                mask &= ~np.isin(segment.document_ids, masked_ids)
+            if document_ids is not None:
+                mask &= np.isin(segment.document_ids, document_ids)
+            rows = np.flatnonzero(mask)
+            for i in _top_k(scores[rows], k):
+                row = rows[i]
+                results.append((float(scores[row]), int(segment.chunk_ids[row]), int(segment.document_ids[row])))
+
+        results.sort(key=lambda result: result[0], reverse=True)
+        return results[:k]
+
+    def stats(self):
+        self._ensure_loaded()
+        changes = self._read_changes()
+        return dict(
+            self._meta,
+            built=self._main is not None,
+            pending_documents=len(changes['changed']),
+            deleted_documents=len(changes['deleted']),
+        )
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_bm25_index():
+    """Return the process-wide BM25 index"""
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                path = getattr(settings, 'BM25_INDEX_DIR', None) or os.path.join(
+                    getattr(settings, 'VECTOR_INDEX_DIR', os.path.join(settings.BASE_DIR, 'vector_index')), 'bm25'
+                )
+                _index = BM25Index(path)
+    return _index
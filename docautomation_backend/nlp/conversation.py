@@ -0,0 +1,261 @@
+import logging
+import threading
+
+from django.conf import settings
+from django.utils import timezone
+
+from .llm import CHARS_PER_TOKEN, estimate_tokens, summarize_conversation
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+DEFAULT_CONTEXT_TURNS = 6
+DEFAULT_CONTEXT_TOKENS = 400
+DEFAULT_SUMMARY_TOKENS = 150
+DEFAULT_SUMMARY_BATCH = 4
+# Length of each turn's excerpt in the summary used when no LLM is available
+EXCERPT_CHARS = 200
+# Turns with less room than this are left out rather than cut to a stub
+MIN_TURN_CHARS = 40
+TRIM_MARKER = ' [...] '
+
+ROLE_ALIASES = {'assistant': 'system'}
+PROMPT_LABELS = {'user': 'User', 'system': 'Assistant'}
+SUMMARY_HEADING = 'Summary of earlier turns: '
+
+
+def normalize_role(role):
+    """Map a client-supplied role to a Message role, or None if unknown"""
+    role = ROLE_ALIASES.get(str(role).lower(), str(role).lower())
+    return role if role in PROMPT_LABELS else None
+
+
+def serialize_message(message, document_id=None):
+    """A message in the shape the frontend's ChatMessage expects"""
+    return {
+        'id': str(message.id),
+        'conversation_id': message.conversation_id,
+        'document_id': document_id,
+        'content': message.content,
+        'sender': message.role,
+        'timestamp': message.created_at.isoformat(),
+        'sources': message.sources,
+    }
+
+
+def serialize_conversation(conversation):
+    return {
+        'id': conversation.id,
+        'document_id': conversation.document_id,
+        'document_ids': conversation.document_ids,
+        'title': conversation.title,
+        'summary': conversation.summary,
+        'created_at': conversation.created_at.isoformat(),
+        'updated_at': conversation.updated_at.isoformat(),
+    }
+
+
+def get_conversation(conversation_id=None, document_ids=None, title=''):
+    """
+    Conversation a query belongs to
+
+    An explicit id must exist. Without one, queries about documents continue
+    the most recent conversation of the first document, and a new
+    conversation is started if there is none.
+
+    Raises:
+        Conversation.DoesNotExist: If conversation_id is unknown
+    """
+    from .models import Conversation
+
+    if conversation_id:
+        return Conversation.objects.get(id=conversation_id)
+    document_id = document_ids[0] if document_ids else None
+    if document_id is not None:
+        conversation = Conversation.objects.filter(document_id=document_id).order_by('-updated_at').first()
+        if conversation is not None:
+            return conversation
+    return Conversation.objects.create(
+        document_id=document_id, document_ids=list(document_ids or []), title=title[:255]
+    )
+
+
+def add_message(conversation, role, content, sources=None):
+    """Append a message and mark the conversation as updated"""
+    from .models import Conversation, Message
+
+    message = Message.objects.create(conversation=conversation, role=role, content=content, sources=sources or [])
+    Conversation.objects.filter(id=conversation.id).update(updated_at=timezone.now())
+    return message
+
+
+def history_page(conversation, before=None, after=None, limit=None):
+    """
+    One page of a conversation's messages, by keyset on the message id
+
+    Pages are fetched with an indexed range scan on (conversation, id), so
+    the cost of a page does not grow with the length of the conversation
+    the way OFFSET pagination does.
+
+    Args:
+        before (int): Return the messages just before this message id
+            (the latest messages if neither cursor is given)
+        after (int): Return the messages just after this message id
+        limit (int): Page size, defaults to CONVERSATION_PAGE_SIZE
+
+    Returns:
+        tuple: (messages oldest first, has_more)
+    """
+    limit = min(limit or getattr(settings, 'CONVERSATION_PAGE_SIZE', DEFAULT_PAGE_SIZE), MAX_PAGE_SIZE)
+    messages = conversation.messages.all()
+    if after is not None:
+        page = list(messages.filter(id__gt=after).order_by('id')[:limit + 1])
+        return page[:limit], len(page) > limit
+    if before is not None:
+        messages = messages.filter(id__lt=before)
+    page = list(messages.order_by('-id')[:limit + 1])
+    return page[:limit][::-1], len(page) > limit
+
+
+def trim_middle(text, limit):
+    """Shorten text to limit characters, keeping its opening and its end"""
+    if len(text) <= limit:
+        return text
+    if limit <= len(TRIM_MARKER) * 2:
+        return text[:limit]
+    head = (limit - len(TRIM_MARKER)) // 2
+    tail = limit - len(TRIM_MARKER) - head
+    return text[:head] + TRIM_MARKER + text[-tail:]
+
+
+def _format_turns(turns):
+    return "\n".join(f"{PROMPT_LABELS[role]}: {content}" for role, content in turns)
+
+
+def build_context(conversation, max_turns=None, token_budget=None):
+    """
+    Earlier turns of a conversation to put in front of the next question
+
+    Only the last `max_turns` messages are read, newest first, and kept
+    while they fit the token budget; older turns are represented by the
+    rolling summary. Prompt size therefore stays bounded however long the
+    conversation gets.
+
+    An answer leaves room for the question before it (up to half of what
+    is left), so a long answer cannot push out the question it answers.
+    Long answers are shortened in the middle, keeping their opening and
+    conclusion; long questions keep their beginning.
+
+    Args:
+        max_turns (int): Messages in the window, defaults to CONVERSATION_CONTEXT_TURNS
+        token_budget (int): Estimated tokens for summary and turns together,
+            defaults to CONVERSATION_CONTEXT_TOKENS
+
+    Returns:
+        dict: summary, turns ((role, content) tuples, oldest first), text
+        (the formatted history, empty for a new conversation) and tokens
+    """
+    max_turns = max_turns or getattr(settings, 'CONVERSATION_CONTEXT_TURNS', DEFAULT_CONTEXT_TURNS)
+    token_budget = token_budget or getattr(settings, 'CONVERSATION_CONTEXT_TOKENS', DEFAULT_CONTEXT_TOKENS)
+    summary_tokens = getattr(settings, 'CONVERSATION_SUMMARY_TOKENS', DEFAULT_SUMMARY_TOKENS)
+
+    remaining = token_budget * CHARS_PER_TOKEN
+    summary = conversation.summary
+    sections = []
+    if summary:
+        # Keep the end of an oversized summary, where the latest turns are
+        summary = summary[-min(summary_tokens, token_budget) * CHARS_PER_TOKEN:]
+        sections.append(f"{SUMMARY_HEADING}{summary}")
+        remaining -= len(sections[0])
+
+    turns = []
+    recent = list(conversation.messages.order_by('-id').values_list('role', 'content')[:max_turns])
+    for i, (role, content) in enumerate(recent):
+        # Label and line break of the formatted turn count against the budget too
+        available = remaining - len(PROMPT_LABELS[role]) - 3
+        reserved = 0
+        if role == 'system' and i + 1 < len(recent) and recent[i + 1][0] == 'user':
+            question = recent[i + 1][1]
+            reserved = min(len(question) + len(PROMPT_LABELS['user']) + 3, remaining // 2)
+        if available - reserved < min(MIN_TURN_CHARS, len(content)):
+            break
+        if role == 'system':
+            content = trim_middle(content, available - reserved)
+        else:
+            content = content[:available]
+        turns.append((role, content))
+        remaining = available - len(content)
+    turns.reverse()
+
+    if turns:
+        sections.append(_format_turns(turns))
+    text = "\n".join(sections)
+    return {'summary': summary, 'turns': turns, 'text': text, 'tokens': estimate_tokens(text)}
+
+
+def _extractive_summary(summary, turns, max_chars):
+    """Running summary made of the opening of each turn, used when no LLM is available"""
+    lines = [summary] if summary else []
+    for role, content in turns:
+        excerpt = ' '.join(content.split())
+        if len(excerpt) > EXCERPT_CHARS:
+            excerpt = excerpt[:EXCERPT_CHARS].rsplit(' ', 1)[0] + '...'
+        lines.append(f"{PROMPT_LABELS[role]}: {excerpt}")
+    summary = "\n".join(lines)
+    if len(summary) > max_chars:
+        # Drop the oldest lines, starting at a line boundary
+        summary = summary[-max_chars:].split("\n", 1)[-1]
+    return summary
+
+
+def update_summary(conversation_id, max_turns=None):
+    """
+    Fold messages that have left the context window into the rolling summary
+
+    Runs once at least CONVERSATION_SUMMARY_BATCH messages are waiting, so
+    the summarization cost is paid every few turns rather than on every
+    one. Concurrent updates of the same conversation are resolved by the
+    summarized_through check: only the first one is saved.
+
+    Returns:
+        bool: True if the summary was updated
+    """
+    from .models import Conversation
+
+    max_turns = max_turns or getattr(settings, 'CONVERSATION_CONTEXT_TURNS', DEFAULT_CONTEXT_TURNS)
+    summary_tokens = getattr(settings, 'CONVERSATION_SUMMARY_TOKENS', DEFAULT_SUMMARY_TOKENS)
+    batch = getattr(settings, 'CONVERSATION_SUMMARY_BATCH', DEFAULT_SUMMARY_BATCH)
+
+    conversation = Conversation.objects.only('id', 'summary', 'summarized_through').get(id=conversation_id)
+    window = list(conversation.messages.order_by('-id').values_list('id', flat=True)[:max_turns])
+    if len(window) < max_turns:
+        return False
+    pending = list(
+        conversation.messages.filter(id__gt=conversation.summarized_through, id__lt=window[-1])
+        .order_by('id').values_list('id', 'role', 'content')
+    )
+    if len(pending) < batch:
+        return False
+
+    turns = [(role, content) for _, role, content in pending]
+    summary = None
+    try:
+        summary = summarize_conversation(conversation.summary, _format_turns(turns), summary_tokens)
+    except Exception as e:
+        logger.error(f"Error summarizing conversation {conversation_id}: {str(e)}")
+    if not summary:
+        summary = _extractive_summary(conversation.summary, turns, summary_tokens * CHARS_PER_TOKEN)
+
+    updated = Conversation.objects.filter(
+        id=conversation_id, summarized_through=conversation.summarized_through
+    ).update(summary=summary, summarized_through=pending[-1][0])
+    if updated:
+        logger.info(f"Summarized {len(pending)} messages of conversation {conversation_id}")
+    return bool(updated)
+
+
+def schedule_summary_update(conversation_id):
+    """Update the rolling summary in the background, off the request path"""
+    threading.Thread(target=update_summary, args=(conversation_id,), daemon=True).start()
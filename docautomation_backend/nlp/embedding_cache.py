@@ -0,0 +1,228 @@
+import hashlib
+import logging
+import re
+import threading
+import unicodedata
+
+import numpy as np
+from django.conf import settings
+from django.utils import timezone
+
+from . import embeddings
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_ENTRIES = 1000000
+LOOKUP_BATCH_SIZE = 500
+# Evict down to this fraction of the cap, so eviction runs rarely
+EVICTION_TARGET = 0.9
+
+_WHITESPACE_RE = re.compile(r'\s+')
+
+
+def normalize_text(text):
+    """Normalize a passage so trivially different copies share a cache entry"""
+    return _WHITESPACE_RE.sub(' ', unicodedata.normalize('NFKC', text)).strip()
+
+
+def text_hash(text):
+    """Cache key for a passage"""
+    return hashlib.sha256(normalize_text(text).encode('utf-8')).hexdigest()
+
+
+class EmbeddingCache:
+    """
+    Database-backed embedding cache
+
+    Vectors are stored as float16 bytes under (model_id, text hash). Hits
+    refresh `last_used_at`, and once the table grows past
+    EMBEDDING_CACHE_MAX_ENTRIES the least recently used entries are evicted.
+    Entries of a replaced model are never hit again, so they age out first;
+    invalidate() removes them immediately. Hits and misses are counted per
+    process and also added to a per-model EmbeddingCacheCounter row, so
+    the hit rate over all workers survives restarts.
+    """
+
+    def __init__(self, encode_fn=None, model_id=None, max_entries=None):
+        self.encode_fn = encode_fn
+        self._model_id = model_id
+        self.max_entries = max_entries or getattr(settings, 'EMBEDDING_CACHE_MAX_ENTRIES', DEFAULT_MAX_ENTRIES)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self._inserted_since_check = 0
+
+    @property
+    def model_id(self):
+        return self._model_id or embeddings.get_model_id()
+
+    @property
+    def hit_rate(self):
+        """Fraction of passages served from the cache by this process"""
+        lookups = self.hits + self.misses
+        return round(self.hits / lookups, 4) if lookups else None
+
+    def _encode(self, texts):
+        if self.encode_fn is not None:
+            return self.encode_fn(texts)
+        from .embedding_service import get_embedding_service
+        return get_embedding_service().encode(texts)
+
+    def encode(self, texts):
+        """
+        Embed passages, serving repeated ones from the cache
+
+        Args:
+            texts (list): Strings to embed
+
+        Returns:
+            numpy.ndarray: (len(texts), dim) float32 unit vectors
+        """
+        from .models import EmbeddingCacheEntry
+
+        if not texts:
+            return np.zeros((0, embeddings.get_dimension()), dtype=np.float32)
+
+        model_id = self.model_id
+        hashes = [text_hash(text) for text in texts]
+        unique_hashes = list(dict.fromkeys(hashes))
+
+        found = {}
+        hit_ids = []
+        for start in range(0, len(unique_hashes), LOOKUP_BATCH_SIZE):
+            rows = EmbeddingCacheEntry.objects.filter(
+                model_id=model_id, text_hash__in=unique_hashes[start:start + LOOKUP_BATCH_SIZE]
+            ).values_list('id', 'text_hash', 'vector')
+            for entry_id, key, vector in rows:
+                found[key] = np.frombuffer(bytes(vector), dtype=np.float16).astype(np.float32)
+                hit_ids.append(entry_id)
+
+        now = timezone.now()
+        if hit_ids:
+            for start in range(0, len(hit_ids), LOOKUP_BATCH_SIZE):
+                EmbeddingCacheEntry.objects.filter(
+                    id__in=hit_ids[start:start + LOOKUP_BATCH_SIZE]
+                ).update(last_used_at=now)
+
+        missing = [key for key in unique_hashes if key not in found]
+        if missing:
+            first_text = {}
+            for key, text in zip(hashes, texts):
+                first_text.setdefault(key, text)
+            vectors = self._encode([first_text[key] for key in missing])
+            entries = []
+            for key, vector in zip(missing, vectors):
+                vector = np.asarray(vector, dtype=np.float32)
+                found[key] = vector
+                entries.append(EmbeddingCacheEntry(
+                    model_id=model_id,
+                    text_hash=key,
+                    dimension=len(vector),
+                    vector=vector.astype(np.float16).tobytes(),
+                    last_used_at=now,
+                ))
+            EmbeddingCacheEntry.objects.bulk_create(entries, batch_size=LOOKUP_BATCH_SIZE, ignore_conflicts=True)
+
+        with self._lock:
+            # Duplicates within one call count as hits: they were not re-encoded
+            self.hits += len(texts) - len(missing)
+            self.misses += len(missing)
+            # Counting rows is not free, so the cap is only checked every 1% of it
+            self._inserted_since_check += len(missing)
+            check_size = self._inserted_since_check >= max(1, self.max_entries // 100)
+            if check_size:
+                self._inserted_since_check = 0
+
+        self._count(model_id, len(texts) - len(missing), len(missing))
+        if check_size:
+            self.evict()
+        return np.stack([found[key] for key in hashes])
+
+    @staticmethod
+    def _count(model_id, hits, misses):
+        """Add lookups to the model's persistent counters"""
+        from django.db.models import F
+        from .models import EmbeddingCacheCounter
+
+        updated = EmbeddingCacheCounter.objects.filter(model_id=model_id).update(
+            hits=F('hits') + hits, misses=F('misses') + misses, updated_at=timezone.now()
+        )
+        if not updated:
+            counter, created = EmbeddingCacheCounter.objects.get_or_create(
+                model_id=model_id, defaults={'hits': hits, 'misses': misses}
+            )
+            if not created:
+                # Another process created it in between
+                EmbeddingCacheCounter.objects.filter(id=counter.id).update(
+                    hits=F('hits') + hits, misses=F('misses') + misses
+                )
+
+    def evict(self):
+        """Remove least recently used entries once the cache exceeds its cap"""
+        from .models import EmbeddingCacheEntry
+
+        count = EmbeddingCacheEntry.objects.count()
+        if count <= self.max_entries:
+            return 0
+        excess = count - int(self.max_entries * EVICTION_TARGET)
+        stale_ids = list(
+            EmbeddingCacheEntry.objects.order_by('last_used_at', 'id').values_list('id', flat=True)[:excess]
+        )
+        deleted = 0
+        for start in range(0, len(stale_ids), LOOKUP_BATCH_SIZE):
+            deleted += EmbeddingCacheEntry.objects.filter(
+                id__in=stale_ids[start:start + LOOKUP_BATCH_SIZE]
+            ).delete()[0]
+        logger.info(f"Evicted {deleted} embedding cache entries")
+        return deleted
+
+    def invalidate(self, model_id=None):
+        """Drop all entries of one model (the current one by default), and its counters"""
+        from .models import EmbeddingCacheCounter, EmbeddingCacheEntry
+
+        model_id = model_id or self.model_id
+        EmbeddingCacheCounter.objects.filter(model_id=model_id).delete()
+        return EmbeddingCacheEntry.objects.filter(model_id=model_id).delete()[0]
+
+    def stats(self):
+        """
+        Hit-rate counters for this process, and entry counts and persistent
+        counters per model
+        """
+        from django.db.models import Count
+        from .models import EmbeddingCacheCounter, EmbeddingCacheEntry
+
+        totals = {}
+        for model_id, hits, misses in EmbeddingCacheCounter.objects.values_list('model_id', 'hits', 'misses'):
+            lookups = hits + misses
+            totals[model_id] = {
+                'hits': hits,
+                'misses': misses,
+                'hit_rate': round(hits / lookups, 4) if lookups else None,
+            }
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hit_rate,
+            'max_entries': self.max_entries,
+            'entries': {
+                row['model_id']: row['count']
+                for row in EmbeddingCacheEntry.objects.values('model_id').annotate(count=Count('id'))
+            },
+            'totals': totals,
+        }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_embedding_cache():
+    """Return the process-wide embedding cache"""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = EmbeddingCache()
+    return _cache
@@ -0,0 +1,185 @@
+import logging
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+import numpy as np
+from django.conf import settings
+
+from . import embeddings
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Try to import optional dependencies
+try:
+    import torch
+    HAVE_TORCH = True
+except ImportError:
+    HAVE_TORCH = False
+
+DEFAULT_MAX_BATCH_SIZE = 64
+DEFAULT_MAX_WAIT_MS = 20
+
+
+def _length_bucket(text):
+    """Power-of-two length class, so a batch is padded to at most ~2x its shortest text"""
+    return max(len(text), 1).bit_length()
+
+
+class _Request:
+    __slots__ = ('text', 'future', 'bucket', 'enqueued_at')
+
+    def __init__(self, text):
+        self.text = text
+        self.future = Future()
+        self.bucket = _length_bucket(text)
+        self.enqueued_at = time.monotonic()
+
+
+class EmbeddingService:
+    """
+    In-process dynamic batcher for the embedding model
+
+    Callers from any thread submit passages and get one future per passage.
+    A single worker thread waits until `max_batch_size` passages are queued
+    or the oldest has waited `max_wait_ms`, then encodes up to
+    `max_batch_size` passages from the oldest request's length bucket, so
+    many small jobs share model calls and padding waste stays low.
+    """
+
+    def __init__(self, encode_fn=None, max_batch_size=None, max_wait_ms=None, num_threads=None):
+        self.encode_fn = encode_fn or embeddings.encode
+        self.max_batch_size = max_batch_size or getattr(settings, 'EMBEDDING_MAX_BATCH_SIZE', DEFAULT_MAX_BATCH_SIZE)
+        wait_ms = max_wait_ms if max_wait_ms is not None else getattr(settings, 'EMBEDDING_MAX_WAIT_MS', DEFAULT_MAX_WAIT_MS)
+        self.max_wait = wait_ms / 1000.0
+        self.num_threads = num_threads or getattr(settings, 'EMBEDDING_TORCH_THREADS', None)
+
+        self._pending = deque()
+        self._condition = threading.Condition()
+        self._worker = None
+        self._pid = None
+        self._stopping = False
+        self.stats = {'batches': 0, 'passages': 0, 'encode_seconds': 0.0, 'wait_seconds': 0.0}
+
+    def _ensure_worker(self):
+        # Threads do not survive fork, so each worker process starts its own
+        if self._worker is not None and self._worker.is_alive() and self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        self._stopping = False
+        self._pending = deque(request for request in self._pending if not request.future.done())
+        self._worker = threading.Thread(target=self._run, name='embedding-service', daemon=True)
+        self._worker.start()
+
+    def _pin_threads(self):
+        if not HAVE_TORCH:
+            return
+        threads = self.num_threads or os.cpu_count() or 1
+        torch.set_num_threads(threads)
+        try:
+            # Only allowed before any inter-op parallel work has started
+            torch.set_num_interop_threads(1)
+        except RuntimeError:
+            pass
+        logger.info(f"Embedding service using {threads} torch threads")
+
+    def submit(self, texts):
+        """
+        Queue passages for embedding
+
+        Args:
+            texts (list): Strings to embed
+
+        Returns:
+            list: One Future per text, resolving to a (dim,) float32 unit vector
+        """
+        requests = [_Request(text) for text in texts]
+        with self._condition:
+            self._ensure_worker()
+            self._pending.extend(requests)
+            self._condition.notify()
+        return [request.future for request in requests]
+
+    def encode(self, texts, timeout=None):
+        """Embed passages through the batcher and wait for the results"""
+        if not texts:
+            return np.zeros((0, embeddings.get_dimension()), dtype=np.float32)
+        futures = self.submit(texts)
+        return np.stack([future.result(timeout=timeout) for future in futures])
+
+    def shutdown(self):
+        """Stop the worker after draining queued requests"""
+        with self._condition:
+            self._stopping = True
+            self._condition.notify()
+        if self._worker is not None:
+            self._worker.join()
+
+    def _next_batch(self):
+        """Block until a batch is due, then take it off the queue"""
+        with self._condition:
+            while True:
+                if self._pending:
+                    waited = time.monotonic() - self._pending[0].enqueued_at
+                    if len(self._pending) >= self.max_batch_size or waited >= self.max_wait or self._stopping:
+                        break
+                    self._condition.wait(self.max_wait - waited)
+                elif self._stopping:
+                    return None
+                else:
+                    self._condition.wait()
+
+            bucket = self._pending[0].bucket
+            batch = []
+            remaining = deque()
+            for request in self._pending:
+                if request.bucket == bucket and len(batch) < self.max_batch_size:
+                    batch.append(request)
+                else:
+                    remaining.append(request)
+            self._pending = remaining
+            return batch
+
+    def _run(self):
+        self._pin_threads()
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            batch = [request for request in batch if request.future.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+
+            started = time.monotonic()
+            try:
+                vectors = self.encode_fn([request.text for request in batch])
+            except Exception as e:
+                logger.error(f"Error encoding batch of {len(batch)} passages: {str(e)}")
+                for request in batch:
+                    request.future.set_exception(e)
+                continue
+
+            elapsed = time.monotonic() - started
+            self.stats['batches'] += 1
+            self.stats['passages'] += len(batch)
+            self.stats['encode_seconds'] += elapsed
+            self.stats['wait_seconds'] += sum(started - request.enqueued_at for request in batch)
+            for request, vector in zip(batch, vectors):
+                request.future.set_result(vector)
+
+
+_service = None
+_service_lock = threading.Lock()
+
+
+def get_embedding_service():
+    """Return the process-wide embedding service"""
+    global _service
+    if _service is None:
+        with _service_lock:
+            if _service is None:
+                _service = EmbeddingService()
+    return _service
@@ -0,0 +1,119 @@
+import hashlib
+import logging
+import re
+
+import numpy as np
+from django.conf import settings
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Try to import optional dependencies
+try:
+    from sentence_transformers import SentenceTransformer
+    HAVE_SENTENCE_TRANSFORMERS = True
+except ImportError:
+    logger.warning("sentence-transformers not available. Embeddings will fall back to feature hashing.")
+    HAVE_SENTENCE_TRANSFORMERS = False
+
+DEFAULT_EMBEDDING_MODEL = 'sentence-transformers/all-MiniLM-L6-v2'
+HASHING_DIMENSION = 384
+
+_WORD_RE = re.compile(r'\w+', re.UNICODE)
+
+
+class HashingEmbedder:
+    """
+    Feature-hashed bag of words, used when sentence-transformers is missing
+
+    Only captures lexical overlap, but keeps retrieval working (and testable)
+    in installs without the model.
+    """
+
+    model_id = f'hashing-{HASHING_DIMENSION}'
+
+    def __init__(self, dimension=HASHING_DIMENSION):
+        self.dimension = dimension
+
+    def get_sentence_embedding_dimension(self):
+        return self.dimension
+
+    def encode(self, texts, batch_size=32, **kwargs):
+        vectors = np.zeros((len(texts), self.dimension), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for word in _WORD_RE.findall(text.lower()):
+                digest = hashlib.blake2b(word.encode('utf-8'), digest_size=8).digest()
+                bucket = int.from_bytes(digest[:4], 'little') % self.dimension
+                sign = 1.0 if digest[4] & 1 else -1.0
+                vectors[row, bucket] += sign
+        return vectors
+
+
+def get_model_name():
+    """Hugging Face name of the configured embedding model"""
+    return getattr(settings, 'EMBEDDING_MODEL', DEFAULT_EMBEDDING_MODEL)
+
+
+def get_model_id():
+    """
+    Identifier of the embedding model in use, stored alongside vectors and cache entries
+
+    Includes the revision and, for ONNX Runtime, the backend and precision,
+    since those produce slightly different vectors.
+    """
+    from .model_registry import registry
+
+    config = registry.get_config('embedding')
+    if config.get('backend') == 'onnx':
+        model_id = f"{get_model_name()}#onnx{'-int8' if config.get('quantize') else ''}"
+    elif HAVE_SENTENCE_TRANSFORMERS:
+        model_id = get_model_name()
+    else:
+        return HashingEmbedder.model_id
+    revision = getattr(settings, 'EMBEDDING_MODEL_REVISION', None)
+    return f"{model_id}@{revision}" if revision else model_id
+
+
+def load_embedding_model():
+    """Load the configured embedding model; used by the model registry"""
+    if not HAVE_SENTENCE_TRANSFORMERS:
+        return HashingEmbedder()
+    name = get_model_name()
+    revision = getattr(settings, 'EMBEDDING_MODEL_REVISION', None)
+    return SentenceTransformer(name, device='cpu', revision=revision)
+
+
+def get_embedding_model():
+    """Return the process-wide embedding model from the model registry"""
+    from .model_registry import registry
+    return registry.get('embedding')
+
+
+def get_dimension():
+    """Dimension of the vectors produced by encode()"""
+    return get_embedding_model().get_sentence_embedding_dimension()
+
+
+def normalize(vectors):
+    """L2-normalize rows so that dot products are cosine similarities"""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def encode(texts, batch_size=32):
+    """
+    Embed a list of texts
+
+    Args:
+        texts (list): Strings to embed
+        batch_size (int): Batch size passed to the model
+
+    Returns:
+        numpy.ndarray: (len(texts), dimension) float32 array of unit vectors
+    """
+    if not texts:
+        return np.zeros((0, get_dimension()), dtype=np.float32)
+    vectors = get_embedding_model().encode(list(texts), batch_size=batch_size, show_progress_bar=False)
+    return normalize(vectors)
@@ -0,0 +1,263 @@
+import json
+import logging
+import math
+import re
+
+from django.conf import settings
+
+from .model_registry import ModelUnavailable, registry
+from .scheduler import BATCH, INTERACTIVE, get_llm_scheduler
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+DEFAULT_CONTEXT_CHARS = 6000
+DEFAULT_DOCUMENT_MAX_TOKENS = 1024
+DEFAULT_SECTION_MAX_TOKENS = 384
+DEFAULT_GENERATION_CONTEXT_TOKENS = 1500
+# Rough size of a token in English text, good enough for budgeting
+CHARS_PER_TOKEN = 4
+
+_TOKEN_RE = re.compile(r'\s*\S+|\s+')
+# Numbering or bullet in front of an outline heading
+_OUTLINE_MARKER_RE = re.compile(r'^\s*(?:\d+[.)]|[-*#]+)\s*')
+
+
+def estimate_tokens(text):
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def generation_context_chars():
+    """Reference context budget of document generation, GENERATION_CONTEXT_TOKENS in characters"""
+    return getattr(settings, 'GENERATION_CONTEXT_TOKENS', DEFAULT_GENERATION_CONTEXT_TOKENS) * CHARS_PER_TOKEN
+
+
+def _numbered_context(texts, context_chars=None):
+    """Number passages for citation, cut to the context budget"""
+    context_chars = context_chars or getattr(settings, 'LLM_CONTEXT_CHARS', DEFAULT_CONTEXT_CHARS)
+    sections = []
+    used = 0
+    for i, text in enumerate(texts, 1):
+        text = text[:max(context_chars - used, 0)]
+        if not text:
+            break
+        sections.append(f"[{i}] {text}")
+        used += len(text)
+    return "\n\n".join(sections)
+
+
+def build_prompt(query_text, passages, context_chars=None, history=''):
+    """
+    Prompt asking the LLM to answer from the retrieved passages only
+
+    Args:
+        history (str): Earlier turns of the conversation, from
+            conversation.build_context()
+
+    Returns:
+        tuple: (prefix, question). The prefix holds the instructions and
+        passages and becomes the system prompt; the history goes with the
+        question.
+    """
+    from .retrieval import split_context_budget
+
+    # Every document gets a fair share of the context, not just the top one
+    texts = split_context_budget(passages, context_chars)
+    prefix = (
+        "Answer the question using only the numbered passages below, citing them like [1]. "
+        "If the passages do not contain the answer, say so.\n\n"
+        f"Passages:\n{_numbered_context(texts, context_chars)}"
+    )
+    question = f"Question: {query_text}\nAnswer:"
+    if history:
+        question = f"Conversation so far:\n{history}\n\n{question}"
+    return prefix, question
+
+
+def build_extractive_answer(query_text, passages):
+    """Compose an extractive answer from retrieved passages, used when no LLM is available"""
+    if not passages:
+        return f"I couldn't find any passages relevant to '{query_text}' in the selected documents."
+    lines = [f"The most relevant passages for '{query_text}':"]
+    for i, passage in enumerate(passages, 1):
+        location = f"page {passage['page']}" if passage['page'] else f"passage {passage['index'] + 1}"
+        lines.append(f"\n[{i}] (document {passage['document_id']}, {location})\n{passage['text']}")
+    return "\n".join(lines)
+
+
+def llm_available():
+    """True if answers can come from the local LLM"""
+    if not getattr(settings, 'LLM_ENABLED', True):
+        return False
+    try:
+        registry.get('llm')
+        return True
+    except ModelUnavailable as e:
+        logger.info(f"Local LLM unavailable: {str(e)}")
+        return False
+
+
+def get_llm_model_id():
+    """
+    Configured LLM model name, or None if answers cannot come from an LLM
+
+    Unlike llm_available() this never loads the model, so it is cheap
+    enough for cache keys. A model that is installed but fails to load
+    still reports its name.
+    """
+    from .model_registry import HAVE_GPT4ALL
+
+    if not getattr(settings, 'LLM_ENABLED', True):
+        return None
+    if not (registry.is_loaded('llm') or HAVE_GPT4ALL):
+        return None
+    return registry.get_config('llm')['model']
+
+
+def generate_answer(query_text, passages, max_tokens=None, metrics=None, history=''):
+    """
+    Yield the answer to a query token by token
+
+    Uses the local LLM when it is enabled and installed; otherwise yields the
+    extractive answer in word-sized pieces, so streaming clients behave the
+    same either way.
+
+    Args:
+        query_text (str): The user's question
+        passages (list): Retrieved passage dicts
+        max_tokens (int): Generation limit, defaults to LLM_MAX_TOKENS
+        metrics (dict): Filled with the scheduler's queue wait and tokens/sec
+        history (str): Earlier turns of the conversation, if any
+
+    Yields:
+        str: Pieces of the answer, in order
+    """
+    if not passages or not llm_available():
+        for match in _TOKEN_RE.finditer(build_extractive_answer(query_text, passages)):
+            yield match.group()
+        return
+
+    prefix, question = build_prompt(query_text, passages, history=history)
+    yield from get_llm_scheduler().stream(
+        question, prefix=prefix, max_tokens=max_tokens, priority=INTERACTIVE, metrics=metrics
+    )
+
+
+def generate_document_text(title, prompt, reference_texts, max_tokens=None, metrics=None):
+    """
+    Draft a document with the local LLM, queued behind interactive queries
+
+    Args:
+        title (str): Document title
+        prompt (str): The user's instructions
+        reference_texts (list): Passages of the reference documents, from
+            retrieval.assemble_context()
+
+    Returns:
+        str: The generated body, or None if no LLM is available
+    """
+    if not llm_available():
+        return None
+    prefix = "You write clear, well-structured business documents in Markdown."
+    if reference_texts:
+        prefix += (
+            " Base the document on the numbered reference passages below.\n\n"
+            f"Reference passages:\n{_numbered_context(reference_texts, generation_context_chars())}"
+        )
+    max_tokens = max_tokens or getattr(settings, 'LLM_DOCUMENT_MAX_TOKENS', DEFAULT_DOCUMENT_MAX_TOKENS)
+    return get_llm_scheduler().generate(
+        f"Write the document titled '{title}'. Instructions: {prompt}\nDocument:",
+        prefix=prefix, max_tokens=max_tokens, priority=BATCH, metrics=metrics,
+    )
+
+
+def generate_outline(title, prompt, reference_texts, count, metrics=None):
+    """
+    Plan the sections of a long document with the local LLM
+
+    Args:
+        title (str): Document title
+        prompt (str): The user's instructions
+        reference_texts (list): Passages of the reference documents
+        count (int): Number of sections wanted
+
+    Returns:
+        list: Section headings, in order, or None if no LLM is available
+    """
+    if not llm_available():
+        return None
+    prefix = "You plan clear, well-structured business documents."
+    if reference_texts:
+        prefix += (
+            " Base the plan on the numbered reference passages below.\n\n"
+            f"Reference passages:\n{_numbered_context(reference_texts, generation_context_chars())}"
+        )
+    text = get_llm_scheduler().generate(
+        f"List the {count} section headings of the document titled '{title}', one per line, "
+        f"without numbering or descriptions. Instructions: {prompt}\nSections:",
+        prefix=prefix, max_tokens=16 * count, priority=BATCH, metrics=metrics,
+    )
+    return [_OUTLINE_MARKER_RE.sub('', line).strip() for line in text.splitlines() if line.strip()]
+
+
+def generate_section_text(title, prompt, heading, outline, reference_texts, max_tokens=None, metrics=None):
+    """
+    Draft one section of a document with the local LLM, queued behind interactive queries
+
+    The instructions, title and outline form the system prompt; the
+    section's own passages go with the question.
+
+    Args:
+        title (str): Document title
+        prompt (str): The user's instructions
+        heading (str): The section to write
+        outline (list): Every section heading of the document, in order
+        reference_texts (list): Passages selected for this section
+
+    Returns:
+        str: The section body, or None if no LLM is available
+    """
+    if not llm_available():
+        return None
+    sections = "\n".join(f"{i}. {section}" for i, section in enumerate(outline, 1))
+    prefix = (
+        "You write clear, well-structured business documents in Markdown, one section at a time.\n\n"
+        f"Document: {title}\nInstructions: {prompt}\nOutline:\n{sections}"
+    )
+    question = f"Write the body of the section '{heading}' only, without its heading."
+    if reference_texts:
+        question = (
+            f"Reference passages:\n{_numbered_context(reference_texts, generation_context_chars())}\n\n"
+            f"{question} Base it on the reference passages."
+        )
+    max_tokens = max_tokens or getattr(settings, 'LLM_SECTION_MAX_TOKENS', DEFAULT_SECTION_MAX_TOKENS)
+    return get_llm_scheduler().generate(
+        f"{question}\nSection:", prefix=prefix, max_tokens=max_tokens, priority=BATCH, metrics=metrics,
+    )
+
+
+def summarize_conversation(summary, transcript, max_tokens):
+    """
+    Fold turns that left the context window into a conversation's running summary
+
+    Args:
+        summary (str): The summary so far
+        transcript (str): The new turns, one "Role: content" line each
+        max_tokens (int): Length limit of the new summary
+
+    Returns:
+        str: The updated summary, or None if no LLM is available
+    """
+    if not llm_available():
+        return None
+    prefix = "You keep short running summaries of conversations about documents."
+    prompt = (
+        f"Summary so far:\n{summary or '(none)'}\n\nNew turns:\n{transcript}\n\n"
+        "Rewrite the summary to include the new turns. Keep names, numbers and open questions.\nSummary:"
+    )
+    return get_llm_scheduler().generate(prompt, prefix=prefix, max_tokens=max_tokens, priority=BATCH).strip()
+
+
+def sse_event(event, data):
+    """Format one server-sent event with a JSON payload"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
@@ -0,0 +1,80 @@
+import random
+import threading
+import time
+
+from django.core.management.base import BaseCommand
+
+from document_processing.models import DocumentChunk
+from nlp import embeddings
+from nlp.embedding_service import EmbeddingService
+
+
+class Command(BaseCommand):
+    help = "Compare embedding throughput of the batching service against naive encoding"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--documents', type=int, default=32,
+                            help="Simulated documents finishing processing concurrently")
+        parser.add_argument('--passages', type=int, default=16,
+                            help="Passages per document")
+        parser.add_argument('--batch-size', type=int, default=64)
+        parser.add_argument('--max-wait-ms', type=int, default=20)
+        parser.add_argument('--threads', type=int, default=None,
+                            help="Torch threads for the service (default: all cores)")
+
+    def handle(self, *args, **options):
+        documents = self._load_documents(options['documents'], options['passages'])
+        total = sum(len(passages) for passages in documents)
+        self.stdout.write(f"Model: {embeddings.get_model_id()}, {len(documents)} documents, {total} passages")
+
+        # Warm up so model loading is not measured
+        embeddings.encode(documents[0][:2])
+
+        started = time.perf_counter()
+        for passages in documents:
+            for passage in passages:
+                embeddings.encode([passage])
+        self._report("naive, one passage per call", total, time.perf_counter() - started)
+
+        started = time.perf_counter()
+        for passages in documents:
+            embeddings.encode(passages)
+        self._report("naive, one document per call", total, time.perf_counter() - started)
+
+        service = EmbeddingService(
+            max_batch_size=options['batch_size'],
+            max_wait_ms=options['max_wait_ms'],
+            num_threads=options['threads'],
+        )
+        workers = [threading.Thread(target=service.encode, args=(passages,)) for passages in documents]
+        started = time.perf_counter()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        elapsed = time.perf_counter() - started
+        service.shutdown()
+        self._report("batching service, concurrent documents", total, elapsed)
+
+        stats = service.stats
+        if stats['batches']:
+            self.stdout.write(
+                f"  {stats['batches']} batches, mean size {stats['passages'] / stats['batches']:.1f}, "
+                f"mean queue wait {stats['wait_seconds'] / stats['passages'] * 1000:.1f}ms"
+            )
+
+    def _report(self, label, total, elapsed):
+        self.stdout.write(f"{label}: {total / elapsed:.1f} passages/s ({elapsed:.2f}s)")
+
+    @staticmethod
+    def _load_documents(count, per_document):
+        """Use real chunks when there are enough, synthetic passages otherwise"""
+        texts = list(DocumentChunk.objects.values_list('text', flat=True)[:count * per_document])
+        if len(texts) < count * per_document:
+            rng = random.Random(0)
+            words = "agreement party clause term notice payment invoice liability confidential breach".split()
+            texts = [
+                " ".join(rng.choice(words) for _ in range(rng.randint(20, 250)))
+                for _ in range(count * per_document)
+            ]
+        return [texts[i:i + per_document] for i in range(0, len(texts), per_document)]
@@ -0,0 +1,113 @@
+import time
+
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from document_processing.models import DocumentChunk
+from nlp import embeddings
+from nlp.model_registry import ModelUnavailable, ModelRegistry
+from nlp.onnx_backend import TASKS
+
+SAMPLE_TEXTS = [
+    "Acme Corporation and Globex Inc. signed the agreement in Paris on 3 March.",
+    "The supplier shall deliver the goods within thirty days of the purchase order.",
+    "Either party may terminate this contract with ninety days written notice.",
+    "We are very pleased with the quality of the service provided by Initech.",
+    "The late delivery caused significant losses and the client is unhappy.",
+    "John Smith, acting on behalf of Umbrella Ltd, approved the revised budget.",
+]
+
+
+class Command(BaseCommand):
+    help = "Compare latency, throughput and output drift of the PyTorch and ONNX Runtime backends"
+
+    def add_arguments(self, parser):
+        parser.add_argument('kinds', nargs='*', default=list(TASKS))
+        parser.add_argument('--samples', type=int, default=64,
+                            help="Number of texts to run")
+        parser.add_argument('--batch-size', type=int, default=16,
+                            help="Batch size for the throughput run")
+
+    def handle(self, *args, **options):
+        texts = self._load_texts(options['samples'])
+        for kind in options['kinds']:
+            self.stdout.write(self.style.MIGRATE_HEADING(f"{kind} ({len(texts)} texts)"))
+            variants = [
+                ('pytorch', {'backend': 'pytorch'}),
+                ('onnx fp32', {'backend': 'onnx', 'quantize': False}),
+                ('onnx int8', {'backend': 'onnx', 'quantize': True}),
+            ]
+            reference = None
+            for label, overrides in variants:
+                # Keep the configured model (path, tokenizer, ...) and only switch the backend
+                configured = getattr(settings, 'MODEL_REGISTRY', {}).get(kind, {})
+                registry = ModelRegistry(models={kind: {**configured, **overrides}})
+                try:
+                    model = registry.get(kind)
+                except ModelUnavailable as e:
+                    self.stdout.write(f"  {label}: skipped ({e})")
+                    continue
+
+                run = self._runner(kind, model)
+                run(texts[:2])  # warmup
+
+                latencies = []
+                for text in texts:
+                    started = time.perf_counter()
+                    run([text])
+                    latencies.append((time.perf_counter() - started) * 1000)
+
+                started = time.perf_counter()
+                outputs = []
+                for start in range(0, len(texts), options['batch_size']):
+                    outputs.extend(run(texts[start:start + options['batch_size']]))
+                throughput = len(texts) / (time.perf_counter() - started)
+
+                line = (
+                    f"  {label}: p50 {np.percentile(latencies, 50):.1f}ms, "
+                    f"p95 {np.percentile(latencies, 95):.1f}ms, {throughput:.1f} texts/s"
+                )
+                if reference is None:
+                    reference = outputs
+                else:
+                    line += f", {self._drift(kind, reference, outputs)}"
+                self.stdout.write(line)
+
+    @staticmethod
+    def _runner(kind, model):
+        if kind == 'embedding':
+            return lambda batch: list(embeddings.normalize(model.encode(batch, batch_size=len(batch))))
+        return lambda batch: model(batch)
+
+    @staticmethod
+    def _drift(kind, reference, outputs):
+        """Agreement of a variant's outputs with the PyTorch outputs"""
+        if kind == 'embedding':
+            similarity = [float(np.dot(a, b)) for a, b in zip(reference, outputs)]
+            return f"cosine vs pytorch mean {np.mean(similarity):.4f} min {np.min(similarity):.4f}"
+        if kind == 'sentiment':
+            agree = np.mean([a['label'] == b['label'] for a, b in zip(reference, outputs)])
+            score_delta = np.mean([abs(a['score'] - b['score']) for a, b in zip(reference, outputs)])
+            return f"label agreement {agree:.1%}, mean score delta {score_delta:.4f}"
+
+        def spans(entities):
+            return {(e['entity_group'], e['start'], e['end']) for e in entities}
+
+        matched = expected = found = 0
+        for a, b in zip(reference, outputs):
+            a, b = spans(a), spans(b)
+            matched += len(a & b)
+            expected += len(a)
+            found += len(b)
+        precision = matched / found if found else 1.0
+        recall = matched / expected if expected else 1.0
+        f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+        return f"entity F1 vs pytorch {f1:.3f}"
+
+    @staticmethod
+    def _load_texts(count):
+        texts = list(DocumentChunk.objects.values_list('text', flat=True)[:count])
+        while len(texts) < count:
+            texts.append(SAMPLE_TEXTS[len(texts) % len(SAMPLE_TEXTS)])
+        return texts
@@ -0,0 +1,79 @@
+import json
+import random
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+
+from document_processing.models import DocumentChunk
+from nlp.bm25 import tokenize
+from nlp.retrieval import rank_passages
+
+MODES = ('dense', 'bm25', 'hybrid')
+
+
+class Command(BaseCommand):
+    help = "Compare recall@k and latency of dense, BM25 and hybrid retrieval"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--queries', type=int, default=200,
+                            help="Number of synthetic queries sampled from the indexed passages")
+        parser.add_argument('--queries-file',
+                            help="JSONL file of {\"query\": ..., \"chunk_ids\": [...]} with relevant passages")
+        parser.add_argument('--k', type=int, default=10)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        if options['queries_file']:
+            with open(options['queries_file']) as f:
+                cases = [json.loads(line) for line in f if line.strip()]
+            cases = [(case['query'], set(case['chunk_ids']), 'labelled') for case in cases]
+        else:
+            cases = self._synthetic_cases(options['queries'], options['seed'])
+        if not cases:
+            raise CommandError("No indexed passages to sample queries from")
+
+        k = options['k']
+        kinds = sorted({kind for _, _, kind in cases})
+        self.stdout.write(f"{len(cases)} queries, k={k}")
+        for mode in MODES:
+            recall = {kind: [] for kind in kinds}
+            timings = []
+            for query, relevant, kind in cases:
+                started = time.perf_counter()
+                hits, _ = rank_passages(query, top_k=k, mode=mode)
+                timings.append((time.perf_counter() - started) * 1000)
+                found = {chunk_id for _, chunk_id, _ in hits}
+                recall[kind].append(len(found & relevant) / len(relevant))
+            breakdown = ', '.join(f"{kind} {np.mean(values):.3f}" for kind, values in recall.items())
+            self.stdout.write(
+                f"{mode:>6}: recall@{k} {np.mean([v for values in recall.values() for v in values]):.3f} "
+                f"({breakdown}), p50 {np.percentile(timings, 50):.2f}ms, p95 {np.percentile(timings, 95):.2f}ms"
+            )
+
+    @staticmethod
+    def _synthetic_cases(count, seed):
+        """
+        Queries whose answer is the passage they were sampled from
+
+        'keyword' queries are a verbatim run of words (favouring exact
+        identifiers); 'partial' queries keep half the words of a span in
+        shuffled order, a rough stand-in for paraphrases.
+        """
+        rng = random.Random(seed)
+        chunk_ids = list(DocumentChunk.objects.values_list('id', flat=True))
+        rng.shuffle(chunk_ids)
+        texts = DocumentChunk.objects.in_bulk(chunk_ids[:count])
+        cases = []
+        for i, chunk_id in enumerate(chunk_ids[:count]):
+            words = tokenize(texts[chunk_id].text)
+            if len(words) < 8:
+                continue
+            start = rng.randrange(0, len(words) - 7)
+            span = words[start:start + 8]
+            if i % 2 == 0:
+                cases.append((' '.join(span[:5]), {chunk_id}, 'keyword'))
+            else:
+                kept = rng.sample(span, 4)
+                cases.append((' '.join(kept), {chunk_id}, 'partial'))
+        return cases
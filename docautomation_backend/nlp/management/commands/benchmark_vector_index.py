@@ -0,0 +1,94 @@
+import tempfile
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand
+
+from nlp.embeddings import normalize
+from nlp.retrieval import search_documents
+from nlp.vector_index import VectorIndex
+
+
+class Command(BaseCommand):
+    help = "Measure vector index build time, query latency and recall on synthetic passages"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--passages', type=int, default=1000000)
+        parser.add_argument('--dimension', type=int, default=384)
+        parser.add_argument('--documents', type=int, default=10000)
+        parser.add_argument('--queries', type=int, default=100)
+        parser.add_argument('--k', type=int, default=10)
+        parser.add_argument('--nprobe', type=int, nargs='+', default=[8, 16, 32])
+        parser.add_argument('--selection-sizes', type=int, nargs='+', default=[1, 10, 100, 500],
+                            help="Document selection sizes for the multi-document fan-out benchmark")
+
+    def handle(self, *args, **options):
+        n = options['passages']
+        dim = options['dimension']
+        k = options['k']
+        rng = np.random.default_rng(0)
+
+        # Clustered synthetic data, closer to real embeddings than uniform noise
+        topics = normalize(rng.standard_normal((max(n // 500, 1), dim)))
+
+        def make(count):
+            assignment = rng.integers(0, len(topics), count)
+            return normalize(topics[assignment] + rng.standard_normal((count, dim)) / np.sqrt(dim))
+
+        with tempfile.TemporaryDirectory() as path:
+            index = VectorIndex(path)
+
+            def batches(batch_size=50000):
+                for start in range(0, n, batch_size):
+                    size = min(batch_size, n - start)
+                    chunk_ids = np.arange(start, start + size)
+                    yield chunk_ids, chunk_ids % options['documents'], make(size)
+
+            started = time.perf_counter()
+            meta = index.build(batches(), n, dim, 'synthetic')
+            self.stdout.write(f"Built {n} x {dim} index with {meta['nlist']} lists in {time.perf_counter() - started:.1f}s")
+
+            vectors = np.load(f"{path}/main/vectors.npy", mmap_mode='r')
+            chunk_ids = np.load(f"{path}/main/chunk_ids.npy", mmap_mode='r')
+            queries = make(options['queries'])
+
+            # Exact top-k by brute force, for recall
+            truth = []
+            for query in queries:
+                scores = np.empty(n, dtype=np.float32)
+                for start in range(0, n, 200000):
+                    scores[start:start + 200000] = vectors[start:start + 200000].astype(np.float32) @ query
+                truth.append(set(chunk_ids[np.argpartition(-scores, k)[:k]].tolist()))
+
+            for nprobe in options['nprobe']:
+                timings = []
+                recall = []
+                for query, expected in zip(queries, truth):
+                    started = time.perf_counter()
+                    hits = index.search(query, k=k, nprobe=nprobe)
+                    timings.append((time.perf_counter() - started) * 1000)
+                    recall.append(len(expected & {hit[1] for hit in hits}) / k)
+                self.stdout.write(
+                    f"nprobe={nprobe}: p50 {np.percentile(timings, 50):.2f}ms, "
+                    f"p95 {np.percentile(timings, 95):.2f}ms, recall@{k} {np.mean(recall):.3f}"
+                )
+
+            timings = []
+            for query in queries:
+                started = time.perf_counter()
+                index.search(query, k=k, document_ids=rng.integers(0, options['documents'], 5))
+                timings.append((time.perf_counter() - started) * 1000)
+            self.stdout.write(f"5-document filter: p50 {np.percentile(timings, 50):.2f}ms")
+
+            # Multi-document queries, fanned out across shards and merged
+            for size in options['selection_sizes']:
+                timings = []
+                for query in queries:
+                    selection = rng.choice(options['documents'], size=min(size, options['documents']), replace=False)
+                    started = time.perf_counter()
+                    search_documents(query, document_ids=selection.tolist(), top_k=k, index=index)
+                    timings.append((time.perf_counter() - started) * 1000)
+                self.stdout.write(
+                    f"{size}-document fan-out: p50 {np.percentile(timings, 50):.2f}ms, "
+                    f"p95 {np.percentile(timings, 95):.2f}ms"
+                )
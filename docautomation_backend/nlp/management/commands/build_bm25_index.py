@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from nlp.bm25 import get_bm25_index
+
+
+class Command(BaseCommand):
+    help = "Rebuild the BM25 keyword index from all document chunks"
+
+    def handle(self, *args, **options):
+        meta = get_bm25_index().build()
+        self.stdout.write(self.style.SUCCESS(
+            f"Indexed {meta['passages']} passages ({meta['terms']} terms, "
+            f"{meta['postings']} postings) in {meta['build_seconds']}s"
+        ))
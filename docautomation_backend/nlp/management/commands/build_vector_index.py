@@ -0,0 +1,48 @@
+from django.core.management.base import BaseCommand
+
+from document_processing.models import DocumentChunk
+from nlp import embeddings
+from nlp.embedding_cache import get_embedding_cache
+from nlp.vector_index import get_vector_index
+
+
+class Command(BaseCommand):
+    help = "Embed all document chunks and rebuild the vector index"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=256,
+                            help="Passages embedded per model call")
+        parser.add_argument('--nlist', type=int, default=None,
+                            help="Number of IVF lists (default: sqrt of the passage count)")
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        count = DocumentChunk.objects.count()
+
+        def batches():
+            rows = DocumentChunk.objects.order_by('id').values_list('id', 'document_id', 'text')
+            batch = []
+            done = 0
+            for row in rows.iterator(chunk_size=batch_size * 4):
+                batch.append(row)
+                if len(batch) == batch_size:
+                    yield self._encode(batch)
+                    done += len(batch)
+                    batch = []
+                    if done % (batch_size * 40) == 0:
+                        self.stdout.write(f"Embedded {done}/{count} passages")
+            if batch:
+                yield self._encode(batch)
+
+        meta = get_vector_index().build(
+            batches(), count, embeddings.get_dimension(), embeddings.get_model_id(), nlist=options['nlist']
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"Indexed {meta['count']} passages in {meta['nlist']} lists ({meta['build_seconds']}s)"
+        ))
+
+    @staticmethod
+    def _encode(batch):
+        chunk_ids = [row[0] for row in batch]
+        document_ids = [row[1] for row in batch]
+        return chunk_ids, document_ids, get_embedding_cache().encode([row[2] for row in batch])
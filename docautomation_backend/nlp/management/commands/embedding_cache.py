@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+
+from nlp.embedding_cache import get_embedding_cache
+
+
+class Command(BaseCommand):
+    help = "Show embedding cache statistics and hit rates, or invalidate entries of a model"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--invalidate', metavar='MODEL_ID', default=None,
+                            help="Delete all entries of this model id")
+        parser.add_argument('--evict', action='store_true',
+                            help="Evict least recently used entries down to the size cap")
+
+    def handle(self, *args, **options):
+        cache = get_embedding_cache()
+
+        if options['invalidate']:
+            deleted = cache.invalidate(options['invalidate'])
+            self.stdout.write(self.style.SUCCESS(f"Deleted {deleted} entries for {options['invalidate']}"))
+        if options['evict']:
+            self.stdout.write(self.style.SUCCESS(f"Evicted {cache.evict()} entries"))
+
+        stats = cache.stats()
+        self.stdout.write(f"Current model: {cache.model_id}")
+        self.stdout.write(f"Size cap: {stats['max_entries']} entries")
+        for model_id in sorted(set(stats['entries']) | set(stats['totals'])):
+            line = f"  {model_id}: {stats['entries'].get(model_id, 0)} entries"
+            totals = stats['totals'].get(model_id)
+            if totals and totals['hit_rate'] is not None:
+                line += f", hit rate {totals['hit_rate']:.1%} ({totals['hits']} hits, {totals['misses']} misses)"
+            self.stdout.write(line)
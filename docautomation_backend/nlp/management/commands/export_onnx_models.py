@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from nlp import embeddings
+from nlp.model_registry import registry
+from nlp.onnx_backend import TASKS, export_model
+
+
+class Command(BaseCommand):
+    help = "Export the NER, sentiment and embedding models to ONNX (with int8 variants)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('kinds', nargs='*', default=list(TASKS),
+                            help=f"Models to export (default: {', '.join(TASKS)})")
+        parser.add_argument('--no-quantize', action='store_true',
+                            help="Skip writing the int8 dynamically quantized model")
+
+    def handle(self, *args, **options):
+        for kind in options['kinds']:
+            if kind not in TASKS:
+                raise CommandError(f"Unknown model kind '{kind}'; choose from {', '.join(TASKS)}")
+            model_name = embeddings.get_model_name() if kind == 'embedding' else registry.get_config(kind)['model']
+            try:
+                output_dir = export_model(kind, model_name, quantize=not options['no_quantize'])
+            except RuntimeError as e:
+                raise CommandError(str(e))
+            self.stdout.write(self.style.SUCCESS(f"Exported {kind} ({model_name}) to {output_dir}"))
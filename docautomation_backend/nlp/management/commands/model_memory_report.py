@@ -0,0 +1,87 @@
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from nlp.model_registry import registry
+
+SMAPS_FIELDS = ('Rss', 'Pss', 'Shared_Clean', 'Shared_Dirty', 'Private_Clean', 'Private_Dirty')
+
+
+def read_smaps_rollup(pid):
+    """Memory totals of a process in kB, from /proc/<pid>/smaps_rollup"""
+    totals = {}
+    with open(f'/proc/{pid}/smaps_rollup') as f:
+        for line in f:
+            key, _, rest = line.partition(':')
+            if key in SMAPS_FIELDS:
+                totals[key] = int(rest.split()[0])
+    return totals
+
+
+def child_pids(pid):
+    children = []
+    for task in os.listdir(f'/proc/{pid}/task'):
+        with open(f'/proc/{pid}/task/{task}/children') as f:
+            children.extend(int(child) for child in f.read().split())
+    return children
+
+
+class Command(BaseCommand):
+    help = "Report model memory in this process, or per-worker RSS/PSS of a running gunicorn"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--pid', type=int, default=None,
+                            help="PID of the gunicorn master to inspect")
+        parser.add_argument('--load', nargs='*', default=None, metavar='MODEL',
+                            help="Load these models (default: preload models) before reporting")
+
+    def handle(self, *args, **options):
+        if options['pid']:
+            self.report_processes(options['pid'])
+        else:
+            self.report_registry(options['load'])
+
+    def report_registry(self, names):
+        if names:
+            for name in names:
+                registry.get(name)
+        else:
+            registry.preload()
+
+        for row in registry.report():
+            size = row['parameter_bytes']
+            size = f"{size / 1024 / 1024:.1f} MB" if size else "unknown size"
+            self.stdout.write(f"{row['name']}: {size}, loaded in {row['load_seconds']}s")
+        self.print_process('this process', os.getpid(), read_smaps_rollup(os.getpid()))
+
+    def report_processes(self, master_pid):
+        if not os.path.exists(f'/proc/{master_pid}/smaps_rollup'):
+            raise CommandError("Per-process memory needs Linux /proc/<pid>/smaps_rollup for the given PID")
+
+        self.print_process('master', master_pid, read_smaps_rollup(master_pid))
+        workers = child_pids(master_pid)
+        rss_total = 0
+        pss_total = 0
+        for pid in workers:
+            totals = read_smaps_rollup(pid)
+            rss_total += totals['Rss']
+            pss_total += totals['Pss']
+            self.print_process('worker', pid, totals)
+
+        if workers:
+            # RSS counts shared pages in full for every worker; PSS splits them
+            # between the processes sharing them
+            self.stdout.write(
+                f"Workers: {len(workers)}, total RSS {rss_total / 1024:.1f} MB, "
+                f"total PSS {pss_total / 1024:.1f} MB, "
+                f"shared copy-on-write savings {(rss_total - pss_total) / 1024:.1f} MB "
+                f"({(rss_total - pss_total) / len(workers) / 1024:.1f} MB per worker)"
+            )
+
+    def print_process(self, label, pid, totals):
+        shared = totals.get('Shared_Clean', 0) + totals.get('Shared_Dirty', 0)
+        private = totals.get('Private_Clean', 0) + totals.get('Private_Dirty', 0)
+        self.stdout.write(
+            f"{label} {pid}: RSS {totals.get('Rss', 0) / 1024:.1f} MB, PSS {totals.get('Pss', 0) / 1024:.1f} MB, "
+            f"shared {shared / 1024:.1f} MB, private {private / 1024:.1f} MB"
+        )
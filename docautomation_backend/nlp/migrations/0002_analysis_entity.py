@@ -0,0 +1,55 @@
+# Generated by Django 4.2.30 on 2026-10-19 08:55
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('document_processing', '0004_document_chunk'),
+        ('nlp', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Analysis',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('task', models.CharField(choices=[('ner', 'Named entities'), ('sentiment', 'Sentiment')], max_length=20)),
+                ('model_id', models.CharField(max_length=255)),
+                ('text_hash', models.CharField(max_length=64)),
+                ('result', models.JSONField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Entity',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('model_id', models.CharField(max_length=255)),
+                ('label', models.CharField(max_length=50)),
+                ('text', models.CharField(db_index=True, max_length=255)),
+                ('start_char', models.PositiveIntegerField()),
+                ('end_char', models.PositiveIntegerField()),
+                ('score', models.FloatField()),
+                ('chunk', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='entities', to='document_processing.documentchunk')),
+                ('document', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='entities', to='document_processing.document')),
+            ],
+            options={
+                'ordering': ['document', 'start_char'],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='analysis',
+            constraint=models.UniqueConstraint(fields=('task', 'model_id', 'text_hash'), name='unique_analysis_key'),
+        ),
+        migrations.AddIndex(
+            model_name='entity',
+            index=models.Index(fields=['document', 'label'], name='nlp_entity_document_label'),
+        ),
+        migrations.AddIndex(
+            model_name='entity',
+            index=models.Index(fields=['label', 'text'], name='nlp_entity_label_text'),
+        ),
+    ]
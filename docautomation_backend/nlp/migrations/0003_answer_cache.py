@@ -0,0 +1,34 @@
+# Generated by Django 4.2.30 on 2026-10-19 08:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('document_processing', '0004_document_chunk'),
+        ('nlp', '0002_analysis_entity'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AnswerCacheEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('scope', models.CharField(max_length=64)),
+                ('model_id', models.CharField(max_length=255)),
+                ('query_text', models.TextField()),
+                ('query_hash', models.CharField(max_length=64)),
+                ('query_vector', models.BinaryField()),
+                ('content', models.TextField()),
+                ('sources', models.JSONField(default=list)),
+                ('hits', models.PositiveIntegerField(default=0)),
+                ('last_used_at', models.DateTimeField(db_index=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('documents', models.ManyToManyField(blank=True, related_name='+', to='document_processing.document')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['scope', 'model_id', 'query_hash'], name='nlp_answer_cache_lookup')],
+            },
+        ),
+    ]
@@ -0,0 +1,247 @@
+import gc
+import logging
+import os
+import threading
+import time
+
+from django.conf import settings
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Try to import optional dependencies
+try:
+    from transformers import pipeline
+    HAVE_TRANSFORMERS = True
+except ImportError:
+    logger.warning("transformers not available. NER and sentiment models will be disabled.")
+    HAVE_TRANSFORMERS = False
+
+try:
+    from gpt4all import GPT4All
+    HAVE_GPT4ALL = True
+except ImportError:
+    logger.warning("gpt4all not available. Local LLM generation will be disabled.")
+    HAVE_GPT4ALL = False
+
+# `backend` selects PyTorch ('pytorch') or ONNX Runtime ('onnx', optionally
+# with `quantize: True` for int8 weights) for the transformer models
+DEFAULT_MODELS = {
+    'embedding': {'policy': 'preload', 'backend': 'pytorch'},
+    'ner': {'policy': 'lazy', 'backend': 'pytorch', 'model': 'dslim/bert-base-NER'},
+    'sentiment': {'policy': 'lazy', 'backend': 'pytorch', 'model': 'distilbert-base-uncased-finetuned-sst-2-english'},
+    'llm': {'policy': 'lazy', 'model': 'orca-mini-3b-gguf2-q4_0.gguf'},
+}
+
+
+class ModelUnavailable(Exception):
+    """Raised when a model's optional dependency is not installed"""
+
+
+def _load_onnx(kind, model_name, config):
+    """Load the ONNX Runtime variant of a model, as selected by `backend: onnx`"""
+    from .onnx_backend import HAVE_ONNXRUNTIME, load_onnx_model
+    if not HAVE_ONNXRUNTIME:
+        raise ModelUnavailable("onnxruntime is not installed")
+    try:
+        return load_onnx_model(kind, model_name, quantized=config.get('quantize', False))
+    except FileNotFoundError as e:
+        raise ModelUnavailable(str(e))
+
+
+def _load_embedding(config):
+    from . import embeddings
+    if config.get('backend') == 'onnx':
+        return _load_onnx('embedding', embeddings.get_model_name(), config)
+    return embeddings.load_embedding_model()
+
+
+def _warm_embedding(model):
+    model.encode(["Warmup passage for the embedding model."], batch_size=1)
+
+
+def _load_ner(config):
+    if config.get('backend') == 'onnx':
+        return _load_onnx('ner', config['model'], config)
+    if not HAVE_TRANSFORMERS:
+        raise ModelUnavailable("transformers is not installed")
+    return pipeline('ner', model=config['model'], aggregation_strategy='simple', device=-1)
+
+
+def _load_sentiment(config):
+    if config.get('backend') == 'onnx':
+        return _load_onnx('sentiment', config['model'], config)
+    if not HAVE_TRANSFORMERS:
+        raise ModelUnavailable("transformers is not installed")
+    return pipeline('sentiment-analysis', model=config['model'], device=-1)
+
+
+def _warm_pipeline(model):
+    model("Warmup sentence mentioning Acme Corporation in Paris.")
+
+
+def _load_llm(config):
+    if not HAVE_GPT4ALL:
+        raise ModelUnavailable("gpt4all is not installed")
+    return GPT4All(config['model'], model_path=config.get('model_path'), device='cpu')
+
+
+def _warm_llm(model):
+    model.generate("Hello", max_tokens=1)
+
+
+LOADERS = {
+    'embedding': (_load_embedding, _warm_embedding),
+    'ner': (_load_ner, _warm_pipeline),
+    'sentiment': (_load_sentiment, _warm_pipeline),
+    'llm': (_load_llm, _warm_llm),
+}
+
+
+class ModelRegistry:
+    """
+    Process-wide registry of loaded models
+
+    Each model is loaded at most once per process, either lazily on first
+    use or up front by preload(). Under gunicorn with `preload_app`,
+    preload() runs in the master before workers fork, so the weights are
+    shared copy-on-write by every worker instead of being loaded per worker.
+    """
+
+    def __init__(self, models=None):
+        self.models = models
+        self._loaded = {}
+        self._load_seconds = {}
+        self._warmed = set()
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    def get_config(self, name):
+        """Merged default and MODEL_REGISTRY settings for a model"""
+        models = self.models if self.models is not None else getattr(settings, 'MODEL_REGISTRY', {})
+        config = dict(DEFAULT_MODELS.get(name, {}))
+        config.update(models.get(name, {}))
+        return config
+
+    def names(self):
+        models = self.models if self.models is not None else getattr(settings, 'MODEL_REGISTRY', {})
+        return list(dict.fromkeys(list(DEFAULT_MODELS) + list(models)))
+
+    def _name_lock(self, name):
+        with self._lock:
+            return self._locks.setdefault(name, threading.Lock())
+
+    def get(self, name):
+        """
+        Return a loaded model, loading it on first use
+
+        Raises:
+            ModelUnavailable: If the model's dependency is not installed
+        """
+        model = self._loaded.get(name)
+        if model is not None:
+            return model
+        with self._name_lock(name):
+            if name not in self._loaded:
+                loader, _ = LOADERS[name]
+                started = time.time()
+                logger.info(f"Loading model '{name}' in process {os.getpid()}")
+                self._loaded[name] = loader(self.get_config(name))
+                self._load_seconds[name] = round(time.time() - started, 2)
+                logger.info(f"Loaded model '{name}' in {self._load_seconds[name]}s")
+        return self._loaded[name]
+
+    def is_available(self, name):
+        """True if the model can be loaded (or already is)"""
+        try:
+            self.get(name)
+            return True
+        except ModelUnavailable:
+            return False
+
+    def is_loaded(self, name):
+        return name in self._loaded
+
+    def warmup(self, names=None):
+        """Run one small inference on loaded models so first requests are not slow"""
+        for name in names or list(self._loaded):
+            if name in self._warmed or name not in self._loaded:
+                continue
+            _, warm = LOADERS[name]
+            started = time.time()
+            try:
+                warm(self._loaded[name])
+                self._warmed.add(name)
+                logger.info(f"Warmed up model '{name}' in {time.time() - started:.2f}s")
+            except Exception as e:
+                logger.error(f"Error warming up model '{name}': {str(e)}")
+
+    def preload(self, warmup=False):
+        """
+        Load every model whose policy is 'preload'
+
+        Args:
+            warmup (bool): Also run warmup inference in this process. Leave
+                this off in a pre-fork master and warm up in each worker, so
+                no inference thread pools exist at fork time.
+
+        Returns:
+            list: Names of the models that were loaded
+        """
+        loaded = []
+        for name in self.names():
+            if self.get_config(name).get('policy') != 'preload':
+                continue
+            try:
+                self.get(name)
+                loaded.append(name)
+            except ModelUnavailable as e:
+                logger.warning(f"Skipping preload of model '{name}': {str(e)}")
+            except Exception as e:
+                logger.error(f"Error preloading model '{name}': {str(e)}")
+        if warmup:
+            self.warmup(loaded)
+        return loaded
+
+    def prepare_for_fork(self):
+        """
+        Move everything allocated so far into the permanent GC generation
+
+        The cyclic collector would otherwise write to the headers of the
+        preloaded objects in each worker, un-sharing their pages.
+        """
+        gc.collect()
+        gc.freeze()
+
+    def report(self):
+        """Loaded models with load time and parameter memory where known"""
+        rows = []
+        for name, model in self._loaded.items():
+            rows.append({
+                'name': name,
+                'config': self.get_config(name),
+                'load_seconds': self._load_seconds.get(name),
+                'warmed_up': name in self._warmed,
+                'parameter_bytes': parameter_bytes(model),
+            })
+        return rows
+
+
+def parameter_bytes(model):
+    """Best-effort size of a model's weights in bytes, or None if unknown"""
+    torch_model = getattr(model, 'model', model)
+    parameters = getattr(torch_model, 'parameters', None)
+    if parameters is None:
+        return None
+    try:
+        return sum(p.numel() * p.element_size() for p in parameters())
+    except Exception:
+        return None
+
+
+registry = ModelRegistry()
+
+
+def get_model(name):
+    """Shortcut for registry.get(name)"""
+    return registry.get(name)
@@ -1,3 +1,146 @@
 from django.db import models
 
-# Create your models here.
+
+class EmbeddingCacheEntry(models.Model):
+    """Cached passage embedding, keyed by model and normalized text hash"""
+    model_id = models.CharField(max_length=255)
+    text_hash = models.CharField(max_length=64)
+    dimension = models.PositiveIntegerField()
+    vector = models.BinaryField()
+    last_used_at = models.DateTimeField(db_index=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['model_id', 'text_hash'], name='unique_embedding_cache_key'),
+        ]
+
+    def __str__(self):
+        return f"{self.model_id}:{self.text_hash[:12]}"
+
+
+class EmbeddingCacheCounter(models.Model):
+    """Embedding cache lookups of a model, summed over all processes"""
+    model_id = models.CharField(max_length=255, unique=True)
+    hits = models.PositiveBigIntegerField(default=0)
+    misses = models.PositiveBigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.model_id}: {self.hits} hits, {self.misses} misses"
+
+
+class Analysis(models.Model):
+    """Cached NER or sentiment output for one passage, keyed by model and exact text hash"""
+    TASK_CHOICES = (
+        ('ner', 'Named entities'),
+        ('sentiment', 'Sentiment'),
+    )
+
+    task = models.CharField(max_length=20, choices=TASK_CHOICES)
+    model_id = models.CharField(max_length=255)
+    text_hash = models.CharField(max_length=64)
+    result = models.JSONField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['task', 'model_id', 'text_hash'], name='unique_analysis_key'),
+        ]
+
+    def __str__(self):
+        return f"{self.task}:{self.model_id}:{self.text_hash[:12]}"
+
+
+class Entity(models.Model):
+    """Named entity found in a document, with offsets into its extracted text"""
+    document = models.ForeignKey('document_processing.Document', on_delete=models.CASCADE, related_name='entities')
+    chunk = models.ForeignKey('document_processing.DocumentChunk', on_delete=models.CASCADE, related_name='entities')
+    model_id = models.CharField(max_length=255)
+    label = models.CharField(max_length=50)
+    text = models.CharField(max_length=255, db_index=True)
+    start_char = models.PositiveIntegerField()
+    end_char = models.PositiveIntegerField()
+    score = models.FloatField()
+
+    class Meta:
+        ordering = ['document', 'start_char']
+        indexes = [
+            models.Index(fields=['document', 'label'], name='nlp_entity_document_label'),
+            models.Index(fields=['label', 'text'], name='nlp_entity_label_text'),
+        ]
+
+    def __str__(self):
+        return f"{self.label}: {self.text}"
+
+
+class AnswerCacheEntry(models.Model):
+    """Cached analyze_query answer for a query over a set of documents"""
+    # Hash of the sorted document ids, or 'all' for queries over every document
+    scope = models.CharField(max_length=64)
+    documents = models.ManyToManyField('document_processing.Document', blank=True, related_name='+')
+    model_id = models.CharField(max_length=255)
+    query_text = models.TextField()
+    query_hash = models.CharField(max_length=64)
+    query_vector = models.BinaryField()
+    content = models.TextField()
+    sources = models.JSONField(default=list)
+    hits = models.PositiveIntegerField(default=0)
+    last_used_at = models.DateTimeField(db_index=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['scope', 'model_id', 'query_hash'], name='nlp_answer_cache_lookup'),
+        ]
+
+    def __str__(self):
+        return f"{self.scope[:12]}: {self.query_text[:50]}"
+
+
+class Conversation(models.Model):
+    """Multi-turn Q&A session over a document (or a selection of documents)"""
+    # First document of the selection; conversations are listed per document
+    document = models.ForeignKey(
+        'document_processing.Document', on_delete=models.CASCADE, null=True, blank=True, related_name='conversations'
+    )
+    document_ids = models.JSONField(default=list)
+    title = models.CharField(max_length=255, blank=True)
+    # Rolling summary of the messages up to and including summarized_through,
+    # which have fallen out of the context window
+    summary = models.TextField(blank=True)
+    summarized_through = models.PositiveBigIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['document', '-updated_at'], name='nlp_conversation_document'),
+        ]
+
+    def __str__(self):
+        return self.title or f"Conversation {self.id}"
+
+
+class Message(models.Model):
+    """One turn of a conversation"""
+    ROLE_CHOICES = (
+        ('user', 'User'),
+        ('system', 'System'),
+    )
+
+    conversation = models.ForeignKey(Conversation, on_delete=models.CASCADE, related_name='messages')
+    role = models.CharField(max_length=10, choices=ROLE_CHOICES)
+    content = models.TextField()
+    sources = models.JSONField(default=list, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['id']
+        indexes = [
+            # Keyset pagination walks a conversation's messages by id
+            models.Index(fields=['conversation', 'id'], name='nlp_message_conversation_id'),
+        ]
+
+    def __str__(self):
+        return f"{self.role}: {self.content[:50]}"
@@ -0,0 +1,261 @@
+import json
+import logging
+import os
+
+import numpy as np
+from django.conf import settings
+
+from .model_registry import ModelUnavailable
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Try to import optional dependencies
+try:
+    import onnxruntime
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+    HAVE_ONNXRUNTIME = True
+except ImportError:
+    logger.warning("onnxruntime not available. The ONNX inference backend will be disabled.")
+    HAVE_ONNXRUNTIME = False
+
+# Running an exported model only needs the tokenizer, not torch
+try:
+    from transformers import AutoTokenizer
+    HAVE_TOKENIZER = True
+except ImportError:
+    HAVE_TOKENIZER = False
+
+try:
+    import torch
+    from transformers import AutoModel, AutoModelForSequenceClassification, AutoModelForTokenClassification
+    HAVE_TRANSFORMERS = True
+except ImportError:
+    HAVE_TRANSFORMERS = False
+
+# Kinds of model the backend can export and run, with the transformers
+# class used to export them
+TASKS = {
+    'embedding': 'feature-extraction',
+    'ner': 'token-classification',
+    'sentiment': 'text-classification',
+}
+
+MODEL_FILE = 'model.onnx'
+QUANTIZED_MODEL_FILE = 'model.int8.onnx'
+CONFIG_FILE = 'onnx_config.json'
+DEFAULT_MAX_LENGTH = 256
+
+
+def get_onnx_dir(kind, model_name):
+    """Directory holding the exported files for a model"""
+    base = getattr(settings, 'ONNX_MODEL_DIR', os.path.join(settings.BASE_DIR, 'onnx_models'))
+    return os.path.join(base, kind, model_name.replace('/', '__'))
+
+
+def export_model(kind, model_name, output_dir=None, quantize=True, opset=17):
+    """
+    Export a Hugging Face model to ONNX, optionally with int8 weights
+
+    Args:
+        kind (str): 'embedding', 'ner' or 'sentiment'
+        model_name (str): Hugging Face model id
+        output_dir (str): Target directory, defaults to get_onnx_dir()
+        quantize (bool): Also write a dynamically quantized int8 model
+        opset (int): ONNX opset version
+
+    Returns:
+        str: The output directory
+    """
+    if not (HAVE_TRANSFORMERS and HAVE_ONNXRUNTIME):
+        raise RuntimeError("Exporting to ONNX requires torch, transformers and onnxruntime")
+    if kind not in TASKS:
+        raise ValueError(f"Unknown model kind: {kind}")
+
+    output_dir = output_dir or get_onnx_dir(kind, model_name)
+    os.makedirs(output_dir, exist_ok=True)
+
+    model_class = {
+        'embedding': AutoModel,
+        'ner': AutoModelForTokenClassification,
+        'sentiment': AutoModelForSequenceClassification,
+    }[kind]
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+    model = model_class.from_pretrained(model_name)
+    model.eval()
+
+    sample = tokenizer(["An example sentence for tracing."], return_tensors='pt')
+    input_names = [name for name in ('input_ids', 'attention_mask', 'token_type_ids') if name in sample]
+    output_name = 'last_hidden_state' if kind == 'embedding' else 'logits'
+    dynamic_axes = {name: {0: 'batch', 1: 'sequence'} for name in input_names}
+    dynamic_axes[output_name] = {0: 'batch', 1: 'sequence'} if kind != 'sentiment' else {0: 'batch'}
+
+    model_path = os.path.join(output_dir, MODEL_FILE)
+    with torch.no_grad():
+        torch.onnx.export(
+            model,
+            tuple(sample[name] for name in input_names),
+            model_path,
+            input_names=input_names,
+            output_names=[output_name],
+            dynamic_axes=dynamic_axes,
+            opset_version=opset,
+        )
+    tokenizer.save_pretrained(output_dir)
+
+    if quantize:
+        quantize_dynamic(model_path, os.path.join(output_dir, QUANTIZED_MODEL_FILE), weight_type=QuantType.QInt8)
+
+    config = {
+        'kind': kind,
+        'model_name': model_name,
+        'input_names': input_names,
+        'output_name': output_name,
+        'id2label': {str(k): v for k, v in getattr(model.config, 'id2label', {}).items()},
+        'hidden_size': getattr(model.config, 'hidden_size', None),
+    }
+    with open(os.path.join(output_dir, CONFIG_FILE), 'w') as f:
+        json.dump(config, f, indent=2)
+
+    logger.info(f"Exported {kind} model {model_name} to {output_dir}")
+    return output_dir
+
+
+class OnnxModel:
+    """Tokenizer plus ONNX Runtime session for an exported model"""
+
+    def __init__(self, model_dir, quantized=False, num_threads=None, max_length=DEFAULT_MAX_LENGTH):
+        if not HAVE_ONNXRUNTIME:
+            raise ModelUnavailable("onnxruntime is not installed")
+        if not HAVE_TOKENIZER:
+            raise ModelUnavailable("transformers is not installed; ONNX models need its tokenizer")
+        with open(os.path.join(model_dir, CONFIG_FILE)) as f:
+            self.config = json.load(f)
+        filename = QUANTIZED_MODEL_FILE if quantized else MODEL_FILE
+        path = os.path.join(model_dir, filename)
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"No exported model at {path}; run `manage.py export_onnx_models`")
+
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        threads = num_threads or getattr(settings, 'ONNX_INTRA_OP_THREADS', None)
+        if threads:
+            options.intra_op_num_threads = threads
+        options.inter_op_num_threads = 1
+        self.session = onnxruntime.InferenceSession(path, options, providers=['CPUExecutionProvider'])
+        self.tokenizer = AutoTokenizer.from_pretrained(model_dir)
+        self.max_length = max_length
+        self.quantized = quantized
+
+    def _run(self, texts, return_offsets=False):
+        encoded = self.tokenizer(
+            list(texts), padding=True, truncation=True, max_length=self.max_length,
+            return_tensors='np', return_offsets_mapping=return_offsets,
+        )
+        feeds = {name: encoded[name].astype(np.int64) for name in self.config['input_names']}
+        output = self.session.run([self.config['output_name']], feeds)[0]
+        return output, encoded
+
+
+class OnnxEmbedder(OnnxModel):
+    """Drop-in replacement for SentenceTransformer.encode with mean pooling"""
+
+    def get_sentence_embedding_dimension(self):
+        return self.config['hidden_size']
+
+    def encode(self, texts, batch_size=32, **kwargs):
+        vectors = []
+        for start in range(0, len(texts), batch_size):
+            hidden, encoded = self._run(texts[start:start + batch_size])
+            mask = encoded['attention_mask'][..., None].astype(np.float32)
+            pooled = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+            vectors.append(pooled)
+        if not vectors:
+            return np.zeros((0, self.get_sentence_embedding_dimension()), dtype=np.float32)
+        vectors = np.concatenate(vectors).astype(np.float32)
+        return vectors / np.clip(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12, None)
+
+
+def _softmax(logits):
+    logits = logits - logits.max(axis=-1, keepdims=True)
+    exp = np.exp(logits)
+    return exp / exp.sum(axis=-1, keepdims=True)
+
+
+class OnnxTextClassifier(OnnxModel):
+    """Same call signature and output as a transformers text-classification pipeline"""
+
+    def __call__(self, texts, batch_size=32, **kwargs):
+        single = isinstance(texts, str)
+        texts = [texts] if single else list(texts)
+        labels = self.config['id2label']
+        results = []
+        for start in range(0, len(texts), batch_size):
+            logits, _ = self._run(texts[start:start + batch_size])
+            probs = _softmax(logits)
+            for row in probs:
+                best = int(row.argmax())
+                results.append({'label': labels.get(str(best), str(best)), 'score': float(row[best])})
+        return results[0] if single else results
+
+
+class OnnxTokenClassifier(OnnxModel):
+    """Same output as a transformers NER pipeline with aggregation_strategy='simple'"""
+
+    def __call__(self, texts, batch_size=16, **kwargs):
+        single = isinstance(texts, str)
+        texts = [texts] if single else list(texts)
+        labels = self.config['id2label']
+        results = []
+        for start in range(0, len(texts), batch_size):
+            batch = texts[start:start + batch_size]
+            logits, encoded = self._run(batch, return_offsets=True)
+            probs = _softmax(logits)
+            for i, text in enumerate(batch):
+                results.append(self._aggregate(
+                    text, probs[i], encoded['offset_mapping'][i], encoded['attention_mask'][i], labels
+                ))
+        return results[0] if single else results
+
+    @staticmethod
+    def _aggregate(text, probs, offsets, mask, labels):
+        """Merge B-/I- tagged tokens into entity spans"""
+        entities = []
+        current = None
+        for position, (start, end) in enumerate(offsets):
+            if not mask[position] or end <= start:
+                continue
+            best = int(probs[position].argmax())
+            label = labels.get(str(best), 'O')
+            prefix, _, group = label.partition('-') if '-' in label else ('', '', label)
+            continues = (
+                current is not None and group == current['entity_group'] and prefix != 'B'
+                and (start == current['end'] or text[current['end']:start].isspace())
+            )
+            if label == 'O':
+                current = None
+                continue
+            if continues:
+                current['end'] = int(end)
+                current['scores'].append(float(probs[position][best]))
+            else:
+                current = {'entity_group': group, 'start': int(start), 'end': int(end),
+                           'scores': [float(probs[position][best])]}
+                entities.append(current)
+        for entity in entities:
+            scores = entity.pop('scores')
+            entity['score'] = float(np.mean(scores))
+            entity['word'] = text[entity['start']:entity['end']]
+        return entities
+
+
+RUNTIME_CLASSES = {
+    'embedding': OnnxEmbedder,
+    'ner': OnnxTokenClassifier,
+    'sentiment': OnnxTextClassifier,
+}
+
+
+def load_onnx_model(kind, model_name, quantized=False):
+    """Load an exported model for inference"""
+    return RUNTIME_CLASSES[kind](get_onnx_dir(kind, model_name), quantized=quantized)
@@ -0,0 +1,371 @@
+import heapq
+import logging
+import math
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+
+from document_processing.models import DocumentChunk
+
+from . import embeddings
+from .embedding_cache import get_embedding_cache
+from .vector_index import get_vector_index
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+DEFAULT_TOP_K = 5
+DEFAULT_MIN_SCORE = 0.0
+DEFAULT_MODE = 'hybrid'
+DEFAULT_RRF_K = 60
+DEFAULT_CANDIDATES = 4
+DEFAULT_SHARD_SIZE = 16
+DEFAULT_EXACT_ROWS = 8000
+# Candidates fetched per result slot when a large selection is searched in one IVF pass
+IVF_OVERFETCH = 4
+DEFAULT_CONTEXT_CHARS = 6000
+# Shorter leftovers of a cut passage are not worth a place in the context
+MIN_PASSAGE_CHARS = 100
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    """Thread pool for shard searches; numpy releases the GIL while scoring"""
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                workers = getattr(settings, 'RETRIEVAL_MAX_WORKERS', None) or min(8, os.cpu_count() or 1)
+                _executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='retrieval')
+    return _executor
+
+
+def index_document_chunks(document):
+    """
+    Embed a document's chunks and replace its vectors in the index
+
+    Args:
+        document: Document model instance
+
+    Returns:
+        int: Number of passages indexed
+    """
+    chunks = list(
+        DocumentChunk.objects.filter(document=document).order_by('index').values_list('id', 'text')
+    )
+    index = get_vector_index()
+    if not chunks:
+        index.remove_document(document.id)
+        return 0
+
+    chunk_ids = [chunk_id for chunk_id, _ in chunks]
+    # Unchanged passages come from the cache; the rest are batched together
+    # with passages from other documents finishing processing
+    cache = get_embedding_cache()
+    vectors = cache.encode([text for _, text in chunks])
+    index.add_document(document.id, chunk_ids, vectors)
+    logger.info(
+        f"Indexed {len(chunk_ids)} passages for document {document.id} "
+        f"(embedding cache hit rate {cache.hit_rate})"
+    )
+    return len(chunk_ids)
+
+
+def _search_shard(index, query_vector, document_ids, per_document_k):
+    """Best candidates of one shard, at most per_document_k per document, best first"""
+    hits = index.search(query_vector, k=per_document_k * len(document_ids), document_ids=document_ids)
+    taken = {}
+    candidates = []
+    for hit in hits:
+        if taken.get(hit[2], 0) < per_document_k:
+            taken[hit[2]] = taken.get(hit[2], 0) + 1
+            candidates.append(hit)
+    return candidates
+
+
+def merge_top_k(candidate_lists, top_k, max_per_document=None):
+    """
+    Merge per-shard candidate lists into the overall top k
+
+    Args:
+        candidate_lists (list): Lists of (score, chunk_id, document_id), each best first
+        top_k (int): Number of results
+        max_per_document (int): Cap on results from one document while
+            others still have candidates; lifted to fill the remaining slots
+
+    Returns:
+        list: (score, chunk_id, document_id) tuples, best first
+    """
+    merged = heapq.merge(*candidate_lists, key=lambda hit: -hit[0])
+    if max_per_document is None:
+        return [hit for _, hit in zip(range(top_k), merged)]
+
+    results = []
+    skipped = []
+    taken = {}
+    for hit in merged:
+        if taken.get(hit[2], 0) < max_per_document:
+            taken[hit[2]] = taken.get(hit[2], 0) + 1
+            results.append(hit)
+            if len(results) == top_k:
+                return results
+        elif len(skipped) < top_k:
+            skipped.append(hit)
+    results.extend(skipped[:top_k - len(results)])
+    results.sort(key=lambda hit: hit[0], reverse=True)
+    return results
+
+
+def search_documents(query_vector, document_ids=None, top_k=None, index=None):
+    """
+    Vector search over a document selection
+
+    Selections of up to RETRIEVAL_EXACT_ROWS passages are scored exactly:
+    split into shards of RETRIEVAL_SHARD_SIZE documents searched in
+    parallel, each returning its best candidates per document, and merged
+    with a heap. Larger selections are searched in a single IVF pass
+    restricted to the selection, whose cost depends on the probed lists
+    rather than the number of documents, so latency stays flat as the
+    selection grows. Either way no document takes more than its share of
+    the top k while other documents have relevant passages.
+
+    Returns:
+        list: (score, chunk_id, document_id) tuples, best first
+    """
+    top_k = top_k or getattr(settings, 'RETRIEVAL_TOP_K', DEFAULT_TOP_K)
+    index = index or get_vector_index()
+    if not document_ids:
+        return index.search(query_vector, k=top_k)
+
+    document_ids = sorted(set(document_ids))
+    max_per_document = math.ceil(top_k / min(len(document_ids), top_k))
+    exact_rows = getattr(settings, 'RETRIEVAL_EXACT_ROWS', DEFAULT_EXACT_ROWS)
+    if index.document_row_count(document_ids) > exact_rows:
+        hits = index.search(query_vector, k=top_k * IVF_OVERFETCH, document_ids=document_ids, exact_limit=0)
+        return merge_top_k([hits], top_k, max_per_document)
+
+    shard_size = getattr(settings, 'RETRIEVAL_SHARD_SIZE', DEFAULT_SHARD_SIZE)
+    shards = [document_ids[start:start + shard_size] for start in range(0, len(document_ids), shard_size)]
+    if len(shards) == 1:
+        candidate_lists = [_search_shard(index, query_vector, shards[0], max_per_document)]
+    else:
+        candidate_lists = list(_get_executor().map(
+            lambda shard: _search_shard(index, query_vector, shard, max_per_document), shards
+        ))
+    return merge_top_k(candidate_lists, top_k, max_per_document)
+
+
+def split_context_budget(passages, context_chars=None):
+    """
+    Share a prompt's context budget fairly between the documents of the passages
+
+    Each document gets an equal share, spent on its passages best first;
+    whatever a document does not need is redistributed to the others.
+
+    Returns:
+        list: The passage texts, truncated to fit, in the original order
+    """
+    context_chars = context_chars or getattr(settings, 'LLM_CONTEXT_CHARS', DEFAULT_CONTEXT_CHARS)
+    needs = {}
+    for passage in passages:
+        needs[passage['document_id']] = needs.get(passage['document_id'], 0) + len(passage['text'])
+
+    # Water-filling: documents needing less than an equal share keep what
+    # they need, and the rest split what is left
+    budgets = {}
+    remaining = context_chars
+    pending = sorted(needs, key=needs.get)
+    while pending:
+        share = remaining // len(pending)
+        document_id = pending[0]
+        if needs[document_id] <= share:
+            budgets[document_id] = needs[document_id]
+            remaining -= needs[document_id]
+            pending.pop(0)
+        else:
+            for document_id in pending:
+                budgets[document_id] = share
+            break
+
+    texts = []
+    for passage in passages:
+        allowed = budgets[passage['document_id']]
+        text = passage['text'][:allowed]
+        budgets[passage['document_id']] -= len(text)
+        texts.append(text)
+    return texts
+
+
+def fuse_rankings(rankings, top_k, max_per_document=None, rrf_k=None):
+    """
+    Combine ranked hit lists with reciprocal rank fusion
+
+    Each passage scores sum(1 / (rrf_k + rank)) over the lists it appears
+    in, so passages ranked well by both retrievers rise to the top without
+    having to calibrate BM25 against cosine scores.
+
+    Args:
+        rankings (dict): Name -> list of (score, chunk_id, document_id), best first
+        top_k (int): Number of results
+        max_per_document (int): Per-document cap, as in merge_top_k()
+        rrf_k (int): Rank smoothing constant, defaults to RETRIEVAL_RRF_K
+
+    Returns:
+        tuple: ((fused_score, chunk_id, document_id) list, {chunk_id: {name: score}})
+    """
+    rrf_k = rrf_k or getattr(settings, 'RETRIEVAL_RRF_K', DEFAULT_RRF_K)
+    fused = {}
+    components = {}
+    for name, hits in rankings.items():
+        for rank, (score, chunk_id, document_id) in enumerate(hits, 1):
+            previous = fused.get(chunk_id, (0.0, document_id))[0]
+            fused[chunk_id] = (previous + 1.0 / (rrf_k + rank), document_id)
+            components.setdefault(chunk_id, {})[name] = round(score, 4)
+    ranked = sorted(
+        ((score, chunk_id, document_id) for chunk_id, (score, document_id) in fused.items()),
+        key=lambda hit: hit[0], reverse=True,
+    )
+    return merge_top_k([ranked], top_k, max_per_document), components
+
+
+def rank_passages(query_text, document_ids=None, top_k=None, query_vector=None, mode=None):
+    """
+    Rank passages with the dense retriever, BM25, or both fused
+
+    Args:
+        mode (str): 'dense', 'bm25' or 'hybrid', defaults to RETRIEVAL_MODE
+
+    Returns:
+        tuple: ((score, chunk_id, document_id) list, {chunk_id: {retriever: score}})
+    """
+    from .bm25 import get_bm25_index
+
+    top_k = top_k or getattr(settings, 'RETRIEVAL_TOP_K', DEFAULT_TOP_K)
+    mode = mode or getattr(settings, 'RETRIEVAL_MODE', DEFAULT_MODE)
+    min_score = getattr(settings, 'RETRIEVAL_MIN_SCORE', DEFAULT_MIN_SCORE)
+    # Fusion needs deeper lists than the final top k
+    candidates = top_k * getattr(settings, 'RETRIEVAL_CANDIDATES', DEFAULT_CANDIDATES) if mode == 'hybrid' else top_k
+
+    rankings = {}
+    if mode in ('dense', 'hybrid'):
+        if query_vector is None:
+            query_vector = embeddings.encode([query_text])[0]
+        hits = search_documents(query_vector, document_ids=document_ids, top_k=candidates)
+        rankings['dense'] = [hit for hit in hits if hit[0] > min_score]
+    if mode in ('bm25', 'hybrid'):
+        rankings['bm25'] = get_bm25_index().search(query_text, k=candidates, document_ids=document_ids or None)
+
+    if len(rankings) == 1:
+        name, hits = next(iter(rankings.items()))
+        return hits, {chunk_id: {name: round(score, 4)} for score, chunk_id, _ in hits}
+    max_per_document = math.ceil(top_k / min(len(document_ids), top_k)) if document_ids else None
+    return fuse_rankings(rankings, top_k, max_per_document)
+
+
+def retrieve(query_text, document_ids=None, top_k=None, query_vector=None):
+    """
+    Find the passages most relevant to a query
+
+    Args:
+        query_text (str): Natural-language query
+        document_ids (list): Restrict results to these documents
+        top_k (int): Number of passages, defaults to RETRIEVAL_TOP_K
+        query_vector (numpy.ndarray): Precomputed query embedding
+
+    Returns:
+        list: Passage dicts (chunk_id, document_id, index, page, start_char,
+        end_char, text, score, scores), most relevant first. `score` is the
+        fused rank score in hybrid mode; `scores` has each retriever's own
+        score (cosine similarity, BM25).
+    """
+    started = time.perf_counter()
+    hits, components = rank_passages(query_text, document_ids, top_k, query_vector)
+    search_ms = (time.perf_counter() - started) * 1000
+
+    chunks = DocumentChunk.objects.only(
+        'id', 'document_id', 'index', 'page', 'start_char', 'end_char', 'text'
+    ).in_bulk([chunk_id for _, chunk_id, _ in hits])
+
+    passages = []
+    for score, chunk_id, document_id in hits:
+        chunk = chunks.get(chunk_id)
+        if chunk is None:
+            # The chunk was rewritten or deleted after it was indexed
+            continue
+        passages.append({
+            'chunk_id': chunk.id,
+            'document_id': chunk.document_id,
+            'index': chunk.index,
+            'page': chunk.page,
+            'start_char': chunk.start_char,
+            'end_char': chunk.end_char,
+            'text': chunk.text,
+            'score': round(score, 4),
+            'scores': components.get(chunk_id, {}),
+        })
+
+    logger.info(f"Retrieved {len(passages)} passages in {search_ms:.1f}ms (search) for query: {query_text[:80]}")
+    return passages
+
+
+def assemble_context(query_text, document_ids, token_budget=None):
+    """
+    The passages of a set of documents most relevant to a task, within a token budget
+
+    Only the selected chunks are loaded, never the documents' full text,
+    and the number of queries does not depend on how many documents are
+    given. Every document gets a fair share of the budget (see
+    split_context_budget()), and at least one passage is retrieved per
+    document. When there are too many documents for each to get
+    MIN_PASSAGE_CHARS, only the best-ranked ones that fit are used.
+    Documents left without a passage are logged.
+
+    Args:
+        query_text (str): What the passages are needed for, e.g. a
+            generation title and prompt
+        document_ids (list): Documents to draw from
+        token_budget (int): Defaults to GENERATION_CONTEXT_TOKENS
+
+    Returns:
+        list: Passage dicts as from retrieve(), texts cut to the budget, in
+        document order and reading order within each document
+    """
+    from .llm import CHARS_PER_TOKEN, generation_context_chars
+
+    if not document_ids:
+        return []
+    context_chars = token_budget * CHARS_PER_TOKEN if token_budget else generation_context_chars()
+    chunk_chars = getattr(settings, 'CHUNK_MAX_TOKENS', 256) * CHARS_PER_TOKEN
+    # Twice the passages that fit, so documents needing less than their
+    # share leave room for the others' next-best passages, and never fewer
+    # than the documents, so none of them is cut by the per-document cap
+    top_k = max(2 * math.ceil(context_chars / chunk_chars), len(document_ids))
+    passages = retrieve(query_text, document_ids=document_ids, top_k=top_k)
+
+    # Passages come best first, so the documents kept are the best-ranked
+    max_documents = max(context_chars // MIN_PASSAGE_CHARS, 1)
+    kept = set()
+    for passage in passages:
+        if len(kept) < max_documents:
+            kept.add(passage['document_id'])
+    passages = [passage for passage in passages if passage['document_id'] in kept]
+
+    selected = []
+    for passage, text in zip(passages, split_context_budget(passages, context_chars)):
+        if text == passage['text'] or len(text) >= MIN_PASSAGE_CHARS:
+            selected.append(dict(passage, text=text))
+    order = {document_id: i for i, document_id in enumerate(document_ids)}
+    selected.sort(key=lambda passage: (order.get(passage['document_id'], len(order)), passage['index']))
+
+    omitted = set(document_ids) - {passage['document_id'] for passage in selected}
+    if omitted:
+        logger.warning(
+            f"{len(omitted)} of {len(set(document_ids))} reference documents have no passage in the "
+            f"{context_chars}-character context: {sorted(omitted)[:10]}"
+        )
+    return selected
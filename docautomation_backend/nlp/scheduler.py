@@ -0,0 +1,200 @@
+import heapq
+import itertools
+import logging
+import threading
+import time
+from contextlib import nullcontext
+
+from django.conf import settings
+
+from .model_registry import LOADERS, registry
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Lower values are served first
+INTERACTIVE = 0
+BATCH = 10
+
+DEFAULT_MAX_CONCURRENT = 1
+DEFAULT_MAX_TOKENS = 512
+
+
+class _Slot:
+    """One model instance"""
+
+    def __init__(self, index):
+        self.index = index
+        self.model = None
+        self.last_used = 0.0
+
+
+class _Job:
+    __slots__ = ('priority', 'seq', 'enqueued_at')
+
+    def __init__(self, priority, seq):
+        self.priority = priority
+        self.seq = seq
+        self.enqueued_at = time.monotonic()
+
+    def __lt__(self, other):
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+class LLMScheduler:
+    """
+    Runs all local LLM generations of a process through a fixed set of slots
+
+    At most `max_concurrent` generations run at once (each slot holds its
+    own model instance), so concurrent requests queue instead of
+    oversubscribing the CPU. Waiting jobs are served by priority, then in
+    arrival order: interactive queries go ahead of document generation.
+
+    The scheduler only caps concurrency and orders jobs; it does not cache
+    evaluated prompt prefixes. The instructions and document context of a
+    prompt are passed as `prefix` and become the system prompt of a chat
+    session opened for the job alone. gpt4all keeps a session's earlier
+    turns in the model's context and its bindings cannot rewind it to the
+    system prompt, so a session kept for later jobs would show one
+    request's questions and answers to the next.
+    """
+
+    def __init__(self, max_concurrent=None, load_fn=None):
+        self.max_concurrent = max_concurrent or getattr(settings, 'LLM_MAX_CONCURRENT', DEFAULT_MAX_CONCURRENT)
+        self.load_fn = load_fn
+        self._slots = [_Slot(i) for i in range(self.max_concurrent)]
+        self._idle = list(self._slots)
+        self._waiting = []
+        self._seq = itertools.count()
+        self._condition = threading.Condition()
+        self.stats = {
+            'jobs': 0,
+            'tokens': 0,
+            'queue_wait_seconds': 0.0,
+            'generation_seconds': 0.0,
+            'max_queue_depth': 0,
+        }
+
+    def _load(self, slot):
+        if self.load_fn is not None:
+            return self.load_fn()
+        if slot.index == 0:
+            return registry.get('llm')
+        # Extra slots need their own instance: a model runs one generation at a time
+        loader, _ = LOADERS['llm']
+        return loader(registry.get_config('llm'))
+
+    def _acquire(self, job):
+        with self._condition:
+            heapq.heappush(self._waiting, job)
+            self.stats['max_queue_depth'] = max(self.stats['max_queue_depth'], len(self._waiting))
+            while not (self._idle and self._waiting[0] is job):
+                self._condition.wait()
+            heapq.heappop(self._waiting)
+            slot = min(self._idle, key=lambda s: s.last_used)
+            self._idle.remove(slot)
+            # The next waiter may be able to take another idle slot
+            self._condition.notify_all()
+            return slot
+
+    def _release(self, slot):
+        with self._condition:
+            slot.last_used = time.monotonic()
+            self._idle.append(slot)
+            self._condition.notify_all()
+
+    def stream(self, prompt, prefix='', max_tokens=None, priority=INTERACTIVE, metrics=None):
+        """
+        Queue a generation and yield its tokens once it gets a slot
+
+        Args:
+            prompt (str): The part of the prompt specific to this request
+            prefix (str): Instructions and context, used as the system prompt
+            max_tokens (int): Generation limit, defaults to LLM_MAX_TOKENS
+            priority (int): INTERACTIVE or BATCH; lower runs first
+            metrics (dict): If given, filled with this job's queue_wait_ms,
+                tokens and tokens_per_second
+
+        Yields:
+            str: Generated tokens
+        """
+        max_tokens = max_tokens or getattr(settings, 'LLM_MAX_TOKENS', DEFAULT_MAX_TOKENS)
+        job = _Job(priority, next(self._seq))
+        slot = self._acquire(job)
+        started = time.monotonic()
+        queue_wait = started - job.enqueued_at
+        tokens = 0
+        stop = threading.Event()
+        try:
+            if slot.model is None:
+                slot.model = self._load(slot)
+            chat = bool(prefix) and hasattr(slot.model, 'chat_session')
+            text = f"{prefix}\n\n{prompt}" if prefix and not chat else prompt
+            # The session ends with the job, so nothing of it stays in the model's context
+            with slot.model.chat_session(prefix) if chat else nullcontext():
+                generator = slot.model.generate(
+                    text, max_tokens=max_tokens, streaming=True,
+                    callback=lambda token_id, response: not stop.is_set(),
+                )
+                try:
+                    for token in generator:
+                        tokens += 1
+                        yield token
+                except GeneratorExit:
+                    # The client went away: stop the model and let it wind down
+                    # before the slot is handed to the next job
+                    stop.set()
+                    for _ in generator:
+                        pass
+                    raise
+        finally:
+            elapsed = time.monotonic() - started
+            job_metrics = {
+                'queue_wait_ms': round(queue_wait * 1000, 1),
+                'tokens': tokens,
+                'tokens_per_second': round(tokens / elapsed, 2) if elapsed > 0 else None,
+            }
+            if metrics is not None:
+                metrics.update(job_metrics)
+            with self._condition:
+                self.stats['jobs'] += 1
+                self.stats['tokens'] += tokens
+                self.stats['queue_wait_seconds'] += queue_wait
+                self.stats['generation_seconds'] += elapsed
+            self._release(slot)
+            logger.info(
+                f"LLM job on slot {slot.index}: waited {job_metrics['queue_wait_ms']}ms, "
+                f"{tokens} tokens at {job_metrics['tokens_per_second']} tokens/s"
+            )
+
+    def generate(self, prompt, prefix='', max_tokens=None, priority=INTERACTIVE, metrics=None):
+        """Run a generation through the queue and return the full text"""
+        return ''.join(self.stream(prompt, prefix, max_tokens, priority, metrics))
+
+    def report(self):
+        """Counters plus averages and the current queue state"""
+        with self._condition:
+            stats = dict(self.stats)
+            stats['queued'] = len(self._waiting)
+            stats['busy_slots'] = self.max_concurrent - len(self._idle)
+        jobs = stats['jobs']
+        stats['max_concurrent'] = self.max_concurrent
+        stats['avg_queue_wait_ms'] = round(stats['queue_wait_seconds'] * 1000 / jobs, 1) if jobs else None
+        stats['tokens_per_second'] = (
+            round(stats['tokens'] / stats['generation_seconds'], 2) if stats['generation_seconds'] else None
+        )
+        return stats
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_llm_scheduler():
+    """Return the process-wide LLM scheduler"""
+    global _scheduler
+    if _scheduler is None:
+        with _scheduler_lock:
+            if _scheduler is None:
+                _scheduler = LLMScheduler()
+    return _scheduler
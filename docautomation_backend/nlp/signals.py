@@ -0,0 +1,72 @@
+import logging
+
+from django.db.models.signals import post_delete, pre_delete
+from django.dispatch import receiver
+
+from document_processing.models import Document
+from document_processing.signals import document_processed
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+
+@receiver(document_processed)
+def embed_document_passages(sender, document, **kwargs):
+    """Embed the new chunks of a processed document into the vector index"""
+    from .retrieval import index_document_chunks
+    index_document_chunks(document)
+
+
+@receiver(document_processed)
+def refresh_keyword_index(sender, document, **kwargs):
+    """Log the document as changed in the BM25 index, rebuilding it in the background once enough did"""
+    from .bm25 import get_bm25_index
+    index = get_bm25_index()
+    index.mark_changed(document.id)
+    index.refresh()
+
+
+@receiver(document_processed)
+def analyze_document_passages(sender, document, **kwargs):
+    """Extract entities and cache passage sentiment for a processed document"""
+    from .analysis import analyze_processed_document
+    analyze_processed_document(document)
+
+
+@receiver(post_delete, sender=Document)
+def remove_deleted_document_vectors(sender, instance, **kwargs):
+    """Drop the vectors of deleted documents"""
+    from .vector_index import get_vector_index
+    try:
+        get_vector_index().remove_document(instance.id)
+    except Exception as e:
+        logger.error(f"Error removing document {instance.id} from vector index: {str(e)}")
+
+
+@receiver(post_delete, sender=Document)
+def remove_deleted_document_passages(sender, instance, **kwargs):
+    """Mask the passages of deleted documents in the BM25 index until its next build"""
+    from .bm25 import get_bm25_index
+    try:
+        index = get_bm25_index()
+        index.mark_deleted(instance.id)
+        index.refresh()
+    except Exception as e:
+        logger.error(f"Error removing document {instance.id} from BM25 index: {str(e)}")
+
+
+@receiver(document_processed)
+def invalidate_reprocessed_document_answers(sender, document, **kwargs):
+    """Cached answers may quote the document's old text"""
+    from .answer_cache import get_answer_cache
+    get_answer_cache().invalidate_document(document.id)
+
+
+@receiver(pre_delete, sender=Document)
+def invalidate_deleted_document_answers(sender, instance, **kwargs):
+    """Runs before deletion, while the cache entries still link to the document"""
+    from .answer_cache import get_answer_cache
+    try:
+        get_answer_cache().invalidate_document(instance.id)
+    except Exception as e:
+        logger.error(f"Error invalidating cached answers for document {instance.id}: {str(e)}")
@@ -1,3 +1,817 @@
-from django.test import TestCase
+import io
+import json
+import re
+import shutil
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+
+from document_processing.chunking import chunk_document
+from document_processing.models import Document
+
+from .analysis import analyze_texts, get_model_id, summarize_sentiment
+from .answer_cache import AnswerCache, get_scope
+from .bm25 import BM25Index, BM25Segment
+from .conversation import PROMPT_LABELS, TRIM_MARKER, add_message, build_context, history_page, trim_middle
+from .embedding_cache import EmbeddingCache
+from .embedding_service import EmbeddingService
+from .llm import CHARS_PER_TOKEN
+from .model_registry import ModelRegistry, ModelUnavailable, registry
+from .models import AnswerCacheEntry, Conversation, EmbeddingCacheCounter, Entity
+from .onnx_backend import OnnxTokenClassifier
+from .retrieval import assemble_context, fuse_rankings, merge_top_k, search_documents, split_context_budget
+from .scheduler import BATCH, INTERACTIVE, LLMScheduler
+from .vector_index import VectorIndex
+
+
+def create_document(text, title='contract.txt'):
+    """A document chunked from the given text"""
+    document = Document.objects.create(title=title, document_type='txt', processing_status='completed')
+    chunk_document(document, text, max_tokens=50, overlap=0)
+    return document
+
+
+def unit_vectors(count, dimension=16, seed=0):
+    vectors = np.random.default_rng(seed).standard_normal((count, dimension)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+class VectorIndexTests(TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.index = VectorIndex(self.path, model_id='test-model')
+        # 2000 passages of 100 documents, 20 each
+        self.vectors = unit_vectors(2000)
+        self.chunk_ids = np.arange(2000) + 1
+        self.document_ids = np.arange(2000) // 20 + 1
+        batches = [
+            (self.chunk_ids[start:start + 500], self.document_ids[start:start + 500], self.vectors[start:start + 500])
+            for start in range(0, 2000, 500)
+        ]
+        self.index.build(batches, 2000, 16, 'test-model', nlist=8)
+
+    def tearDown(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def test_probed_lists_hold_the_nearest_passage(self):
+        for row in (0, 777, 1999):
+            hits = self.index.search(self.vectors[row], k=3, nprobe=1)
+            self.assertEqual(hits[0][1:], (int(self.chunk_ids[row]), int(self.document_ids[row])))
+            self.assertAlmostEqual(hits[0][0], 1.0, places=2)
+            self.assertEqual(len(hits), 3)
+
+    def test_document_filter_with_exact_and_probed_search(self):
+        query = self.vectors[5]
+        for exact_limit in (50000, 0):
+            hits = self.index.search(query, k=10, document_ids=[7, 8], nprobe=8, exact_limit=exact_limit)
+            self.assertEqual(len(hits), 10)
+            self.assertTrue(all(document_id in (7, 8) for _, _, document_id in hits))
+            self.assertEqual([hit[0] for hit in hits], sorted((hit[0] for hit in hits), reverse=True))
+        self.assertEqual(self.index.document_row_count([7, 8, 500]), 40)
+
+    def test_delta_replaces_and_removes_documents(self):
+        replacement = unit_vectors(3, seed=1)
+        self.index.add_document(1, [9001, 9002, 9003], replacement)
+
+        # The main rows of document 1 are masked by its delta rows
+        self.assertEqual(self.index.document_row_count([1]), 3)
+        hits = self.index.search(replacement[2], k=5, document_ids=[1])
+        self.assertEqual({chunk_id for _, chunk_id, _ in hits}, {9001, 9002, 9003})
+        self.assertEqual(hits[0][1], 9003)
+        self.assertNotIn(1, [hit[1] for hit in self.index.search(self.vectors[0], k=5, nprobe=8)])
+        self.assertEqual(self.index.size, 2000 - 20 + 3)
+
+        self.index.remove_document(1)
+        self.index.remove_document(2)
+        self.assertEqual(self.index.search(replacement[2], k=5, document_ids=[1, 2]), [])
+        self.assertEqual(self.index.document_row_count([1, 2, 3]), 20)
+
+    def test_reload_swaps_a_new_snapshot(self):
+        snapshot = self.index._ensure_loaded()
+        self.assertIs(self.index._ensure_loaded(), snapshot)
+
+        self.index.add_document(3, [9001], unit_vectors(1, seed=2))
+        reloaded = self.index._ensure_loaded()
+        self.assertIsNot(reloaded, snapshot)
+        # A search holding the old snapshot still sees a consistent state
+        self.assertEqual(len(snapshot.delta['chunk_ids']), 0)
+        self.assertEqual(list(reloaded.delta['stale_documents']), [3])
+
+    def test_segments_of_another_model_are_ignored(self):
+        other = VectorIndex(self.path, model_id='other-model')
+
+        self.assertEqual(other.search(self.vectors[0], k=3), [])
+        self.assertEqual(other.model_mismatch, 'test-model')
+        other.add_document(1, [9001], unit_vectors(1, seed=3))
+        self.assertEqual([hit[1] for hit in other.search(unit_vectors(1, seed=3)[0], k=3)], [9001])
+
+
+class EmbeddingServiceTests(TestCase):
+    def setUp(self):
+        self.batches = []
+        self.service = EmbeddingService(encode_fn=self.encode, max_batch_size=4, max_wait_ms=50)
+
+    def tearDown(self):
+        self.service.shutdown()
+
+    def encode(self, texts):
+        self.batches.append(list(texts))
+        return np.array([[len(text), 1.0] for text in texts], dtype=np.float32)
+
+    def test_futures_resolve_to_their_own_vectors(self):
+        texts = [f"passage {i}" for i in range(10)]
+        futures = self.service.submit(texts)
+
+        vectors = [future.result(timeout=5) for future in futures]
+        self.assertEqual([vector[0] for vector in vectors], [len(text) for text in texts])
+        self.assertEqual([len(batch) for batch in self.batches], [4, 4, 2])
+        self.assertEqual(self.service.stats['passages'], 10)
+
+    def test_batches_hold_one_length_bucket(self):
+        vectors = self.service.encode(["short", "x" * 100, "tiny!"], timeout=5)
+
+        self.assertEqual(vectors[:, 0].tolist(), [5, 100, 5])
+        self.assertEqual(self.batches, [["short", "tiny!"], ["x" * 100]])
+
+    def test_concurrent_callers_share_model_calls(self):
+        results = {}
+
+        def call(i):
+            results[i] = self.service.encode([f"query {i}"], timeout=5)
+
+        threads = [threading.Thread(target=call, args=(i,)) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(sorted(results), list(range(8)))
+        self.assertLess(len(self.batches), 8)
+
+    def test_encode_errors_reach_every_caller(self):
+        service = EmbeddingService(encode_fn=mock.Mock(side_effect=RuntimeError("out of memory")), max_wait_ms=0)
+        self.addCleanup(service.shutdown)
+
+        futures = service.submit(["one", "two"])
+        for future in futures:
+            with self.assertRaisesMessage(RuntimeError, "out of memory"):
+                future.result(timeout=5)
+
+
+class EmbeddingCacheTests(TestCase):
+    def test_counters_are_shared_and_persisted(self):
+        encode = mock.Mock(side_effect=lambda texts: np.ones((len(texts), 4), dtype=np.float32))
+        first = EmbeddingCache(encode_fn=encode, model_id='test-model')
+        first.encode(["alpha", "beta"])
+        second = EmbeddingCache(encode_fn=encode, model_id='test-model')
+        vectors = second.encode(["alpha", "gamma", "alpha"])
+
+        self.assertEqual(vectors.shape, (3, 4))
+        self.assertEqual(sum(len(call.args[0]) for call in encode.call_args_list), 3)
+        self.assertEqual((second.hits, second.misses), (2, 1))
+        counter = EmbeddingCacheCounter.objects.get(model_id='test-model')
+        self.assertEqual((counter.hits, counter.misses), (2, 3))
+        self.assertEqual(second.stats()['totals']['test-model']['hit_rate'], 0.4)
+
+        second.invalidate()
+        self.assertFalse(EmbeddingCacheCounter.objects.exists())
+
+
+class ModelRegistryTests(TestCase):
+    def setUp(self):
+        self.loads = []
+        self.warmed = []
+        loaders = {name: (self.loader(name), self.warmed.append) for name in ('embedding', 'ner', 'sentiment', 'llm')}
+        patcher = mock.patch.dict('nlp.model_registry.LOADERS', loaders)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def loader(self, name):
+        def load(config):
+            self.loads.append((name, config))
+            if config.get('missing'):
+                raise ModelUnavailable(f"{name} is not installed")
+            time.sleep(0.01)
+            return f"{name} model"
+        return load
+
+    def test_lazy_model_loads_once_on_first_use(self):
+        registry = ModelRegistry(models={'ner': {'model': 'custom/ner'}})
+        self.assertFalse(registry.is_loaded('ner'))
+
+        models = []
+        threads = [threading.Thread(target=lambda: models.append(registry.get('ner'))) for _ in range(6)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(models, ["ner model"] * 6)
+        self.assertEqual(self.loads, [('ner', {'policy': 'lazy', 'backend': 'pytorch', 'model': 'custom/ner'})])
+
+    def test_preload_loads_preload_policies_and_skips_unavailable(self):
+        registry = ModelRegistry(models={
+            'sentiment': {'policy': 'preload'},
+            'llm': {'policy': 'preload', 'missing': True},
+        })
+
+        with self.assertLogs('nlp.model_registry', 'WARNING'):
+            self.assertEqual(registry.preload(), ['embedding', 'sentiment'])
+        self.assertFalse(registry.is_loaded('ner'))
+        self.assertFalse(registry.is_available('llm'))
+        self.assertEqual(self.warmed, [])
+
+    def test_warmup_runs_once_per_loaded_model(self):
+        registry = ModelRegistry(models={})
+        registry.preload(warmup=True)
+        registry.get('ner')
+        registry.warmup()
+
+        self.assertEqual(self.warmed, ["embedding model", "ner model"])
+        self.assertEqual([row['warmed_up'] for row in registry.report()], [True, True])
+
+
+class OnnxBackendTests(TestCase):
+    def test_token_classifier_merges_word_pieces(self):
+        text = "Acme Corp signed in Paris"
+        labels = {'0': 'O', '1': 'B-ORG', '2': 'I-ORG', '3': 'B-LOC', '4': 'I-LOC'}
+        # [CLS] Acme Corp signed in Par ##is [SEP]
+        offsets = [(0, 0), (0, 4), (5, 9), (10, 16), (17, 19), (20, 23), (23, 25), (0, 0)]
+        predicted = [0, 1, 2, 0, 0, 3, 4, 0]
+        probs = np.full((len(offsets), len(labels)), 0.025, dtype=np.float32)
+        probs[np.arange(len(offsets)), predicted] = 0.9
+
+        entities = OnnxTokenClassifier._aggregate(text, probs, offsets, [1] * len(offsets), labels)
+
+        self.assertEqual(
+            [(entity['entity_group'], entity['start'], entity['end'], entity['word']) for entity in entities],
+            [('ORG', 0, 9, "Acme Corp"), ('LOC', 20, 25, "Paris")],
+        )
+        self.assertAlmostEqual(entities[0]['score'], 0.9, places=5)
+
+    @mock.patch('nlp.onnx_backend.HAVE_ONNXRUNTIME', False)
+    def test_onnx_backend_without_runtime_is_unavailable(self):
+        registry = ModelRegistry(models={'sentiment': {'backend': 'onnx', 'quantize': True}})
+
+        with self.assertRaisesMessage(ModelUnavailable, "onnxruntime"):
+            registry.get('sentiment')
+
+    @override_settings(MODEL_REGISTRY={'ner': {'model': 'custom/ner', 'policy': 'preload'}})
+    def test_benchmark_only_switches_the_backend_of_the_configured_model(self):
+        with mock.patch('nlp.management.commands.benchmark_inference.ModelRegistry') as registry_class:
+            registry_class.return_value.get.side_effect = ModelUnavailable("not installed")
+            out = io.StringIO()
+            call_command('benchmark_inference', 'ner', samples=2, stdout=out)
+
+        configs = [call.kwargs['models']['ner'] for call in registry_class.call_args_list]
+        self.assertEqual(configs, [
+            {'model': 'custom/ner', 'policy': 'preload', 'backend': 'pytorch'},
+            {'model': 'custom/ner', 'policy': 'preload', 'backend': 'onnx', 'quantize': False},
+            {'model': 'custom/ner', 'policy': 'preload', 'backend': 'onnx', 'quantize': True},
+        ])
+        self.assertEqual(out.getvalue().count("skipped"), 3)
+
+
+class FakeSentimentModel:
+    """Negative for passages mentioning lateness, records its batches"""
+
+    def __init__(self):
+        self.batches = []
+
+    def __call__(self, texts, batch_size=None, **options):
+        self.batches.append(list(texts))
+        return [{'label': 'NEGATIVE' if 'late' in text else 'POSITIVE', 'score': 0.9} for text in texts]
+
+
+def fake_ner(texts, batch_size=None):
+    """Every capitalized word is an organization"""
+    return [
+        [{'entity_group': 'ORG', 'start': match.start(), 'end': match.end(), 'score': 0.8}
+         for match in re.finditer(r'\b[A-Z][a-z]+\b', text)]
+        for text in texts
+    ]
+
+
+class AnalysisTests(TestCase):
+    def setUp(self):
+        self.models = {'sentiment': FakeSentimentModel(), 'ner': fake_ner}
+        patcher = mock.patch.object(registry, 'get', side_effect=lambda task: self.models[task])
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_repeated_passages_run_once(self):
+        texts = ["Delivery was late.", "Great service.", "Delivery was late."]
+
+        results = analyze_texts('sentiment', texts)
+        self.assertEqual([result['label'] for result in results], ['NEGATIVE', 'POSITIVE', 'NEGATIVE'])
+        self.assertEqual(analyze_texts('sentiment', texts[::-1]), results[::-1])
+        self.assertEqual(self.models['sentiment'].batches, [["Delivery was late.", "Great service."]])
+
+        # Results of another backend are cached separately
+        with override_settings(MODEL_REGISTRY={'sentiment': {'backend': 'onnx', 'quantize': True}}):
+            self.assertTrue(get_model_id('sentiment').endswith('#onnx-int8'))
+            analyze_texts('sentiment', texts)
+        self.assertEqual(len(self.models['sentiment'].batches), 2)
+
+    def test_document_sentiment_is_weighted_by_length(self):
+        summary = summarize_sentiment(
+            ["a" * 300, "b" * 100], [{'label': 'POSITIVE', 'score': 0.9}, {'label': 'NEGATIVE', 'score': 0.6}]
+        )
+
+        self.assertEqual(summary, {
+            'label': 'POSITIVE', 'score': 0.9, 'distribution': {'POSITIVE': 0.75, 'NEGATIVE': 0.25}, 'passages': 2,
+        })
+        self.assertIsNone(summarize_sentiment([], []))
+
+    def test_endpoint_returns_document_entities_and_text_sentiment(self):
+        document = create_document("Acme delivered late. Globex paid on time.")
+
+        response = self.client.post('/api/nlp/analysis/', {
+            'document_ids': [document.id], 'texts': ["Great service."],
+        }, content_type='application/json')
+
+        self.assertEqual(response.status_code, 200)
+        entities = response.data['documents'][0]['entities']
+        self.assertEqual([(entity['text'], entity['start_char']) for entity in entities], [("Acme", 0), ("Globex", 21)])
+        self.assertEqual(Entity.objects.filter(document=document).count(), 2)
+        self.assertEqual(response.data['documents'][0]['sentiment']['label'], 'NEGATIVE')
+        self.assertEqual(response.data['texts'][0]['sentiment']['label'], 'POSITIVE')
+
+    def test_endpoint_rejects_unknown_tasks_and_reports_missing_models(self):
+        response = self.client.post('/api/nlp/analysis/', {'texts': ["x"], 'tasks': ['summary']},
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+        with mock.patch.object(registry, 'get', side_effect=ModelUnavailable("transformers is not installed")):
+            response = self.client.post('/api/nlp/analysis/', {'texts': ["x"]}, content_type='application/json')
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(set(response.data['errors']), {'ner', 'sentiment'})
+
+
+def fake_encode(texts, batch_size=32):
+    """Unit vectors that only depend on whether a text mentions payment"""
+    vectors = np.array([[1.0, 0.0] if 'pay' in text.lower() else [0.0, 1.0] for text in texts], dtype=np.float32)
+    return vectors
+
+
+def read_events(response):
+    """(event, data) pairs of a server-sent event stream"""
+    events = []
+    for block in b''.join(response.streaming_content).decode('utf-8').split('\n\n'):
+        if block:
+            event, data = block.split('\n', 1)
+            events.append((event[len('event: '):], json.loads(data[len('data: '):])))
+    return events
+
+
+@mock.patch('nlp.conversation.schedule_summary_update', lambda conversation_id: None)
+@mock.patch('nlp.answer_cache.embeddings.encode', fake_encode)
+@mock.patch('nlp.answer_cache.get_answer_model_id', lambda: 'test-model')
+@mock.patch('nlp.llm.llm_available', lambda: False)
+class AnalyzeQueryStreamTests(TestCase):
+    def setUp(self):
+        self.document = create_document("Payment is due within thirty days.")
+        self.passages = [{'chunk_id': 1, 'document_id': self.document.id, 'text': "Payment is due within thirty days."}]
+
+    def ask(self, **data):
+        data = {'query_text': "When is payment due?", 'document_ids': [self.document.id], **data}
+        with mock.patch('nlp.retrieval.retrieve', return_value=self.passages) as retrieve, \
+                mock.patch('nlp.llm.generate_answer', return_value=iter(["Within ", "thirty days."])):
+            response = self.client.post('/api/nlp/analyze/', data, content_type='application/json')
+            self.assertEqual(response['Content-Type'], 'text/event-stream')
+            return read_events(response), retrieve
+
+    def test_events_arrive_in_order(self):
+        events, _ = self.ask(stream=True, cache=False)
+
+        self.assertEqual([event for event, _ in events], ['message', 'sources', 'token', 'token', 'done'])
+        self.assertEqual(events[0][1]['content'], "When is payment due?")
+        self.assertEqual(events[1][1], self.passages)
+        self.assertEqual(events[-1][1]['content'], "Within thirty days.")
+        conversation = Conversation.objects.get()
+        self.assertEqual([message.role for message in conversation.messages.all()], ['user', 'system'])
+
+    def test_cached_answer_is_one_token(self):
+        self.ask(stream=True)
+        events, retrieve = self.ask(stream=True)
+
+        self.assertEqual([event for event, _ in events], ['message', 'sources', 'token', 'done'])
+        self.assertEqual(events[2][1], {'token': "Within thirty days."})
+        self.assertEqual(events[-1][1]['cached']['match'], 'exact')
+        retrieve.assert_not_called()
+
+    def test_errors_end_the_stream(self):
+        with mock.patch('nlp.retrieval.retrieve', side_effect=RuntimeError("index unavailable")):
+            response = self.client.post('/api/nlp/analyze/', {
+                'query_text': "When is payment due?", 'document_ids': [self.document.id],
+            }, content_type='application/json', HTTP_ACCEPT='text/event-stream')
+            events = read_events(response)
+
+        self.assertEqual(events[-1], ('error', {'error': "index unavailable"}))
+        self.assertEqual([event for event, _ in events], ['message', 'error'])
+
+
+class FakeLLM:
+    """Streams the words of its prompt and records what it was asked"""
+
+    def __init__(self):
+        self.prompts = []
+        self.sessions = []
+        self.open_sessions = 0
+
+    @contextmanager
+    def chat_session(self, system_prompt):
+        self.sessions.append(system_prompt)
+        self.open_sessions += 1
+        try:
+            yield self
+        finally:
+            self.open_sessions -= 1
+
+    def generate(self, prompt, max_tokens, streaming, callback):
+        self.prompts.append(prompt)
+        for word in prompt.split()[:max_tokens]:
+            if not callback(0, word):
+                return
+            yield word
+
+
+class LLMSchedulerTests(TestCase):
+    def wait_until(self, condition):
+        deadline = time.monotonic() + 5
+        while not condition():
+            self.assertLess(time.monotonic(), deadline, "Timed out")
+            time.sleep(0.01)
+
+    def test_queued_jobs_run_by_priority_then_arrival(self):
+        scheduler = LLMScheduler(max_concurrent=1, load_fn=FakeLLM)
+        running = scheduler.stream("hold the slot")
+        next(running)
+
+        order = []
+
+        def submit(name, priority):
+            scheduler.generate(name, priority=priority)
+            order.append(name)
+
+        threads = []
+        for name, priority in (('batch-1', BATCH), ('query-1', INTERACTIVE), ('batch-2', BATCH), ('query-2', INTERACTIVE)):
+            thread = threading.Thread(target=submit, args=(name, priority))
+            thread.start()
+            threads.append(thread)
+            # Enqueue in a known order
+            self.wait_until(lambda: scheduler.report()['queued'] == len(threads))
+
+        list(running)
+        for thread in threads:
+            thread.join()
+        self.assertEqual(order, ['query-1', 'query-2', 'batch-1', 'batch-2'])
+        self.assertEqual(scheduler.report()['jobs'], 5)
+
+    def test_disconnect_stops_generation_and_frees_the_slot(self):
+        scheduler = LLMScheduler(max_concurrent=1, load_fn=FakeLLM)
+        metrics = {}
+        stream = scheduler.stream("one two three four five", prefix="Context", metrics=metrics)
+
+        self.assertEqual(next(stream), "one")
+        self.assertEqual(scheduler.report()['busy_slots'], 1)
+        stream.close()
+
+        report = scheduler.report()
+        self.assertEqual((report['busy_slots'], report['jobs']), (0, 1))
+        self.assertEqual(metrics['tokens'], 1)
+        self.assertEqual(scheduler.generate("next job"), "nextjob")
+
+    def test_each_job_gets_its_own_session(self):
+        scheduler = LLMScheduler(max_concurrent=1, load_fn=FakeLLM)
+
+        scheduler.generate("first question", prefix="Shared context")
+        scheduler.generate("second question", prefix="Shared context")
+        scheduler.generate("no prefix")
+
+        model = scheduler._slots[0].model
+        self.assertEqual(model.sessions, ["Shared context", "Shared context"])
+        self.assertEqual(model.open_sessions, 0)
+        self.assertEqual(model.prompts, ["first question", "second question", "no prefix"])
+
+
+@mock.patch('nlp.answer_cache.embeddings.encode', fake_encode)
+@mock.patch('nlp.answer_cache.get_answer_model_id', lambda: 'test-model')
+class AnswerCacheTests(TestCase):
+    def setUp(self):
+        self.cache = AnswerCache(similarity=0.95, max_entries=100)
+        self.document = create_document("Payment is due within thirty days.")
+
+    def test_exact_and_semantic_matches(self):
+        self.cache.store("When is payment due?", [self.document.id], "Within thirty days.", [{'id': 1}])
+
+        answer, vector = self.cache.lookup("  when is PAYMENT due ", [self.document.id])
+        self.assertEqual((answer['match'], answer['content']), ('exact', "Within thirty days."))
+        self.assertIsNone(vector)
+
+        answer, _ = self.cache.lookup("Payment deadline?", [self.document.id])
+        self.assertEqual(answer['match'], 'semantic')
+
+        answer, vector = self.cache.lookup("Who signs the contract?", [self.document.id])
+        self.assertIsNone(answer)
+        self.assertEqual(vector.shape, (2,))
+        self.assertEqual(self.cache.stats, {'exact_hits': 1, 'semantic_hits': 1, 'misses': 1})
+
+    def test_answers_are_scoped_to_the_selection(self):
+        other = create_document("Unrelated text.")
+        self.cache.store("When is payment due?", [self.document.id], "Within thirty days.", [])
+
+        self.assertIsNone(self.cache.lookup("When is payment due?", [self.document.id, other.id])[0])
+        self.assertIsNone(self.cache.lookup("When is payment due?", [])[0])
+        self.assertEqual(get_scope([2, 1, 2]), get_scope([1, 2]))
+
+    def test_invalidate_and_evict(self):
+        self.cache.store("When is payment due?", [self.document.id], "Within thirty days.", [])
+        self.cache.store("Payment terms overall?", [], "Thirty days.", [])
+        other = create_document("Unrelated text.")
+        self.cache.store("What is this?", [other.id], "Unrelated.", [])
+
+        # Answers over every document depend on any document
+        self.assertEqual(self.cache.invalidate_document(self.document.id), 2)
+        self.assertIsNotNone(self.cache.lookup("What is this?", [other.id])[0])
+
+        # A tiny cap is checked on every store, least recently used first
+        small = AnswerCache(similarity=0.95, max_entries=2)
+        for i in range(3):
+            small.store(f"Question {i}?", [other.id], "Answer.", [])
+        self.assertEqual(
+            sorted(AnswerCacheEntry.objects.values_list('query_text', flat=True)), ["Question 1?", "Question 2?"]
+        )
+
+
+class RetrievalFanOutTests(TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.index = VectorIndex(self.path)
+        # 600 passages of 30 documents
+        vectors = unit_vectors(600, seed=4)
+        self.index.build([(np.arange(600) + 1, np.arange(600) // 20 + 1, vectors)], 600, 16, 'test-model', nlist=4)
+        self.query = unit_vectors(1, seed=5)[0]
+        self.selection = list(range(1, 31, 2))
+
+    def tearDown(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def expected(self, top_k, max_per_document):
+        hits = self.index.search(self.query, k=600, document_ids=self.selection)
+        return merge_top_k([hits], top_k, max_per_document)
+
+    def test_shards_merge_to_the_single_search_result(self):
+        with override_settings(RETRIEVAL_SHARD_SIZE=4):
+            hits = search_documents(self.query, self.selection, top_k=10, index=self.index)
+
+        self.assertEqual(hits, self.expected(10, 1))
+        self.assertEqual(len({document_id for _, _, document_id in hits}), 10)
+
+    def test_large_selection_takes_one_probed_pass(self):
+        with override_settings(RETRIEVAL_EXACT_ROWS=0), mock.patch.object(
+            self.index, 'search', wraps=self.index.search
+        ) as search:
+            hits = search_documents(self.query, self.selection, top_k=10, index=self.index)
+
+        self.assertEqual(search.call_count, 1)
+        self.assertEqual(search.call_args.kwargs['exact_limit'], 0)
+        # Every list is probed, so the result is exact
+        self.assertEqual(hits, self.expected(10, 1))
+
+    def test_few_documents_share_the_top_k(self):
+        hits = search_documents(self.query, [3, 4], top_k=6, index=self.index)
+
+        self.assertEqual(sorted(document_id for _, _, document_id in hits), [3, 3, 3, 4, 4, 4])
+
+    def test_per_document_cap_is_lifted_to_fill_slots(self):
+        hits = [(0.9, 1, 10), (0.8, 2, 10), (0.7, 3, 10), (0.6, 4, 11)]
+
+        capped = merge_top_k([hits], top_k=3, max_per_document=1)
+        self.assertEqual([chunk_id for _, chunk_id, _ in capped], [1, 2, 4])
+        self.assertEqual(len(merge_top_k([hits], top_k=10, max_per_document=1)), 4)
+
+
+class BM25SegmentTests(TestCase):
+    def test_rare_terms_and_term_frequency_rank_higher(self):
+        segment = BM25Segment.build([
+            (1, 10, "payment terms and payment schedule"),
+            (2, 10, "delivery terms"),
+            (3, 11, "payment"),
+            (4, 11, "warranty and liability"),
+        ])
+        self.assertEqual(len(segment), 4)
+        self.assertEqual(segment.document_frequency('payment'), 2)
+        self.assertEqual(segment.document_frequency('missing'), 0)
+
+        idf = {'payment': 1.0, 'warranty': 2.0}
+        scores = segment.score(['payment', 'warranty'], idf, segment.avgdl, 1.2, 0.75)
+        self.assertEqual(scores[1], 0)
+        self.assertGreater(scores[3], scores[0])
+        self.assertGreater(scores[0], 0)
+
+
+class BM25IndexTests(TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.index = BM25Index(self.path)
+
+    def tearDown(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def test_search_covers_built_changed_and_deleted_documents(self):
+        payment = create_document("Late payment incurs a penalty of two percent per month.")
+        delivery = create_document("Delivery happens within thirty days of the order.")
+        meta = self.index.build()
+
+        self.assertTrue(self.index.built)
+        self.assertEqual(meta['passages'], 2)
+        hits = self.index.search("payment penalty")
+        self.assertEqual([hit[2] for hit in hits], [payment.id])
+
+        # A reprocessed document is served from the delta, not the stale segment
+        chunk_document(delivery, "Delivery is late: a penalty applies after thirty days.", max_tokens=50, overlap=0)
+        self.index.mark_changed(delivery.id)
+        self.assertEqual(self.index.pending_documents(), [delivery.id])
+        self.assertEqual({hit[2] for hit in self.index.search("penalty")}, {payment.id, delivery.id})
+        self.assertEqual(self.index.search("order"), [])
+
+        self.index.mark_deleted(payment.id)
+        self.assertEqual([hit[2] for hit in self.index.search("penalty")], [delivery.id])
+        self.assertEqual([hit[2] for hit in self.index.search("penalty", document_ids=[payment.id])], [])
+
+        # A rebuild folds the change log into the new segment
+        payment.chunks.all().delete()
+        self.index.build()
+        stats = self.index.stats()
+        self.assertEqual((stats['pending_documents'], stats['deleted_documents']), (0, 0))
+        self.assertEqual([hit[2] for hit in self.index.search("penalty")], [delivery.id])
+
+    def test_search_before_build_uses_change_log(self):
+        document = create_document("Confidential information must not be disclosed.")
+
+        self.assertFalse(self.index.built)
+        self.assertEqual(self.index.search("confidential"), [])
+        self.index.mark_changed(document.id)
+        self.assertEqual([hit[2] for hit in self.index.search("confidential")], [document.id])
+
+
+class RankFusionTests(TestCase):
+    def test_passages_ranked_by_both_retrievers_come_first(self):
+        rankings = {
+            'vector': [(0.9, 1, 10), (0.8, 2, 10), (0.7, 3, 11)],
+            'bm25': [(12.0, 3, 11), (9.0, 4, 12), (5.0, 1, 10)],
+        }
+        hits, components = fuse_rankings(rankings, top_k=4, rrf_k=60)
+
+        self.assertEqual([chunk_id for _, chunk_id, _ in hits][:2], [1, 3])
+        self.assertAlmostEqual(hits[0][0], 1 / 61 + 1 / 63)
+        self.assertEqual(components[3], {'vector': 0.7, 'bm25': 12.0})
+        self.assertEqual(components[4], {'bm25': 9.0})
+
+
+class ConversationPagingTests(TestCase):
+    def setUp(self):
+        self.conversation = Conversation.objects.create(title='Contract questions')
+        self.messages = [
+            add_message(self.conversation, 'user' if i % 2 == 0 else 'system', f"Message {i}")
+            for i in range(7)
+        ]
+
+    def test_pages_walk_back_and_forward_without_gaps(self):
+        page, has_more = history_page(self.conversation, limit=3)
+        self.assertEqual([message.content for message in page], ["Message 4", "Message 5", "Message 6"])
+        self.assertTrue(has_more)
+
+        seen = list(page)
+        while has_more:
+            page, has_more = history_page(self.conversation, before=seen[0].id, limit=3)
+            seen = page + seen
+        self.assertEqual(seen, self.messages)
+
+        page, has_more = history_page(self.conversation, after=self.messages[1].id, limit=4)
+        self.assertEqual(page, self.messages[2:6])
+        self.assertTrue(has_more)
+        page, has_more = history_page(self.conversation, after=self.messages[5].id, limit=4)
+        self.assertEqual((page, has_more), ([self.messages[6]], False))
+
+    def test_page_cost_does_not_depend_on_position(self):
+        with self.assertNumQueries(1):
+            history_page(self.conversation, before=self.messages[1].id, limit=2)
+
+
+class ConversationContextTests(TestCase):
+    def setUp(self):
+        self.conversation = Conversation.objects.create(title='Contract questions')
+
+    def test_trim_middle_keeps_both_ends(self):
+        text = "opening " + "x" * 200 + " conclusion"
+        trimmed = trim_middle(text, 60)
+
+        self.assertEqual(len(trimmed), 60)
+        self.assertTrue(trimmed.startswith("opening"))
+        self.assertTrue(trimmed.endswith("conclusion"))
+        self.assertIn(TRIM_MARKER, trimmed)
+        self.assertEqual(trim_middle("short", 60), "short")
+
+    def test_new_conversation_has_no_context(self):
+        context = build_context(self.conversation)
+
+        self.assertEqual((context['text'], context['turns']), ("", []))
+
+    def test_context_fits_budget_and_keeps_latest_question(self):
+        add_message(self.conversation, 'user', "An old question about termination?")
+        add_message(self.conversation, 'system', "An old answer. " * 40)
+        add_message(self.conversation, 'user', "What is the late payment penalty?")
+        add_message(self.conversation, 'system', "The penalty is two percent. " + "Details. " * 200 + "In short: 2%.")
+        self.conversation.summary = "Earlier the user asked about parties."
+        self.conversation.save()
+
+        context = build_context(self.conversation, max_turns=4, token_budget=200)
+
+        self.assertLessEqual(len(context['text']), 200 * CHARS_PER_TOKEN)
+        self.assertTrue(context['text'].startswith("Summary of earlier turns: Earlier the user"))
+        roles = [role for role, _ in context['turns']]
+        self.assertEqual(roles[-2:], ['user', 'system'])
+        self.assertEqual(context['turns'][-2][1], "What is the late payment penalty?")
+        answer = context['turns'][-1][1]
+        self.assertTrue(answer.startswith("The penalty is two percent."))
+        self.assertTrue(answer.endswith("In short: 2%."))
+        self.assertIn(f"{PROMPT_LABELS['system']}: {answer}", context['text'])
+
+    def test_window_limits_turns_read(self):
+        for i in range(10):
+            add_message(self.conversation, 'user', f"Question {i}?")
+
+        context = build_context(self.conversation, max_turns=3, token_budget=1000)
+        self.assertEqual([content for _, content in context['turns']], ["Question 7?", "Question 8?", "Question 9?"])
+
+
+@override_settings(CONVERSATION_SUMMARY_TOKENS=10)
+class ConversationSummaryBudgetTests(TestCase):
+    def test_oversized_summary_keeps_its_end(self):
+        conversation = Conversation.objects.create(summary="old " * 100 + "latest point")
+
+        context = build_context(conversation, token_budget=100)
+        self.assertEqual(len(context['summary']), 10 * CHARS_PER_TOKEN)
+        self.assertTrue(context['summary'].endswith("latest point"))
+
+
+def ranked_passages(document_ids, per_document=3, length=400):
+    """Passages of each document, best first, rank by rank"""
+    return [
+        {'chunk_id': document_id * 100 + rank, 'document_id': document_id, 'index': rank,
+         'text': f"{document_id}.{rank} " + "x" * length, 'score': 1.0 / (rank + 1)}
+        for rank in range(per_document)
+        for document_id in document_ids
+    ]
+
+
+@override_settings(CHUNK_MAX_TOKENS=100)
+class AssembleContextTests(TestCase):
+    def test_budget_is_shared_between_documents(self):
+        passages = [
+            {'document_id': 1, 'text': "a" * 100},
+            {'document_id': 2, 'text': "b" * 1000},
+            {'document_id': 2, 'text': "c" * 1000},
+            {'document_id': 3, 'text': "d" * 1000},
+        ]
+
+        texts = split_context_budget(passages, context_chars=1500)
+        self.assertEqual([len(text) for text in texts], [100, 700, 0, 700])
+
+    def test_every_document_gets_a_passage_in_document_order(self):
+        document_ids = list(range(30, 0, -1))
+        with mock.patch('nlp.retrieval.retrieve', return_value=ranked_passages(document_ids)) as retrieve:
+            selected = assemble_context("Scope of work", document_ids, token_budget=1500)
+
+        self.assertGreaterEqual(retrieve.call_args.kwargs['top_k'], 30)
+        self.assertEqual([passage['document_id'] for passage in selected], document_ids)
+        self.assertLessEqual(sum(len(passage['text']) for passage in selected), 1500 * CHARS_PER_TOKEN)
+        self.assertTrue(all(len(passage['text']) >= 100 for passage in selected))
+
+    def test_small_budget_keeps_the_best_ranked_documents(self):
+        document_ids = list(range(1, 31))
+        with mock.patch('nlp.retrieval.retrieve', return_value=ranked_passages(document_ids[::-1])), \
+                self.assertLogs('nlp.retrieval', 'WARNING') as logs:
+            selected = assemble_context("Scope of work", document_ids, token_budget=100)
+
+        self.assertEqual(sorted({passage['document_id'] for passage in selected}), [27, 28, 29, 30])
+        self.assertIn("26 of 30 reference documents", logs.output[0])
+
+    def test_short_documents_leave_room_for_others(self):
+        passages = ranked_passages([1], per_document=1, length=50) + ranked_passages([2], per_document=3, length=900)
+        passages.sort(key=lambda passage: passage['index'])
+        with mock.patch('nlp.retrieval.retrieve', return_value=passages):
+            selected = assemble_context("Scope of work", [1, 2], token_budget=500)
+
+        self.assertEqual([(passage['document_id'], passage['index']) for passage in selected],
+                         [(1, 0), (2, 0), (2, 1), (2, 2)])
+        self.assertEqual(selected[0]['text'], passages[0]['text'])
+        self.assertEqual(sum(len(passage['text']) for passage in selected), 500 * CHARS_PER_TOKEN)
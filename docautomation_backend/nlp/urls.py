@@ -1,37 +1,222 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from rest_framework.decorators import api_view, permission_classes
+from rest_framework.decorators import api_view, permission_classes, renderer_classes
+from rest_framework.renderers import BaseRenderer
+from rest_framework.settings import api_settings
+from django.conf import settings
+from django.http import StreamingHttpResponse
 from rest_framework.permissions import IsAuthenticated, AllowAny
 from rest_framework.response import Response
 from rest_framework import status
 import json
-from datetime import datetime
+import logging
 
-# Simple view for conversations
-@api_view(['GET'])
+# Configure logging
+logger = logging.getLogger(__name__)
+
+def _page_params(request):
+    """Keyset cursors and page size from the query string; raises ValueError if malformed"""
+    params = {}
+    for name in ('before', 'after', 'limit'):
+        value = request.query_params.get(name)
+        if value not in (None, ''):
+            params[name] = int(value)
+    return params
+
+def _message_page(conversation, request):
+    from .conversation import history_page, serialize_message
+    messages, has_more = history_page(conversation, **_page_params(request))
+    cursor_name = 'next_after' if request.query_params.get('after') else 'next_before'
+    cursor = None
+    if has_more and messages:
+        cursor = messages[-1].id if cursor_name == 'next_after' else messages[0].id
+    return {
+        'messages': [serialize_message(message, conversation.document_id) for message in messages],
+        'has_more': has_more,
+        cursor_name: cursor,
+    }
+
+@api_view(['GET', 'POST'])
 @permission_classes([AllowAny])
 def conversation_list(request):
     """
-    List conversations for a document or all conversations
+    List conversations for a document or all conversations, or start one
+
+    Conversations are listed most recently active first; `limit` caps the
+    number returned. POST takes a title and optional document_ids.
     """
     print("Conversation list endpoint called")
+    from .conversation import MAX_PAGE_SIZE, serialize_conversation
+    from .models import Conversation
+
+    if request.method == 'POST':
+        data = request.data
+        try:
+            document_ids = [int(doc_id) for doc_id in data.get('document_ids', [])]
+        except (TypeError, ValueError):
+            return Response(
+                {'error': 'document_ids must be a list of document IDs'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        conversation = Conversation.objects.create(
+            document_id=document_ids[0] if document_ids else None,
+            document_ids=document_ids,
+            title=str(data.get('title', ''))[:255],
+        )
+        return Response(serialize_conversation(conversation), status=status.HTTP_201_CREATED)
+
     document_id = request.query_params.get('document_id')
-    
-    # For now, return an empty list - we'll implement actual conversation storage later
+    try:
+        limit = min(int(request.query_params.get('limit') or MAX_PAGE_SIZE), MAX_PAGE_SIZE)
+    except ValueError:
+        return Response({'error': 'limit must be an integer'}, status=status.HTTP_400_BAD_REQUEST)
+
+    conversations = Conversation.objects.order_by('-updated_at')
     if document_id:
         print(f"Getting conversations for document {document_id}")
-        return Response([])
-    else:
-        return Response([])
+        conversations = conversations.filter(document_id=document_id)
+    return Response([serialize_conversation(conversation) for conversation in conversations[:limit]])
+
+@api_view(['GET'])
+@permission_classes([AllowAny])
+def conversation_detail(request, conversation_id):
+    """A conversation with its latest messages; older ones via `before`"""
+    from .conversation import serialize_conversation
+    from .models import Conversation
+
+    try:
+        conversation = Conversation.objects.get(id=conversation_id)
+        response = serialize_conversation(conversation)
+        response.update(_message_page(conversation, request))
+    except Conversation.DoesNotExist:
+        return Response({'error': 'Conversation not found'}, status=status.HTTP_404_NOT_FOUND)
+    except ValueError:
+        return Response({'error': 'before, after and limit must be integers'}, status=status.HTTP_400_BAD_REQUEST)
+    return Response(response)
+
+@api_view(['GET'])
+@permission_classes([AllowAny])
+def conversation_messages(request, conversation_id):
+    """
+    Page through a conversation's messages
+
+    Without cursors the latest page is returned. Pass `before=<next_before>`
+    for older messages, or `after=<message id>` for newer ones.
+    """
+    from .models import Conversation
+
+    try:
+        conversation = Conversation.objects.only('id', 'document_id').get(id=conversation_id)
+        return Response(_message_page(conversation, request))
+    except Conversation.DoesNotExist:
+        return Response({'error': 'Conversation not found'}, status=status.HTTP_404_NOT_FOUND)
+    except ValueError:
+        return Response({'error': 'before, after and limit must be integers'}, status=status.HTTP_400_BAD_REQUEST)
 
 @api_view(['POST'])
 @permission_classes([AllowAny])
+def conversation_add_message(request, conversation_id):
+    """Append a message (role 'user' or 'system') to a conversation"""
+    from .conversation import add_message, normalize_role, schedule_summary_update, serialize_message
+    from .models import Conversation
+
+    try:
+        conversation = Conversation.objects.get(id=conversation_id)
+    except Conversation.DoesNotExist:
+        return Response({'error': 'Conversation not found'}, status=status.HTTP_404_NOT_FOUND)
+    role = normalize_role(request.data.get('role', 'user'))
+    content = request.data.get('content', '')
+    if role is None:
+        return Response({'error': "role must be 'user' or 'system'"}, status=status.HTTP_400_BAD_REQUEST)
+    if not content:
+        return Response({'error': 'No content provided'}, status=status.HTTP_400_BAD_REQUEST)
+    message = add_message(conversation, role, content)
+    schedule_summary_update(conversation.id)
+    return Response(serialize_message(message, conversation.document_id), status=status.HTTP_201_CREATED)
+
+class EventStreamRenderer(BaseRenderer):
+    """Lets clients send `Accept: text/event-stream` to the streaming endpoints"""
+    media_type = 'text/event-stream'
+    format = 'sse'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return json.dumps(data)
+
+def _save_answer(conversation, content, passages):
+    """Store the system response and fold old turns into the summary"""
+    from .conversation import add_message, schedule_summary_update
+    message = add_message(conversation, 'system', content, passages)
+    schedule_summary_update(conversation.id)
+    return message
+
+def stream_query_answer(query_text, document_ids, conversation, user_message, history='', use_cache=True):
+    """
+    Server-sent events for a streamed answer
+
+    Emits `message` (the stored user message) right away, then `sources`
+    once retrieval is done, one `token` event per generated piece of the
+    answer, and finally `done` with the stored system response. A cached
+    answer is sent as a single `token` event.
+    """
+    from .answer_cache import get_answer_cache
+    from .conversation import serialize_message
+    from .llm import generate_answer, sse_event
+    from .retrieval import retrieve
+
+    yield sse_event('message', serialize_message(user_message, conversation.document_id))
+    metrics = {}
+    try:
+        cached, query_vector = get_answer_cache().lookup(query_text, document_ids) if use_cache else (None, None)
+        if cached:
+            passages = cached['sources']
+            yield sse_event('sources', passages)
+            content = [cached['content']]
+            yield sse_event('token', {'token': cached['content']})
+        else:
+            passages = retrieve(query_text, document_ids=document_ids or None, query_vector=query_vector)
+            yield sse_event('sources', passages)
+            content = []
+            for token in generate_answer(query_text, passages, metrics=metrics, history=history):
+                content.append(token)
+                yield sse_event('token', {'token': token})
+            if use_cache:
+                get_answer_cache().store(query_text, document_ids, ''.join(content), passages, query_vector)
+        system_message = _save_answer(conversation, ''.join(content), passages)
+    except Exception as e:
+        logger.error(f"Error in streamed analyze query: {str(e)}")
+        yield sse_event('error', {'error': str(e)})
+        return
+    system_response = serialize_message(system_message, conversation.document_id)
+    if metrics:
+        system_response['generation'] = metrics
+    if cached:
+        system_response['cached'] = {'match': cached['match'], 'similarity': cached['similarity']}
+    yield sse_event('done', system_response)
+
+@api_view(['POST'])
+@permission_classes([AllowAny])
+@renderer_classes(api_settings.DEFAULT_RENDERER_CLASSES + [EventStreamRenderer])
 def analyze_query(request):
     """
     Analyze a user query against document(s)
+
+    The query and its answer are stored in a conversation: the one given
+    by `conversation_id`, otherwise the latest conversation of the first
+    document (or a new one). The last turns and a rolling summary of the
+    earlier ones are passed to the LLM with the query.
+
+    Send `"stream": true` (or `Accept: text/event-stream`) to receive the
+    answer as server-sent events while it is generated. Answers are cached
+    per document selection, except LLM answers to follow-up questions; send
+    `"cache": false` to bypass the cache.
     """
     print("Analyze query endpoint called")
     try:
+        from .conversation import add_message, build_context, get_conversation, serialize_message
+        from .llm import llm_available
+        from .models import Conversation
+
         data = request.data
         print(f"Query data: {data}")
         
@@ -46,26 +231,72 @@ def analyze_query(request):
             
         print(f"Processing query: {query_text}")
         print(f"For documents: {document_ids}")
-        
-        # Generate a simple response for now
-        current_time = datetime.now().isoformat()
+
+        try:
+            document_ids = [int(doc_id) for doc_id in document_ids]
+        except (TypeError, ValueError):
+            return Response(
+                {'error': 'document_ids must be a list of document IDs'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        try:
+            conversation = get_conversation(data.get('conversation_id'), document_ids, title=query_text[:100])
+        except (ValueError, Conversation.DoesNotExist):
+            return Response({'error': 'Conversation not found'}, status=status.HTTP_404_NOT_FOUND)
+        # Only the last turns and a summary of the rest, so long sessions
+        # keep a bounded prompt
+        context = build_context(conversation)
+        user_message = add_message(conversation, 'user', query_text)
+        logger.info(f"Conversation {conversation.id}: {len(context['turns'])} turns, ~{context['tokens']} tokens of history")
+
+        stream = str(data.get('stream', request.query_params.get('stream', ''))).lower() in ('1', 'true')
+        # LLM answers to follow-ups depend on the conversation, so only the
+        # opening query of a conversation can be shared through the cache
+        use_cache = (
+            getattr(settings, 'ANSWER_CACHE_ENABLED', True)
+            and str(data.get('cache', True)).lower() not in ('0', 'false')
+            and (not context['text'] or not llm_available())
+        )
+        if stream or request.accepted_media_type == EventStreamRenderer.media_type:
+            response = StreamingHttpResponse(
+                stream_query_answer(
+                    query_text, document_ids, conversation, user_message,
+                    history=context['text'], use_cache=use_cache,
+                ),
+                content_type='text/event-stream'
+            )
+            response['Cache-Control'] = 'no-cache'
+            # Stop nginx from buffering the stream
+            response['X-Accel-Buffering'] = 'no'
+            return response
+
+        # Repeated (or near-identical) questions are answered from the cache
+        from .answer_cache import get_answer_cache
+        from .llm import generate_answer
+        from .retrieval import retrieve
+        cached, query_vector = get_answer_cache().lookup(query_text, document_ids) if use_cache else (None, None)
+        metrics = {}
+        if cached:
+            content, passages = cached['content'], cached['sources']
+        else:
+            # Retrieve the passages most relevant to the query
+            passages = retrieve(query_text, document_ids=document_ids or None, query_vector=query_vector)
+            content = ''.join(generate_answer(query_text, passages, metrics=metrics, history=context['text']))
+            if use_cache:
+                get_answer_cache().store(query_text, document_ids, content, passages, query_vector)
+        system_message = _save_answer(conversation, content, passages)
         
         # Create response with both user message and system response
+        system_response = serialize_message(system_message, conversation.document_id)
+        if metrics:
+            system_response['generation'] = metrics
+        if cached:
+            system_response['cached'] = {'match': cached['match'], 'similarity': cached['similarity']}
         response = {
-            'userMessage': {
-                'id': f'user-{int(datetime.now().timestamp())}',
-                'document_id': document_ids[0] if document_ids else None,
-                'content': query_text,
-                'sender': 'user',
-                'timestamp': current_time
-            },
-            'systemResponse': {
-                'id': f'system-{int(datetime.now().timestamp())}',
-                'document_id': document_ids[0] if document_ids else None,
-                'content': f"I've processed your query: '{query_text}'. This is a placeholder response from the document automation system.",
-                'sender': 'system',
-                'timestamp': current_time
-            }
+            'conversationId': conversation.id,
+            'userMessage': serialize_message(user_message, conversation.document_id),
+            'systemResponse': system_response,
         }
         
         return Response(response)
@@ -79,15 +310,104 @@ def analyze_query(request):
             status=status.HTTP_500_INTERNAL_SERVER_ERROR
         )
 
+@api_view(['POST'])
+@permission_classes([AllowAny])
+def analyze_documents(request):
+    """
+    Named entities and sentiment for documents and/or raw texts
+
+    Request body: document_ids (list), texts (list), tasks (subset of
+    'ner' and 'sentiment', default both) and refresh (re-extract stored
+    entities). Passage results are cached by text hash, so repeated
+    requests are served from the database.
+    """
+    logger.info("Analyze documents endpoint called")
+    from document_processing.models import Document
+    from .analysis import TASKS, analyze_texts, document_entities, document_sentiment
+    from .model_registry import ModelUnavailable
+
+    data = request.data
+    document_ids = data.get('document_ids', [])
+    texts = data.get('texts', [])
+    tasks = data.get('tasks') or list(TASKS)
+    refresh = bool(data.get('refresh', False))
+
+    try:
+        document_ids = [int(doc_id) for doc_id in document_ids]
+    except (TypeError, ValueError):
+        return Response(
+            {'error': 'document_ids must be a list of document IDs'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    if not isinstance(texts, list) or not all(isinstance(text, str) for text in texts):
+        return Response({'error': 'texts must be a list of strings'}, status=status.HTTP_400_BAD_REQUEST)
+    if not document_ids and not texts:
+        return Response({'error': 'No document_ids or texts provided'}, status=status.HTTP_400_BAD_REQUEST)
+    unknown = [task for task in tasks if task not in TASKS]
+    if unknown:
+        return Response(
+            {'error': f"Unknown tasks: {', '.join(map(str, unknown))}"},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    documents = Document.objects.only('id').in_bulk(document_ids)
+    missing = [doc_id for doc_id in document_ids if doc_id not in documents]
+    if missing:
+        return Response(
+            {'error': f"Documents not found: {', '.join(map(str, missing))}"},
+            status=status.HTTP_404_NOT_FOUND
+        )
+
+    document_results = [{'document_id': doc_id} for doc_id in dict.fromkeys(document_ids)]
+    text_results = [{} for _ in texts]
+    errors = {}
+    for task in tasks:
+        try:
+            if task == 'ner':
+                for result in document_results:
+                    result['entities'] = document_entities(documents[result['document_id']], refresh=refresh)
+                for result, entities in zip(text_results, analyze_texts('ner', texts)):
+                    result['entities'] = entities
+            else:
+                for result in document_results:
+                    result['sentiment'] = document_sentiment(documents[result['document_id']])
+                for result, sentiment in zip(text_results, analyze_texts('sentiment', texts)):
+                    result['sentiment'] = sentiment
+        except ModelUnavailable as e:
+            errors[task] = str(e)
+
+    if len(errors) == len(set(tasks)):
+        return Response({'errors': errors}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+    response = {'documents': document_results, 'texts': text_results}
+    if errors:
+        response['errors'] = errors
+    return Response(response)
+
+@api_view(['GET'])
+@permission_classes([AllowAny])
+def llm_stats(request):
+    """Queue wait, tokens/sec and slot usage of this worker's LLM scheduler"""
+    from .scheduler import get_llm_scheduler
+    return Response(get_llm_scheduler().report())
+
 # Create a router
 router = DefaultRouter()
 
 urlpatterns = [
     # Conversation endpoints
     path('conversation/', conversation_list, name='conversation-list'),
+    path('conversation/<int:conversation_id>/', conversation_detail, name='conversation-detail'),
+    path('conversation/<int:conversation_id>/messages/', conversation_messages, name='conversation-messages'),
+    path('conversation/<int:conversation_id>/add_message/', conversation_add_message, name='conversation-add-message'),
     
     # Query analysis endpoint
     path('analyze/', analyze_query, name='analyze-query'),
+
+    # Entity and sentiment analysis endpoint
+    path('analysis/', analyze_documents, name='analyze-documents'),
+
+    # LLM scheduler metrics
+    path('llm/stats/', llm_stats, name='llm-stats'),
     
     # Include router URLs
     path('', include(router.urls)),
@@ -0,0 +1,637 @@
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+from contextlib import contextmanager
+
+import numpy as np
+from django.conf import settings
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+try:
+    import fcntl
+    HAVE_FCNTL = True
+except ImportError:
+    HAVE_FCNTL = False
+
+DEFAULT_NPROBE = 16
+# Filtered searches touching at most this many rows skip the IVF lists and
+# score every row of the requested documents exactly
+EXACT_SEARCH_LIMIT = 50000
+ASSIGN_BLOCK_SIZE = 65536
+KMEANS_ITERATIONS = 10
+KMEANS_SAMPLES_PER_LIST = 64
+
+MAIN_DIR = 'main'
+DELTA_FILE = 'delta.json'
+ROW_DTYPE = np.dtype([('chunk_id', '<i8'), ('document_id', '<i8'), ('batch', '<i8')])
+# Dead delta rows (of replaced or removed documents) tolerated before compaction
+DELTA_COMPACT_ROWS = 10000
+META_FILE = 'meta.json'
+LOCK_FILE = '.lock'
+
+
+def spherical_kmeans(vectors, nlist, iterations=KMEANS_ITERATIONS, seed=0):
+    """
+    Cluster unit vectors by cosine similarity
+
+    Args:
+        vectors (numpy.ndarray): (n, dim) float32 unit vectors
+        nlist (int): Number of clusters
+        iterations (int): Lloyd iterations
+
+    Returns:
+        numpy.ndarray: (nlist, dim) float32 unit centroids
+    """
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), nlist, replace=False)].copy()
+    for _ in range(iterations):
+        assignment = np.argmax(vectors @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignment, vectors)
+        counts = np.bincount(assignment, minlength=nlist)
+        # Re-seed empty clusters from random points so every list is used
+        empty = np.flatnonzero(counts == 0)
+        if len(empty):
+            sums[empty] = vectors[rng.choice(len(vectors), len(empty), replace=False)]
+        norms = np.linalg.norm(sums, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        centroids = sums / norms
+    return centroids.astype(np.float32)
+
+
+def _top_k(scores, k):
+    """Indices of the k largest scores, best first"""
+    if len(scores) <= k:
+        return np.argsort(-scores, kind='stable')
+    top = np.argpartition(-scores, k - 1)[:k]
+    return top[np.argsort(-scores[top], kind='stable')]
+
+
+class _Snapshot:
+    """
+    Segments loaded together from one on-disk state
+
+    A reload builds a new snapshot and swaps it in with a single assignment,
+    so a search that took one never mixes one state's main segment with
+    another's delta. Snapshots are not modified once built.
+    """
+
+    def __init__(self, main, delta, meta, signature):
+        self.main = main
+        self.delta = delta
+        self.meta = meta
+        self.signature = signature
+
+
+class VectorIndex:
+    """
+    Memory-mapped IVF index over passage embeddings
+
+    The main segment stores float16 unit vectors grouped by their nearest
+    coarse centroid, so a query only scores the rows of the `nprobe` closest
+    lists. Vectors for newly processed documents go to a small delta segment
+    that is searched exhaustively until the next rebuild folds it in; main
+    rows of documents that have been re-indexed since are masked out.
+
+    The delta is append-only: indexing a document appends its rows and
+    rewrites only the small delta.json, which records how many rows are
+    committed and which batch of rows is live for each document. Rows of
+    replaced or removed documents are dropped when the delta is compacted.
+
+    Segments built with another embedding model than `model_id` are not
+    searched: their vectors are not comparable with the query's.
+
+    Files under the index directory:
+        main/vectors.npy      (n, dim) float16, rows sorted by list
+        main/chunk_ids.npy    (n,) int64
+        main/document_ids.npy (n,) int64
+        main/centroids.npy    (nlist, dim) float32
+        main/list_offsets.npy (nlist + 1,) int64, row range of each list
+        main/doc_order.npy    (n,) int64, rows ordered by document id
+        main/doc_sorted.npy   (n,) int64, document ids in that order
+        main/meta.json        model id, dimension and counts
+        delta.json            model id, dimension, committed rows, live
+                              batch per document, stale_documents
+        delta-<generation>.vectors  appended float16 rows
+        delta-<generation>.rows     appended (chunk_id, document_id, batch) rows
+    """
+
+    def __init__(self, path, model_id=None):
+        self.path = str(path)
+        self.model_id = model_id
+        self._lock = threading.Lock()
+        self._snapshot = None
+        self.model_mismatch = None
+
+    @property
+    def meta(self):
+        """Metadata of the loaded main segment"""
+        return self._ensure_loaded().meta
+
+    # Loading
+
+    def _signature(self):
+        """Identity of the on-disk segments' metadata files, used to detect changes"""
+        signature = []
+        for name in (os.path.join(MAIN_DIR, META_FILE), DELTA_FILE):
+            try:
+                stat = os.stat(os.path.join(self.path, name))
+                signature.append((stat.st_ino, stat.st_mtime_ns))
+            except FileNotFoundError:
+                signature.append(None)
+        return tuple(signature)
+
+    def _ensure_loaded(self):
+        """The current snapshot, reloaded if the segments changed on disk"""
+        signature = self._signature()
+        snapshot = self._snapshot
+        if snapshot is not None and snapshot.signature == signature:
+            return snapshot
+        with self._lock:
+            snapshot = self._snapshot
+            if snapshot is None or snapshot.signature != signature:
+                main, meta = self._load_main()
+                snapshot = _Snapshot(main, self._load_delta(meta), meta, signature)
+                self._snapshot = snapshot
+            return snapshot
+
+    def _load_main(self):
+        """The main segment's arrays (None if missing or unusable) and metadata"""
+        main_path = os.path.join(self.path, MAIN_DIR)
+        meta_path = os.path.join(main_path, META_FILE)
+        if not os.path.exists(meta_path):
+            return None, {}
+        with open(meta_path) as f:
+            meta = json.load(f)
+        if self.model_id and meta.get('model_id') != self.model_id:
+            if self.model_mismatch != meta.get('model_id'):
+                logger.error(
+                    f"Vector index was built with {meta.get('model_id')} but the embedding model is "
+                    f"{self.model_id}; its main segment is ignored until `manage.py build_vector_index` is run"
+                )
+            self.model_mismatch = meta.get('model_id')
+            return None, meta
+        self.model_mismatch = None
+
+        def load(name, mmap=True):
+            return np.load(os.path.join(main_path, f'{name}.npy'), mmap_mode='r' if mmap else None)
+
+        return {
+            'vectors': load('vectors'),
+            'chunk_ids': load('chunk_ids'),
+            'document_ids': load('document_ids'),
+            'centroids': load('centroids', mmap=False),
+            'list_offsets': load('list_offsets', mmap=False),
+            'doc_order': load('doc_order'),
+            'doc_sorted': load('doc_sorted'),
+        }, meta
+
+    def _read_delta_state(self):
+        try:
+            with open(os.path.join(self.path, DELTA_FILE)) as f:
+                state = json.load(f)
+        except FileNotFoundError:
+            return {
+                'model_id': self.model_id, 'dimension': 0, 'generation': 0, 'batch': 0, 'rows': 0,
+                'live': {}, 'stale_documents': [],
+            }
+        # JSON object keys are strings
+        state['live'] = {int(document_id): tuple(entry) for document_id, entry in state['live'].items()}
+        return state
+
+    def _delta_paths(self, generation):
+        return (
+            os.path.join(self.path, f'delta-{generation}.vectors'),
+            os.path.join(self.path, f'delta-{generation}.rows'),
+        )
+
+    def _read_delta_rows(self, state, live_only=True):
+        """The committed delta rows, (vectors, rows), optionally only the live ones"""
+        vectors_path, rows_path = self._delta_paths(state['generation'])
+        rows = np.fromfile(rows_path, dtype=ROW_DTYPE, count=state['rows'])
+        vectors = np.memmap(vectors_path, dtype=np.float16, mode='r', shape=(state['rows'], state['dimension']))
+        if not live_only:
+            return np.asarray(vectors), rows
+        live = np.isin(rows['batch'], np.asarray([batch for batch, _ in state['live'].values()], dtype=np.int64))
+        return np.asarray(vectors[live]), rows[live]
+
+    def _load_delta(self, meta):
+        state = self._read_delta_state()
+        if state['rows'] == 0 or (self.model_id and state['model_id'] != self.model_id):
+            delta = self._empty_delta(state['dimension'] or meta.get('dimension', 0))
+            if state['model_id'] == self.model_id or not self.model_id:
+                delta['stale_documents'] = np.asarray(state['stale_documents'], dtype=np.int64)
+            return delta
+        try:
+            vectors, rows = self._read_delta_rows(state)
+        except FileNotFoundError:
+            # Compacted by another process since the state was read
+            state = self._read_delta_state()
+            vectors, rows = self._read_delta_rows(state)
+        return {
+            'vectors': vectors,
+            'chunk_ids': rows['chunk_id'].copy(),
+            'document_ids': rows['document_id'].copy(),
+            'stale_documents': np.asarray(state['stale_documents'], dtype=np.int64),
+        }
+
+    @staticmethod
+    def _empty_delta(dimension):
+        return {
+            'vectors': np.zeros((0, dimension), dtype=np.float16),
+            'chunk_ids': np.zeros(0, dtype=np.int64),
+            'document_ids': np.zeros(0, dtype=np.int64),
+            'stale_documents': np.zeros(0, dtype=np.int64),
+        }
+
+    @property
+    def size(self):
+        """Number of live vectors (main plus delta)"""
+        snapshot = self._ensure_loaded()
+        main = 0
+        if snapshot.main:
+            # Main rows of documents re-indexed or removed since are not live
+            starts, ends = self._document_ranges(snapshot.main, snapshot.delta['stale_documents'])
+            main = len(snapshot.main['chunk_ids']) - int((ends - starts).sum())
+        return main + len(snapshot.delta['chunk_ids'])
+
+    # Writing
+
+    @contextmanager
+    def _write_lock(self):
+        """Serialize writers across threads and worker processes"""
+        os.makedirs(self.path, exist_ok=True)
+        with self._lock:
+            with open(os.path.join(self.path, LOCK_FILE), 'a') as lock_file:
+                if HAVE_FCNTL:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    if HAVE_FCNTL:
+                        fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _commit_delta(self, state):
+        """Publish a delta state; the data files must already hold its rows"""
+        state = dict(state, live={str(document_id): list(entry) for document_id, entry in state['live'].items()})
+        tmp_path = os.path.join(self.path, f'{DELTA_FILE}.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump(state, f)
+        os.replace(tmp_path, os.path.join(self.path, DELTA_FILE))
+        self._snapshot = None
+
+    def _append_delta_rows(self, state, vectors, rows):
+        """Append rows after the committed ones, dropping any left by an interrupted write"""
+        vectors_path, rows_path = self._delta_paths(state['generation'])
+        for path, data, committed in (
+            (vectors_path, vectors.tobytes(), state['rows'] * state['dimension'] * 2),
+            (rows_path, rows.tobytes(), state['rows'] * ROW_DTYPE.itemsize),
+        ):
+            with open(path, 'ab') as f:
+                f.truncate(committed)
+                f.write(data)
+
+    def _rewrite_delta(self, state, vectors, rows):
+        """
+        Write rows to a new generation of delta files and commit state for it
+
+        Readers keep using the previous generation until the new state is
+        committed, then its files are removed.
+        """
+        previous = state['generation']
+        state = dict(state, generation=previous + 1, rows=len(rows), dimension=vectors.shape[1])
+        self._append_delta_rows(dict(state, rows=0), vectors, rows)
+        self._commit_delta(state)
+        for path in self._delta_paths(previous):
+            if os.path.exists(path):
+                os.remove(path)
+        return state
+
+    def _main_exists(self):
+        return os.path.exists(os.path.join(self.path, MAIN_DIR, META_FILE))
+
+    def add_document(self, document_id, chunk_ids, vectors):
+        """
+        Replace the vectors of one document
+
+        Args:
+            document_id (int): Document the chunks belong to
+            chunk_ids (sequence): DocumentChunk ids, one per vector
+            vectors (numpy.ndarray): (len(chunk_ids), dim) unit vectors
+        """
+        vectors = np.asarray(vectors, dtype=np.float16).reshape(len(chunk_ids), -1)
+        with self._write_lock():
+            state = self._read_delta_state()
+            mismatched = self.model_id and state['model_id'] != self.model_id
+            if mismatched or (state['rows'] and state['dimension'] != vectors.shape[1]):
+                # Vectors of another model cannot be searched together with these
+                state = self._rewrite_delta(
+                    dict(state, model_id=self.model_id, live={}, stale_documents=[]),
+                    np.zeros((0, vectors.shape[1]), dtype=np.float16), np.zeros(0, dtype=ROW_DTYPE),
+                )
+            state['dimension'] = vectors.shape[1]
+            state['batch'] += 1
+            rows = np.zeros(len(chunk_ids), dtype=ROW_DTYPE)
+            rows['chunk_id'] = np.asarray(chunk_ids, dtype=np.int64)
+            rows['document_id'] = document_id
+            rows['batch'] = state['batch']
+            self._append_delta_rows(state, vectors, rows)
+            state['rows'] += len(rows)
+            state['live'][document_id] = (state['batch'], len(rows))
+            if self._main_exists() and document_id not in state['stale_documents']:
+                state['stale_documents'].append(document_id)
+            self._commit_delta(state)
+            live_rows = self._compact_delta(state)
+
+        if live_rows > getattr(settings, 'VECTOR_INDEX_DELTA_LIMIT', 100000):
+            logger.warning(
+                f"Vector index delta holds {live_rows} vectors; "
+                f"run `manage.py build_vector_index` to fold it into the main segment"
+            )
+
+    def remove_document(self, document_id):
+        """Drop all vectors of a document"""
+        with self._write_lock():
+            state = self._read_delta_state()
+            state['live'].pop(document_id, None)
+            if self._main_exists() and document_id not in state['stale_documents']:
+                state['stale_documents'].append(document_id)
+            self._commit_delta(state)
+            self._compact_delta(state)
+
+    def _compact_delta(self, state):
+        """
+        Drop the rows of replaced and removed documents once they outnumber
+        the live ones (and DELTA_COMPACT_ROWS)
+
+        Returns:
+            int: Number of live rows
+        """
+        live_rows = sum(count for _, count in state['live'].values())
+        if state['rows'] - live_rows > max(live_rows, DELTA_COMPACT_ROWS):
+            vectors, rows = self._read_delta_rows(state)
+            self._rewrite_delta(state, vectors, rows)
+        return live_rows
+
+    def build(self, batches, count, dimension, model_id, nlist=None, seed=0):
+        """
+        Build a new main segment and clear the delta
+
+        Vectors are spilled to a temporary memmap, clustered on a sample and
+        then written sorted by list, so memory stays bounded by the sample
+        and block sizes rather than the corpus. Documents added to the delta
+        while the build runs are kept there.
+
+        Args:
+            batches: Iterable of (chunk_ids, document_ids, vectors) batches
+            count (int): Upper bound on the total number of vectors
+            dimension (int): Vector dimension
+            model_id (str): Embedding model identifier stored in the metadata
+            nlist (int): Number of IVF lists, defaults to sqrt(count)
+            seed (int): Random seed for sampling and clustering
+
+        Returns:
+            dict: The new segment's metadata
+        """
+        os.makedirs(self.path, exist_ok=True)
+        started = time.time()
+        # Documents indexed after this batch may be missing from the new segment
+        watermark = self._read_delta_state()['batch']
+        build_path = os.path.join(self.path, f'{MAIN_DIR}.build')
+        shutil.rmtree(build_path, ignore_errors=True)
+        os.makedirs(build_path)
+
+        raw_path = os.path.join(build_path, 'raw.npy')
+        raw = np.lib.format.open_memmap(raw_path, mode='w+', dtype=np.float16, shape=(max(count, 1), dimension))
+        chunk_ids = np.zeros(count, dtype=np.int64)
+        document_ids = np.zeros(count, dtype=np.int64)
+        n = 0
+        for batch_chunk_ids, batch_document_ids, batch_vectors in batches:
+            size = len(batch_chunk_ids)
+            if n + size > count:
+                raise ValueError("More vectors were produced than the declared count")
+            raw[n:n + size] = batch_vectors
+            chunk_ids[n:n + size] = batch_chunk_ids
+            document_ids[n:n + size] = batch_document_ids
+            n += size
+        raw.flush()
+        chunk_ids = chunk_ids[:n]
+        document_ids = document_ids[:n]
+
+        if nlist is None:
+            nlist = int(np.sqrt(n)) if n >= 1024 else 1
+        nlist = max(1, min(nlist, n))
+
+        rng = np.random.default_rng(seed)
+        if nlist > 1:
+            sample_size = min(n, nlist * KMEANS_SAMPLES_PER_LIST)
+            sample_rows = np.sort(rng.choice(n, sample_size, replace=False))
+            centroids = spherical_kmeans(raw[sample_rows].astype(np.float32), nlist, seed=seed)
+            assignment = np.empty(n, dtype=np.int32)
+            for start in range(0, n, ASSIGN_BLOCK_SIZE):
+                block = raw[start:start + ASSIGN_BLOCK_SIZE].astype(np.float32)
+                assignment[start:start + len(block)] = np.argmax(block @ centroids.T, axis=1)
+        else:
+            centroids = np.zeros((1, dimension), dtype=np.float32)
+            assignment = np.zeros(n, dtype=np.int32)
+
+        order = np.argsort(assignment, kind='stable')
+        list_offsets = np.zeros(nlist + 1, dtype=np.int64)
+        np.cumsum(np.bincount(assignment, minlength=nlist), out=list_offsets[1:])
+
+        vectors = np.lib.format.open_memmap(
+            os.path.join(build_path, 'vectors.npy'), mode='w+', dtype=np.float16, shape=(n, dimension)
+        )
+        for start in range(0, n, ASSIGN_BLOCK_SIZE):
+            vectors[start:start + ASSIGN_BLOCK_SIZE] = raw[order[start:start + ASSIGN_BLOCK_SIZE]]
+        vectors.flush()
+        del vectors, raw
+        os.remove(raw_path)
+
+        chunk_ids = chunk_ids[order]
+        document_ids = document_ids[order]
+        doc_order = np.argsort(document_ids, kind='stable')
+        np.save(os.path.join(build_path, 'chunk_ids.npy'), chunk_ids)
+        np.save(os.path.join(build_path, 'document_ids.npy'), document_ids)
+        np.save(os.path.join(build_path, 'centroids.npy'), centroids)
+        np.save(os.path.join(build_path, 'list_offsets.npy'), list_offsets)
+        np.save(os.path.join(build_path, 'doc_order.npy'), doc_order)
+        np.save(os.path.join(build_path, 'doc_sorted.npy'), document_ids[doc_order])
+
+        meta = {
+            'model_id': model_id,
+            'dimension': dimension,
+            'count': int(n),
+            'nlist': int(nlist),
+            'built_at': time.time(),
+            'build_seconds': round(time.time() - started, 2),
+        }
+        with open(os.path.join(build_path, META_FILE), 'w') as f:
+            json.dump(meta, f)
+
+        with self._write_lock():
+            main_path = os.path.join(self.path, MAIN_DIR)
+            old_path = os.path.join(self.path, f'{MAIN_DIR}.old')
+            shutil.rmtree(old_path, ignore_errors=True)
+            if os.path.exists(main_path):
+                os.replace(main_path, old_path)
+            os.replace(build_path, main_path)
+            shutil.rmtree(old_path, ignore_errors=True)
+
+            # Documents indexed while the build was running may be missing
+            # from (or outdated in) the new segment, so they stay in the delta
+            state = self._read_delta_state()
+            keep = {document_id: entry for document_id, entry in state['live'].items() if entry[0] > watermark}
+            vectors = np.zeros((0, dimension), dtype=np.float16)
+            rows = np.zeros(0, dtype=ROW_DTYPE)
+            if keep and state['dimension'] == dimension and state['model_id'] in (None, model_id):
+                vectors, rows = self._read_delta_rows(dict(state, live=keep))
+            else:
+                keep = {}
+            self._rewrite_delta(
+                dict(state, model_id=model_id, live=keep, stale_documents=sorted(keep)), vectors, rows
+            )
+
+        logger.info(f"Built vector index with {n} vectors in {nlist} lists in {meta['build_seconds']}s")
+        return meta
+
+    # Searching
+
+    @staticmethod
+    def _document_ranges(main, document_ids):
+        doc_sorted = main['doc_sorted']
+        starts = np.searchsorted(doc_sorted, document_ids, side='left')
+        ends = np.searchsorted(doc_sorted, document_ids, side='right')
+        return starts, ends
+
+    def _rows_for_documents(self, main, document_ids):
+        """Main-segment rows belonging to the given documents"""
+        starts, ends = self._document_ranges(main, document_ids)
+        lengths = ends - starts
+        total = int(lengths.sum())
+        if total == 0:
+            return np.zeros(0, dtype=np.int64)
+        # Concatenated ranges [start, end) without a Python loop
+        offsets = np.repeat(starts - np.concatenate([[0], np.cumsum(lengths)[:-1]]), lengths)
+        positions = offsets + np.arange(total)
+        return np.sort(np.asarray(main['doc_order'][positions]))
+
+    def document_row_count(self, document_ids):
+        """Number of indexed passages of the given documents, delta included"""
+        snapshot = self._ensure_loaded()
+        document_ids = np.unique(np.asarray(list(document_ids), dtype=np.int64))
+        count = int(np.isin(snapshot.delta['document_ids'], document_ids).sum())
+        if snapshot.main is not None and len(snapshot.main['chunk_ids']):
+            document_ids = np.setdiff1d(document_ids, snapshot.delta['stale_documents'])
+            starts, ends = self._document_ranges(snapshot.main, document_ids)
+            count += int((ends - starts).sum())
+        return count
+
+    def _search_main(self, snapshot, query, k, document_ids, nprobe, exact_limit):
+        main = snapshot.main
+        if main is None or len(main['chunk_ids']) == 0:
+            return np.zeros(0, dtype=np.float32), np.zeros(0, dtype=np.int64)
+
+        stale = snapshot.delta['stale_documents']
+        if document_ids is not None:
+            document_ids = np.setdiff1d(document_ids, stale)
+            rows = self._rows_for_documents(main, document_ids)
+            if len(rows) <= exact_limit:
+                scores = main['vectors'][rows].astype(np.float32) @ query
+                top = _top_k(scores, k)
+                return scores[top], rows[top]
+
+        centroids = main['centroids']
+        offsets = main['list_offsets']
+        probe = _top_k(centroids @ query, min(nprobe, len(centroids)))
+
+        all_scores = []
+        all_rows = []
+        for list_id in probe:
+            start, end = offsets[list_id], offsets[list_id + 1]
+            if end == start:
+                continue
+            rows = np.arange(start, end)
+            doc_ids = main['document_ids'][start:end]
+            if document_ids is not None:
+                mask = np.isin(doc_ids, document_ids)
+            elif len(stale):
+                mask = ~np.isin(doc_ids, stale)
+            else:
+                mask = None
+            vectors = main['vectors'][start:end]
+            if mask is not None:
+                rows = rows[mask]
+                vectors = vectors[mask]
+            if len(rows):
+                all_scores.append(vectors.astype(np.float32) @ query)
+                all_rows.append(rows)
+
+        if not all_rows:
+            return np.zeros(0, dtype=np.float32), np.zeros(0, dtype=np.int64)
+        scores = np.concatenate(all_scores)
+        rows = np.concatenate(all_rows)
+        top = _top_k(scores, k)
+        return scores[top], rows[top]
+
+    def search(self, query, k=5, document_ids=None, nprobe=None, exact_limit=EXACT_SEARCH_LIMIT):
+        """
+        Find the passages most similar to a query vector
+
+        Args:
+            query (numpy.ndarray): (dim,) unit query vector
+            k (int): Number of results
+            document_ids (list): Restrict results to these documents
+            nprobe (int): IVF lists to scan, defaults to VECTOR_INDEX_NPROBE
+            exact_limit (int): Filtered searches over at most this many
+                passages score every passage instead of probing lists
+
+        Returns:
+            list: (score, chunk_id, document_id) tuples, best first
+        """
+        snapshot = self._ensure_loaded()
+        nprobe = nprobe or getattr(settings, 'VECTOR_INDEX_NPROBE', DEFAULT_NPROBE)
+        query = np.asarray(query, dtype=np.float32).reshape(-1)
+        if document_ids is not None:
+            document_ids = np.unique(np.asarray(list(document_ids), dtype=np.int64))
+
+        results = []
+        main = snapshot.main
+        main_scores, main_rows = self._search_main(snapshot, query, k, document_ids, nprobe, exact_limit)
+        for score, row in zip(main_scores, main_rows):
+            results.append((float(score), int(main['chunk_ids'][row]), int(main['document_ids'][row])))
+
+        delta = snapshot.delta
+        if len(delta['chunk_ids']):
+            rows = np.arange(len(delta['chunk_ids']))
+            if document_ids is not None:
+                rows = rows[np.isin(delta['document_ids'], document_ids)]
+            if len(rows):
+                scores = delta['vectors'][rows].astype(np.float32) @ query
+                for i in _top_k(scores, k):
+                    row = rows[i]
+                    results.append((float(scores[i]), int(delta['chunk_ids'][row]), int(delta['document_ids'][row])))
+
+        results.sort(key=lambda result: result[0], reverse=True)
+        return results[:k]
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_vector_index():
+    """Return the process-wide vector index"""
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                from . import embeddings
+                path = getattr(settings, 'VECTOR_INDEX_DIR', os.path.join(settings.BASE_DIR, 'vector_index'))
+                _index = VectorIndex(path, model_id=embeddings.get_model_id())
+    return _index
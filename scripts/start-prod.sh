@@ -43,6 +43,6 @@ fi
 
 # Start backend using gunicorn
 echo -e "${GREEN}Starting Django backend with Gunicorn...${NC}"
-gunicorn docautomation_backend.wsgi:application --bind 0.0.0.0:8000 --workers 4 --timeout 120
+gunicorn docautomation_backend.wsgi:application --config gunicorn.conf.py
 
 echo -e "${GREEN}Server is running at http://localhost:8000${NC}" 
\ No newline at end of file
@@ -230,11 +230,13 @@ export const nlpApi = {
   // Additional methods for compatibility with chatService usage
   getChatHistory: async (documentId: string) => {
     try {
-      // Map to the new API - get conversations related to a document
+      // Messages of the document's most recent conversation
       const response = await apiClient.get(`${NLP_API_URL}conversation/`, {
-        params: { document_id: documentId }
+        params: { document_id: documentId, limit: 1 }
       });
-      return response.data;
+      if (!response.data.length) return [];
+      const conversation = await apiClient.get(`${NLP_API_URL}conversation/${response.data[0].id}/messages/`);
+      return conversation.data.messages;
     } catch (error) {
       console.error(`Error fetching chat history for document ${documentId}:`, error);
       return []; // Return empty array as fallback